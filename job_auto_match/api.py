@@ -1,41 +1,15 @@
 import frappe
-from contextlib import contextmanager
-from jinja2.exceptions import TemplateNotFound
 
 from job_auto_match.job_auto_match.utils.matching import (
     send_candidate_not_matching_email,
     send_candidate_invite,
-    _set_flag, _set_text, _set_statut,
+    _set_flag, _set_text,
     FLAG_MATCHING_IN_PROGRESS, FLAG_MATCHING_FAILED, FIELD_AI_LAST_ERROR,
 )
-
-# ── Constantes ───────────────────────────────────────────────────────────────
-FLAG_REJECTED_AFTER_TEST_EMAIL_SENT = "custom_rejected_after_test_email_sent"
-TEMPLATE_REJECTED = "job_auto_match/templates/emails/candidate_rejected.html"
-
-DEFAULT_REJECTED_HTML = """
-<div style="font-family: Inter, Arial, sans-serif; line-height:1.5; color:#111">
-  <h2 style="margin:0 0 8px">Résultat de votre évaluation</h2>
-  <p>Bonjour {{ applicant_name or "Candidat" }},</p>
-  <p>Suite à votre évaluation pour le poste <strong>{{ job_title or "—" }}</strong>,
-     nous ne pouvons malheureusement pas donner suite favorablement à votre candidature.</p>
-  {% if score is not none %}
-    <p><strong>Score global :</strong> {{ score }} %</p>
-  {% endif %}
-  <p>Nous vous remercions pour le temps consacré et conserverons votre profil pour des opportunités futures.</p>
-  <p>Bien cordialement,<br>Équipe Recrutement</p>
-</div>
-""".strip()
+from job_auto_match.job_auto_match.utils.testlify_inbox import enqueue_inbox_consumer, record_event
 
 
 # ── Helpers ──────────────────────────────────────────────────────────────────
-def _to_float(x, default=0.0):
-    try:
-        return float(x)
-    except (TypeError, ValueError):
-        return default
-
-
 def _is_test_ping(payload: dict) -> bool:
     return not payload.get("type") and not payload.get("event")
 
@@ -48,16 +22,6 @@ def _get_password_safely(doc, fieldname: str) -> str:
         return ""
 
 
-@contextmanager
-def _as_user(user: str):
-    prev = frappe.session.user
-    frappe.set_user(user)
-    try:
-        yield
-    finally:
-        frappe.set_user(prev)
-
-
 # ── Webhook Testlify ─────────────────────────────────────────────────────────
 @frappe.whitelist(allow_guest=True, methods=["POST"])
 def completed():
@@ -99,130 +63,16 @@ def completed():
             frappe.local.response["http_status_code"] = 400
             return {"status": 400, "reason": "`data.candidate.email` manquant."}
 
-        # 4) Recherche du candidat
-        applicant_name = frappe.db.get_value(
-            "Assessment Score", {"assessment_id": assessment_id}, "parent"
-        )
-        if not applicant_name:
-            frappe.local.response["http_status_code"] = 404
-            return {"status": 404, "reason": f"Aucun candidat pour assessment_id '{assessment_id}'."}
-
-        # 5) Chargement du Job Applicant
-        candidate = frappe.get_doc("Job Applicant", applicant_name)
-        candidate.flags.ignore_permissions = True
-
-        scores_data = data.get("scores") or {}
-        incoming_score = _to_float(scores_data.get("avgScorePercentage", 0))
-
-        # Mise à jour des assessments
-        row_found = False
-        for row in candidate.get("custom_assessments") or []:
-            if getattr(row, "assessment_id", None) == assessment_id:
-                row.completed = True
-                row.assessment_score = incoming_score
-                row_found = True
-                break
-
-        if not row_found:
-            candidate.append("custom_assessments", {
-                "assessment_id": assessment_id,
-                "completed": True,
-                "assessment_score": incoming_score,
-            })
-
-        # 6) Calcul score global
-        all_rows = candidate.get("custom_assessments") or []
-        item_count = len(all_rows)
-        completed_count = sum(1 for r in all_rows if getattr(r, "completed", False))
-        total_score = sum(_to_float(getattr(r, "assessment_score", 0)) for r in all_rows)
-
-        frappe.logger().info(
-            f"[TESTLIFY] {applicant_name} — {completed_count}/{item_count} évaluations complètes"
-        )
-
-        if item_count > 0 and completed_count == item_count:
-            global_score = round(total_score / item_count, 2)
-            rating = max(0.0, min(1.0, global_score / 100.0))
-
-            candidate.applicant_rating = float(f"{rating:.2f}")
-            candidate.custom_testlify_score = global_score
-
-            # Mise à jour du statut
-            threshold = getattr(settings, "score_test", 0) or 0
-            new_status = getattr(settings, "status_after_test", None) if global_score >= threshold else getattr(settings, "status_rejected", None)
-            _set_statut(candidate, new_status)
-
-            # Envoi email de rejet
-            if getattr(candidate, "custom_status", None) == getattr(settings, "status_rejected", None):
-                recipient = (getattr(candidate, "email_id", "") or "").strip()
-                if not recipient:
-                    frappe.local.response["http_status_code"] = 404
-                    return {"status": 404, "reason": "Email candidat introuvable."}
-
-                ctx = {
-                    "applicant_name": getattr(candidate, "applicant_name", ""),
-                    "job_title": getattr(candidate, "custom_nom_de_loffre", "") or getattr(candidate, "job_title", ""),
-                    "score": global_score,
-                }
-
-                subject_tpl = getattr(settings, "candidate_rejected_after_test_subject", "") or "Résultat de votre évaluation"
-
-                try:
-                    subject = frappe.render_template(subject_tpl, ctx)
-                except Exception:
-                    subject = subject_tpl
-
-                html_src = (getattr(settings, "candidate_rejected_after_test_template", "") or "").strip()
-
-                try:
-                    if html_src:
-                        message_html = frappe.render_template(html_src, ctx)
-                    else:
-                        try:
-                            message_html = frappe.get_template(TEMPLATE_REJECTED).render(ctx)
-                        except (TemplateNotFound, Exception):
-                            message_html = frappe.render_template(DEFAULT_REJECTED_HTML, ctx)
-
-                    frappe.sendmail(
-                        recipients=[recipient],
-                        subject=subject,
-                        message=message_html,
-                        delayed=False
-                    )
-                    _set_flag(candidate, FLAG_REJECTED_AFTER_TEST_EMAIL_SENT, 1)
-                except Exception as e:
-                    frappe.log_error(title="[TESTLIFY] Envoi email rejet échoué", message=frappe.get_traceback())
-                    _set_text(candidate, FIELD_AI_LAST_ERROR, f"Email rejet: {str(e)}")
-                    _set_flag(candidate, FLAG_REJECTED_AFTER_TEST_EMAIL_SENT, 0)
-
-        # 7) Sauvegarde sous un utilisateur de service (sécurisé)
-        # On utilise le champ webhook_service_user s'il existe, sinon on prend "Administrator" en dernier recours
-        service_user = "Administrator"  # Valeur par défaut minimale
-
-        if hasattr(settings, "webhook_service_user"):
-            configured_user = (getattr(settings, "webhook_service_user", "") or "").strip()
-            if configured_user and frappe.db.exists("User", configured_user):
-                service_user = configured_user
-            else:
-                frappe.logger().warning(f"[TESTLIFY] Utilisateur configuré '{configured_user}' inexistant → fallback sur Administrator")
+        # 4) Inbox idempotente : l'événement est appliqué en tâche de fond
+        event = (payload.get("event") or payload.get("type") or "completed").strip()
+        created = record_event(payload, assessment_id, email, event)
+        if created:
+            enqueue_inbox_consumer()
         else:
-            frappe.logger().warning("[TESTLIFY] Champ 'webhook_service_user' absent du doctype → utilisation d'Administrator")
-
-        frappe.logger().info(f"[TESTLIFY] Sauvegarde effectuée en tant que : {service_user}")
-
-        with _as_user(service_user):
-            candidate.save(ignore_permissions=True)
-
+            frappe.logger().info(f"[TESTLIFY] Redélivrance ignorée ({assessment_id} / {email} / {event})")
         frappe.db.commit()
 
-        return {
-            "status": 200,
-            "data": {
-                "applicant": candidate.name,
-                "global_score": getattr(candidate, "custom_testlify_score", None),
-                "updated": True
-            }
-        }
+        return {"status": 200, "data": {"queued": created, "duplicate": not created}}
 
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "[TESTLIFY] Erreur générale webhook")
@@ -234,16 +84,39 @@ def completed():
 @frappe.whitelist()
 def retry_matching(applicant_name: str):
     from job_auto_match.job_auto_match.doctype.job_applicant.job_applicant import _enqueue_matching
+    from job_auto_match.job_auto_match.utils.matching_queue import PRIORITY_RETRY
+
     doc = frappe.get_doc("Job Applicant", applicant_name)
     _set_text(doc, FIELD_AI_LAST_ERROR, "")
     _set_flag(doc, FLAG_MATCHING_FAILED, 0)
     _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 1)
     doc.save(ignore_permissions=True)
     frappe.db.commit()
-    _enqueue_matching(doc.name)
+    # Déjà en attente : la demande est fusionnée dans la file, pas de second job
+    _enqueue_matching(doc.name, priority=PRIORITY_RETRY, job_opening=doc.job_title)
     return {"ok": True, "message": f"Relance planifiée pour {doc.name}"}
 
 
+@frappe.whitelist()
+def rematch_job_opening(job_opening: str, applicant_names=None):
+    """
+    Re-matching en masse des candidats d'une offre, en priorité basse : les
+    nouvelles candidatures et les relances passent devant.
+    """
+    from job_auto_match.job_auto_match.doctype.job_applicant.job_applicant import _enqueue_matching
+    from job_auto_match.job_auto_match.utils.matching_queue import PRIORITY_BULK
+
+    frappe.has_permission("Job Opening", "write", doc=job_opening, throw=True)
+    filters = {"job_title": job_opening, "resume_attachment": ["is", "set"]}
+    names = frappe.parse_json(applicant_names) if applicant_names else None
+    if names:
+        filters["name"] = ["in", names]
+    names = frappe.get_all("Job Applicant", filters=filters, pluck="name")
+    for name in names:
+        _enqueue_matching(name, priority=PRIORITY_BULK, job_opening=job_opening)
+    return {"ok": True, "queued": len(names)}
+
+
 @frappe.whitelist()
 def resend_not_match_email(applicant_name: str):
     doc = frappe.get_doc("Job Applicant", applicant_name)
@@ -266,4 +139,193 @@ def resend_invites(applicant_name: str):
 
     assessments = getattr(fiche, "custom_assessments", None) or []
     res = send_candidate_invite(doc, assessments)
-    return {"ok": True, "result": res}
\ No newline at end of file
+    return {"ok": True, "result": res}
+
+
+@frappe.whitelist()
+def resend_invites_bulk(job_opening: str, applicant_names=None):
+    """
+    Ré-invite une shortlist en mode groupé (une requête Testlify par évaluation).
+    Sans liste explicite : tous les candidats de l'offre au statut « qualifié ».
+    """
+    from job_auto_match.job_auto_match.utils.matching import send_bulk_candidate_invites
+
+    frappe.has_permission("Job Opening", "write", doc=job_opening, throw=True)
+    fiche = frappe.get_doc("Job Opening", job_opening)
+
+    # Seuls les candidats de cette offre : une liste explicite ne peut pas viser d'autres offres
+    filters = {"job_title": job_opening}
+    names = frappe.parse_json(applicant_names) if applicant_names else None
+    if names:
+        filters["name"] = ["in", names]
+    else:
+        settings = frappe.get_cached_doc("Job Matching Integration Settings")
+        filters["custom_status"] = settings.status_qualified or "En Cours de qualification"
+    names = frappe.get_all("Job Applicant", filters=filters, pluck="name")
+    if not names:
+        return {"ok": True, "result": {"candidates": 0, "invited": 0, "results": []}}
+
+    for name in names:
+        frappe.has_permission("Job Applicant", "write", doc=name, throw=True)
+    docs = [frappe.get_doc("Job Applicant", name) for name in names]
+    assessments = getattr(fiche, "custom_assessments", None) or []
+    return {"ok": True, "result": send_bulk_candidate_invites(docs, assessments)}
+
+# ── Talent pool ──────────────────────────────────────────────────────────────
+@frappe.whitelist()
+def score_profile_against_openings(job_openings, profile: str | None = None, applicant_name: str | None = None):
+    """
+    Score un profil du talent pool contre plusieurs offres en une passe, sans
+    créer de candidature. Profil désigné directement ou via une candidature
+    existante (même e-mail et même CV). Au plus MAX_OPENINGS offres : la
+    réponse attend les appels Gemini.
+    """
+    from frappe.utils.file_manager import get_file_path
+
+    from job_auto_match.job_auto_match.utils.extraction_cache import compute_file_hash
+    from job_auto_match.job_auto_match.utils.talent_pool import (
+        MAX_OPENINGS,
+        PROFILE_DOCTYPE,
+        profile_name,
+        score_profile,
+    )
+
+    openings = frappe.parse_json(job_openings) if isinstance(job_openings, str) else job_openings
+    openings = list(dict.fromkeys(openings or []))
+    if not openings:
+        frappe.throw("Aucune offre à évaluer.", title="Offres manquantes")
+    if len(openings) > MAX_OPENINGS:
+        frappe.throw(f"Au plus {MAX_OPENINGS} offres par évaluation.", title="Trop d'offres")
+    for name in openings:
+        frappe.has_permission("Job Opening", "read", doc=name, throw=True)
+
+    if applicant_name:
+        frappe.has_permission("Job Applicant", "read", doc=applicant_name, throw=True)
+        doc = frappe.get_doc("Job Applicant", applicant_name)
+        if not doc.resume_attachment:
+            frappe.throw("Aucun CV attaché.")
+        profile = profile_name(doc.email_id, compute_file_hash(get_file_path(doc.resume_attachment)))
+    elif profile:
+        frappe.has_permission(PROFILE_DOCTYPE, "read", doc=profile, throw=True)
+
+    if not profile or not frappe.db.exists(PROFILE_DOCTYPE, profile):
+        frappe.throw("Profil introuvable : le CV n'a pas encore été extrait.", title="Profil introuvable")
+    return {"ok": True, "profile": profile, "results": score_profile(profile, openings)}
+
+
+# ── Pré-scoring ──────────────────────────────────────────────────────────────
+@frappe.whitelist()
+def prescore_job_opening(job_opening: str):
+    """Classement local (sans LLM) des candidats d'une offre."""
+    from job_auto_match.job_auto_match.utils.prescoring import score_job_opening_applicants
+
+    frappe.has_permission("Job Opening", "read", doc=job_opening, throw=True)
+    return {"ok": True, "results": score_job_opening_applicants(job_opening)}
+
+
+# ── Diagnostics ──────────────────────────────────────────────────────────────
+@frappe.whitelist()
+def extraction_cache_stats(reset: int = 0, clear: int = 0):
+    """Hits/misses du cache d'extraction CV ; clear=1 vide le cache (System Manager uniquement)."""
+    from job_auto_match.job_auto_match.utils.extraction_cache import (
+        clear_extraction_cache,
+        get_extraction_cache_stats,
+        reset_extraction_cache_stats,
+    )
+
+    frappe.only_for("System Manager")
+    stats = get_extraction_cache_stats()
+    if int(reset or 0):
+        reset_extraction_cache_stats()
+    if int(clear or 0):
+        clear_extraction_cache()
+    return {"ok": True, "stats": stats}
+
+
+@frappe.whitelist()
+def gemini_context_cache_stats(reset: int = 0):
+    """Caches de contexte Gemini : réutilisations, créations, envois inline (System Manager uniquement)."""
+    from job_auto_match.job_auto_match.utils.context_cache import (
+        get_context_cache_stats,
+        reset_context_cache_stats,
+    )
+
+    frappe.only_for("System Manager")
+    stats = get_context_cache_stats()
+    if int(reset or 0):
+        reset_context_cache_stats()
+    return {"ok": True, "stats": stats}
+
+
+@frappe.whitelist()
+def rescore_job_opening(job_opening: str, applicant_names=None):
+    """
+    Re-scoring par lot des candidats déjà extraits d'une offre (après modification
+    des exigences, arriéré) : plusieurs candidats par appel Gemini. Met à jour
+    score, justification et note ; statuts et invitations ne sont pas rejoués.
+    """
+    from job_auto_match.job_auto_match.utils.batch_scoring import enqueue_rescore
+
+    frappe.has_permission("Job Opening", "write", doc=job_opening, throw=True)
+    names = frappe.parse_json(applicant_names) if applicant_names else None
+    enqueue_rescore(job_opening, names or None)
+    return {"ok": True, "message": f"Re-scoring planifié pour {job_opening}"}
+
+
+@frappe.whitelist()
+def matching_queue_stats():
+    """
+    Profondeur et âge du plus ancien candidat en attente, par priorité, et
+    compteurs du bail par candidat : demandes fusionnées, relances, baux perdus
+    (System Manager).
+    """
+    from job_auto_match.job_auto_match.utils.applicant_lock import get_lease_stats
+    from job_auto_match.job_auto_match.utils.matching_queue import queue_stats
+
+    frappe.only_for("System Manager")
+    return {"ok": True, "stats": queue_stats(), "lease": get_lease_stats()}
+
+
+@frappe.whitelist()
+def matching_db_stats(reset: int = 0):
+    """Requêtes / écritures / commits SQL moyens par run de matching (System Manager)."""
+    from job_auto_match.job_auto_match.utils import metrics
+
+    frappe.only_for("System Manager")
+    stats = metrics.get_db_stats()
+    if int(reset or 0):
+        metrics.reset_counters([
+            metrics.COUNTER_MATCHING_RUNS,
+            metrics.COUNTER_MATCHING_DB_QUERIES,
+            metrics.COUNTER_MATCHING_DB_WRITES,
+            metrics.COUNTER_MATCHING_DB_COMMITS,
+        ])
+    return {"ok": True, "stats": stats}
+
+
+@frappe.whitelist()
+def gemini_model_health(reset: int = 0):
+    """État du disjoncteur par modèle Gemini ; reset=1 referme tous les circuits (System Manager)."""
+    from job_auto_match.job_auto_match.utils.matching import SAFE_MODEL_CANDIDATES
+    from job_auto_match.job_auto_match.utils.model_health import get_health_registry
+
+    frappe.only_for("System Manager")
+    health = get_health_registry()
+    if int(reset or 0):
+        health.reset(SAFE_MODEL_CANDIDATES)
+    return {"ok": True, "models": health.snapshot(SAFE_MODEL_CANDIDATES)}
+
+
+@frappe.whitelist()
+def matching_run_metrics(hours: int = 24, reset: int = 0):
+    """
+    Compteurs, histogrammes de durée par étape (p50/p95 estimés) et coût en
+    tokens par offre sur les `hours` dernières heures (System Manager).
+    """
+    from job_auto_match.job_auto_match.utils.tracing import get_matching_metrics, reset_matching_metrics
+
+    frappe.only_for("System Manager")
+    metrics = get_matching_metrics(hours=int(hours or 24))
+    if int(reset or 0):
+        reset_matching_metrics()
+    return {"ok": True, "metrics": metrics}
@@ -0,0 +1,172 @@
+import click
+from frappe.commands import get_site, pass_context
+
+
+@click.command("job-auto-match-explain")
+@click.option("--runs", default=20, help="Nombre d'exécutions pour le temps moyen")
+@pass_context
+def explain_hot_queries(context, runs=20):
+    """Plans EXPLAIN et temps des requêtes chaudes de job_auto_match."""
+    import frappe
+
+    from job_auto_match.job_auto_match.utils.db_indexes import explain_hot_queries as _explain
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        for entry in _explain(runs=runs):
+            click.secho(f"\n{entry['query']} — {entry['avg_ms']} ms", bold=True)
+            for row in entry["plan"]:
+                click.echo(
+                    f"  table={row.get('table')} type={row.get('type')} key={row.get('key')} "
+                    f"rows={row.get('rows')} extra={row.get('Extra') or ''}"
+                )
+    finally:
+        frappe.destroy()
+
+
+@click.command("job-auto-match-link-orphans")
+@click.option("--chunk-size", default=1000, help="Candidats par lot (un UPDATE + commit par lot)")
+@click.option("--restart", is_flag=True, default=False, help="Ignorer le curseur de reprise")
+@pass_context
+def link_orphans(context, chunk_size=1000, restart=False):
+    """Lie les CV orphelins à leur Job Applicant, par lots avec reprise."""
+    import frappe
+
+    from job_auto_match.job_auto_match.utils.orphan_files import link_orphan_resume_files
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        fixed = link_orphan_resume_files(chunk_size=chunk_size, restart=restart, verbose=True)
+        click.secho(f"{fixed} fichier(s) lié(s).", fg="green")
+    finally:
+        frappe.destroy()
+
+
+@click.command("job-auto-match-benchmark")
+@click.option("--applicants", default=50, help="Nombre de CV synthétiques")
+@click.option("--openings", default=3, help="Nombre d'offres synthétiques")
+@click.option("--formats", default="pdf,docx,doc", help="Formats de CV, répartis à parts égales")
+@click.option("--mode", type=click.Choice(["sync", "batch"]), default="sync", help="Pilote unitaire ou consommateur par lots")
+@click.option("--batch-size", default=20, help="Mode batch : candidats par lot")
+@click.option("--in-flight", default=8, help="Mode batch : appels Gemini simultanés")
+@click.option("--gemini-latency", default=0.8, help="Latence simulée d'un appel Gemini (s)")
+@click.option("--gemini-429", default=0.0, help="Taux de 429 Gemini (0-1)")
+@click.option("--gemini-503", default=0.0, help="Taux de 503 Gemini (0-1)")
+@click.option("--not-cv-rate", default=0.05, help="Part des documents classés non CV")
+@click.option("--gemini-malformed", default=0.0, help="Part des réponses Gemini mal formées (balises, JSON tronqué)")
+@click.option("--testlify-latency", default=0.2, help="Latence simulée Testlify (s)")
+@click.option("--testlify-429", default=0.0, help="Taux de 429 Testlify (0-1)")
+@click.option("--testlify-503", default=0.0, help="Taux de 503 Testlify (0-1)")
+@click.option("--seed", default=42, help="Graine du corpus et des tirages")
+@click.option("--keep", is_flag=True, default=False, help="Conserver les enregistrements créés")
+@click.option("--json", "json_path", default=None, help="Écrire le rapport JSON dans ce fichier")
+@click.option("--compare", "baseline_path", default=None, help="Rapport JSON de référence à comparer")
+@click.option("--tolerance", default=0.10, help="Dégradation relative tolérée avant régression")
+@pass_context
+def benchmark(context, formats="pdf,docx,doc", json_path=None, baseline_path=None, tolerance=0.10, **options):
+    """Benchmark hors réseau du pipeline de matching (Gemini et Testlify simulés)."""
+    import json
+
+    import frappe
+
+    from job_auto_match.job_auto_match.benchmarks.runner import compare_reports, run_benchmark
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    frappe.set_user("Administrator")
+    try:
+        report = run_benchmark(
+            formats=tuple(f.strip() for f in formats.split(",") if f.strip()),
+            progress=click.echo,
+            **options,
+        )
+    finally:
+        frappe.destroy()
+
+    click.secho(
+        f"\n{report['config']['applicants']} candidats en {report['elapsed_s']} s — "
+        f"{report['applicants_per_min']} candidats/min ({report['config']['mode']})",
+        bold=True,
+    )
+    click.echo(f"Corpus : {report['corpus']}")
+    click.echo(f"{'Étape':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'moy. ms':>10}")
+    for stage, values in report["stages"].items():
+        click.echo(f"{stage:<22}{values['count']:>6}{values['p50_ms']:>10}{values['p95_ms']:>10}{values['mean_ms']:>10}")
+    click.echo("DB par candidat : " + ", ".join(f"{k}={v}" for k, v in report["db"].items()))
+    click.echo(f"Pic RSS : {report['rss_mb']['peak']['self']} Mo (enfants {report['rss_mb']['peak']['children']} Mo)")
+    click.echo(f"Gemini : {report['gemini']} | Testlify : {report['testlify']}")
+    click.echo(f"Résultats : {report['outcomes']}")
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        click.echo(f"Rapport écrit dans {json_path}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != report["config"]:
+            click.secho("Attention : configuration différente de la référence", fg="yellow")
+        rows = compare_reports(report, baseline, tolerance=tolerance)
+        click.secho(f"\nComparaison avec {baseline_path} (v{baseline.get('version')})", bold=True)
+        for row in rows:
+            click.secho(
+                f"{row['metric']:<32}{row['baseline']:>12}{row['current']:>12}{row['change_pct']:>+9}%",
+                fg="red" if row["regression"] else None,
+            )
+        regressions = [row["metric"] for row in rows if row["regression"]]
+        if regressions:
+            click.secho(f"{len(regressions)} régression(s) : {', '.join(regressions)}", fg="red")
+            raise SystemExit(1)
+
+
+@click.command("job-auto-match-benchmark-scoring")
+@click.option("--candidates", default=100, help="Nombre de profils synthétiques")
+@click.option("--batch-size", default=20, help="Candidats max par appel en mode lot")
+@click.option("--token-budget", default=24000, help="Budget de tokens d'entrée par appel en mode lot")
+@click.option("--gemini-latency", default=0.8, help="Latence simulée d'un appel Gemini (s)")
+@click.option("--token-latency", default=0.004, help="Durée de génération simulée par token de sortie (s)")
+@click.option("--gemini-malformed", default=0.0, help="Part des réponses Gemini mal formées (balises, JSON tronqué)")
+@click.option("--seed", default=42, help="Graine des profils et des tirages")
+@click.option("--json", "json_path", default=None, help="Écrire le rapport JSON dans ce fichier")
+@pass_context
+def benchmark_scoring(context, json_path=None, **options):
+    """Scoring unitaire vs scoring par lot (Gemini simulé) : appels et secondes pour 100 candidats."""
+    import json
+
+    import frappe
+
+    from job_auto_match.job_auto_match.benchmarks.runner import run_scoring_benchmark
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        report = run_scoring_benchmark(**options)
+    finally:
+        frappe.destroy()
+
+    click.secho(f"\n{report['config']['candidates']} candidats, lots de {report['config']['batch_size']} max", bold=True)
+    click.echo(f"{'Mode':<10}{'appels':>8}{'s':>10}{'appels/100':>12}{'s/100':>10}{'découpages':>12}{'échecs':>8}")
+    for mode in ("single", "batch"):
+        r = report[mode]
+        click.echo(
+            f"{mode:<10}{r['calls']:>8}{r['elapsed_s']:>10}{r['calls_per_100']:>12}{r['seconds_per_100']:>10}"
+            f"{r['splits']:>12}{r['failed']:>8}"
+        )
+    saved = report["saved_per_100"]
+    click.secho(f"Gain pour 100 candidats : {saved['calls']} appels, {saved['seconds']} s", fg="green")
+    click.echo(f"Accord des scores : {report['agreement']}")
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        click.echo(f"Rapport écrit dans {json_path}")
+
+
+commands = [explain_hot_queries, link_orphans, benchmark, benchmark_scoring]
@@ -15,13 +15,40 @@ doctype_js = {"Job Applicant": "public/js/job_applicant.js"}
 doc_events = {
     "Job Applicant": {
         "before_insert": "job_auto_match.job_auto_match.doctype.job_applicant.job_applicant.validate_unique_application",
-        "after_insert":  [
-            "job_auto_match.job_auto_match.doctype.job_applicant.job_applicant.enqueue_matching",
-            "job_auto_match.job_auto_match.doctype.job_applicant.job_applicant.ensure_resume_file_linked",
-        ],
+        "after_insert":  "job_auto_match.job_auto_match.doctype.job_applicant.job_applicant.enqueue_matching",
         "on_update":     "job_auto_match.job_auto_match.doctype.job_applicant.job_applicant.ensure_resume_file_linked",
+        "on_trash":      "job_auto_match.job_auto_match.utils.talent_pool.on_applicant_trash",
         "validate":      "job_auto_match.job_auto_match.doctype.job_applicant.job_applicant.sync_workflow_state",
-    }
+    },
+    "Job Opening": {
+        "on_update": "job_auto_match.job_auto_match.utils.context_cache.on_job_opening_update",
+    },
+    "Job Matching Integration Settings": {
+        "on_update": "job_auto_match.job_auto_match.utils.context_cache.on_settings_update",
+    },
+}
+
+# ── Migration ───────────────────────────────────────────────────────────────
+# Index des requêtes chaudes, revérifiés à chaque migrate
+after_migrate = [
+    "job_auto_match.job_auto_match.utils.db_indexes.ensure_indexes",
+]
+
+# ── Tâches planifiées ───────────────────────────────────────────────────────
+scheduler_events = {
+    "all": [
+        "job_auto_match.job_auto_match.utils.matching_queue.drain_matching_queue",
+        "job_auto_match.job_auto_match.utils.testlify_inbox.drain_testlify_inbox",
+        "job_auto_match.job_auto_match.utils.notifications.drain_notifications",
+    ],
+    "daily": [
+        "job_auto_match.job_auto_match.utils.office_converter.cleanup_converted_pdf_cache",
+        "job_auto_match.job_auto_match.utils.cv_preprocess.cleanup_preprocessed_cv_cache",
+        "job_auto_match.job_auto_match.utils.testlify_inbox.purge_testlify_inbox",
+        "job_auto_match.job_auto_match.utils.orphan_files.scheduled_link_orphan_resume_files",
+        "job_auto_match.job_auto_match.utils.tracing.purge_matching_runs",
+        "job_auto_match.job_auto_match.utils.talent_pool.purge_candidate_profiles",
+    ],
 }
 
 # ── Fixtures ────────────────────────────────────────────────────────────────
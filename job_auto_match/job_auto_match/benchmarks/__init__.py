@@ -0,0 +1,9 @@
+"""
+Benchmark hors réseau du pipeline de matching.
+
+    bench --site <site> job-auto-match-benchmark --applicants 50 --json bench.json
+
+Gemini et Testlify sont remplacés par les doublures de utils.fakes (latence,
+taux de 429/503 réglables) ; la base, Redis et LibreOffice sont ceux du site.
+Voir runner.run_benchmark pour les métriques produites.
+"""
@@ -0,0 +1,243 @@
+"""
+Corpus synthétique du benchmark : CV PDF / DOCX / DOC et offres (Job Opening).
+
+Chaque document porte une référence unique au run : empreintes distinctes, le
+cache d'extraction et le cache de conversion ne faussent pas les mesures.
+Tous les enregistrements créés sont marqués par le run_id et supprimés par
+cleanup_fixtures().
+"""
+
+import io
+import pathlib
+import random
+import shutil
+import subprocess
+import tempfile
+
+import frappe
+from docx import Document
+
+from job_auto_match.job_auto_match.utils.fakes import FIRST_NAMES, LAST_NAMES, SKILLS, TOOLS
+
+FORMATS = ("pdf", "docx", "doc")
+EMAIL_DOMAIN = "bench.example.invalid"
+DESIGNATION = "Benchmark RecrutIA"
+ASSESSMENTS_PER_OPENING = 2
+
+
+# ---------- Documents ----------
+
+def _cv_lines(rng: random.Random, ref: str) -> list[str]:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    lines = [
+        f"{first} {last}",
+        f"{first}.{last}@{EMAIL_DOMAIN}".lower(),
+        f"Référence : {ref}",
+        "",
+        "COMPÉTENCES",
+        ", ".join(rng.sample(SKILLS, 5)),
+        "OUTILS",
+        ", ".join(rng.sample(TOOLS, 5)),
+        "",
+        "EXPÉRIENCE PROFESSIONNELLE",
+    ]
+    for i in range(rng.randint(2, 5)):
+        start = 2024 - 2 * (i + 1)
+        lines += [
+            f"{start} - {start + 2} : Poste {i + 1}, Entreprise {rng.randint(1, 99)}",
+            "Pilotage des missions, suivi des indicateurs et amélioration continue des processus.",
+        ]
+    lines += ["", "FORMATION", f"{rng.choice(['Licence', 'Master', 'BTS'])} - Université de test ({2024 - rng.randint(5, 15)})"]
+    return lines
+
+
+def _pdf_escape(text: str) -> bytes:
+    raw = text.encode("latin-1", "replace")
+    return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def build_pdf(lines: list[str]) -> bytes:
+    """PDF texte minimal d'une page (Helvetica, flux non compressé), sans dépendance."""
+    stream = b"BT /F1 11 Tf 50 790 Td 14 TL\n"
+    stream += b"".join(b"(" + _pdf_escape(line) + b") Tj T*\n" for line in lines)
+    stream += b"ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{i} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    out.write(b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def build_docx(lines: list[str]) -> bytes:
+    doc = Document()
+    for line in lines:
+        doc.add_paragraph(line)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def _docx_to_doc(docx_paths: list[pathlib.Path], outdir: pathlib.Path) -> dict:
+    """Conversion DOCX → DOC en un seul appel LibreOffice ; {} si soffice est absent."""
+    soffice = shutil.which("soffice") or shutil.which("libreoffice")
+    if not soffice or not docx_paths:
+        return {}
+    profile = pathlib.Path(tempfile.mkdtemp(prefix="bench_lo_profile_"))
+    try:
+        subprocess.run(
+            [soffice, f"-env:UserInstallation=file://{profile}", "--headless",
+             "--convert-to", "doc", "--outdir", str(outdir), *map(str, docx_paths)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=60 + 5 * len(docx_paths),
+            check=False,
+        )
+    except subprocess.TimeoutExpired:
+        pass
+    finally:
+        shutil.rmtree(profile, ignore_errors=True)
+    converted = {}
+    for path in docx_paths:
+        target = outdir / (path.stem + ".doc")
+        if target.exists():
+            converted[path] = target.read_bytes()
+    return converted
+
+
+def build_corpus(count: int, run_id: str, formats=FORMATS, seed: int = 0) -> list[dict]:
+    """
+    [{"file_name", "content", "format"}] : `count` CV répartis entre les formats.
+    Les DOC sont produits par LibreOffice ; sans LibreOffice, ils sont remplacés
+    par des DOCX (signalé par "format": "docx" dans le résultat).
+    """
+    rng = random.Random(seed)
+    formats = [f for f in formats if f in FORMATS] or list(FORMATS)
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix="bench_corpus_"))
+    try:
+        docs, pending_doc = [], []
+        for i in range(count):
+            fmt = formats[i % len(formats)]
+            lines = _cv_lines(rng, f"{run_id}-{i}")
+            stem = f"cv-{run_id}-{i:05d}"
+            if fmt == "pdf":
+                docs.append({"file_name": f"{stem}.pdf", "content": build_pdf(lines), "format": "pdf"})
+                continue
+            content = build_docx(lines)
+            entry = {"file_name": f"{stem}.docx", "content": content, "format": "docx"}
+            docs.append(entry)
+            if fmt == "doc":
+                path = workdir / f"{stem}.docx"
+                path.write_bytes(content)
+                pending_doc.append((path, entry))
+
+        converted = _docx_to_doc([path for path, _ in pending_doc], workdir)
+        for path, entry in pending_doc:
+            if path in converted:
+                entry.update(file_name=path.stem + ".doc", content=converted[path], format="doc")
+        return docs
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ---------- Enregistrements ----------
+
+def _ensure(doctype: str, name: str, values: dict):
+    if not frappe.db.exists(doctype, name):
+        frappe.get_doc({"doctype": doctype, **values}).insert(ignore_permissions=True, ignore_if_duplicate=True)
+
+
+def _default_company() -> str | None:
+    return (
+        frappe.defaults.get_global_default("company")
+        or frappe.db.get_value("Company", {}, "name", order_by="creation asc")
+    )
+
+
+def create_job_openings(count: int, run_id: str, seed: int = 0) -> list[str]:
+    """Offres actives (matching auto) avec compétences, outils et évaluations Testlify fictives."""
+    rng = random.Random(seed)
+    _ensure("Designation", DESIGNATION, {"designation_name": DESIGNATION})
+    for skill in SKILLS:
+        _ensure("Skill", skill, {"skill_name": skill})
+    for tool in TOOLS:
+        _ensure("Outil", tool, {"outil_name": tool})
+
+    company = _default_company()
+    names = []
+    for i in range(count):
+        opening = frappe.get_doc({
+            "doctype": "Job Opening",
+            "job_title": f"Benchmark {run_id} #{i + 1}",
+            "designation": DESIGNATION,
+            "company": company,
+            "status": "Open",
+            "description": "Offre synthétique du benchmark RecrutIA : missions, environnement et profil recherché.",
+            "custom_active_cv_auto_matching": 1,
+            "custom_minimum_experience": str(rng.randint(0, 8)),
+            "custom_study_level": f"BAC+{rng.randint(2, 5)}",
+            "custom_skills": [{"skill": s} for s in rng.sample(SKILLS, 5)],
+            "custom_outils": [{"outil": t} for t in rng.sample(TOOLS, 4)],
+            "custom_assessments": [
+                {"id": f"bench-{run_id}-{i + 1}-{k + 1}", "assessment_name": f"Évaluation {k + 1}"}
+                for k in range(ASSESSMENTS_PER_OPENING)
+            ],
+        })
+        opening.insert(ignore_permissions=True, ignore_mandatory=True)
+        names.append(opening.name)
+    frappe.db.commit()
+    return names
+
+
+def create_applicants(corpus: list[dict], openings: list[str], run_id: str) -> list[str]:
+    """Un File privé + un Job Applicant par CV, sans déclencher le job de matching."""
+    names = []
+    for i, entry in enumerate(corpus):
+        file_doc = frappe.get_doc({
+            "doctype": "File",
+            "file_name": entry["file_name"],
+            "content": entry["content"],
+            "is_private": 1,
+        }).insert(ignore_permissions=True)
+
+        applicant = frappe.get_doc({
+            "doctype": "Job Applicant",
+            "applicant_name": f"Candidat benchmark {i + 1}",
+            "email_id": f"cv-{run_id}-{i}@{EMAIL_DOMAIN}".lower(),
+            "job_title": openings[i % len(openings)],
+            "resume_attachment": file_doc.file_url,
+        })
+        applicant.flags.skip_matching = True  # piloté directement par le benchmark
+        applicant.insert(ignore_permissions=True, ignore_mandatory=True)
+        names.append(applicant.name)
+    frappe.db.commit()
+    return names
+
+
+def cleanup_fixtures(run_id: str) -> dict:
+    """Supprime profils, candidats, fichiers et offres du run (la désignation et le vocabulaire restent)."""
+    profiles = frappe.get_all("Candidate Profile", filters={"email": ["like", f"cv-{run_id}-%@{EMAIL_DOMAIN}"]}, pluck="name")
+    applicants = frappe.get_all("Job Applicant", filters={"email_id": ["like", f"cv-{run_id}-%@{EMAIL_DOMAIN}"]}, pluck="name")
+    files = frappe.get_all("File", filters={"file_name": ["like", f"cv-{run_id}-%"]}, pluck="name")
+    openings = frappe.get_all("Job Opening", filters={"job_title": ["like", f"Benchmark {run_id} #%"]}, pluck="name")
+
+    for doctype, names in (
+        ("Candidate Profile", profiles), ("Job Applicant", applicants), ("File", files), ("Job Opening", openings),
+    ):
+        for name in names:
+            frappe.delete_doc(doctype, name, force=True, ignore_permissions=True, delete_permanently=True)
+    frappe.db.commit()
+    return {"profiles": len(profiles), "applicants": len(applicants), "files": len(files), "openings": len(openings)}
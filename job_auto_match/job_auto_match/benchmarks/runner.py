@@ -0,0 +1,463 @@
+"""
+Exécution et rapport du benchmark de matching.
+
+Le pipeline réel (matching_steps, call_gemini_with_retry[_async], limiteur,
+disjoncteurs, cache d'extraction, conversion LibreOffice, écritures DB,
+invitations Testlify, file d'e-mails) est exercé contre des doublures locales :
+
+- Gemini : FakeGeminiClient, sur des noms de modèles dédiés (bench-*) pour ne
+  pas toucher aux limiteurs ni aux disjoncteurs des vrais modèles ;
+- Testlify : FakeTestlifyServer (HTTP local), via TestlifyClient et sa session ;
+- e-mails : file de notifications dédiée, rendue sans Email Queue.
+
+Rapport : candidats/minute, p50/p95 par étape, requêtes/écritures/commits DB
+par candidat, pic de RSS. compare_reports() signale les régressions par rapport
+à un rapport JSON de référence (version précédente).
+"""
+
+import asyncio
+import math
+import random
+import resource
+import time
+import uuid
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+import frappe
+from frappe.utils import now
+
+from job_auto_match import __version__
+from job_auto_match.job_auto_match.benchmarks.corpus import (
+    build_corpus,
+    cleanup_fixtures,
+    create_applicants,
+    create_job_openings,
+)
+from job_auto_match.job_auto_match.utils import rate_limiter
+from job_auto_match.job_auto_match.utils.batch_scoring import DEFAULT_TOKEN_BUDGET, BatchScorer
+from job_auto_match.job_auto_match.utils.fakes import (
+    SKILLS,
+    TOOLS,
+    FakeGeminiClient,
+    FakeTestlifyServer,
+    fake_candidate_info,
+    prompt_label,
+)
+from job_auto_match.job_auto_match.utils.gemini_files import GeminiFileSession
+from job_auto_match.job_auto_match.utils.matching import (
+    call_gemini_with_retry,
+    call_gemini_with_retry_async,
+    matching_steps,
+    run_matching_steps,
+    run_matching_steps_async,
+)
+from job_auto_match.job_auto_match.utils.metrics import DBQueryCounter
+from job_auto_match.job_auto_match.utils.model_health import get_health_registry
+from job_auto_match.job_auto_match.utils.notifications import BENCHMARK_QUEUE_KEY, flush_notifications
+from job_auto_match.job_auto_match.utils.testlify import TestlifyClient
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+
+BENCH_MODELS = ["bench-gemini-pro", "bench-gemini-flash"]
+BENCH_LIMITS = {"rpm": 100_000, "tpm": 1_000_000_000}
+
+MODE_SYNC = "sync"
+MODE_BATCH = "batch"
+
+# Sens d'une régression : une baisse du débit, une hausse des autres métriques
+_HIGHER_IS_BETTER = {"applicants_per_min"}
+
+
+# ---------- Mesures ----------
+
+def percentile(values: list[float], q: float) -> float:
+    """Percentile au rang le plus proche (q entre 0 et 100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), math.ceil(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def _peak_rss_mb() -> dict:
+    # ru_maxrss en Ko sous Linux ; les enfants couvrent les conversions LibreOffice
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+class StageTimer:
+    """Durées par étape : préparation, appels Gemini (par prompt), traitement, finalisation."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def add(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p95_ms": round(percentile(values, 95) * 1000, 1),
+                "mean_ms": round(sum(values) / len(values) * 1000, 1),
+            }
+            for stage, values in sorted(self.samples.items())
+        }
+
+
+class _RunClock:
+    """
+    Découpe un run en segments entre deux appels Gemini : avant le premier
+    appel (lecture, empreinte, conversion) = preparation, entre deux appels =
+    processing, après le dernier (score, invitations, écriture finale) = finalize.
+    """
+
+    def __init__(self, timer: StageTimer):
+        self.timer = timer
+        self.started = self.mark = time.perf_counter()
+        self.segment = "preparation"
+
+    def call_started(self) -> float:
+        now_ = time.perf_counter()
+        self.timer.add(self.segment, now_ - self.mark)
+        return now_
+
+    def call_finished(self, label: str, started: float):
+        self.mark = time.perf_counter()
+        self.timer.add(f"gemini:{label}", self.mark - started)
+        self.segment = "processing"
+
+    def finished(self):
+        end = time.perf_counter()
+        self.timer.add("finalize", end - self.mark)
+        self.timer.add("total", end - self.started)
+
+
+class _TimedTestlify:
+    """Client Testlify dont les envois sont chronométrés (étape testlify)."""
+
+    def __init__(self, client: TestlifyClient, timer: StageTimer):
+        self._client = client
+        self._timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def invite_many(self, requests_):
+        started = time.perf_counter()
+        try:
+            return self._client.invite_many(requests_)
+        finally:
+            self._timer.add("testlify", time.perf_counter() - started)
+
+
+# ---------- Pilotes ----------
+
+def _run_sync(names, settings, client, testlify, timer) -> dict:
+    """Un candidat après l'autre, comme process_job_applicant_matching."""
+    counter = DBQueryCounter().start()
+    try:
+        for name in names:
+            clock = _RunClock(timer)
+            gemini_files = GeminiFileSession(client, settings)
+
+            def call(request, clock=clock):
+                label, started = prompt_label(request), clock.call_started()
+                try:
+                    return call_gemini_with_retry(client, request, model_candidates=BENCH_MODELS, files=gemini_files)
+                finally:
+                    clock.call_finished(label, started)
+
+            try:
+                run_matching_steps(matching_steps(name, settings, gemini_files, testlify=testlify), call)
+            except Exception as e:
+                frappe.logger().error(f"[BENCHMARK] Échec pour {name} : {e!r}")
+            finally:
+                gemini_files.close()
+                clock.finished()
+    finally:
+        stats = counter.stop()
+    return stats
+
+
+async def _run_applicant_async(name, settings, client, testlify, timer, semaphore, db_lock):
+    clock = _RunClock(timer)
+    gemini_files = GeminiFileSession(client, settings)
+
+    async def call(request):
+        label, started = prompt_label(request), clock.call_started()
+        try:
+            async with semaphore:
+                return await call_gemini_with_retry_async(client, request, model_candidates=BENCH_MODELS, files=gemini_files)
+        finally:
+            clock.call_finished(label, started)
+
+    try:
+        await run_matching_steps_async(matching_steps(name, settings, gemini_files, testlify=testlify), call, db_lock)
+    finally:
+        await asyncio.to_thread(gemini_files.close)
+        clock.finished()
+
+
+async def _run_batches(names, settings, client, testlify, timer, batch_size, in_flight):
+    semaphore = asyncio.Semaphore(max(1, in_flight))
+    db_lock = asyncio.Lock()
+    for i in range(0, len(names), batch_size):
+        chunk = names[i:i + batch_size]
+        results = await asyncio.gather(
+            *(_run_applicant_async(n, settings, client, testlify, timer, semaphore, db_lock) for n in chunk),
+            return_exceptions=True,
+        )
+        for name, result in zip(chunk, results, strict=True):
+            if isinstance(result, BaseException):
+                frappe.logger().error(f"[BENCHMARK] Échec pour {name} : {result!r}")
+
+
+def _run_batch(names, settings, client, testlify, timer, batch_size, in_flight) -> dict:
+    """Même découpage que le consommateur matching_batch (lots de N, appels concurrents)."""
+    counter = DBQueryCounter().start()
+    try:
+        asyncio.run(_run_batches(names, settings, client, testlify, timer, batch_size, in_flight))
+    finally:
+        stats = counter.stop()
+    return stats
+
+
+# ---------- Benchmark ----------
+
+def _isolate_models():
+    """Modèles dédiés : limites très hautes (process courant) et disjoncteurs remis à zéro."""
+    for model in BENCH_MODELS:
+        rate_limiter.DEFAULT_LIMITS.setdefault(model, dict(BENCH_LIMITS))
+    get_health_registry().reset(BENCH_MODELS)
+
+
+def _outcomes(names: list[str]) -> dict:
+    rows = frappe.get_all(
+        "Job Applicant",
+        filters={"name": ["in", names]},
+        fields=["custom_status", "custom_is_matching_failed", "custom_invites_sent"],
+    )
+    statuses = Counter((r.custom_status or "—") for r in rows)
+    return {
+        "statuses": dict(statuses),
+        "failed": sum(1 for r in rows if r.custom_is_matching_failed),
+        "invited": sum(1 for r in rows if r.custom_invites_sent),
+    }
+
+
+def run_benchmark(
+    applicants: int = 50,
+    openings: int = 3,
+    formats=("pdf", "docx", "doc"),
+    mode: str = MODE_SYNC,
+    batch_size: int = 20,
+    in_flight: int = 8,
+    gemini_latency: float = 0.8,
+    gemini_429: float = 0.0,
+    gemini_503: float = 0.0,
+    not_cv_rate: float = 0.05,
+    gemini_malformed: float = 0.0,
+    testlify_latency: float = 0.2,
+    testlify_429: float = 0.0,
+    testlify_503: float = 0.0,
+    seed: int = 42,
+    keep: bool = False,
+    progress=None,
+) -> dict:
+    """
+    Crée le corpus, exécute le pipeline sur tous les candidats et retourne le
+    rapport (dict sérialisable en JSON). `keep=True` conserve les
+    enregistrements créés ; `progress(message)` reçoit l'avancement.
+    """
+    log = progress or (lambda message: None)
+    settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    run_id = uuid.uuid4().hex[:8]
+    frappe.flags.job_auto_match_benchmark = True
+    _isolate_models()
+
+    server = FakeTestlifyServer(latency=testlify_latency, rate_429=testlify_429, rate_503=testlify_503, seed=seed).start()
+    client = FakeGeminiClient(
+        latency=gemini_latency, rate_429=gemini_429, rate_503=gemini_503, not_cv_rate=not_cv_rate,
+        malformed_rate=gemini_malformed, seed=seed,
+    )
+    timer = StageTimer()
+    testlify = _TimedTestlify(TestlifyClient(settings=server.settings()), timer)
+
+    try:
+        log(f"Corpus {run_id} : {applicants} CV, {openings} offre(s)")
+        corpus = build_corpus(applicants, run_id, formats=formats, seed=seed)
+        opening_names = create_job_openings(max(1, openings), run_id, seed=seed)
+        names = create_applicants(corpus, opening_names, run_id)
+
+        log(f"Matching ({mode})…")
+        rss_before = _peak_rss_mb()
+        started = time.perf_counter()
+        if mode == MODE_BATCH:
+            db = _run_batch(names, settings, client, testlify, timer, batch_size, in_flight)
+        else:
+            db = _run_sync(names, settings, client, testlify, timer)
+        elapsed = time.perf_counter() - started
+
+        flush_started = time.perf_counter()
+        notified = flush_notifications(queue_key=BENCHMARK_QUEUE_KEY, send=False)
+        if notified:
+            timer.add("notifications", time.perf_counter() - flush_started)
+
+        count = len(names)
+        return {
+            "version": __version__,
+            "run_id": run_id,
+            "date": now(),
+            "config": {
+                "applicants": applicants, "openings": openings, "formats": list(formats), "mode": mode,
+                "batch_size": batch_size, "in_flight": in_flight, "seed": seed,
+                "gemini": {
+                    "latency": gemini_latency, "rate_429": gemini_429, "rate_503": gemini_503,
+                    "not_cv_rate": not_cv_rate, "malformed_rate": gemini_malformed,
+                },
+                "testlify": {"latency": testlify_latency, "rate_429": testlify_429, "rate_503": testlify_503},
+                "extraction_mode": getattr(settings, "cv_extraction_mode", None),
+            },
+            "corpus": dict(Counter(entry["format"] for entry in corpus)),
+            "elapsed_s": round(elapsed, 2),
+            "applicants_per_min": round(count / elapsed * 60, 1) if elapsed else 0.0,
+            "stages": timer.summary(),
+            "db": {
+                f"{key}_per_applicant": round(value / count, 2) if count else 0.0
+                for key, value in db.items()
+            },
+            "rss_mb": {"before": rss_before, "peak": _peak_rss_mb()},
+            "gemini": {"calls": dict(client.calls), "errors": {str(k): v for k, v in client.errors.items()}},
+            "testlify": {
+                "requests": server.requests,
+                "invites": server.invites,
+                "errors": {str(k): v for k, v in server.errors.items()},
+            },
+            "notifications": notified,
+            "outcomes": _outcomes(names),
+        }
+    finally:
+        server.stop()
+        frappe.flags.job_auto_match_benchmark = False
+        if not keep:
+            log(f"Nettoyage : {cleanup_fixtures(run_id)}")
+
+
+# ---------- Scoring par lot ----------
+
+def _scoring_mode(fiche, candidates: dict, limits: dict, client_options: dict) -> tuple[dict, dict]:
+    client = FakeGeminiClient(**client_options)
+    scorer = BatchScorer(
+        fiche, lambda request: call_gemini_with_retry(client, request, model_candidates=BENCH_MODELS), limits,
+    )
+    started = time.perf_counter()
+    results = scorer.score(candidates)
+    elapsed = time.perf_counter() - started
+    per_100 = 100 / len(candidates) if candidates else 0.0
+    return results, {
+        **scorer.stats,
+        "elapsed_s": round(elapsed, 2),
+        "calls_per_100": round(scorer.stats["calls"] * per_100, 1),
+        "seconds_per_100": round(elapsed * per_100, 2),
+        "gemini": {"calls": dict(client.calls), "errors": {str(k): v for k, v in client.errors.items()}},
+    }
+
+
+def run_scoring_benchmark(
+    candidates: int = 100,
+    batch_size: int = 20,
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    gemini_latency: float = 0.8,
+    token_latency: float = 0.004,
+    gemini_malformed: float = 0.0,
+    seed: int = 42,
+) -> dict:
+    """
+    Scoring seul, sans DB : les mêmes profils synthétiques contre une offre,
+    en mode unitaire puis par lot. Rapport : appels et secondes pour 100
+    candidats, gain, et écart des scores entre les deux modes.
+    """
+    _isolate_models()
+    rng = random.Random(seed)
+    fiche = SimpleNamespace(
+        name=f"bench-scoring-{uuid.uuid4().hex[:8]}",
+        custom_skills=[SimpleNamespace(skill=s) for s in rng.sample(SKILLS, 5)],
+        custom_outils=[SimpleNamespace(outil=o) for o in rng.sample(TOOLS, 4)],
+        custom_minimum_experience=3,
+        custom_study_level="BAC+3",
+        description="Offre synthétique de benchmark : missions, responsabilités et environnement technique.",
+    )
+    profiles = {f"bench-{i}": fake_candidate_info(rng) for i in range(candidates)}
+    client_options = {
+        "latency": gemini_latency, "token_latency": token_latency, "malformed_rate": gemini_malformed, "seed": seed,
+    }
+
+    single_scores, single = _scoring_mode(fiche, profiles, {"max_candidates": 1, "token_budget": token_budget}, client_options)
+    batch_scores, batch = _scoring_mode(
+        fiche, profiles, {"max_candidates": batch_size, "token_budget": token_budget}, client_options,
+    )
+
+    diffs = [
+        abs(single_scores[key]["score"] - batch_scores[key]["score"])
+        for key in profiles
+        if single_scores.get(key, {}).get("score") is not None and batch_scores.get(key, {}).get("score") is not None
+    ]
+    return {
+        "version": __version__,
+        "date": now(),
+        "config": {
+            "candidates": candidates, "batch_size": batch_size, "token_budget": token_budget, "seed": seed,
+            "gemini": {"latency": gemini_latency, "token_latency": token_latency, "malformed_rate": gemini_malformed},
+        },
+        "single": single,
+        "batch": batch,
+        "saved_per_100": {
+            "calls": round(single["calls_per_100"] - batch["calls_per_100"], 1),
+            "seconds": round(single["seconds_per_100"] - batch["seconds_per_100"], 2),
+        },
+        "agreement": {
+            "compared": len(diffs),
+            "identical_pct": round(100 * sum(1 for d in diffs if d == 0) / len(diffs), 1) if diffs else 0.0,
+            "mean_abs_diff": round(sum(diffs) / len(diffs), 2) if diffs else 0.0,
+            "max_abs_diff": max(diffs, default=0),
+        },
+    }
+
+
+# ---------- Comparaison ----------
+
+def _flatten(report: dict) -> dict:
+    """Métriques comparables d'un rapport : {nom: valeur}."""
+    metrics = {"applicants_per_min": report.get("applicants_per_min") or 0.0}
+    for stage, values in (report.get("stages") or {}).items():
+        metrics[f"{stage}.p95_ms"] = values.get("p95_ms") or 0.0
+    for key, value in (report.get("db") or {}).items():
+        metrics[f"db.{key}"] = value or 0.0
+    metrics["rss_mb.peak"] = ((report.get("rss_mb") or {}).get("peak") or {}).get("self") or 0.0
+    return metrics
+
+
+def compare_reports(current: dict, baseline: dict, tolerance: float = 0.10) -> list[dict]:
+    """
+    Écarts entre deux rapports, métrique par métrique. Une métrique régresse si
+    elle se dégrade de plus de `tolerance` (relatif) par rapport à la référence.
+    """
+    now_, ref = _flatten(current), _flatten(baseline)
+    rows = []
+    for name in sorted(set(now_) & set(ref)):
+        before, after = ref[name], now_[name]
+        change = (after - before) / before if before else 0.0
+        worse = -change if name in _HIGHER_IS_BETTER else change
+        rows.append({
+            "metric": name,
+            "baseline": before,
+            "current": after,
+            "change_pct": round(change * 100, 1),
+            "regression": worse > tolerance,
+        })
+    return rows
@@ -0,0 +1,12 @@
+# Copyright (c) 2026, KONE Fousseni and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+from job_auto_match.job_auto_match.utils.talent_pool import profile_name
+
+
+class CandidateProfile(Document):
+	def autoname(self):
+		# Un profil par (e-mail normalisé, CV) : nom déterministe, lecture directe par clé
+		self.name = profile_name(self.email, self.cv_hash)
@@ -1,5 +1,5 @@
 import frappe
-from frappe import enqueue
+from frappe.query_builder.functions import IfNull
 from urllib.parse import urlparse
 import pathlib
 
@@ -11,22 +11,22 @@ def _norm(s):
     return (s or "").strip().lower()
 
 
-def _enqueue_matching(applicant_name: str):
-    enqueue(
-        "job_auto_match.job_auto_match.utils.matching.process_job_applicant_matching",
-        applicant_name=applicant_name,
-        queue="long",
-        timeout=300,
-        now=False,
-        user="Administrator",  # job système : toujours en Administrator, peu importe qui a soumis
-    )
+def _enqueue_matching(applicant_name: str, priority: int | None = None, job_opening: str | None = None):
+    """File de matching dédiée : une entrée par candidat, priorité puis tourniquet par offre."""
+    from job_auto_match.job_auto_match.utils import matching_queue
+
+    if priority is None:
+        priority = matching_queue.PRIORITY_NEW
+    matching_queue.enqueue_matching(applicant_name, priority=priority, job_opening=job_opening)
 
 
 # ── Hooks document ────────────────────────────────────────────────────────────
 def enqueue_matching(doc, method=None):
+    if doc.flags.skip_matching:
+        return  # candidatures créées par le benchmark, pilotées directement
     try:
         frappe.logger().info(f"[MATCHING] Enqueue pour candidat : {doc.name}")
-        _enqueue_matching(doc.name)
+        _enqueue_matching(doc.name, job_opening=doc.job_title)
     except Exception:
         frappe.log_error(frappe.get_traceback(), "[MATCHING] Échec enqueue")
         raise
@@ -122,35 +122,37 @@ def _validate_no_duplicate(doc):
 
 
 # ── Liaison fichier CV ────────────────────────────────────────────────────────
+def link_resume_files(file_url: str, applicant_name: str):
+    """Rattache en un seul UPDATE tous les File orphelins portant cette URL."""
+    File = frappe.qb.DocType("File")
+    (
+        frappe.qb.update(File)
+        .set(File.attached_to_doctype, "Job Applicant")
+        .set(File.attached_to_name, applicant_name)
+        .set(File.attached_to_field, "resume_attachment")
+        .where(File.file_url == file_url)
+        .where(IfNull(File.attached_to_doctype, "") == "")
+        .run()
+    )
+
+
 def ensure_resume_file_linked(doc, method=None):
     """
     Garantit que le fichier CV (resume_attachment) est bien rattaché à ce Job
-    Applicant dans le document File.  Appelé sur after_insert et on_update pour
-    couvrir les uploads manuels (Administrator) et via web form (Guest).
+    Applicant dans le document File.  Appelé sur on_update (insert compris)
+    pour couvrir les uploads manuels (Administrator) et via web form (Guest).
+
+    Les saves qui ne touchent pas resume_attachment (matching, webhook,
+    éditions) ne touchent pas à File ; les fichiers devenus orphelins plus tard
+    relèvent de la tâche planifiée link_orphan_resume_files.
     """
     resume_url = (getattr(doc, "resume_attachment", "") or "").strip()
     if not resume_url:
         return
+    if not (doc.is_new() or doc.has_value_changed("resume_attachment")):
+        return
 
-    orphan_files = frappe.db.get_all(
-        "File",
-        filters={
-            "file_url": resume_url,
-            "attached_to_doctype": ("is", "not set"),
-        },
-        fields=["name"],
-    )
-    for file_record in orphan_files:
-        frappe.db.set_value(
-            "File",
-            file_record.name,
-            {
-                "attached_to_doctype": "Job Applicant",
-                "attached_to_name": doc.name,
-                "attached_to_field": "resume_attachment",
-            },
-            update_modified=False,
-        )
+    link_resume_files(resume_url, doc.name)
 
 
 # ── Synchronisation custom_status ↔ workflow_state ──────────────────────────
@@ -167,6 +169,8 @@ def retry_matching(applicant_name: str, force: int = 0):
     """Relance le job de matching avec cooldown anti-spam."""
     from frappe.utils import now_datetime
 
+    from job_auto_match.job_auto_match.utils.matching_queue import PRIORITY_RETRY
+
     doc = frappe.get_doc("Job Applicant", applicant_name)
 
     if not getattr(doc, "resume_attachment", None):
@@ -186,5 +190,5 @@ def retry_matching(applicant_name: str, force: int = 0):
     doc.save(ignore_permissions=True)
     frappe.db.commit()
 
-    _enqueue_matching(doc.name)
+    _enqueue_matching(doc.name, priority=PRIORITY_RETRY, job_opening=doc.job_title)
     return {"ok": True, "queued": True, "message": f"Relance planifiée pour {doc.name}."}
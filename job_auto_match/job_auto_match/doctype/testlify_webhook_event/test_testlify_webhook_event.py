@@ -0,0 +1,71 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from job_auto_match.job_auto_match.utils import testlify_inbox
+
+
+class TestTestlifyWebhookEvent(FrappeTestCase):
+	def _record(self, assessment_id="asmt-test", email="Candidat@Example.com", event="completed"):
+		return testlify_inbox.record_event({"data": {}}, assessment_id, email, event)
+
+	def _events(self, *names):
+		return frappe.get_all(
+			testlify_inbox.INBOX_DOCTYPE,
+			filters={"name": ["in", names]},
+			fields=["name", "status", "attempts", "error", "applicant"],
+			order_by="name asc",
+		)
+
+	def test_redelivery_is_ignored(self):
+		self.assertTrue(self._record())
+		# même clé (e-mail normalisé) : la clé primaire refuse le doublon
+		self.assertFalse(self._record(email=" candidat@example.com "))
+		self.assertEqual(frappe.db.count(testlify_inbox.INBOX_DOCTYPE, {"assessment_id": "asmt-test"}), 1)
+
+	def test_event_key_is_stable(self):
+		key = testlify_inbox.event_key("a1", "X@Y.com", "completed")
+		self.assertEqual(key, testlify_inbox.event_key("a1", " x@y.com ", "completed"))
+		self.assertNotEqual(key, testlify_inbox.event_key("a1", "x@y.com", "started"))
+		self.assertNotEqual(key, testlify_inbox.event_key("a2", "x@y.com", "completed"))
+
+	def test_mark_failed_retries_until_max_attempts(self):
+		self._record(assessment_id="asmt-retry")
+		self._record(assessment_id="asmt-final")
+		retry = testlify_inbox.event_key("asmt-retry", "candidat@example.com", "completed")
+		final = testlify_inbox.event_key("asmt-final", "candidat@example.com", "completed")
+		frappe.db.set_value(testlify_inbox.INBOX_DOCTYPE, final, "attempts", testlify_inbox.MAX_ATTEMPTS - 1)
+
+		events = frappe.get_all(
+			testlify_inbox.INBOX_DOCTYPE, filters={"name": ["in", [retry, final]]}, fields=["name", "attempts"]
+		)
+		testlify_inbox._mark_failed(events, "boom")
+
+		by_name = {e.name: e for e in self._events(retry, final)}
+		self.assertEqual(by_name[retry].status, testlify_inbox.STATUS_PENDING)
+		self.assertEqual(by_name[retry].attempts, 1)
+		self.assertEqual(by_name[retry].error, "boom")
+		self.assertEqual(by_name[final].status, testlify_inbox.STATUS_FAILED)
+		self.assertEqual(by_name[final].attempts, testlify_inbox.MAX_ATTEMPTS)
+
+	def test_paging_does_not_skip_same_creation(self):
+		for i in range(3):
+			self._record(assessment_id=f"asmt-page-{i}")
+		names = [
+			testlify_inbox.event_key(f"asmt-page-{i}", "candidat@example.com", "completed") for i in range(3)
+		]
+		# même horodatage pour les trois : seul name départage
+		frappe.db.set_value(
+			testlify_inbox.INBOX_DOCTYPE, {"name": ["in", names]}, "creation", "2025-01-01 00:00:00"
+		)
+
+		seen, last = [], None
+		while True:
+			page = testlify_inbox._next_events(last, 1)
+			if not page:
+				break
+			seen.extend(e.name for e in page if e.name in names)
+			last = (page[-1].creation, page[-1].name)
+		self.assertEqual(seen, sorted(names))
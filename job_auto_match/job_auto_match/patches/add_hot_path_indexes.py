@@ -0,0 +1,14 @@
+"""
+Patch: add_hot_path_indexes
+---------------------------
+Crée les index composites des chemins de lecture chauds (webhook Testlify,
+dédoublonnage des candidatures, liaison/validation des fichiers CV).
+Voir utils/db_indexes.py ; les index sont aussi vérifiés à chaque migrate.
+"""
+
+from job_auto_match.job_auto_match.utils.db_indexes import ensure_indexes
+
+
+def execute():
+    created = ensure_indexes()
+    print(f"Patch terminé : {len(created)} index créé(s).")
@@ -0,0 +1,245 @@
+"""
+Bail Redis par candidat : un seul run de matching à la fois (single-flight).
+
+Sans verrou, deux workers pouvaient traiter le même candidat en parallèle
+(insertion puis « Relancer matching » rapide) : appels Gemini payés deux fois,
+invitations Testlify et e-mails en double, TimestampMismatchError sur la
+sauvegarde finale.
+
+- Bail : SET NX avec expiration et jeton propre au run. Un thread de
+  heartbeat le prolonge tant que le run tourne. Un worker tué ne bloque donc
+  le candidat que LEASE_TTL secondes.
+- Une demande qui trouve le bail pris ne lance rien. Elle pose un marqueur
+  « rerun » et le détenteur, en libérant le bail, remet le candidat une seule
+  fois dans la file de matching. Plusieurs demandes concurrentes donnent donc
+  au plus un run supplémentaire, après le run en cours.
+- Prise, libération et prolongation sont des scripts Lua : ils ne touchent le
+  bail que si le jeton correspond.
+- Un bail perdu (heartbeat bloqué, Redis indisponible) n'est pas qu'un
+  compteur : le pipeline le revérifie (still_held) avant les invitations et
+  l'écriture finale, et abandonne si un autre run a repris le candidat.
+- Un marqueur « rerun » resté sans bail (détenteur tué) est repris par
+  drain_matching_queue (requeue_orphan_reruns).
+"""
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import frappe
+
+from job_auto_match.job_auto_match.utils.metrics import get_counters, incr_counter
+
+_PREFIX = "job_auto_match:applicant_lease"
+
+LEASE_TTL = 90  # s sans heartbeat avant qu'un bail orphelin expire
+HEARTBEAT_INTERVAL = LEASE_TTL / 3
+RERUN_TTL = 24 * 3600
+
+COUNTER_COALESCED = "matching:lease_coalesced"
+COUNTER_RERUNS = "matching:lease_reruns"
+COUNTER_LOST = "matching:lease_lost"
+LEASE_COUNTERS = (COUNTER_COALESCED, COUNTER_RERUNS, COUNTER_LOST)
+
+# KEYS = bail, marqueur rerun ; ARGV = jeton, ttl bail, ttl marqueur
+_ACQUIRE_LUA = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', tonumber(ARGV[2])) then
+    redis.call('DEL', KEYS[2])
+    return 1
+end
+redis.call('SET', KEYS[2], '1', 'EX', tonumber(ARGV[3]))
+return 0
+"""
+
+# KEYS = bail, marqueur rerun ; ARGV = jeton → 1 si une relance a été demandée pendant le run
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return redis.call('DEL', KEYS[2])
+"""
+
+# KEYS = bail ; ARGV = jeton, ttl → 1 si le bail est (de nouveau) à ce jeton, 0 s'il a été repris
+_HELD_LUA = """
+local current = redis.call('GET', KEYS[1])
+if current == ARGV[1] then
+    return 1
+end
+if not current then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+    return 1
+end
+return 0
+"""
+
+# KEYS = bail, marqueur rerun → 1 si le marqueur était orphelin (supprimé)
+_ORPHAN_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return redis.call('DEL', KEYS[2])
+end
+return 0
+"""
+
+# KEYS = bail ; ARGV = jeton, ttl
+_RENEW_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+end
+return 0
+"""
+
+class LeaseLostError(Exception):
+    """Le bail du candidat a été repris par un autre run pendant celui-ci."""
+
+
+_scripts = {}
+# Baux détenus par ce processus : clé → [jeton, candidat, perdu]
+_held = {}
+_held_lock = threading.Lock()
+_heartbeat = None
+
+
+def _script(name: str, source: str):
+    if name not in _scripts:
+        _scripts[name] = frappe.cache().register_script(source)
+    return _scripts[name]
+
+
+def _keys(applicant_name: str) -> tuple[str, str]:
+    key = frappe.cache().make_key(f"{_PREFIX}:{applicant_name}")
+    key = key.decode() if isinstance(key, bytes) else key
+    return key, f"{key}:rerun"
+
+
+# ---------- Heartbeat ----------
+
+def _heartbeat_loop(renew):
+    # Un seul thread par processus pour tous les baux (les clés sont déjà préfixées :
+    # aucun accès à frappe.local, propre au thread principal)
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        with _held_lock:
+            held = list(_held.items())
+        for key, entry in held:
+            try:
+                if not int(renew(keys=[key], args=[entry[0], LEASE_TTL]) or 0):
+                    entry[2] = True
+            except Exception:
+                continue  # Redis indisponible : nouvel essai au prochain battement
+
+
+def _ensure_heartbeat():
+    global _heartbeat
+    if _heartbeat is None or not _heartbeat.is_alive():
+        renew = _script("renew", _RENEW_LUA)
+        _heartbeat = threading.Thread(target=_heartbeat_loop, args=(renew,), name="applicant-lease", daemon=True)
+        _heartbeat.start()
+
+
+# ---------- Bail ----------
+
+def acquire(applicant_name: str) -> str | None:
+    """Jeton du bail, ou None si un run est déjà en cours (la relance est alors notée)."""
+    key, rerun_key = _keys(applicant_name)
+    token = uuid.uuid4().hex
+    if not int(_script("acquire", _ACQUIRE_LUA)(keys=[key, rerun_key], args=[token, LEASE_TTL, RERUN_TTL]) or 0):
+        incr_counter(COUNTER_COALESCED)
+        return None
+    with _held_lock:
+        _held[key] = [token, applicant_name, False]
+    _ensure_heartbeat()
+    return token
+
+
+def release(applicant_name: str, token: str) -> bool:
+    """Libère le bail ; True si une relance a été demandée pendant le run."""
+    key, rerun_key = _keys(applicant_name)
+    with _held_lock:
+        entry = _held.pop(key, None)
+    if entry and entry[2]:
+        incr_counter(COUNTER_LOST)
+        frappe.logger().warning(f"[MATCHING_LEASE] Bail perdu en cours de run pour {applicant_name}")
+    return bool(int(_script("release", _RELEASE_LUA)(keys=[key, rerun_key], args=[token]) or 0))
+
+
+def still_held(applicant_name: str) -> bool:
+    """
+    Ce processus détient-il encore le bail du candidat ? Un bail expiré sans
+    repreneur est repris sur place ; False seulement si un autre run le tient.
+    True hors bail (benchmarks, console).
+    """
+    key, _ = _keys(applicant_name)
+    with _held_lock:
+        entry = _held.get(key)
+    if entry is None:
+        return True
+    try:
+        held = bool(int(_script("held", _HELD_LUA)(keys=[key], args=[entry[0], LEASE_TTL]) or 0))
+    except Exception:
+        return True  # Redis indisponible : la libération le signalera
+    if not held:
+        entry[2] = True
+    return held
+
+
+def _rerun(applicant_name: str):
+    from job_auto_match.job_auto_match.utils import matching_queue
+
+    incr_counter(COUNTER_RERUNS)
+    opening = frappe.db.get_value("Job Applicant", applicant_name, "job_title")
+    matching_queue.push(applicant_name, matching_queue.PRIORITY_RETRY, opening)
+    matching_queue.wake_consumers()
+
+
+def begin(applicant_name: str) -> str | None:
+    """Jeton du run, ou None si un run est déjà en cours (il sera relancé une fois à sa fin)."""
+    token = acquire(applicant_name)
+    if token is None:
+        frappe.logger().info(f"[MATCHING_LEASE] Run en cours pour {applicant_name} : relance notée")
+    return token
+
+
+def end(applicant_name: str, token: str):
+    """Libère le bail ; remet le candidat en file si une relance a été demandée pendant le run."""
+    try:
+        if release(applicant_name, token):
+            _rerun(applicant_name)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), f"[MATCHING_LEASE] Libération du bail {applicant_name}")
+
+
+@contextmanager
+def applicant_lease(applicant_name: str):
+    """
+    Contexte d'un run de matching : cède True si le bail est obtenu, False si un
+    run est déjà en cours (ne rien faire : il sera relancé une fois à sa fin).
+    """
+    token = begin(applicant_name)
+    if token is None:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        end(applicant_name, token)
+
+
+def requeue_orphan_reruns() -> int:
+    """Remet en file les candidats dont le marqueur « rerun » n'a plus de bail (détenteur tué)."""
+    cache = frappe.cache()
+    base, _ = _keys("")
+    orphan = _script("orphan", _ORPHAN_LUA)
+    count = 0
+    for raw in cache.scan_iter(match=f"{base}*:rerun"):
+        rerun_key = raw.decode() if isinstance(raw, bytes) else raw
+        applicant_name = rerun_key[len(base):-len(":rerun")]
+        if int(orphan(keys=[rerun_key[:-len(":rerun")], rerun_key]) or 0):
+            frappe.logger().info(f"[MATCHING_LEASE] Relance orpheline reprise pour {applicant_name}")
+            _rerun(applicant_name)
+            count += 1
+    return count
+
+
+def get_lease_stats() -> dict:
+    return get_counters(LEASE_COUNTERS)
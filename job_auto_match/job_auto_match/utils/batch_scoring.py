@@ -0,0 +1,308 @@
+"""
+Scoring par lot : K candidats contre une même offre en un appel Gemini.
+
+Le scoring unitaire envoie un candidat par appel et répète à chaque fois le
+barème et la fiche de poste. Quand les exigences d'une offre changent, ou qu'un
+arriéré doit être re-scoré, cela fait des centaines d'appels presque identiques.
+
+- Un appel porte K profils, chacun avec un identifiant court (c1, c2…). La
+  réponse est une liste {candidate_id, score, justification}, confrontée aux
+  identifiants envoyés : les inconnus sont ignorés et les absents sont
+  re-scorés.
+- K s'adapte au budget de tokens : les profils sont empaquetés tant que le
+  budget d'entrée (réglage) et le budget de sortie (justifications) tiennent,
+  dans la limite de la taille de lot.
+- Réponse mal formée ou incomplète : seuls les candidats concernés sont
+  rejoués, en deux moitiés. Un candidat isolé repasse par le prompt unitaire,
+  à l'identique du pipeline. Après un découpage, les lots suivants sont
+  plafonnés à la moitié.
+- Reproductibilité : même barème que le scoring unitaire, consigne d'évaluer
+  chaque candidat indépendamment, décodage à température 0 dans les deux
+  modes.
+- rescore_job_opening() re-score les candidats déjà extraits d'une offre. Le
+  profil vient du Candidate Profile du talent pool quand il existe (titre,
+  lieu, e-mail et téléphone compris), sinon des tables custom_skills,
+  custom_outils, custom_experiences et custom_diplomes. Il met à jour score,
+  justification et note sous le bail du candidat, mais ni le statut ni les
+  invitations : ceux-ci restent du ressort du pipeline complet.
+"""
+
+import json
+
+import frappe
+
+from job_auto_match.job_auto_match.utils.rate_limiter import estimate_tokens
+from job_auto_match.job_auto_match.utils.structured_output import (
+    OUTPUT_BATCH_SCORING,
+    OUTPUT_SCORING,
+    GeminiRequest,
+    StructuredOutputError,
+    coerce_candidate_info,
+    parse_output,
+)
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_TOKEN_BUDGET = 24000  # tokens d'entrée par appel, hors préfixe (consignes + fiche)
+MAX_OUTPUT_TOKENS = 8192
+OUTPUT_TOKENS_PER_CANDIDATE = 200  # id + score + justification de 1 à 5 phrases
+BATCH_KEY_SUFFIX = ":batch"
+RESCORE_JOB_ID = "job_auto_match:rescore:{job_opening}"
+
+
+def batch_limits(settings=None) -> dict:
+    settings = settings or frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    return {
+        "max_candidates": int(getattr(settings, "batch_scoring_size", 0) or DEFAULT_BATCH_SIZE),
+        "token_budget": int(getattr(settings, "batch_scoring_token_budget", 0) or DEFAULT_TOKEN_BUDGET),
+    }
+
+
+def _entry_tokens(info: dict) -> int:
+    return estimate_tokens([json.dumps({"candidate_id": "c00", "candidate_info": info}, ensure_ascii=False)])
+
+
+class BatchScorer:
+    """
+    Scoring d'une offre par lots. `call(request)` envoie une GeminiRequest et
+    renvoie la réponse (call_gemini_with_retry en production, client simulé au
+    benchmark). Compteurs : appels, découpages, replis unitaires.
+    """
+
+    def __init__(self, fiche, call, limits: dict | None = None):
+        from job_auto_match.job_auto_match.utils.matching import BATCH_SCORING_PROMPT, scoring_static_context
+
+        self.call = call
+        self.limits = limits or batch_limits()
+        self.max_k = max(1, min(self.limits["max_candidates"], MAX_OUTPUT_TOKENS // OUTPUT_TOKENS_PER_CANDIDATE))
+        # Préfixes statiques distincts (cache de contexte) : lot et unitaire, tous deux invalidés avec l'offre
+        self.batch_context = scoring_static_context(fiche, BATCH_SCORING_PROMPT, BATCH_KEY_SUFFIX)
+        self.single_context = scoring_static_context(fiche)
+        self.stats = {"calls": 0, "batches": 0, "splits": 0, "single": 0, "failed": 0}
+
+    def _next_batch(self, remaining: list[str], tokens: dict) -> list[str]:
+        """Plus grand préfixe de `remaining` qui tient dans K et dans le budget (au moins un candidat)."""
+        batch, used = [], 0
+        for key in remaining:
+            if batch and (len(batch) >= self.max_k or used + tokens[key] > self.limits["token_budget"]):
+                break
+            batch.append(key)
+            used += tokens[key]
+        return batch
+
+    def score(self, candidates: dict) -> dict:
+        """{clé: {"score", "justification"}} ; {"score": None, "error"} si aucun essai n'a abouti."""
+        tokens = {key: _entry_tokens(info) for key, info in candidates.items()}
+        remaining, results = list(candidates), {}
+        while remaining:
+            batch = self._next_batch(remaining, tokens)
+            remaining = remaining[len(batch):]
+            results.update(self._score_batch(batch, candidates))
+        return results
+
+    def _score_batch(self, keys: list[str], candidates: dict) -> dict:
+        if len(keys) == 1:
+            return {keys[0]: self._score_single(candidates[keys[0]])}
+
+        ids = {f"c{i + 1}": key for i, key in enumerate(keys)}
+        entries = [{"candidate_id": cid, "candidate_info": candidates[key]} for cid, key in ids.items()]
+        part = f"""
+            Profils candidats à évaluer :
+            {json.dumps(entries, ensure_ascii=False)}
+            """
+        self.stats["calls"] += 1
+        self.stats["batches"] += 1
+        try:
+            scored = parse_output(
+                self.call(GeminiRequest([self.batch_context, part], OUTPUT_BATCH_SCORING)),
+                OUTPUT_BATCH_SCORING, f"score lot de {len(keys)}",
+            )["results"]
+        except StructuredOutputError as e:
+            frappe.logger().warning(f"[BATCH_SCORING] {e}")
+            scored = {}
+
+        results = {key: scored[cid] for cid, key in ids.items() if cid in scored}
+        missing = [key for key in keys if key not in results]
+        if missing:
+            # Réponse tronquée ou incomplète : lots suivants plus petits, absents rejoués en deux moitiés
+            self.stats["splits"] += 1
+            self.max_k = max(1, min(self.max_k, len(keys) // 2))
+            half = (len(missing) + 1) // 2
+            for chunk in (missing[:half], missing[half:]):
+                if chunk:
+                    results.update(self._score_batch(chunk, candidates))
+        return results
+
+    def _score_single(self, info: dict) -> dict:
+        """Prompt unitaire du pipeline, avec un nouvel essai si la réponse reste inexploitable."""
+        from job_auto_match.job_auto_match.utils.matching import FORMAT_RETRIES, scoring_candidate_part
+
+        self.stats["single"] += 1
+        request = GeminiRequest([self.single_context, scoring_candidate_part({"candidate_info": info})], OUTPUT_SCORING)
+        for _ in range(FORMAT_RETRIES + 1):
+            self.stats["calls"] += 1
+            try:
+                return parse_output(self.call(request), OUTPUT_SCORING, "score matching")
+            except StructuredOutputError as e:
+                frappe.logger().warning(f"[BATCH_SCORING] {e}")
+        self.stats["failed"] += 1
+        return {"score": None, "justification": "", "error": "réponse Gemini inexploitable"}
+
+
+# ---------- Candidats déjà extraits ----------
+
+def applicant_candidate_infos(names: list[str]) -> dict:
+    """
+    candidate_info des Job Applicant (7 requêtes au total) : celui du Candidate
+    Profile quand il existe, sinon reconstruit depuis les champs et tables
+    enfants. Les candidats sans donnée extraite sont omis.
+    """
+    if not names:
+        return {}
+    applicants = frappe.get_all(
+        "Job Applicant",
+        filters={"name": ["in", names]},
+        fields=[
+            "name", "email_id", "phone_number", "custom_first_name", "custom_last_name", "custom_old",
+            "custom_minimum_experience", "custom_study_level",
+        ],
+        limit_page_length=0,
+    )
+    profiles = _profile_infos(applicants)
+    children = {}
+    for doctype, fields in (
+        ("Skill Applicant", ["skill_name"]),
+        ("Outil Applicant", ["outil_name"]),
+        ("Experience Applicant", ["annee", "title", "description"]),
+        ("Diploma Applicant", ["annee", "qualification", "institution", "level"]),
+    ):
+        for row in frappe.get_all(
+            doctype,
+            filters={"parenttype": "Job Applicant", "parent": ["in", names]},
+            fields=["parent", *fields],
+            order_by="idx asc",
+            limit_page_length=0,
+        ):
+            children.setdefault((doctype, row.parent), []).append(row)
+
+    infos = {}
+    for a in applicants:
+        if a.name in profiles:
+            infos[a.name] = profiles[a.name]
+            continue
+        rows = {doctype: children.get((doctype, a.name), []) for doctype in (
+            "Skill Applicant", "Outil Applicant", "Experience Applicant", "Diploma Applicant",
+        )}
+        if not any(rows.values()):
+            continue  # jamais extrait : relève du pipeline complet
+        infos[a.name] = coerce_candidate_info({
+            "first_name": a.custom_first_name,
+            "last_name": a.custom_last_name,
+            "age": a.custom_old,
+            "email": a.email_id,
+            "phone": a.phone_number,
+            "competences": [r.skill_name for r in rows["Skill Applicant"]],
+            "outils": [r.outil_name for r in rows["Outil Applicant"]],
+            "experience_professionnelle": [
+                {"annee": r.annee, "titre": r.title, "description": r.description}
+                for r in rows["Experience Applicant"]
+            ],
+            "diplomes": [
+                {"annee": r.annee, "diplome": r.qualification, "institution": r.institution, "level": r.level}
+                for r in rows["Diploma Applicant"]
+            ],
+            "annee_experience": a.custom_minimum_experience,
+            "niveau_etude": a.custom_study_level,
+        })
+    return infos
+
+
+def _profile_infos(applicants) -> dict:
+    """
+    candidate_info des Candidate Profile : celui dont le candidat est la dernière
+    candidature, sinon le profil unique de son e-mail (plusieurs CV : ambigu, ignoré).
+    """
+    from job_auto_match.job_auto_match.utils.talent_pool import PROFILE_DOCTYPE, normalize_email
+
+    emails = {a.name: normalize_email(a.email_id) for a in applicants}
+    Profile = frappe.qb.DocType(PROFILE_DOCTYPE)
+    rows = (
+        frappe.qb.from_(Profile)
+        .select(Profile.email, Profile.last_applicant, Profile.candidate_info)
+        .where(Profile.last_applicant.isin(list(emails)) | Profile.email.isin([e for e in emails.values() if e] or [""]))
+    ).run(as_dict=True)
+
+    by_applicant, by_email = {}, {}
+    for r in rows:
+        try:
+            info = coerce_candidate_info(json.loads(r.candidate_info or ""))
+        except (ValueError, StructuredOutputError):
+            continue
+        if r.last_applicant:
+            by_applicant[r.last_applicant] = info
+        by_email.setdefault(r.email, []).append(info)
+
+    infos = {}
+    for name, email in emails.items():
+        info = by_applicant.get(name) or (by_email[email][0] if len(by_email.get(email, [])) == 1 else None)
+        if info:
+            infos[name] = info
+    return infos
+
+
+def enqueue_rescore(job_opening: str, applicant_names: list[str] | None = None):
+    frappe.enqueue(
+        "job_auto_match.job_auto_match.utils.batch_scoring.rescore_job_opening",
+        queue="long",
+        timeout=3600,
+        job_id=RESCORE_JOB_ID.format(job_opening=job_opening),
+        deduplicate=True,
+        user="Administrator",  # job système : toujours en Administrator, peu importe qui a soumis
+        job_opening=job_opening,
+        applicant_names=applicant_names,
+    )
+
+
+def rescore_job_opening(job_opening: str, applicant_names: list[str] | None = None) -> dict:
+    """Job RQ : re-score par lots les candidats déjà extraits d'une offre (score, justification, note)."""
+    from job_auto_match.job_auto_match.utils import applicant_lock
+    from job_auto_match.job_auto_match.utils.matching import (
+        FLAG_MATCHING_IN_PROGRESS,
+        call_gemini_with_retry,
+        get_gemini_client,
+    )
+
+    settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    fiche = frappe.get_doc("Job Opening", job_opening)
+    filters = {"job_title": job_opening, FLAG_MATCHING_IN_PROGRESS: 0}  # un run en cours écrira son propre score
+    if applicant_names:
+        filters["name"] = ["in", applicant_names]
+    candidates = applicant_candidate_infos(frappe.get_all("Job Applicant", filters=filters, pluck="name"))
+    if not candidates:
+        return {"candidates": 0, "scored": 0}
+
+    client = get_gemini_client(settings)
+    scorer = BatchScorer(fiche, lambda request: call_gemini_with_retry(client, request), batch_limits(settings))
+    results = scorer.score(candidates)
+
+    scored = skipped = 0
+    for name, result in results.items():
+        if result.get("score") is None:
+            continue
+        # Bail du candidat : si un run du pipeline le tient, il est relancé à sa fin et écrira le score
+        with applicant_lock.applicant_lease(name) as acquired:
+            if not acquired:
+                skipped += 1
+                continue
+            frappe.db.set_value("Job Applicant", name, {
+                "custom_matching_score": result["score"],
+                "custom_justification": result.get("justification"),
+                "applicant_rating": float(f"{max(0.0, min(1.0, result['score'] / 100)):.2f}"),
+            })
+            frappe.db.commit()
+        scored += 1
+
+    summary = {"candidates": len(candidates), "scored": scored, "skipped": skipped, **scorer.stats}
+    frappe.logger().info(f"[BATCH_SCORING] {job_opening} : {summary}")
+    return summary
@@ -0,0 +1,315 @@
+"""
+Cache de contexte Gemini (cachedContents) pour les préfixes statiques des prompts.
+
+Les consignes d'extraction sont identiques pour tous les candidats. Les
+consignes de scoring et le profil de poste (job_json, description comprise)
+sont identiques pour tous les candidats d'une même offre. Ces préfixes sont
+enregistrés une fois chez Gemini avec un TTL. Les appels par candidat ne
+transportent plus que le contenu propre au candidat : le CV, ou le profil
+extrait.
+
+- Le pipeline marque les parts statiques avec static_context(texte, clé).
+  Partout ailleurs ce sont des chaînes ordinaires : estimation de tokens,
+  envoi inline si le cache est désactivé ou indisponible.
+- Un cache Gemini est propre à un modèle. Le nom est mémorisé dans Redis par
+  (modèle, clé, empreinte du texte). Un texte modifié donne donc une nouvelle
+  entrée, même sans invalidation explicite.
+- Création protégée par un verrou Redis (un seul worker crée, les autres
+  envoient inline en attendant). Un préfixe refusé par Gemini (trop court
+  pour le minimum du modèle, etc.) est mémorisé comme non cachable pour la
+  durée du TTL.
+- La modification d'une Job Opening supprime les caches de scoring de l'offre.
+  La modification des settings supprime tous les caches.
+"""
+
+import hashlib
+import json
+
+import frappe
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+_PREFIX = "job_auto_match:gemini_ctx"
+_UNCACHEABLE = "-"
+
+# Clés des préfixes : les consignes d'extraction sont globales, le scoring est par offre
+KEY_CHECK = "extraction:check"
+KEY_EXTRACTION = "extraction:cv"
+KEY_COMBINED = "extraction:combined"
+KEY_SCORING = "scoring"
+KEY_PROFILE_SCORING = "profile-scoring"
+
+DEFAULT_TTL_MINUTES = 60
+MIN_TTL_MINUTES = 5
+EXPIRY_MARGIN = 120  # l'entrée Redis expire avant le cache Gemini
+CREATE_LOCK_TTL = 60
+# En dessous, Gemini refuse de toute façon le cache (minimum ~1 024 tokens)
+MIN_CACHE_CHARS = 4096
+
+COUNTER_HITS = "gemini_ctx:hits"
+COUNTER_CREATED = "gemini_ctx:created"
+COUNTER_INLINE = "gemini_ctx:inline"
+
+
+class StaticContext(str):
+    """Chaîne marquée comme préfixe statique cachable, identifiée par `cache_key`."""
+
+    cache_key: str
+
+    def __new__(cls, text: str, cache_key: str):
+        obj = super().__new__(cls, text)
+        obj.cache_key = cache_key
+        return obj
+
+
+def static_context(text: str, cache_key: str) -> StaticContext:
+    return StaticContext(text, cache_key)
+
+
+def scoring_key(job_opening: str) -> str:
+    return f"{KEY_SCORING}:{job_opening}"
+
+
+# ---------- Réglages ----------
+
+def _settings():
+    return frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+
+
+def is_enabled(settings=None) -> bool:
+    try:
+        return bool(int(getattr(settings or _settings(), "gemini_context_cache_enabled", 0) or 0))
+    except Exception:
+        return False
+
+
+def _ttl_seconds(settings=None) -> int:
+    try:
+        minutes = int(getattr(settings or _settings(), "gemini_context_cache_ttl", 0) or DEFAULT_TTL_MINUTES)
+    except Exception:
+        minutes = DEFAULT_TTL_MINUTES
+    return max(minutes, MIN_TTL_MINUTES) * 60
+
+
+# ---------- Registre Redis ----------
+
+def _entry_key(model: str, context: StaticContext) -> str:
+    digest = hashlib.sha1(str.__str__(context).encode("utf-8")).hexdigest()[:16]
+    return f"{_PREFIX}:{context.cache_key}:{model}:{digest}"
+
+
+def _get(key: str):
+    try:
+        return frappe.cache().get_value(key, expires=True)
+    except Exception:
+        return None
+
+
+def _set(key: str, value: str, ttl: int):
+    try:
+        frappe.cache().set_value(key, value, expires_in_sec=max(ttl - EXPIRY_MARGIN, 60))
+    except Exception:
+        pass
+
+
+def _try_lock(key: str) -> bool:
+    try:
+        return bool(frappe.cache().set(frappe.cache().make_key(f"{key}:lock"), 1, nx=True, ex=CREATE_LOCK_TTL))
+    except Exception:
+        return False
+
+
+def _unlock(key: str):
+    try:
+        frappe.cache().delete(frappe.cache().make_key(f"{key}:lock"))
+    except Exception:
+        pass
+
+
+def _count(name: str):
+    from job_auto_match.job_auto_match.utils.metrics import incr_counter
+
+    incr_counter(name)
+
+
+# ---------- Préparation d'un appel ----------
+
+def _split(parts) -> tuple[StaticContext | None, list]:
+    static = next((p for p in parts or [] if isinstance(p, StaticContext)), None)
+    if static is None:
+        return None, list(parts or [])
+    return static, [p for p in parts if p is not static]
+
+
+def _create_config(context: StaticContext, ttl: int):
+    from google.genai import types
+
+    return types.CreateCachedContentConfig(
+        system_instruction=str.__str__(context),
+        ttl=f"{ttl}s",
+        display_name=f"job_auto_match {context.cache_key}"[:128],
+    )
+
+
+def _generate_config(name: str):
+    from google.genai import types
+
+    return types.GenerateContentConfig(cached_content=name)
+
+
+def _plan(model: str, parts):
+    """
+    (contents, config, entry_key, à_créer) : contenu à envoyer pour ce modèle.
+    à_créer = True si ce worker doit créer le cache (verrou obtenu).
+    """
+    static, rest = _split(parts)
+    if static is None or not is_enabled() or len(static) < MIN_CACHE_CHARS:
+        return parts, None, None, False
+
+    key = _entry_key(model, static)
+    name = _get(key)
+    if name and name != _UNCACHEABLE:
+        _count(COUNTER_HITS)
+        return rest, _generate_config(name), key, False
+    if name == _UNCACHEABLE or not _try_lock(key):
+        _count(COUNTER_INLINE)
+        return parts, None, None, False
+    return parts, None, key, True
+
+
+def _created(key: str, cache, parts, ttl: int):
+    _set(key, cache.name, ttl)
+    _unlock(key)
+    _count(COUNTER_CREATED)
+    static, rest = _split(parts)
+    return rest, _generate_config(cache.name), key
+
+
+def _refused(key: str, model: str, err: Exception, parts, ttl: int):
+    frappe.logger().warning(f"[GEMINI_CTX] Cache refusé pour {key} ({model}) : {err}")
+    _set(key, _UNCACHEABLE, ttl)
+    _unlock(key)
+    _count(COUNTER_INLINE)
+    return parts, None, None
+
+
+def prepare(client, model: str, parts):
+    """
+    (contents, config, entry_key) pour generate_content : préfixe statique
+    remplacé par le cache Gemini du modèle si possible, sinon envoyé inline.
+    """
+    contents, config, key, create = _plan(model, parts)
+    if not create:
+        return contents, config, key
+    ttl = _ttl_seconds()
+    static, _ = _split(parts)
+    try:
+        cache = client.caches.create(model=model, config=_create_config(static, ttl))
+    except Exception as e:
+        return _refused(key, model, e, parts, ttl)
+    return _created(key, cache, parts, ttl)
+
+
+async def prepare_async(client, model: str, parts):
+    """Variante asyncio de prepare (client.aio.caches)."""
+    contents, config, key, create = _plan(model, parts)
+    if not create:
+        return contents, config, key
+    ttl = _ttl_seconds()
+    static, _ = _split(parts)
+    try:
+        cache = await client.aio.caches.create(model=model, config=_create_config(static, ttl))
+    except Exception as e:
+        return _refused(key, model, e, parts, ttl)
+    return _created(key, cache, parts, ttl)
+
+
+def is_cache_error(err: Exception) -> bool:
+    """Erreur due au cache lui-même (expiré/supprimé côté Gemini) plutôt qu'au modèle."""
+    resp = getattr(err, "response_json", {}) or {}
+    message = ((resp.get("error") or {}).get("message") or str(err)).lower()
+    return "cachedcontent" in message.replace(" ", "") or "cached content" in message
+
+
+def forget(entry_key: str | None):
+    """Oublie un cache devenu invalide : le prochain appel le recrée."""
+    if not entry_key:
+        return
+    try:
+        frappe.cache().delete_value(entry_key)
+    except Exception:
+        pass
+
+
+# ---------- Invalidation ----------
+
+def _entries(cache_key_prefix: str) -> list[tuple[str, str]]:
+    """[(clé Redis sans préfixe de site, nom du cache Gemini)] pour un préfixe de clé."""
+    cache = frappe.cache()
+    site_prefix = cache.make_key("")
+    entries = []
+    try:
+        for raw in cache.scan_iter(match=cache.make_key(f"{_PREFIX}:{cache_key_prefix}*")):
+            full = raw.decode() if isinstance(raw, bytes) else raw
+            if full.endswith(":lock"):
+                continue
+            key = full[len(site_prefix.decode() if isinstance(site_prefix, bytes) else site_prefix):]
+            name = _get(key)
+            entries.append((key, name))
+    except Exception:
+        frappe.logger().warning(f"[GEMINI_CTX] Parcours des caches impossible ({cache_key_prefix})")
+    return entries
+
+
+def invalidate(cache_key_prefix: str = "") -> int:
+    """Supprime les caches Gemini et les entrées Redis dont la clé commence par `cache_key_prefix`."""
+    entries = _entries(cache_key_prefix)
+    if not entries:
+        return 0
+    names = [name for _, name in entries if name and name != _UNCACHEABLE]
+    for key, _ in entries:
+        forget(key)
+    if names:
+        frappe.enqueue(
+            "job_auto_match.job_auto_match.utils.context_cache.delete_remote_caches",
+            queue="short",
+            names=json.dumps(names),
+            enqueue_after_commit=True,
+        )
+    return len(entries)
+
+
+def delete_remote_caches(names):
+    """Job : suppression des caches chez Gemini (ils expireraient de toute façon au TTL)."""
+    from job_auto_match.job_auto_match.utils.matching import get_gemini_client
+
+    if isinstance(names, str):
+        names = json.loads(names)
+    client = get_gemini_client()
+    for name in names or []:
+        try:
+            client.caches.delete(name=name)
+        except Exception as e:
+            frappe.logger().info(f"[GEMINI_CTX] Suppression de {name} ignorée : {e}")
+
+
+def on_job_opening_update(doc, method=None):
+    """doc_event Job Opening : le profil de poste a pu changer, on repart de zéro pour l'offre."""
+    invalidate(f"{scoring_key(doc.name)}:")
+
+
+def on_settings_update(doc, method=None):
+    """doc_event des settings : TTL, activation ou consignes ont pu changer."""
+    invalidate()
+
+
+def get_context_cache_stats() -> dict:
+    from job_auto_match.job_auto_match.utils.metrics import get_counters
+
+    c = get_counters([COUNTER_HITS, COUNTER_CREATED, COUNTER_INLINE])
+    return {"hits": c[COUNTER_HITS], "created": c[COUNTER_CREATED], "inline": c[COUNTER_INLINE]}
+
+
+def reset_context_cache_stats():
+    from job_auto_match.job_auto_match.utils.metrics import reset_counters
+
+    reset_counters([COUNTER_HITS, COUNTER_CREATED, COUNTER_INLINE])
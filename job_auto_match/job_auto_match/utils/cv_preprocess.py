@@ -0,0 +1,164 @@
+"""
+Prétraitement des CV PDF avant envoi à Gemini : pages et poids.
+
+Certains candidats envoient des scans photo de 15 à 30 Mo ou des portfolios
+de 20 pages. Les envoyer tels quels gonfle la mémoire du worker, le temps
+d'upload et les tokens, et dépasse parfois la limite des requêtes inline.
+
+- Mesure : taille et nombre de pages, lus sans charger le fichier en mémoire
+  (pypdf lit les objets à la demande).
+- Pages : seules les `max_pages` premières sont gardées. Identité,
+  expériences et diplômes s'y trouvent ; les annexes et portfolios suivent.
+- Poids : au-delà de `max_size_mb`, les images des pages gardées sont
+  réduites (côté long ≤ `image_max_px`, JPEG) ; c'est le cas des scans.
+- Le PDF réduit est écrit sur disque, dans un cache par empreinte et réglages,
+  puis envoyé par chemin (upload streamé ou lecture unique). Le fichier
+  d'origine n'est jamais modifié.
+- Les décisions prises sont renvoyées pour prep_info.
+"""
+
+import io
+import os
+import pathlib
+import tempfile
+import time
+
+import frappe
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+
+DEFAULT_MAX_PAGES = 6
+DEFAULT_MAX_SIZE_MB = 8
+DEFAULT_IMAGE_MAX_PX = 1600
+DEFAULT_CACHE_DAYS = 30
+JPEG_QUALITY = 70
+MB = 1024 * 1024
+
+
+def _dir() -> pathlib.Path:
+    p = pathlib.Path(frappe.get_site_path("private", "preprocessed_cv"))
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+def preprocess_limits(settings=None) -> dict:
+    settings = settings or frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+
+    def _int(fieldname, default):
+        try:
+            return int(getattr(settings, fieldname, 0) or default)
+        except (TypeError, ValueError):
+            return default
+
+    return {
+        "max_pages": _int("cv_max_pages", DEFAULT_MAX_PAGES),
+        "max_bytes": _int("cv_max_size_mb", DEFAULT_MAX_SIZE_MB) * MB,
+        "image_max_px": _int("cv_image_max_px", DEFAULT_IMAGE_MAX_PX),
+    }
+
+
+def _downsample(image, max_px: int) -> int:
+    """Réduit une image de page si son côté long dépasse max_px ; 1 si remplacée."""
+    img = image.image
+    if img is None or max(img.size) <= max_px:
+        return 0
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.thumbnail((max_px, max_px))
+    image.replace(img, quality=JPEG_QUALITY)
+    return 1
+
+
+def _write(reader, keep: int, downsample: bool, image_max_px: int, target: pathlib.Path) -> int:
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for page in reader.pages[:keep]:
+        writer.add_page(page)
+    replaced = 0
+    if downsample:
+        for page in writer.pages:
+            for image in page.images:
+                try:
+                    replaced += _downsample(image, image_max_px)
+                except Exception:
+                    continue  # filtre ou espace colorimétrique non géré : image laissée telle quelle
+    # Nom temporaire unique dans le même dossier : deux workers sur le même CV ne s'écrasent pas
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f"{target.stem}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            writer.write(f)
+        os.replace(tmp, target)  # écriture atomique
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return replaced
+
+
+def preprocess_pdf(*, file_hash: str | None, path: str | None = None, data: bytes | None = None, limits=None):
+    """
+    (path, data, file_key, info) du PDF à envoyer : l'original si les limites
+    sont respectées, sinon un PDF réduit sur disque (path). `file_key` identifie
+    la variante envoyée (empreinte d'origine + réglages), pour le cache Files API.
+    """
+    limits = limits or preprocess_limits()
+    size = len(data) if data is not None else os.path.getsize(path)
+    info = {"size_mb": round(size / MB, 2)}
+    try:
+        from pypdf import PdfReader
+
+        reader = PdfReader(path if data is None else io.BytesIO(data))
+        pages = len(reader.pages)
+    except Exception as e:
+        info["preprocess"] = f"illisible: {str(e)[:120]}"
+        return path, data, file_hash, info
+
+    info["pages"] = pages
+    trim = pages > limits["max_pages"]
+    heavy = size > limits["max_bytes"]
+    if not file_hash or not (trim or heavy):
+        return path, data, file_hash, info
+
+    keep = min(pages, limits["max_pages"])
+    variant = f"p{keep}" + (f"-img{limits['image_max_px']}" if heavy else "")
+    file_key = f"{file_hash}-{variant}"
+    target = _dir() / f"{file_key}.pdf"
+    info.update({"preprocess": variant, "pages_kept": keep})
+
+    started = time.perf_counter()
+    try:
+        if target.exists():
+            os.utime(target)  # "dernier accès" pour le nettoyage
+            info["preprocess_cache_hit"] = True
+        else:
+            info["images_downsampled"] = _write(reader, keep, heavy, limits["image_max_px"], target)
+    except Exception as e:
+        frappe.logger().warning(f"[CV_PREPROCESS] Réduction impossible, envoi de l'original : {e}")
+        info["preprocess"] = f"échec: {str(e)[:120]}"
+        return path, data, file_hash, info
+
+    info["preprocess_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    info["size_out_mb"] = round(target.stat().st_size / MB, 2)
+    return str(target), None, file_key, info
+
+
+def cleanup_preprocessed_cv_cache():
+    """Tâche planifiée : purge des PDF réduits non utilisés depuis N jours."""
+    try:
+        days = int(getattr(frappe.get_cached_doc(_SETTINGS_DOCTYPE), "converted_pdf_cache_days", 0) or DEFAULT_CACHE_DAYS)
+    except Exception:
+        days = DEFAULT_CACHE_DAYS
+    limit = time.time() - days * 86400
+    removed = 0
+    for path in _dir().glob("*"):
+        try:
+            if path.stat().st_mtime < limit:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        frappe.logger().info(f"[CV_PREPROCESS] {removed} PDF réduit(s) purgé(s) du cache")
@@ -0,0 +1,95 @@
+"""
+Index des chemins de lecture chauds de l'application + diagnostic EXPLAIN.
+
+- Assessment Score.assessment_id : résolution du candidat à partir du webhook Testlify.
+- Job Applicant.email_id + job_opening / job_title : dédoublonnage à chaque
+  soumission du web form (_validate_no_duplicate).
+- File.file_url : _validate_cv et ensure_resume_file_linked à chaque save.
+
+ensure_indexes() est idempotent : appelé par le patch de migration et à chaque
+`bench migrate` (after_migrate), il recrée un index supprimé par erreur.
+`bench --site <site> job-auto-match-explain` affiche plans et temps des requêtes.
+"""
+
+import time
+
+import frappe
+
+# (doctype, nom de l'index, colonnes) — préfixe sur file_url (colonne texte)
+HOT_INDEXES = [
+    ("Assessment Score", "assessment_id_parent_index", ["assessment_id", "parent"]),
+    ("Job Applicant", "email_id_job_opening_index", ["email_id", "job_opening"]),
+    ("Job Applicant", "email_id_job_title_index", ["email_id", "job_title"]),
+    ("File", "file_url_attached_to_doctype_index", ["file_url(255)", "attached_to_doctype"]),
+]
+
+
+def ensure_indexes():
+    """Crée les index manquants (sans effet s'ils existent déjà)."""
+    created = []
+    for doctype, index_name, fields in HOT_INDEXES:
+        table = f"tab{doctype}"
+        if frappe.db.has_index(table, index_name):
+            continue
+        frappe.db.add_index(doctype, fields, index_name=index_name)
+        created.append(f"{doctype}.{index_name}")
+    if created:
+        frappe.logger().info(f"[DB_INDEXES] Index créés : {', '.join(created)}")
+    return created
+
+
+# ---------- Diagnostic ----------
+
+def _sample(sql: str, default):
+    row = frappe.db.sql(sql)
+    return row[0] if row and row[0] else default
+
+
+def _hot_queries() -> list[tuple[str, str, tuple]]:
+    """(libellé, requête, paramètres) avec des valeurs réelles de la base si possible."""
+    assessment_id, = _sample("select assessment_id from `tabAssessment Score` where ifnull(assessment_id, '') != '' limit 1", ("-",))
+    email, opening, title = _sample(
+        "select email_id, ifnull(job_opening, ''), ifnull(job_title, '') from `tabJob Applicant` limit 1", ("-", "-", "-")
+    )
+    file_url, = _sample("select resume_attachment from `tabJob Applicant` where ifnull(resume_attachment, '') != '' limit 1", ("-",))
+
+    return [
+        (
+            "Webhook Testlify : Assessment Score par assessment_id",
+            "select parent from `tabAssessment Score` where assessment_id = %s",
+            (assessment_id,),
+        ),
+        (
+            "Dédoublonnage : Job Applicant par email_id + job_opening",
+            "select name from `tabJob Applicant` where email_id = %s and job_opening = %s and docstatus != 2 limit 1",
+            (email, opening),
+        ),
+        (
+            "Dédoublonnage : Job Applicant par email_id + job_title",
+            "select name from `tabJob Applicant` where email_id = %s and job_title = %s and docstatus != 2 limit 1",
+            (email, title),
+        ),
+        (
+            "Validation CV : File par file_url",
+            "select mime_type from `tabFile` where file_url = %s limit 1",
+            (file_url,),
+        ),
+        (
+            "Liaison CV : File orphelin par file_url",
+            "select name from `tabFile` where file_url = %s and ifnull(attached_to_doctype, '') = ''",
+            (file_url,),
+        ),
+    ]
+
+
+def explain_hot_queries(runs: int = 20) -> list[dict]:
+    """Plan EXPLAIN et temps moyen (ms) de chaque requête chaude."""
+    report = []
+    for label, sql, params in _hot_queries():
+        plan = frappe.db.sql(f"explain {sql}", params, as_dict=True)
+        started = time.perf_counter()
+        for _ in range(runs):
+            frappe.db.sql(sql, params)
+        elapsed_ms = (time.perf_counter() - started) * 1000 / runs
+        report.append({"query": label, "avg_ms": round(elapsed_ms, 3), "plan": plan})
+    return report
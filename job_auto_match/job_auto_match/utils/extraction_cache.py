@@ -0,0 +1,130 @@
+"""
+Cache d'extraction CV adressé par contenu.
+
+Clé = SHA-256 des octets du CV + version prompt/schéma. Une entrée contient le
+verdict "est-ce un CV" et le JSON candidate_info renvoyé par Gemini : sur un hit,
+le pipeline saute classification + extraction et passe directement au scoring
+(relance matching, retry après changement de seuil, candidature à une autre offre).
+
+Éviction : TTL Redis par entrée (Job Matching Integration Settings), puis
+politique LRU du cache Redis du site. Changer un prompt ou le schéma invalide
+toutes les entrées existantes puisque la version fait partie de la clé.
+"""
+
+import hashlib
+
+import frappe
+from frappe.utils import now_datetime
+
+from job_auto_match.job_auto_match.utils.metrics import get_counters, incr_counter, reset_counters
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+
+# Incrémenter à chaque changement de structure de candidate_info ou de l'entrée en cache.
+EXTRACTION_SCHEMA_VERSION = 1
+DEFAULT_TTL_HOURS = 720
+
+_CACHE_PREFIX = "job_auto_match:cv_extraction"
+COUNTER_HITS = "cv_extraction_cache:hits"
+COUNTER_MISSES = "cv_extraction_cache:misses"
+COUNTER_STORES = "cv_extraction_cache:stores"
+
+
+def compute_file_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 du fichier, lu par blocs pour ne pas charger le CV en mémoire."""
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def prompt_version(*prompts: str) -> str:
+    """Empreinte courte des prompts + version de schéma (fait partie de la clé)."""
+    h = hashlib.sha256(f"schema:{EXTRACTION_SCHEMA_VERSION}".encode())
+    for prompt in prompts:
+        h.update(b"\x00")
+        h.update((prompt or "").encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _cache_key(file_hash: str, version: str) -> str:
+    return f"{_CACHE_PREFIX}:{version}:{file_hash}"
+
+
+def _ttl_seconds() -> int | None:
+    """TTL configuré en secondes, ou None si le cache est désactivé."""
+    try:
+        settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    except Exception:
+        return DEFAULT_TTL_HOURS * 3600
+    if not int(getattr(settings, "extraction_cache_enabled", 1) or 0):
+        return None
+    hours = int(getattr(settings, "extraction_cache_ttl_hours", 0) or DEFAULT_TTL_HOURS)
+    return max(1, hours) * 3600
+
+
+def get_cached_extraction(file_hash: str, version: str) -> dict | None:
+    """
+    Retourne l'entrée en cache ({"cv_check": {...}, "candidate_json": {...}|None})
+    ou None. Compte les hits/misses.
+    """
+    if not file_hash or _ttl_seconds() is None:
+        return None
+    try:
+        entry = frappe.cache().get_value(_cache_key(file_hash, version))
+    except Exception:
+        entry = None
+
+    if isinstance(entry, dict) and isinstance(entry.get("cv_check"), dict):
+        incr_counter(COUNTER_HITS)
+        frappe.logger().info(f"[CV_CACHE] Hit {file_hash[:12]} (version {version})")
+        return entry
+
+    incr_counter(COUNTER_MISSES)
+    return None
+
+
+def set_cached_extraction(
+    file_hash: str,
+    version: str,
+    cv_check: dict,
+    candidate_json: dict | None,
+    prep_info: dict | None = None,
+) -> None:
+    """Enregistre le verdict CV et (si CV) le JSON extrait. Ne lève jamais."""
+    ttl = _ttl_seconds()
+    if not file_hash or ttl is None:
+        return
+    entry = {
+        "cv_check": {"is_cv": bool(cv_check.get("is_cv", True)), "reason": cv_check.get("reason", "")},
+        "candidate_json": candidate_json,
+        "strategy": (prep_info or {}).get("strategy"),
+        "cached_at": str(now_datetime()),
+    }
+    try:
+        frappe.cache().set_value(_cache_key(file_hash, version), entry, expires_in_sec=ttl)
+        incr_counter(COUNTER_STORES)
+    except Exception:
+        frappe.logger().warning(f"[CV_CACHE] Écriture impossible pour {file_hash[:12]}")
+
+
+def clear_extraction_cache() -> None:
+    """Vide le cache (toutes versions) : à utiliser après une correction des prompts hors versionnement."""
+    frappe.cache().delete_keys(_CACHE_PREFIX)
+
+
+def get_extraction_cache_stats() -> dict:
+    counters = get_counters([COUNTER_HITS, COUNTER_MISSES, COUNTER_STORES])
+    hits, misses = counters[COUNTER_HITS], counters[COUNTER_MISSES]
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "stores": counters[COUNTER_STORES],
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+    }
+
+
+def reset_extraction_cache_stats() -> None:
+    reset_counters([COUNTER_HITS, COUNTER_MISSES, COUNTER_STORES])
@@ -0,0 +1,566 @@
+"""
+Doublures locales (hors réseau) des API externes utilisées par le pipeline.
+
+Permettent d'exercer le code de matching sans accès à Gemini ni Testlify
+(développement, tests, benchmarks) :
+
+- LocalFilesAPI : API Files Gemini sur disque ;
+- FakeGeminiClient : client Gemini (sync + client.aio) à latence réglable,
+  avec taux de 429/503, réponses JSON plausibles selon le prompt et cache de
+  contexte en mémoire (client.caches) ;
+- FakeTestlifyServer : vrai serveur HTTP local (127.0.0.1) imitant l'endpoint
+  d'invitation, pour exercer la session, les retries et le parallélisme réels.
+"""
+
+import asyncio
+import hashlib
+import io
+import itertools
+import json
+import pathlib
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from job_auto_match.job_auto_match.utils.context_cache import (
+    KEY_CHECK,
+    KEY_COMBINED,
+    KEY_EXTRACTION,
+    KEY_PROFILE_SCORING,
+    KEY_SCORING,
+    StaticContext,
+)
+from job_auto_match.job_auto_match.utils.structured_output import StructuredOutputError, repair_json
+
+
+class LocalFilesAPI:
+    """
+    Doublure de `client.files` (API Files Gemini) : upload / get / delete.
+    Les fichiers sont copiés dans un répertoire temporaire et exposés via une
+    URI `local://files/<id>`.
+    """
+
+    def __init__(self, root: str | None = None):
+        self.root = pathlib.Path(root or tempfile.mkdtemp(prefix="fake_gemini_files_"))
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._ids = itertools.count(1)
+        self.files = {}
+        self.upload_count = 0
+        self.delete_count = 0
+
+    def upload(self, *, file, config=None):
+        name = f"files/local-{next(self._ids)}"
+        target = self.root / name.replace("/", "_")
+        if isinstance(file, str | pathlib.Path):
+            target.write_bytes(pathlib.Path(file).read_bytes())
+        elif isinstance(file, io.IOBase):
+            target.write_bytes(file.read())
+        else:
+            raise TypeError(f"Type de fichier non supporté: {type(file)!r}")
+
+        mime_type = getattr(config, "mime_type", None) or "application/octet-stream"
+        f = SimpleNamespace(
+            name=name,
+            uri=f"local://{name}",
+            mime_type=mime_type,
+            size_bytes=target.stat().st_size,
+            state=SimpleNamespace(name="ACTIVE"),
+            path=str(target),
+        )
+        self.files[name] = f
+        self.upload_count += 1
+        return f
+
+    def get(self, *, name):
+        try:
+            return self.files[name]
+        except KeyError:
+            raise FileNotFoundError(name)
+
+    def delete(self, *, name):
+        f = self.files.pop(name, None)
+        if f is None:
+            raise FileNotFoundError(name)
+        pathlib.Path(f.path).unlink(missing_ok=True)
+        self.delete_count += 1
+
+    def read_bytes(self, uri: str) -> bytes:
+        """Contenu d'un fichier uploadé à partir de son URI (pour la doublure Gemini)."""
+        name = uri.removeprefix("local://")
+        return pathlib.Path(self.get(name=name).path).read_bytes()
+
+
+# ---------- Gemini ----------
+
+SKILLS = [
+    "gestion de projet", "analyse de données", "comptabilité", "relation client", "développement web",
+    "négociation", "audit", "contrôle de gestion", "marketing digital", "ressources humaines",
+    "logistique", "support technique", "administration système", "rédaction", "management d'équipe",
+]
+TOOLS = [
+    "Python", "JavaScript", "React.js", "Node.js", "MySQL", "PostgreSQL", "Docker", "Git",
+    "Microsoft Office", "SAP", "Power BI", "Excel", "Linux", "Figma", "Salesforce",
+]
+FIRST_NAMES = ["Awa", "Koffi", "Marie", "Yao", "Fatou", "Jean", "Aminata", "Serge", "Nadia", "Eric"]
+LAST_NAMES = ["Kouassi", "Traoré", "Diallo", "Konan", "Bamba", "Dupont", "Ouattara", "Coulibaly", "Yapi", "Koné"]
+
+
+_LABELS = {
+    KEY_COMBINED: "combined",
+    KEY_CHECK: "check",
+    KEY_EXTRACTION: "extraction",
+    KEY_PROFILE_SCORING: "profile_scoring",
+}
+SCORING_LABELS = ("scoring", "batch_scoring", "profile_scoring")
+
+
+def _static_label(key: str) -> str:
+    from job_auto_match.job_auto_match.utils.batch_scoring import BATCH_KEY_SUFFIX
+
+    if key in _LABELS:
+        return _LABELS[key]
+    return "batch_scoring" if key.endswith(BATCH_KEY_SUFFIX) else "scoring"
+
+
+def prompt_label(parts) -> str:
+    """
+    Nature d'une requête : check, extraction, combined, scoring, batch_scoring
+    (plusieurs candidats, une offre) ou profile_scoring (un profil, plusieurs offres).
+    """
+    from job_auto_match.job_auto_match.utils.matching import (
+        CV_CHECK_PROMPT,
+        CV_COMBINED_PROMPT,
+        CV_EXTRACTION_PROMPT,
+    )
+
+    for part in parts or []:
+        if isinstance(part, StaticContext):
+            return _static_label(part.cache_key)
+    last = parts[-1] if parts else None
+    if last == CV_COMBINED_PROMPT:
+        return "combined"
+    if last == CV_CHECK_PROMPT:
+        return "check"
+    if last == CV_EXTRACTION_PROMPT:
+        return "extraction"
+    return "scoring"
+
+
+def _content_seed(parts) -> int:
+    """Graine stable dérivée du contenu : même CV ⇒ même réponse simulée."""
+    digest = hashlib.sha1()
+    for part in parts or []:
+        if isinstance(part, str):
+            digest.update(part.encode("utf-8"))
+            continue
+        inline = getattr(part, "inline_data", None)
+        file_data = getattr(part, "file_data", None)
+        if inline is not None and getattr(inline, "data", None):
+            digest.update(inline.data)
+        elif file_data is not None:
+            digest.update(str(getattr(file_data, "file_uri", "")).encode("utf-8"))
+        else:
+            digest.update(str(getattr(part, "text", "") or "").encode("utf-8"))
+    return int.from_bytes(digest.digest()[:8], "big")
+
+
+def fake_score(opening_key: str, info) -> dict:
+    """Score simulé d'un profil pour une offre : identique en mode unitaire, par lot ou multi-offres."""
+    digest = hashlib.sha1(f"{opening_key}|{json.dumps(info, sort_keys=True, ensure_ascii=False)}".encode())
+    rng = random.Random(int.from_bytes(digest.digest()[:8], "big"))
+    return {"score": rng.randint(0, 100), "justification": "Évaluation simulée."}
+
+
+def _variable_payloads(contents) -> list:
+    """JSON des parts propres à la requête (profils, offres), dans l'ordre."""
+    out = []
+    for part in contents:
+        if isinstance(part, str) and not isinstance(part, StaticContext):
+            try:
+                out.append(repair_json(part))
+            except StructuredOutputError:
+                continue
+    return out
+
+
+def _scoring_payload(label: str, contents) -> dict:
+    from job_auto_match.job_auto_match.utils.batch_scoring import BATCH_KEY_SUFFIX
+
+    key = next((p.cache_key for p in contents if isinstance(p, StaticContext)), KEY_SCORING)
+    payloads = _variable_payloads(contents)
+    if label == "batch_scoring":
+        entries = next((p for p in payloads if isinstance(p, list)), [])
+        return {"results": [
+            {"candidate_id": e.get("candidate_id"), **fake_score(key.removesuffix(BATCH_KEY_SUFFIX), e.get("candidate_info"))}
+            for e in entries if isinstance(e, dict)
+        ]}
+    candidate = next((p for p in reversed(payloads) if isinstance(p, dict)), {})
+    info = candidate.get("candidate_info", candidate)
+    if label == "profile_scoring":
+        openings = next((p for p in payloads if isinstance(p, list)), [])
+        return {"results": [
+            {"job_opening": o.get("job_opening"), **fake_score(f"{KEY_SCORING}:{o.get('job_opening')}", info)}
+            for o in openings if isinstance(o, dict)
+        ]}
+    return fake_score(key, info)
+
+
+def fake_candidate_info(rng: random.Random) -> dict:
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    years = rng.randint(0, 15)
+    return {
+        "first_name": first,
+        "last_name": last,
+        "title": rng.choice(["Analyste", "Développeur", "Comptable", "Chef de projet", "Technicien"]),
+        "age": rng.randint(21, 55),
+        "email": f"{first}.{last}@example.invalid".lower(),
+        "phone": [f"+225 07 {rng.randint(10, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)} {rng.randint(10, 99)}"],
+        "location": rng.choice(["Abidjan", "Dakar", "Paris", "Lomé", "Bamako"]),
+        "competences": rng.sample(SKILLS, rng.randint(3, 8)),
+        "outils": rng.sample(TOOLS, rng.randint(2, 8)),
+        "experience_professionnelle": [
+            {"annee": str(2024 - i * 2), "titre": f"Poste {i + 1}", "description": "Missions et résultats clés."}
+            for i in range(rng.randint(1, 4))
+        ],
+        "diplomes": [{
+            "annee": str(2024 - years - 1),
+            "diplome": rng.choice(["BTS", "Licence", "Master"]),
+            "institution": "Université de test",
+            "level": rng.choice(["Under Graduate", "Graduate", "Post Graduate"]),
+        }],
+        "annee_experience": years,
+        "niveau_etude": f"BAC+{rng.randint(2, 5)}",
+    }
+
+
+def _api_error(code: int, message: str | None = None):
+    from google.genai import errors as genai_errors
+
+    status = {429: "RESOURCE_EXHAUSTED", 404: "NOT_FOUND"}.get(code, "UNAVAILABLE")
+    cls = genai_errors.ClientError if code < 500 else genai_errors.ServerError
+    return cls(code, {"error": {"code": code, "status": status, "message": message or f"Erreur simulée ({status})"}})
+
+
+class FakeCachesAPI:
+    """
+    Doublure de client.caches (create/delete) : le préfixe est conservé en
+    mémoire et réinjecté par FakeGeminiClient quand config.cached_content le cite.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.created = 0
+        self._lock = threading.Lock()
+
+    def create(self, *, model, config):
+        key = (getattr(config, "display_name", "") or "").removeprefix("job_auto_match ")
+        with self._lock:
+            self.created += 1
+            name = f"cachedContents/fake-{self.created}"
+            self.entries[name] = (model, StaticContext(config.system_instruction, key))
+        return SimpleNamespace(name=name, model=model)
+
+    async def create_async(self, *, model, config):
+        return self.create(model=model, config=config)
+
+    def delete(self, *, name):
+        with self._lock:
+            self.entries.pop(name, None)
+
+    def resolve(self, name: str, model: str) -> StaticContext:
+        entry = self.entries.get(name)
+        if entry is None or entry[0] != model:
+            raise _api_error(404, f"CachedContent not found: {name}")
+        return entry[1]
+
+
+class FakeGeminiClient:
+    """
+    Doublure de genai.Client : `models.generate_content` et
+    `aio.models.generate_content`, plus `files` (LocalFilesAPI) et `caches`
+    (FakeCachesAPI, cache de contexte).
+
+    - latency / jitter : durée d'un appel en secondes (± jitter relatif) ;
+    - rate_429 / rate_503 : probabilité qu'un appel échoue en quota / surcharge ;
+    - not_cv_rate : part des documents classés « non CV » ;
+    - malformed_rate : part des réponses mal formées (balises markdown, JSON
+      tronqué), pour exercer la réparation et le rejeu ciblé ;
+    - token_latency : durée de génération par token de sortie (s), qui rend
+      plus longs les appels à longue réponse (scoring par lot).
+    Les réponses dépendent du contenu (graine stable), pas du tirage d'erreurs.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.3,
+        rate_429: float = 0.0,
+        rate_503: float = 0.0,
+        not_cv_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        token_latency: float = 0.0,
+        seed: int | None = None,
+        files_api: LocalFilesAPI | None = None,
+    ):
+        self.latency = max(0.0, float(latency))
+        self.jitter = max(0.0, float(jitter))
+        self.rate_429 = float(rate_429)
+        self.rate_503 = float(rate_503)
+        self.not_cv_rate = float(not_cv_rate)
+        self.malformed_rate = float(malformed_rate)
+        self.token_latency = max(0.0, float(token_latency))
+        self.files = files_api or LocalFilesAPI()
+        self.caches = FakeCachesAPI()
+        self.models = SimpleNamespace(generate_content=self._generate)
+        self.aio = SimpleNamespace(
+            models=SimpleNamespace(generate_content=self._generate_async),
+            caches=SimpleNamespace(create=self.caches.create_async, delete=self.caches.delete),
+        )
+        self.calls = Counter()
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _draw(self) -> tuple[float, int | None]:
+        """(délai, code d'erreur simulé ou None)."""
+        with self._lock:
+            delay = self.latency * (1 + self.jitter * (2 * self._rng.random() - 1))
+            roll = self._rng.random()
+        if roll < self.rate_429:
+            return delay * 0.1, 429
+        if roll < self.rate_429 + self.rate_503:
+            return delay * 0.5, 503
+        return delay, None
+
+    def _with_cached(self, model: str, contents, config) -> tuple[list, int]:
+        """Contenu complet (préfixe du cache réinjecté) et nombre de tokens servis par le cache."""
+        name = getattr(config, "cached_content", None)
+        if not name:
+            return list(contents), 0
+        prefix = self.caches.resolve(name, model)
+        full = [prefix, *contents] if prompt_label([prefix]) in SCORING_LABELS else [*contents, prefix]
+        return full, len(prefix) // 4
+
+    def _respond(self, model: str, contents, config=None) -> SimpleNamespace:
+        contents, cached_tokens = self._with_cached(model, contents, config)
+        label = prompt_label(contents)
+        rng = random.Random(_content_seed([p for p in contents if not isinstance(p, StaticContext)]))
+        is_cv = rng.random() >= self.not_cv_rate
+
+        if label == "check":
+            payload = {"is_cv": is_cv, "reason": "Document simulé"}
+        elif label == "extraction":
+            payload = {"candidate_info": fake_candidate_info(rng)}
+        elif label == "combined":
+            payload = {
+                "is_cv": is_cv,
+                "reason": "Document simulé",
+                "candidate_info": fake_candidate_info(rng) if is_cv else None,
+            }
+        else:
+            payload = _scoring_payload(label, contents)
+
+        text = self._noise(json.dumps(payload, ensure_ascii=False))
+        prompt_tokens = sum(len(p) // 4 if isinstance(p, str) else 2000 for p in contents)
+        output_tokens = len(text) // 4
+        with self._lock:
+            self.calls[label] += 1
+        return SimpleNamespace(
+            text=text,
+            model_version=model,
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=prompt_tokens,
+                candidates_token_count=output_tokens,
+                total_token_count=prompt_tokens + output_tokens,
+                cached_content_token_count=cached_tokens,
+            ),
+        )
+
+    def _noise(self, text: str) -> str:
+        """Bruit de formatage simulé : réponse entourée de balises ou coupée en route."""
+        with self._lock:
+            roll, cut = self._rng.random(), self._rng.random()
+        if roll >= self.malformed_rate:
+            return text
+        with self._lock:
+            self.calls["malformed"] += 1
+        if cut < 0.5:
+            return f"```json\n{text}\n```"
+        return text[: max(1, int(len(text) * cut))]
+
+    def _failed(self, code: int):
+        with self._lock:
+            self.errors[code] += 1
+        return _api_error(code)
+
+    def _generation_delay(self, response) -> float:
+        return self.token_latency * response.usage_metadata.candidates_token_count
+
+    def _generate(self, *, model, contents, config=None):
+        delay, code = self._draw()
+        time.sleep(delay)
+        if code:
+            raise self._failed(code)
+        response = self._respond(model, contents, config)
+        time.sleep(self._generation_delay(response))
+        return response
+
+    async def _generate_async(self, *, model, contents, config=None):
+        delay, code = self._draw()
+        await asyncio.sleep(delay)
+        if code:
+            raise self._failed(code)
+        response = self._respond(model, contents, config)
+        await asyncio.sleep(self._generation_delay(response))
+        return response
+
+
+# ---------- Testlify ----------
+
+class StaticSettings(SimpleNamespace):
+    """Settings en mémoire (attributs + get_password) pour les clients injectés."""
+
+    def __init__(self, passwords: dict | None = None, **fields):
+        super().__init__(**fields)
+        self._passwords = dict(passwords or {})
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def get_password(self, fieldname: str, raise_exception: bool = True):
+        return self._passwords.get(fieldname)
+
+
+class FakeTestlifyServer:
+    """
+    Serveur HTTP local imitant `POST <base>/v1/testlify_candidate_invite`.
+
+    Répond 200, ou 429/503 (avec Retry-After: 0) selon les taux configurés,
+    après `latency` secondes (± jitter). Port libre choisi au démarrage.
+    `idempotent` : une invitation déjà reçue (même évaluation, même e-mail)
+    n'est pas comptée deux fois, comme un Testlify qui dédoublonne.
+    """
+
+    INVITE_PATH = "v1/testlify_candidate_invite"
+    TOKEN = "fake-testlify-token"
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.3,
+        rate_429: float = 0.0,
+        rate_503: float = 0.0,
+        seed: int | None = None,
+        idempotent: bool = False,
+    ):
+        self.latency = max(0.0, float(latency))
+        self.jitter = max(0.0, float(jitter))
+        self.rate_429 = float(rate_429)
+        self.rate_503 = float(rate_503)
+        self.idempotent = idempotent
+        self._seen = set()
+        self.requests = 0
+        self.invites = 0
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def settings(self) -> StaticSettings:
+        """Settings à passer à TestlifyClient(settings=...)."""
+        return StaticSettings(
+            passwords={"testlify_token": self.TOKEN},
+            testlify_base_url=self.base_url,
+            testlify_candidate_invite=self.INVITE_PATH,
+            testlify_invites_idempotent=int(self.idempotent),
+        )
+
+    def _draw(self) -> tuple[float, int]:
+        with self._lock:
+            delay = self.latency * (1 + self.jitter * (2 * self._rng.random() - 1))
+            roll = self._rng.random()
+        if roll < self.rate_429:
+            return delay * 0.1, 429
+        if roll < self.rate_429 + self.rate_503:
+            return delay, 503
+        return delay, 200
+
+    def _handle(self, handler: BaseHTTPRequestHandler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = handler.rfile.read(length) if length else b""
+        delay, status = self._draw()
+        time.sleep(delay)
+
+        if handler.headers.get("Authorization") != f"Bearer {self.TOKEN}":
+            status, payload = 401, {"error": {"message": "Token invalide"}}
+        elif handler.path.lstrip("/") != self.INVITE_PATH:
+            status, payload = 404, {"error": {"message": "Endpoint inconnu"}}
+        elif status != 200:
+            payload = {"error": {"message": f"Erreur simulée ({status})"}}
+        else:
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                data = {}
+            invites = data.get("candidateInvites") or []
+            with self._lock:
+                if self.idempotent:
+                    keys = {(data.get("assessmentId"), (i.get("email") or "").lower()) for i in invites}
+                    invites = keys - self._seen
+                    self._seen |= keys
+                self.invites += len(invites)
+            payload = {"data": {"invited": len(invites)}}
+
+        with self._lock:
+            self.requests += 1
+            if status != 200:
+                self.errors[status] += 1
+
+        raw = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(raw)))
+        if status in (429, 503):
+            handler.send_header("Retry-After", "0")
+        handler.end_headers()
+        handler.wfile.write(raw)
+
+    def start(self) -> "FakeTestlifyServer":
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive : comme l'API réelle derrière la session
+
+            def do_POST(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-testlify", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,158 @@
+"""
+Upload unique des CV via l'API Files de Gemini.
+
+Au lieu d'inliner les octets du CV dans chaque requête (classification,
+extraction et chaque retry de call_gemini_with_retry), le fichier est uploadé
+une fois et référencé par URI dans tous les appels du run.
+
+- Mode Auto : upload au-delà d'un seuil de taille (gros scans), inline sinon.
+- Handle mis en cache (Redis) par empreinte du fichier, avec expiration
+  inférieure à la rétention Gemini (48 h).
+- En fin de run, les fichiers uploadés par le run sont supprimés, sauf si une
+  durée de réutilisation est configurée (relances, candidatures multiples).
+"""
+
+import io
+import time
+
+import frappe
+from google.genai import types
+
+from job_auto_match.job_auto_match.utils.structured_output import GeminiRequest
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+_CACHE_PREFIX = "job_auto_match:gemini_file"
+
+FILES_MODE_AUTO = "Auto"
+FILES_MODE_ALWAYS = "Toujours"
+FILES_MODE_NEVER = "Jamais"
+
+DEFAULT_THRESHOLD_MB = 5
+# Au-delà, une requête inline (CV + prompt) dépasserait la limite de 20 Mo de l'API
+MAX_INLINE_BYTES = 18 * 1024 * 1024
+MAX_TTL_MINUTES = 47 * 60  # Gemini supprime les fichiers après 48 h
+_PROCESSING_TIMEOUT = 30
+
+
+def _cache_key(file_hash: str, mime_type: str) -> str:
+    return f"{_CACHE_PREFIX}:{mime_type}:{file_hash}"
+
+
+def _state_name(f) -> str:
+    state = getattr(f, "state", None)
+    return (getattr(state, "name", None) or str(state or "")).upper()
+
+
+class GeminiFileSession:
+    """
+    Handles Files API d'un run de matching.
+
+    `files_api` permet d'injecter une doublure locale (voir utils.fakes.LocalFilesAPI)
+    ; par défaut client.files.
+    """
+
+    def __init__(self, client, settings=None, files_api=None):
+        self.client = client
+        self.files_api = files_api or getattr(client, "files", None)
+        settings = settings or frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+        self.mode = (getattr(settings, "gemini_files_mode", "") or FILES_MODE_AUTO).strip()
+        self.threshold = int(
+            float(getattr(settings, "gemini_files_threshold_mb", 0) or DEFAULT_THRESHOLD_MB) * 1024 * 1024
+        )
+        self.ttl_minutes = min(int(getattr(settings, "gemini_files_ttl_minutes", 0) or 0), MAX_TTL_MINUTES)
+        self._uploaded = []  # [(cache_key, name)] créés par ce run
+        self._handles = {}  # cache_key → handle, pour tous les appels du run
+        self._sources = {}  # uri → (file_hash, mime_type, path, data), pour ré-uploader un fichier disparu
+
+    def should_upload(self, size_bytes: int) -> bool:
+        if self.files_api is None:
+            return False
+        if size_bytes >= MAX_INLINE_BYTES:
+            return True  # même en mode Jamais : l'envoi inline échouerait
+        if self.mode == FILES_MODE_NEVER:
+            return False
+        if self.mode == FILES_MODE_ALWAYS:
+            return True
+        return size_bytes >= self.threshold
+
+    def part_for(self, *, file_hash: str, mime_type: str, path: str | None = None, data: bytes | None = None):
+        """
+        Part Gemini référencée par URI. Réutilise un handle en cache si possible,
+        sinon uploade `path` (streamé par le SDK) ou `data`.
+        """
+        key = _cache_key(file_hash, mime_type)
+        handle = self._handles.get(key)
+        if not handle and self.ttl_minutes > 0:
+            try:
+                handle = frappe.cache().get_value(key)
+            except Exception:
+                handle = None
+
+        if not handle:
+            handle = self._upload(key, mime_type, path=path, data=data)
+        self._handles[key] = handle
+        self._sources[handle["uri"]] = (file_hash, mime_type, path, data)
+        return types.Part.from_uri(file_uri=handle["uri"], mime_type=handle["mime_type"])
+
+    def refresh(self, parts):
+        """
+        Mêmes parts, avec les fichiers de cette session ré-uploadés : un handle
+        réutilisé (cache Redis) peut désigner un fichier expiré ou supprimé côté
+        Gemini. None si aucune part ne vient de cette session.
+        """
+        refreshed, changed = [], False
+        for part in parts:
+            uri = getattr(getattr(part, "file_data", None), "file_uri", None)
+            source = self._sources.get(uri) if uri else None
+            if source is None:
+                refreshed.append(part)
+                continue
+            file_hash, mime_type, path, data = source
+            key = _cache_key(file_hash, mime_type)
+            self._handles.pop(key, None)
+            try:
+                frappe.cache().delete_value(key)
+            except Exception:
+                pass
+            refreshed.append(self.part_for(file_hash=file_hash, mime_type=mime_type, path=path, data=data))
+            changed = True
+        return GeminiRequest(refreshed, getattr(parts, "output", None)) if changed else None
+
+    def _upload(self, key: str, mime_type: str, path: str | None, data: bytes | None) -> dict:
+        source = path if path is not None else io.BytesIO(data or b"")
+        started = time.monotonic()
+        f = self.files_api.upload(file=source, config=types.UploadFileConfig(mime_type=mime_type))
+
+        # Les PDF sont en général ACTIVE immédiatement ; les gros scans peuvent rester en PROCESSING
+        deadline = time.monotonic() + _PROCESSING_TIMEOUT
+        while _state_name(f) == "PROCESSING" and time.monotonic() < deadline:
+            time.sleep(0.5)
+            f = self.files_api.get(name=f.name)
+        if _state_name(f) == "FAILED":
+            raise RuntimeError(f"Upload Gemini Files en échec: {f.name}")
+
+        handle = {"name": f.name, "uri": f.uri, "mime_type": getattr(f, "mime_type", None) or mime_type}
+        self._uploaded.append((key, f.name))
+        if self.ttl_minutes > 0:
+            try:
+                frappe.cache().set_value(key, handle, expires_in_sec=self.ttl_minutes * 60)
+            except Exception:
+                pass
+        frappe.logger().info(f"[GEMINI_FILES] Upload {f.name} en {time.monotonic() - started:.2f}s")
+        return handle
+
+    def close(self):
+        """Supprime les fichiers uploadés par ce run (sauf réutilisation configurée)."""
+        if self.ttl_minutes > 0:
+            return
+        for key, name in self._uploaded:
+            try:
+                self.files_api.delete(name=name)
+            except Exception as e:
+                frappe.logger().warning(f"[GEMINI_FILES] Suppression impossible de {name}: {e}")
+            try:
+                frappe.cache().delete_value(key)
+            except Exception:
+                pass
+        self._uploaded = []
+        self._handles = {}
@@ -1,9 +1,8 @@
 import frappe
-import requests
 from google import genai
 from google.genai import types
 from frappe.utils.file_manager import get_file_path
-from urllib.parse import urljoin
+import asyncio
 import time
 import random
 from google.genai import errors as genai_errors
@@ -14,6 +13,78 @@ from bs4 import BeautifulSoup
 from docx import Document
 from docx.opc.exceptions import PackageNotFoundError
 
+from job_auto_match.job_auto_match.utils.applicant_lock import LeaseLostError, applicant_lease, still_held
+from job_auto_match.job_auto_match.utils.context_cache import (
+    KEY_CHECK,
+    KEY_COMBINED,
+    KEY_EXTRACTION,
+    StaticContext,
+    forget as forget_context_cache,
+    is_cache_error,
+    prepare as prepare_context,
+    prepare_async as prepare_context_async,
+    scoring_key,
+    static_context,
+)
+from job_auto_match.job_auto_match.utils.cv_preprocess import preprocess_limits, preprocess_pdf
+from job_auto_match.job_auto_match.utils.extraction_cache import (
+    compute_file_hash,
+    get_cached_extraction,
+    prompt_version,
+    set_cached_extraction,
+)
+from job_auto_match.job_auto_match.utils.gemini_files import GeminiFileSession
+from job_auto_match.job_auto_match.utils.metrics import DBQueryCounter, record_db_stats
+from job_auto_match.job_auto_match.utils.model_health import ModelsUnavailableError, get_health_registry
+from job_auto_match.job_auto_match.utils.notifications import (
+    NOTIF_NOT_MATCHING,
+    queue_notification,
+    render_not_matching,
+)
+from job_auto_match.job_auto_match.utils.office_converter import convert_to_pdf_bytes
+from job_auto_match.job_auto_match.utils.prescoring import prescore_for_matching
+from job_auto_match.job_auto_match.utils.rate_limiter import (
+    RateLimitTimeout,
+    estimate_tokens,
+    get_rate_limiter,
+    usage_total_tokens,
+)
+from job_auto_match.job_auto_match.utils.structured_output import (
+    OUTPUT_COMBINED,
+    OUTPUT_CV_CHECK,
+    OUTPUT_EXTRACTION,
+    OUTPUT_SCORING,
+    SCHEMAS,
+    GeminiRequest,
+    StructuredOutputError,
+    coerce_candidate_info,
+    output_config,
+    parse_output,
+)
+from job_auto_match.job_auto_match.utils.talent_pool import (
+    get_profile,
+    mark_reused,
+    save_profile,
+)
+from job_auto_match.job_auto_match.utils.talent_pool import is_enabled as is_talent_pool_enabled
+from job_auto_match.job_auto_match.utils.testlify import TestlifyClient, assessment_ref, candidate_invite
+from job_auto_match.job_auto_match.utils.text_layer import pdf_text, plain_text
+from job_auto_match.job_auto_match.utils.tracing import (
+    STAGE_CLASSIFICATION,
+    STAGE_COMBINED,
+    STAGE_CONVERSION,
+    STAGE_EMAIL,
+    STAGE_EXTRACTION,
+    STAGE_FLAGS,
+    STAGE_INVITE,
+    STAGE_PREPARATION,
+    STAGE_PRESCORING,
+    STAGE_SAVE,
+    STAGE_SCORING,
+    MatchingTrace,
+    fill_call_stats,
+)
+
 
 _SETTINGS_DOCTYPE = "Job Matching Integration Settings"
 
@@ -30,24 +101,9 @@ FIELD_STATUT              = "custom_status"
 
 # ---------- Helpers: Word→PDF/texte & préparation des "parts" ----------
 
-def _libreoffice_to_pdf_bytes(input_path: str) -> bytes | None:
-    soffice = shutil.which("soffice") or shutil.which("libreoffice")
-    if not soffice:
-        return None
-    outdir = tempfile.mkdtemp(prefix="lo2pdf_")
-    try:
-        cmd = [soffice, "--headless", "--convert-to", "pdf", "--outdir", outdir, input_path]
-        subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        base = pathlib.Path(input_path).stem
-        pdf_path = pathlib.Path(outdir) / f"{base}.pdf"
-        if not pdf_path.exists():
-            pdfs = list(pathlib.Path(outdir).glob("*.pdf"))
-            if not pdfs:
-                return None
-            pdf_path = max(pdfs, key=lambda p: p.stat().st_mtime)
-        return pdf_path.read_bytes()
-    except Exception:
-        return None
+def _libreoffice_to_pdf_bytes(input_path: str, file_hash: str | None = None) -> bytes | None:
+    """Conversion via le pool LibreOffice (slots bornés, timeout, cache par empreinte)."""
+    return convert_to_pdf_bytes(input_path, file_hash=file_hash)
 
 
 def _extract_text_from_docx(input_path: str) -> str | None:
@@ -89,7 +145,55 @@ def _extract_text_from_docx(input_path: str) -> str | None:
         return None
 
 
-def _prepare_resume_parts_for_gemini(file_path: str):
+def _pdf_part(files, file_hash: str | None, path: str | None = None, data: bytes | None = None):
+    """
+    Part PDF pour Gemini : référence Files API (upload unique, réutilisée par
+    tous les appels et retries du run) si la session le décide, sinon inline.
+    Retourne (part, via_files).
+    """
+    size = len(data) if data is not None else pathlib.Path(path).stat().st_size
+    if files is not None and file_hash and files.should_upload(size):
+        try:
+            return files.part_for(file_hash=file_hash, mime_type="application/pdf", path=path, data=data), True
+        except Exception as e:
+            frappe.logger().warning(f"[GEMINI_FILES] Upload impossible, repli inline : {e}")
+    if data is None:
+        data = pathlib.Path(path).read_bytes()
+    return types.Part.from_bytes(data=data, mime_type="application/pdf"), False
+
+
+def _prepared_pdf_part(files, file_hash: str | None, limits: dict | None, path: str | None = None, data: bytes | None = None):
+    """
+    Part PDF après prétraitement (pages gardées, images réduites) : (part, via_files, infos).
+    Un PDF réduit est envoyé par chemin, sans garder les octets d'origine en mémoire.
+    """
+    path, data, file_key, info = preprocess_pdf(file_hash=file_hash, path=path, data=data, limits=limits)
+    part, via_files = _pdf_part(files, file_key, path=path, data=data)
+    return part, via_files, info
+
+
+def _text_first_enabled(settings) -> bool:
+    return bool(int(getattr(settings, "cv_text_first", 1) or 0))
+
+
+def _text_first(text: str | None, info: dict, strategy: str, mime: str):
+    """Parts texte si la couche texte est exploitable, sinon None (repli sur le binaire)."""
+    if not text:
+        return None
+    return [text], {"strategy": strategy, "mime": mime, **info}
+
+
+def _prepare_resume_parts_for_gemini(
+    file_path: str, file_hash: str | None = None, files=None, text_first: bool = True, limits: dict | None = None,
+):
+    """
+    Parts du CV pour Gemini + prep_info (stratégie retenue et mesures).
+    Texte d'abord (text_first) : une couche texte de bonne qualité (utils.text_layer)
+    est envoyée en texte brut ; le PDF n'est envoyé que pour les scans et les
+    mises en page que l'extraction ne restitue pas.
+    `limits` (utils.cv_preprocess) : pages gardées et réduction des images d'un PDF lourd.
+    """
+    limits = limits or preprocess_limits()
     p = pathlib.Path(file_path)
     if not p.exists():
         raise FileNotFoundError(f"Fichier introuvable: {file_path}")
@@ -105,31 +209,55 @@ def _prepare_resume_parts_for_gemini(file_path: str):
     if mime not in allowed:
         raise ValueError("Format non supporté. Seuls PDF et Word (DOC/DOCX) sont acceptés.")
 
-    # PDF → send as-is
+    # PDF → texte si la couche texte est bonne, sinon envoi tel quel
     if mime == "application/pdf":
-        data = p.read_bytes()
-        parts = [types.Part.from_bytes(data=data, mime_type="application/pdf")]
-        return parts, {"strategy": "pdf-inline", "mime": mime}
+        text_info = {}
+        if text_first:
+            text, text_info = pdf_text(path=file_path, max_pages=limits["max_pages"])
+            result = _text_first(text, text_info, "pdf->text", mime)
+            if result:
+                return result
+        part, via_files, pre_info = _prepared_pdf_part(files, file_hash, limits, path=file_path)
+        strategy = "pdf-file-api" if via_files else "pdf-inline"
+        return [part], {"strategy": strategy, "mime": mime, **text_info, **pre_info}
 
     # DOCX
     if mime == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-        pdf_bytes = _libreoffice_to_pdf_bytes(file_path)
+        text_info = {}
+        if text_first:
+            # python-docx restitue le texte sans conversion : LibreOffice seulement si insuffisant
+            started = time.perf_counter()
+            text, text_info = plain_text(_extract_text_from_docx(file_path))
+            text_info["text_extraction_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            result = _text_first(text, text_info, "word->text", mime)
+            if result:
+                return result
+
+        pdf_bytes = _libreoffice_to_pdf_bytes(file_path, file_hash)
         if pdf_bytes:
-            parts = [types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")]
-            return parts, {"strategy": "word->pdf(lo)", "mime": mime}
+            part, via_files, pre_info = _prepared_pdf_part(files, file_hash, limits, data=pdf_bytes)
+            strategy = "word->pdf(lo)" + ("+file-api" if via_files else "")
+            return [part], {"strategy": strategy, "mime": mime, **text_info, **pre_info}
 
         text = _extract_text_from_docx(file_path)
         if text:
-            return [text], {"strategy": "word->text", "mime": mime}
+            return [text], {"strategy": "word->text", "mime": mime, **text_info}
 
         raise RuntimeError("Impossible d'extraire le texte du DOCX.")
 
-    # DOC (legacy)
+    # DOC (legacy) : pas de lecture directe, la couche texte est lue sur le PDF converti
     if mime == "application/msword":
-        pdf_bytes = _libreoffice_to_pdf_bytes(file_path)
+        pdf_bytes = _libreoffice_to_pdf_bytes(file_path, file_hash)
         if pdf_bytes:
-            parts = [types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")]
-            return parts, {"strategy": "doc->pdf(lo)", "mime": mime}
+            text_info = {}
+            if text_first:
+                text, text_info = pdf_text(data=pdf_bytes, max_pages=limits["max_pages"])
+                result = _text_first(text, text_info, "doc->pdf(lo)->text", mime)
+                if result:
+                    return result
+            part, via_files, pre_info = _prepared_pdf_part(files, file_hash, limits, data=pdf_bytes)
+            strategy = "doc->pdf(lo)" + ("+file-api" if via_files else "")
+            return [part], {"strategy": strategy, "mime": mime, **text_info, **pre_info}
         raise RuntimeError(
             "Impossible de convertir le fichier .doc. Installez LibreOffice (soffice) ou fournissez un PDF/DOCX."
         )
@@ -162,6 +290,18 @@ def _set_statut(doc, statut: str):
         pass
 
 
+def _mark_extraction_unavailable(doc, err: Exception, gemini_error_status: str):
+    """État "IA indisponible" après échec de l'appel d'extraction (sans sauvegarde)."""
+    _safe_log_error("[GEMINI] Extraction CV échouée (overloaded/404 ?)", err)
+    _set_flag(doc, FLAG_MATCHING_FAILED, 1)
+    _set_text(doc, FIELD_AI_LAST_ERROR, str(err))
+    _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
+    _set_statut(doc, gemini_error_status)
+    doc.custom_justification = "Analyse automatique momentanément indisponible. Traitement manuel."
+    doc.custom_matching_score = 0
+    doc.applicant_rating = 0.0
+
+
 def _safe_log_error(title: str, err: Exception):
     safe_title = (title or "")[:140]
     try:
@@ -187,314 +327,369 @@ def _save_and_reload(doc):
       En remplaçant validate_workflow au niveau de l'instance, on court-circuite
       cette chaîne sans modifier Frappe ni dépendre d'Administrator.
     """
-    doc.flags.ignore_permissions = True
-    doc.validate_workflow = lambda: None  # instance attribute → shadowe la méthode de classe
-    doc.save(ignore_permissions=True)
-    frappe.db.commit()
+    _save(doc)
     doc.reload()
 
-# -----------------------------------------------------------------------------
-
-SAFE_MODEL_CANDIDATES = ["gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite"]
-
 
-def call_gemini_with_retry(
-    client,
-    parts,
-    model_candidates=None,
-    max_attempts=5,
-    base_sleep=1.0,
-    max_sleep=10.0,
-):
+def _save(doc, notifications=()):
     """
-    Appelle Gemini avec retries exponentiels + fallback de modèles.
-    - 404/NOT_FOUND ou 'not supported for generateContent' => skip ce modèle
-    - 429/5xx/UNAVAILABLE/overloaded/quota => retry avec backoff
+    Sauvegarde complète + commit, sans reload (voir _save_and_reload).
+    `notifications` [(type, destinataire, ctx)] sont déposées dans la même
+    transaction : elles partent à ce commit, ou disparaissent avec son rollback.
     """
-    models = model_candidates or SAFE_MODEL_CANDIDATES
-    last_exc = None
-
-    for model in models:
-        for attempt in range(1, max_attempts + 1):
-            try:
-                return client.models.generate_content(model=model, contents=parts)
+    doc.flags.ignore_permissions = True
+    doc.validate_workflow = lambda: None  # instance attribute → shadowe la méthode de classe
+    doc.save(ignore_permissions=True)
+    for kind, recipient, ctx in notifications:
+        queue_notification(kind, doc.name, recipient, ctx)
+    frappe.db.commit()
 
-            except genai_errors.APIError as e:
-                code = getattr(e, "status_code", None)
-                resp = getattr(e, "response_json", {}) or {}
-                err = (resp.get("error") or {})
-                status = (err.get("status") or "").upper()
-                message = (err.get("message") or str(e))
-
-                not_supported = (
-                    code in (400, 404) and (
-                        "NOT_FOUND" in status
-                        or "not found" in message.lower()
-                        or "not supported for generatecontent" in message.lower()
-                    )
-                )
-                if not_supported:
-                    frappe.logger().warning(
-                        f"[GEMINI] Skip modèle non supporté: '{model}' ({code}/{status}) : {message}"
-                    )
-                    last_exc = e
-                    break
 
-                retryable = (
-                    code in (429, 500, 502, 503, 504)
-                    or "UNAVAILABLE" in status
-                    or "RESOURCE_EXHAUSTED" in status
-                    or "overloaded" in message.lower()
-                    or "quota" in message.lower()
-                )
-                if retryable and attempt < max_attempts:
-                    sleep = min(base_sleep * (2 ** (attempt - 1)), max_sleep) + random.uniform(0, 0.5)
-                    frappe.logger().warning(
-                        f"[GEMINI] {model} tentative {attempt}/{max_attempts} échouée "
-                        f"({code or status}) : {message}. Retry dans {sleep:.1f}s"
-                    )
-                    time.sleep(sleep)
-                    continue
+# --- Écriture différée (write-behind) du pipeline de matching ---
+#
+# Le pipeline modifie le document en mémoire et ne le sauvegarde qu'une fois,
+# à la fin du run : une seule validation, une seule réécriture des tables
+# enfants, un seul passage des hooks (ensure_resume_file_linked,
+# sync_workflow_state) et une seule Version. Les flags de progression visibles
+# par l'UI passent par des UPDATE de colonnes (_set_progress_flags).
+
+def _set_progress_flags(doc, values: dict):
+    """UPDATE direct des colonnes de suivi (sans validation, hooks ni Version) + commit."""
+    values = {k: v for k, v in values.items() if doc.meta.has_field(k)}
+    if not values:
+        return
+    for fieldname, value in values.items():
+        setattr(doc, fieldname, value)
+    frappe.db.set_value(doc.doctype, doc.name, values, update_modified=False)
+    frappe.db.commit()
 
-                last_exc = e
-                break
 
-            except Exception as e:
-                last_exc = e
-                break
+def _doc_state(doc) -> dict:
+    """Photo des valeurs (champs simples + tables enfants) pour calculer le delta du run."""
+    from frappe.model import no_value_fields, table_fields
 
-    raise last_exc
+    state = {}
+    for df in doc.meta.fields:
+        if df.fieldtype in table_fields:
+            state[df.fieldname] = [row.as_dict(no_default_fields=True) for row in (doc.get(df.fieldname) or [])]
+        elif df.fieldtype not in no_value_fields:
+            state[df.fieldname] = doc.get(df.fieldname)
+    return state
 
 
-# -----------------------------
-# 1) Email Candidat Non Matching
-# -----------------------------
+def _flush_pending(doc, snapshot: dict):
+    """
+    Persiste en une seule écriture tout ce que le run a modifié sur `doc`.
+    Si le document a été modifié ailleurs entre-temps (TimestampMismatchError),
+    le delta du run est ré-appliqué sur la version fraîche puis sauvegardé.
 
-def send_candidate_not_matching_email(doc):
-    TEMPLATE_PATH = "job_auto_match/templates/emails/candidate_not_matching.html"
+    Les notifications différées du run (doc.flags.pending_notifications) sont
+    déposées avec l'écriture qui aboutit et partent à son commit : le rollback
+    d'une tentative ne les perd pas, un échec après le commit non plus.
+    """
+    notifications = doc.flags.pop("pending_notifications", None) or []
     try:
-        settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
-
-        recipient = (getattr(doc, "email_id", "") or "").strip()
-        if not recipient:
-            frappe.logger().error("[NOT_MATCH_MAIL] Aucun destinataire renseigné")
-            return
-
-        ctx = {
-            "applicant_name": getattr(doc, "applicant_name", ""),
-            "job_title": getattr(doc, "custom_nom_de_loffre", ""),
-            "score": getattr(doc, "custom_matching_score", None),
-            "justification": getattr(doc, "custom_justification", "") or "",
-        }
+        _save(doc, notifications)
+    except frappe.TimestampMismatchError:
+        frappe.db.rollback()
+
+        current = _doc_state(doc)
+        fresh = frappe.get_doc(doc.doctype, doc.name)
+        for fieldname, value in current.items():
+            if value != snapshot.get(fieldname):
+                fresh.set(fieldname, value)
+        _save(fresh, notifications)
+        doc = fresh
+    return doc
 
-        subject_src = getattr(settings, "candidate_not_matching_subject", "") or ""
-        subject = frappe.render_template(subject_src, ctx) if subject_src.strip() else frappe._(
-            "Votre candidature n'est pas retenue pour le moment"
-        )
+# -----------------------------------------------------------------------------
 
-        header_src = getattr(settings, "candidate_not_matching_email_header", "") or ""
-        header = frappe.render_template(header_src, ctx) if header_src.strip() else frappe._(
-            "Information sur votre candidature"
-        )
+SAFE_MODEL_CANDIDATES = ["gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite"]
 
-        html_src = getattr(settings, "candidate_not_matching_email_template", "") or ""
-        if html_src.strip():
-            body = frappe.render_template(html_src, ctx)
-        else:
-            body = frappe.get_template(TEMPLATE_PATH).render(ctx)
 
-        frappe.sendmail(
-            recipients=[recipient],
-            subject=subject,
-            message=body,
-            header=header,
-        )
+_FILE_MISSING = ("not exist", "not found", "expired", "not in an active state")
 
-        _set_flag(doc, FLAG_NOT_MATCH_EMAIL_SENT, 1)
-        _save_and_reload(doc)  # ← reload après save
-        frappe.logger().info(f"[NOT_MATCH_MAIL] Email envoyé à {recipient} avec succès.")
 
-    except TemplateNotFound as e:
-        _safe_log_error("[NOT_MATCH_MAIL] Template introuvable", e)
-        _set_text(doc, FIELD_AI_LAST_ERROR, f"Template introuvable: {e}")
-        _set_flag(doc, FLAG_NOT_MATCH_EMAIL_SENT, 0)
-        _save_and_reload(doc)  # ← reload après save
+def _classify_gemini_error(e) -> dict:
+    """
+    Nature d'une APIError Gemini : modèle non supporté, fichier (API Files)
+    disparu, 429, ou erreur transitoire. Seul un modèle inconnu ou sans
+    generateContent ouvre le circuit longue durée : un URI de fichier expiré
+    renvoie aussi un 400/403/404 « not found », sans que le modèle soit en cause.
+    """
+    code = getattr(e, "status_code", None)
+    resp = getattr(e, "response_json", {}) or {}
+    err = (resp.get("error") or {})
+    status = (err.get("status") or "").upper()
+    message = (err.get("message") or str(e))
+    lower = message.lower()
+
+    file_missing = code in (400, 403, 404) and "file" in lower and any(w in lower for w in _FILE_MISSING)
+    not_supported = code in (400, 404) and not file_missing and (
+        "not supported for generatecontent" in lower
+        or ("model" in lower and ("not found" in lower or "is not supported" in lower))
+    )
+    rate_limited = code == 429 or "RESOURCE_EXHAUSTED" in status
+    retryable = (
+        code in (429, 500, 502, 503, 504)
+        or "UNAVAILABLE" in status
+        or "RESOURCE_EXHAUSTED" in status
+        or "overloaded" in message.lower()
+        or "quota" in message.lower()
+    )
+    return {
+        "code": code,
+        "status": status,
+        "message": message,
+        "not_supported": not_supported,
+        "file_missing": file_missing,
+        "rate_limited": rate_limited,
+        "retryable": retryable,
+    }
 
-    except Exception as e:
-        _safe_log_error("[NOT_MATCH_MAIL] Erreur d'envoi", e)
-        _set_text(doc, FIELD_AI_LAST_ERROR, f"Email non retenu: {e}")
-        _set_flag(doc, FLAG_NOT_MATCH_EMAIL_SENT, 0)
-        _save_and_reload(doc)  # ← reload après save
 
+def _after_gemini_error(e, model, probe, attempt, attempts, limiter, health, base_sleep, max_sleep):
+    """
+    Décision commune aux variantes sync/async après une APIError :
+    None = abandonner ce modèle, sinon durée d'attente avant la tentative suivante.
+    """
+    info = _classify_gemini_error(e)
+    code, status, message = info["code"], info["status"], info["message"]
 
-# -----------------------------
-# 2) Invitation Testlify
-# -----------------------------
+    if info["not_supported"]:
+        frappe.logger().warning(
+            f"[GEMINI] Skip modèle non supporté: '{model}' ({code}/{status}) : {message}"
+        )
+        health.record_failure(model, unsupported=True, probe=probe, reason=message)
+        return None
 
-def send_candidate_invite(doc, assessments: list) -> list:
-    results = []
-    any_success = False
+    if info["retryable"] and not info["rate_limited"]:
+        # Surcharge/5xx : compte pour le disjoncteur (un 429 relève du quota, pas de la santé)
+        health.record_failure(model, probe=probe, reason=f"{code or status}: {message}")
+        if health.is_open(model):
+            return None
+    if info["rate_limited"] and limiter:
+        # Le limiteur partagé réduit le débit et régule la prochaine tentative
+        limiter.penalize(model)
+        if attempt < attempts:
+            return 0
+    if info["retryable"] and attempt < attempts:
+        sleep = min(base_sleep * (2 ** (attempt - 1)), max_sleep) + random.uniform(0, 0.5)
+        frappe.logger().warning(
+            f"[GEMINI] {model} tentative {attempt}/{attempts} échouée "
+            f"({code or status}) : {message}. Retry dans {sleep:.1f}s"
+        )
+        return sleep
+    return None
 
-    try:
-        settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
 
-        base_url  = (settings.testlify_base_url or "").strip()
-        inv_path  = (settings.testlify_candidate_invite or "").strip()
-        token     = (settings.get_password("testlify_token") or "").strip()
-
-        missing = []
-        if not base_url: missing.append("URL de base Testlify")
-        if not inv_path: missing.append("Endpoint invitation candidat")
-        if not token:    missing.append("Token API Testlify")
-        if missing:
-            raise ValueError(
-                f"Configuration Testlify incomplète — champs manquants : {', '.join(missing)}"
-            )
+def _refresh_file_parts(files, parts, error):
+    """Parts avec les fichiers de la session ré-uploadés ; None si rien à rafraîchir (erreur relancée)."""
+    if files is None:
+        return None
+    refreshed = files.refresh(parts)
+    if refreshed is not None:
+        frappe.logger().warning(f"[GEMINI_FILES] Fichier introuvable côté Gemini, ré-upload : {error}")
+    return refreshed
 
-        api_url = urljoin(base_url.rstrip('/') + '/', inv_path.lstrip('/'))
 
-        frappe.logger().info(f"[INVITE] URL : {api_url} | Candidat : {doc.custom_first_name} {doc.custom_last_name} <{getattr(doc, 'email_id', None)}>")
+def _gemini_call_plan(parts, model_candidates, max_attempts):
+    models = model_candidates or SAFE_MODEL_CANDIDATES
+    limiter = get_rate_limiter()
+    health = get_health_registry()
+    plan = health.plan(models)
+    if not plan:
+        raise ModelsUnavailableError(f"Aucun modèle Gemini disponible (circuits ouverts) : {', '.join(models)}")
+    estimated_tokens = estimate_tokens(parts) if limiter else 0
+    return [(model, 1 if probe else max_attempts, probe) for model, probe in plan], limiter, health, estimated_tokens
 
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        }
 
-        for assessment in (assessments or []):
-            if isinstance(assessment, dict):
-                assessment_id = assessment.get('id')
-                assessment_name = assessment.get('assessment_name')
-            else:
-                assessment_id = getattr(assessment, 'id', None)
-                assessment_name = getattr(assessment, 'assessment_name', None)
+def _request_config(parts, config):
+    """Config de l'appel : cache de contexte éventuel + format de sortie JSON attendu."""
+    fields = output_config(parts)
+    if not fields:
+        return config
+    if config is None:
+        return types.GenerateContentConfig(**fields)
+    return config.model_copy(update=fields)
 
-            if not assessment_id:
-                frappe.logger().warning(f"[INVITE] assessment_id vide, ignoré : {assessment!r}")
-                continue
 
-            first_name = (getattr(doc, "custom_first_name", "") or "").strip()
-            last_name  = (getattr(doc, "custom_last_name",  "") or "").strip()
-            email      = (getattr(doc, "email_id",          "") or "").strip()
+def _gemini_call_succeeded(response, model, started, limiter, health, estimated_tokens):
+    health.record_success(model, time.monotonic() - started)
+    if limiter:
+        limiter.settle(model, estimated_tokens, usage_total_tokens(response))
+        limiter.record_success(model)
 
-            if not email:
-                frappe.logger().warning(f"[INVITE] Email candidat vide, assessment {assessment_id} ignoré.")
-                results.append({"assessment_id": assessment_id, "status": "skipped", "message": "email vide"})
-                continue
 
-            payload = {
-                'candidateInvites': [{
-                    'firstName': first_name,
-                    'lastName':  last_name,
-                    'email':     email,
-                }],
-                'assessmentId': assessment_id,
-            }
+def call_gemini_with_retry(
+    client,
+    parts,
+    model_candidates=None,
+    max_attempts=5,
+    base_sleep=1.0,
+    max_sleep=10.0,
+    stats=None,
+    files=None,
+):
+    """
+    Appelle Gemini avec retries exponentiels + fallback de modèles.
+    - modèle introuvable ou 'not supported for generateContent' => skip ce modèle
+    - 429/5xx/UNAVAILABLE/overloaded/quota => retry avec backoff
+    - limiteur partagé actif : attente de capacité avant chaque appel, et un 429
+      réduit le débit du modèle pour tous les workers au lieu d'un sleep local
+    - registre de santé partagé : on démarre au premier modèle sain, les circuits
+      ouverts sont sautés et un modèle rétabli n'a droit qu'à un appel d'essai
+    - stats (span de utils.tracing) : modèle, tentatives, backoff, attente et tokens
+    - parts statiques (utils.context_cache) : remplacées par le cache de contexte
+      du modèle tenté ; un cache disparu côté Gemini est oublié puis rejoué
+    - GeminiRequest.output (utils.structured_output) : réponse JSON contrainte par schéma
+    - files (GeminiFileSession du run) : un fichier expiré côté Gemini est
+      ré-uploadé et l'appel rejoué une fois, sans pénaliser le modèle
+    """
+    plan, limiter, health, estimated_tokens = _gemini_call_plan(parts, model_candidates, max_attempts)
+    last_exc = None
+    model, calls, backoff, waited = None, 0, 0.0, 0.0
+    ctx_key, refreshed = None, False
 
-            response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-            status = response.status_code
+    for model, attempts, probe in plan:
+        if probe and not health.take_probe(model):
+            continue  # appel d'essai déjà en cours sur un autre worker
+        for attempt in range(1, attempts + 1):
             try:
-                body = response.json()
-            except ValueError:
-                body = {}
-
-            if status == 200:
-                any_success = True
-                # Mettre à jour le row existant plutôt qu'en ajouter un doublon
-                if hasattr(doc, "custom_assessments"):
-                    for row in (doc.custom_assessments or []):
-                        if getattr(row, "assessment_id", None) == assessment_id:
-                            row.sent = 1
-                            break
-                    else:
-                        doc.append("custom_assessments", {
-                            "assessment_id":   assessment_id,
-                            "assessment_name": assessment_name,
-                            "sent":            1,
-                        })
-                results.append({"assessment_id": assessment_id, "status": "success"})
-            else:
-                err_body = body.get("error") if isinstance(body, dict) else None
-                msg = (err_body.get("message") if isinstance(err_body, dict) else None) or response.text
-                results.append({"assessment_id": assessment_id, "status": status, "message": msg})
-
-        frappe.logger().info(f"[INVITE] Résultats : {results}")
-        if any_success:
-            _set_flag(doc, FLAG_INVITES_SENT, 1)
-        else:
-            _set_flag(doc, FLAG_INVITES_SENT, 0)
-        _save_and_reload(doc)  # ← reload après save final de la boucle
-
-    except Exception as e:
-        _safe_log_error("[INVITE] Erreur fatale", e)
-        _set_text(doc, FIELD_AI_LAST_ERROR, f"Invite: {e}")
-        _set_flag(doc, FLAG_INVITES_SENT, 0)
-        _save_and_reload(doc)  # ← reload après save dans le handler d'erreur
-        results.append({"status": "fatal_error", "message": str(e)})
+                if limiter:
+                    # attend la capacité partagée (RateLimitTimeout → modèle suivant)
+                    wait_started = time.monotonic()
+                    try:
+                        limiter.acquire(model, estimated_tokens)
+                    finally:
+                        waited += time.monotonic() - wait_started
+                contents, config, ctx_key = prepare_context(client, model, parts)
+                started = time.monotonic()
+                calls += 1
+                response = client.models.generate_content(
+                    model=model, contents=contents, config=_request_config(parts, config),
+                )
+                _gemini_call_succeeded(response, model, started, limiter, health, estimated_tokens)
+                fill_call_stats(stats, model, calls, backoff, waited, response)
+                return response
 
-    return results
+            except genai_errors.APIError as e:
+                last_exc = e
+                if ctx_key and is_cache_error(e):
+                    # cache expiré/supprimé côté Gemini : ni le modèle ni le quota ne sont en cause
+                    forget_context_cache(ctx_key)
+                    ctx_key = None
+                    continue
+                if _classify_gemini_error(e)["file_missing"]:
+                    # URI de fichier expiré/supprimé : ré-upload puis même appel, le modèle n'est pas en cause
+                    parts = _refresh_file_parts(files, parts, e) if not refreshed else None
+                    if parts is None:
+                        if probe:
+                            health.release_probe(model)
+                        raise
+                    refreshed = True
+                    continue
+                sleep = _after_gemini_error(e, model, probe, attempt, attempts, limiter, health, base_sleep, max_sleep)
+                if sleep is None:
+                    break
+                backoff += sleep
+                time.sleep(sleep)
 
+            except RateLimitTimeout as e:
+                last_exc = e
+                if probe:
+                    health.release_probe(model)
+                break
 
-# -----------------------------
-# 3) Process Matching Candidat
-# -----------------------------
+            except Exception as e:
+                # Erreur réseau/transport : comptée comme un échec du modèle
+                health.record_failure(model, probe=probe, reason=str(e))
+                last_exc = e
+                break
 
-def process_job_applicant_matching(applicant_name, **kwargs):
-    settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
-    API_KEY = (settings.get_password("gemini_api_key") or "").strip()
-    if not API_KEY:
-        raise ValueError(
-            "Clé API Gemini non configurée dans Job Matching Integration Settings."
-        )
-    client = genai.Client(api_key=API_KEY)
+    fill_call_stats(stats, model, calls, backoff, waited)
+    # Aucun appel tenté : seuls des modèles half-open restaient, leurs essais sont déjà en cours ailleurs
+    raise last_exc or ModelsUnavailableError("Aucun modèle Gemini disponible (essais en cours sur d'autres workers)")
 
-    qualified_status = settings.status_qualified or "En Cours de qualification"
-    status_not_qualified = settings.status_not_qualified or "Top Profil"
-    qualification_score_threshold = settings.qualification_score_threshold or 70
-    status_rejected = settings.status_rejected or "Rejecté"
-    rejected_score = settings.rejected_max_score or 40
-    gemini_error_status = settings.gemini_error_status or "Open"
 
-    doc = frappe.get_doc("Job Applicant", applicant_name)
+async def call_gemini_with_retry_async(
+    client,
+    parts,
+    model_candidates=None,
+    max_attempts=5,
+    base_sleep=1.0,
+    max_sleep=10.0,
+    stats=None,
+    files=None,
+):
+    """Variante asyncio de call_gemini_with_retry (client.aio), même politique de retry."""
+    plan, limiter, health, estimated_tokens = _gemini_call_plan(parts, model_candidates, max_attempts)
+    last_exc = None
+    model, calls, backoff, waited = None, 0, 0.0, 0.0
+    ctx_key, refreshed = None, False
 
-    # ▶️ Flags: démarrage matching
-    _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 1)
-    _set_flag(doc, FLAG_MATCHING_FAILED, 0)
-    _set_text(doc, FIELD_AI_LAST_ERROR, "")
-    _save_and_reload(doc)
+    for model, attempts, probe in plan:
+        if probe and not health.take_probe(model):
+            continue  # appel d'essai déjà en cours sur un autre worker
+        for attempt in range(1, attempts + 1):
+            try:
+                if limiter:
+                    wait_started = time.monotonic()
+                    try:
+                        await limiter.acquire_async(model, estimated_tokens)
+                    finally:
+                        waited += time.monotonic() - wait_started
+                contents, config, ctx_key = await prepare_context_async(client, model, parts)
+                started = time.monotonic()
+                calls += 1
+                response = await client.aio.models.generate_content(
+                    model=model, contents=contents, config=_request_config(parts, config),
+                )
+                _gemini_call_succeeded(response, model, started, limiter, health, estimated_tokens)
+                fill_call_stats(stats, model, calls, backoff, waited, response)
+                return response
 
-    _matching_error = ""       # non-vide = erreur fatale → persistée dans le finally
-    _matching_succeeded = False  # True = traitement normal terminé
+            except genai_errors.APIError as e:
+                last_exc = e
+                if ctx_key and is_cache_error(e):
+                    # cache expiré/supprimé côté Gemini : ni le modèle ni le quota ne sont en cause
+                    forget_context_cache(ctx_key)
+                    ctx_key = None
+                    continue
+                if _classify_gemini_error(e)["file_missing"]:
+                    # URI de fichier expiré/supprimé : ré-upload puis même appel, le modèle n'est pas en cause
+                    parts = _refresh_file_parts(files, parts, e) if not refreshed else None
+                    if parts is None:
+                        if probe:
+                            health.release_probe(model)
+                        raise
+                    refreshed = True
+                    continue
+                sleep = _after_gemini_error(e, model, probe, attempt, attempts, limiter, health, base_sleep, max_sleep)
+                if sleep is None:
+                    break
+                backoff += sleep
+                await asyncio.sleep(sleep)
 
-    try:
-        fiche = frappe.get_doc("Job Opening", doc.job_title or "")
-        site_url = settings.site_url
+            except RateLimitTimeout as e:
+                last_exc = e
+                if probe:
+                    health.release_probe(model)
+                break
 
-        if fiche.custom_active_cv_auto_matching == 0:
-            raise ValueError("Job auto match desable")
+            except Exception as e:
+                health.record_failure(model, probe=probe, reason=str(e))
+                last_exc = e
+                break
 
-        if not doc.resume_attachment:
-            raise ValueError("Le candidat n'a pas de pièce jointe 'resume_attachment'")
+    fill_call_stats(stats, model, calls, backoff, waited)
+    # Aucun appel tenté : seuls des modèles half-open restaient, leurs essais sont déjà en cours ailleurs
+    raise last_exc or ModelsUnavailableError("Aucun modèle Gemini disponible (essais en cours sur d'autres workers)")
 
-        file_path = get_file_path(doc.resume_attachment)
-        if not pathlib.Path(file_path).exists():
-            raise FileNotFoundError(f"Fichier introuvable: {file_path}")
 
-        # 🔐 Limiter aux PDF/Word + préparer parts sûrs pour Gemini
-        try:
-            parts_cv, prep_info = _prepare_resume_parts_for_gemini(file_path)
-        except ValueError as bad_fmt:
-            _set_flag(doc, FLAG_MATCHING_FAILED, 0)
-            _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
-            _set_text(doc, FIELD_AI_LAST_ERROR, str(bad_fmt))
-            _set_statut(doc, status_rejected or "Rejecté")
-            doc.custom_justification = "Rejeté: format non supporté (PDF ou Word uniquement)."
-            doc.custom_matching_score = 0
-            doc.applicant_rating = 0.0
-            _save_and_reload(doc)
-            return
+# --- Prompts extraction (font partie de la clé du cache d'extraction) ---
 
-        # --- Étape 0 : vérifier que le document est bien un CV ---
-        cv_check_prompt = """
+CV_CHECK_PROMPT = """
         Tu es un classificateur. Dis si le document fourni est un CV (curriculum vitae/résumé).
         Réponds STRICTEMENT en JSON sans markdown:
         {"is_cv": true|false, "reason": "<raison brève en français>"}
@@ -502,28 +697,8 @@ def process_job_applicant_matching(applicant_name, **kwargs):
         Exemples NON CV: facture, attestation, lettre simple, offre d'emploi, tract publicitaire, rapport sans section expérience personnelle, photo seule, etc.
         Ne fais aucune supposition si les indices sont absents.
         """
-        try:
-            cv_check_resp = call_gemini_with_retry(client, parts_cv + [cv_check_prompt])
-            try:
-                cv_check = json.loads(cv_check_resp.text)
-            except Exception:
-                cv_check = json.loads(cv_check_resp.text.strip("```json").strip("```").strip())
-        except Exception as e:
-            cv_check = {"is_cv": True, "reason": "classification sautée (moteur indisponible)"}
-
-        if not cv_check.get("is_cv", True):
-            _set_flag(doc, FLAG_MATCHING_FAILED, 0)
-            _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
-            _set_text(doc, FIELD_AI_LAST_ERROR, "Document non CV")
-            _set_statut(doc, status_rejected or "Rejecté")
-            doc.custom_justification = f"Rejeté: ce document n'est pas un CV ({cv_check.get('reason','')})."
-            doc.custom_matching_score = 0
-            doc.applicant_rating = 0.0
-            _save_and_reload(doc)
-            return
 
-        # --- GEMINI EXTRACTION DU CV ---
-        prompt1 = """
+CV_EXTRACTION_PROMPT = """
             Rôle: Tu es un(e) recruteur(se) technique senior + analyste CV.
             Contexte: Le premier contenu fourni est le CV du candidat (PDF/image convertie en PDF). Ignore toute mise en page; analyse uniquement le texte.
 
@@ -612,34 +787,729 @@ def process_job_applicant_matching(applicant_name, **kwargs):
             - Sors UNIQUEMENT le JSON final (pas de markdown).
             """
 
-        try:
-            response1 = call_gemini_with_retry(client, parts_cv + [prompt1])
-        except Exception as e:
-            _safe_log_error("[GEMINI] Extraction CV échouée (overloaded/404 ?)", e)
-            _set_flag(doc, FLAG_MATCHING_FAILED, 1)
-            _set_text(doc, FIELD_AI_LAST_ERROR, str(e))
-            _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
-            _set_statut(doc, gemini_error_status)
-            doc.custom_justification = "Analyse automatique momentanément indisponible. Traitement manuel."
-            doc.custom_matching_score = 0
-            doc.applicant_rating = 0.0
-            _save_and_reload(doc)  # ← reload avant return
-            return
+# Mode combiné : un seul appel renvoie le verdict CV ET candidate_info.
+CV_COMBINED_PROMPT = """
+        Tu effectues DEUX tâches sur le document fourni, en une seule réponse.
 
-        try:
-            candidate_json = json.loads(response1.text)
-        except Exception:
-            try:
-                candidate_json = json.loads(response1.text.strip("```json\n").strip("```").strip())
-            except Exception as parse_err:
-                raise ValueError(f"Réponse Gemini (extraction CV) non parseable: {parse_err}")
+        Tâche A — Classification: dis si le document est un CV (curriculum vitae/résumé).
+        Critères d'un CV: identité/contact, expériences ou projets professionnels, compétences/outils, éducation/diplômes.
+        Exemples NON CV: facture, attestation, lettre simple, offre d'emploi, tract publicitaire, rapport sans section expérience personnelle, photo seule, etc.
+        Ne fais aucune supposition si les indices sont absents.
 
-        frappe.logger().debug(f"[MATCHING] CV structuré : {json.dumps(candidate_json, ensure_ascii=False)}")
+        Tâche B — Extraction: UNIQUEMENT si is_cv = true, applique les consignes ci-dessous pour produire candidate_info.
+        """ + CV_EXTRACTION_PROMPT + """
+        FORMAT DE SORTIE FINAL (prioritaire sur le schéma ci-dessus) — JSON strict, sans markdown:
+        {"is_cv": true|false, "reason": "<raison brève en français>", "candidate_info": <objet candidate_info décrit ci-dessus, ou null si is_cv = false>}
+        """
 
-        # --- MISE À JOUR DU CANDIDAT ---
-        info = candidate_json.get("candidate_info") if isinstance(candidate_json, dict) else {}
-        if not isinstance(info, dict):
-            info = {}
+# Scoring : consignes statiques ; la fiche de poste est ajoutée par offre et le
+# profil candidat est envoyé à part (voir utils.context_cache).
+SCORING_RUBRIC = """
+            Rôle: Tu es un(e) recruteur(se) technique senior chargé(e) d'évaluer l'adéquation CV ↔ fiche de poste de façon rigoureuse, reproductible et sans hallucination.
+
+            Entrées:
+            - Profil candidat (JSON structuré du CV)
+            - Fiche de poste (JSON: skills, outils, minimum_experience, study_level, fiche [description libre])
+
+            Objectif:
+            Calculer un score sur 100 + une justification brève (1 à 5 phrases) expliquant objectivement les principaux atouts et écarts.
+
+            ⚖️ Barème (total = 100) — critères optionnels:
+            - Compétences (skills): 40 pts
+            - Outils/Technologies (outils): 25 pts
+            - Niveau d'études (study_level): 15 pts
+            - Expérience (minimum_experience): 20 pts
+
+            Si un critère est absent/non renseigné dans la fiche de poste, redistribue proportionnellement son poids sur les critères restants (ex.: si seuls skills et outils présents, ils pèsent 40/(40+25)=61.54% et 25/(40+25)=38.46%, puis normalisés à 100).
+
+            🔎 Règles d'évaluation par critère (précises):
+            1) Compétences (skills)
+            - Normalise (minuscules, pluriels simples, accents, variantes). Déduplique.
+            - Correspondances acceptées: synonymes proches (ex.: "gestion de projet" ~ "project management").
+            - Priorise explicitement les **must-have** s'ils sont identifiables dans la description de la fiche (mots-clés: "obligatoire", "indispensable", "requis", "must-have").
+            - Bonus SI la compétence est **démontrée** dans des projets/missions proches des activités du poste (preuve par description d'expérience).
+            - Score = couverture pondérée des compétences requises (plus fort poids pour must-have), avec crédit partiel pour équivalents proches.
+
+            2) Outils/Technos (outils)
+            - Équivalences acceptées: JS=JavaScript, TS=TypeScript, Node=Node.js, React=React.js, Express=Express.js, SQL~PostgreSQL/MySQL/SQL Server (selon contexte), MS Office~Microsoft Office, etc. Versions voisines acceptées si l'écosystème est identique.
+            - Compte les familles/outils équivalents, mais évite le double comptage.
+            - Score = couverture pondérée des outils requis + pertinence démontrée en projet.
+
+            3) Niveau d'études (study_level)
+            - Mappe les équivalences (Licence=Bachelor, Master=MS/MSc, Bac+5=M2/Ingénieur, etc.).
+            - Si le candidat est en dessous du niveau requis → pénalité proportionnelle (forte si écart net).
+            - Si au-dessus ou équivalent → validation simple (pas de sur-bonus).
+
+            4) Expérience (minimum_experience)
+            - Compare **années pertinentes** (même domaine/tech stack/responsabilités) au minimum requis.
+            - Si < minimum: pénalité proportionnelle à l'écart.
+            - Si > minimum: pas de bonus automatique sans pertinence claire (projets/secteur proches).
+            - Privilégie la **récence** et la **pertinence** des missions par rapport aux activités principales du poste.
+
+            🧭 Contexte & pertinence:
+            - Utilise la description de la fiche (missions/activités) pour juger la similarité des projets vécus par le candidat (secteur, responsabilités, impact, environnement technique).
+            - Aucune source externe. Toute information manquante dans CV/fiche = non satisfaite (pas d'invention).
+
+            🧹 Normalisation/qualité:
+            - Traite tout en minuscules pour matcher; garde les noms propres/technos dans leur forme canonique lors de la rédaction de la justification.
+            - Évite de pénaliser deux fois le même écart.
+            - Rends un score **entier** 0–100 (arrondi à l'unité).
+"""
+
+# Consignes + sortie d'un scoring unitaire (un candidat, une offre)
+SCORING_PROMPT = SCORING_RUBRIC + """
+            🧾 Sortie STRICTE (aucun texte autour, pas de markdown):
+            - "score": entier [0..100]
+            - "justification": 1 à 5 phrases max, en français, mentionnant:
+            - 1–2 forces principales (ex.: compétences/outils alignés, projet très proche)
+            - 1–2 écarts majeurs (ex.: must-have manquant, années d'expérience insuffisantes, niveau d'études inférieur)
+
+            Rends UNIQUEMENT ce JSON :
+            {
+            "score": <entier entre 0 et 100>,
+            "justification": "<jusqu'à 5 phrases expliquant objectivement les points forts et les écarts, sans détails superflus>"
+            }
+            """
+
+
+# Un profil contre plusieurs offres (talent pool) : même barème, une évaluation par offre
+PROFILE_SCORING_PROMPT = SCORING_RUBRIC + """
+            Tu reçois UN profil candidat et PLUSIEURS fiches de poste, chacune identifiée par "job_opening".
+            Évalue chaque fiche indépendamment des autres, avec le barème ci-dessus, comme si elle était seule.
+
+            🧾 Sortie STRICTE (aucun texte autour, pas de markdown) : une entrée par fiche reçue, rien d'autre.
+            Rends UNIQUEMENT ce JSON :
+            {
+            "results": [
+                {
+                "job_opening": "<identifiant exact de la fiche>",
+                "score": <entier entre 0 et 100>,
+                "justification": "<1 à 5 phrases : forces principales et écarts majeurs>"
+                }
+            ]
+            }
+            """
+
+# Plusieurs candidats contre une offre (re-scoring par lot) : même barème, une évaluation par candidat
+BATCH_SCORING_PROMPT = SCORING_RUBRIC + """
+            Tu reçois UNE fiche de poste et PLUSIEURS profils candidats, chacun identifié par "candidate_id".
+            Évalue chaque candidat indépendamment, comme s'il était seul : ne compare pas les candidats entre eux
+            et n'ajuste aucun score selon les autres profils du lot.
+
+            🧾 Sortie STRICTE (aucun texte autour, pas de markdown) : une entrée par candidat reçu, rien d'autre.
+            Rends UNIQUEMENT ce JSON :
+            {
+            "results": [
+                {
+                "candidate_id": "<identifiant exact du candidat>",
+                "score": <entier entre 0 et 100>,
+                "justification": "<1 à 5 phrases : forces principales et écarts majeurs>"
+                }
+            ]
+            }
+            """
+
+EXTRACTION_MODE_COMBINED = "Combinée"
+EXTRACTION_MODE_SEPARATE = "Séparée"
+
+
+FORMAT_RETRIES = 1  # nouvel appel si la réponse reste inexploitable après réparation
+
+
+def extraction_version() -> str:
+    """
+    Version du cache d'extraction et des profils du talent pool : prompts de
+    classification et d'extraction (séparés et combiné) et schémas de sortie.
+    """
+    schemas = (json.dumps(SCHEMAS[o], sort_keys=True) for o in (OUTPUT_CV_CHECK, OUTPUT_EXTRACTION, OUTPUT_COMBINED))
+    return prompt_version(CV_CHECK_PROMPT, CV_EXTRACTION_PROMPT, CV_COMBINED_PROMPT, *schemas)
+
+
+def job_json(fiche) -> dict:
+    """Fiche de poste telle que présentée au scoring."""
+    return {
+        "skills":             [getattr(r, "skill", "") for r in (fiche.custom_skills or [])],
+        "outils":             [getattr(r, "outil", "") for r in (fiche.custom_outils or [])],
+        "minimum_experience": fiche.custom_minimum_experience,
+        "study_level":        fiche.custom_study_level,
+        "fiche":              fiche.description,
+    }
+
+
+def scoring_static_context(fiche, prompt: str = SCORING_PROMPT, key_suffix: str = "") -> StaticContext:
+    """Consignes de scoring + fiche de poste : préfixe commun à tous les candidats de l'offre."""
+    return static_context(
+        prompt + f"""
+            Fiche de poste :
+            {json.dumps(job_json(fiche), ensure_ascii=False)}
+            """,
+        scoring_key(fiche.name) + key_suffix,
+    )
+
+
+def scoring_candidate_part(candidate_json) -> str:
+    """Profil candidat tel que présenté au scoring unitaire."""
+    return f"""
+            Données à évaluer — Profil candidat :
+            {json.dumps(candidate_json, ensure_ascii=False)}
+            """
+
+
+def _ask_json(trace, stage: str, parts, output: str, label: str):
+    """
+    Sous-pipeline (yield from) : un appel Gemini au format `output`, réponse
+    réparée et validée. Une réponse inexploitable ne rejoue que cet appel.
+    """
+    request = GeminiRequest(parts, output)
+    for attempt in range(FORMAT_RETRIES + 1):
+        try:
+            with trace.span(stage) as span:
+                if attempt:
+                    span["format_retry"] = attempt
+                response = yield request
+                return parse_output(response, output, label)
+        except StructuredOutputError as e:
+            if attempt >= FORMAT_RETRIES:
+                raise
+            frappe.logger().warning(f"[GEMINI] {e} → nouvel appel ({label})")
+
+
+def _get_extraction_mode(settings) -> str:
+    mode = (getattr(settings, "cv_extraction_mode", "") or "").strip()
+    return mode if mode in (EXTRACTION_MODE_COMBINED, EXTRACTION_MODE_SEPARATE) else EXTRACTION_MODE_COMBINED
+
+
+def _split_combined_response(payload) -> tuple[dict, dict | None]:
+    """
+    Sépare la réponse combinée en (cv_check, candidate_json) au même format que
+    le mode deux appels. candidate_json vaut None si l'extraction est absente.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Réponse Gemini (classification + extraction CV) inattendue: objet JSON attendu")
+    cv_check = {"is_cv": bool(payload.get("is_cv", True)), "reason": payload.get("reason") or ""}
+    info = payload.get("candidate_info")
+    if not cv_check["is_cv"] or not isinstance(info, dict):
+        return cv_check, None
+    return cv_check, {"candidate_info": info}
+
+
+# -----------------------------
+# 1) Email Candidat Non Matching
+# -----------------------------
+
+def send_candidate_not_matching_email(doc, save: bool = True, queue: bool = False):
+    """
+    save=False : le document n'est pas sauvegardé ici (le pipeline de matching
+    persiste tout en une seule écriture à la fin du run).
+    queue=True : e-mail déposé dans la file d'envoi groupé (utils.notifications),
+    le flag est positionné par le dispatcher une fois l'e-mail en Email Queue.
+    Avec save=False, le dépôt attend l'écriture finale du run (_flush_pending).
+    """
+    try:
+        settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+
+        recipient = (getattr(doc, "email_id", "") or "").strip()
+        if not recipient:
+            frappe.logger().error("[NOT_MATCH_MAIL] Aucun destinataire renseigné")
+            return
+
+        ctx = {
+            "applicant_name": getattr(doc, "applicant_name", ""),
+            "job_title": getattr(doc, "custom_nom_de_loffre", ""),
+            "score": getattr(doc, "custom_matching_score", None),
+            "justification": getattr(doc, "custom_justification", "") or "",
+        }
+
+        if queue:
+            if save:
+                queue_notification(NOTIF_NOT_MATCHING, doc.name, recipient, ctx)
+            else:
+                doc.flags.pending_notifications = [
+                    *(doc.flags.pending_notifications or []), (NOTIF_NOT_MATCHING, recipient, ctx),
+                ]
+            return
+
+        subject, header, body = render_not_matching(settings, ctx)
+
+        frappe.sendmail(
+            recipients=[recipient],
+            subject=subject,
+            message=body,
+            header=header,
+        )
+
+        _set_flag(doc, FLAG_NOT_MATCH_EMAIL_SENT, 1)
+        if save:
+            _save_and_reload(doc)  # ← reload après save
+        frappe.logger().info(f"[NOT_MATCH_MAIL] Email envoyé à {recipient} avec succès.")
+
+    except TemplateNotFound as e:
+        _safe_log_error("[NOT_MATCH_MAIL] Template introuvable", e)
+        _set_text(doc, FIELD_AI_LAST_ERROR, f"Template introuvable: {e}")
+        _set_flag(doc, FLAG_NOT_MATCH_EMAIL_SENT, 0)
+        if save:
+            _save_and_reload(doc)  # ← reload après save
+
+    except Exception as e:
+        _safe_log_error("[NOT_MATCH_MAIL] Erreur d'envoi", e)
+        _set_text(doc, FIELD_AI_LAST_ERROR, f"Email non retenu: {e}")
+        _set_flag(doc, FLAG_NOT_MATCH_EMAIL_SENT, 0)
+        if save:
+            _save_and_reload(doc)  # ← reload après save
+
+
+# -----------------------------
+# 2) Invitation Testlify
+# -----------------------------
+
+def _mark_assessment_sent(doc, assessment_id, assessment_name):
+    """Marque la ligne custom_assessments de l'évaluation comme envoyée (sans doublon)."""
+    if not hasattr(doc, "custom_assessments"):
+        return
+    for row in (doc.custom_assessments or []):
+        if getattr(row, "assessment_id", None) == assessment_id:
+            row.sent = 1
+            return
+    doc.append("custom_assessments", {
+        "assessment_id":   assessment_id,
+        "assessment_name": assessment_name,
+        "sent":            1,
+    })
+
+
+def _uncertain_invites_note(results: list) -> str:
+    uncertain = [f"{r['assessment_id']} ({r['status']})" for r in results if r.get("uncertain")]
+    if not uncertain:
+        return ""
+    return "Invitations Testlify incertaines, à vérifier avant « Renvoyer invitations » : " + ", ".join(uncertain)
+
+
+def send_candidate_invite(doc, assessments: list, save: bool = True, client: TestlifyClient | None = None) -> list:
+    """`client` : client Testlify à utiliser (benchmark hors réseau) ; par défaut celui des settings."""
+    return run_matching_steps(_invite_steps(doc, assessments, save, client))
+
+
+def _invite_steps(doc, assessments: list, save: bool, client: TestlifyClient | None):
+    """Sous-pipeline (yield from) de send_candidate_invite : l'envoi HTTP est cédé comme BlockingStep."""
+    results = []
+    any_success = False
+
+    try:
+        client = client or TestlifyClient()
+
+        frappe.logger().info(f"[INVITE] URL : {client.api_url} | Candidat : {doc.custom_first_name} {doc.custom_last_name} <{getattr(doc, 'email_id', None)}>")
+
+        invite = candidate_invite(doc)
+        names = {}
+        to_send = []
+        for assessment in (assessments or []):
+            assessment_id, assessment_name = assessment_ref(assessment)
+
+            if not assessment_id:
+                frappe.logger().warning(f"[INVITE] assessment_id vide, ignoré : {assessment!r}")
+                continue
+
+            if not invite["email"]:
+                frappe.logger().warning(f"[INVITE] Email candidat vide, assessment {assessment_id} ignoré.")
+                results.append({"assessment_id": assessment_id, "status": "skipped", "message": "email vide"})
+                continue
+
+            if assessment_id in names:
+                continue
+            names[assessment_id] = assessment_name
+            to_send.append((assessment_id, [invite]))
+
+        # Évaluations envoyées en parallèle, hors de la boucle du mode lot ; le document est mis à jour ici
+        for result in (yield BlockingStep(client.invite_many, to_send)):
+            if result["status"] == "success":
+                any_success = True
+                # Mettre à jour le row existant plutôt qu'en ajouter un doublon
+                _mark_assessment_sent(doc, result["assessment_id"], names[result["assessment_id"]])
+            results.append(result)
+
+        frappe.logger().info(f"[INVITE] Résultats : {results}")
+        # Réponse perdue ou 5xx non rejoué : invitation peut-être partie, à vérifier puis renvoyer
+        doc.flags.invite_warning = _uncertain_invites_note(results)
+        if doc.flags.invite_warning:
+            frappe.logger().warning(f"[INVITE] {doc.flags.invite_warning} | Candidat : {doc.name}")
+            _set_text(doc, FIELD_AI_LAST_ERROR, doc.flags.invite_warning)
+        if any_success:
+            _set_flag(doc, FLAG_INVITES_SENT, 1)
+        else:
+            _set_flag(doc, FLAG_INVITES_SENT, 0)
+        if save:
+            _save_and_reload(doc)  # ← reload après save final de la boucle
+
+    except Exception as e:
+        _safe_log_error("[INVITE] Erreur fatale", e)
+        _set_text(doc, FIELD_AI_LAST_ERROR, f"Invite: {e}")
+        _set_flag(doc, FLAG_INVITES_SENT, 0)
+        if save:
+            _save_and_reload(doc)  # ← reload après save dans le handler d'erreur
+        results.append({"status": "fatal_error", "message": str(e)})
+
+    return results
+
+
+def send_bulk_candidate_invites(docs: list, assessments: list) -> dict:
+    """
+    Ré-invitation groupée (shortlist) : une requête par évaluation avec tous les
+    candidats dans candidateInvites, au lieu d'une requête par candidat et par
+    évaluation. Chaque candidat n'est marqué `sent` que pour les lots acceptés.
+    """
+    client = TestlifyClient()
+
+    by_email = {}
+    for doc in docs:
+        email = candidate_invite(doc)["email"].lower()
+        if email:
+            by_email.setdefault(email, doc)
+    invites = [candidate_invite(doc) for doc in by_email.values()]
+
+    refs = {}
+    for assessment in (assessments or []):
+        assessment_id, assessment_name = assessment_ref(assessment)
+        if assessment_id:
+            refs.setdefault(assessment_id, assessment_name)
+
+    results = []
+    sent_any, flagged = set(), set()
+    for assessment_id, assessment_name in refs.items():
+        for result in client.invite_bulk(assessment_id, invites):
+            emails = result.pop("emails")
+            results.append({**result, "candidates": len(emails)})
+            if result.get("uncertain"):
+                frappe.logger().warning(
+                    f"[INVITE] Lot incertain pour {assessment_id} ({result['status']}) : {len(emails)} candidat(s) à vérifier"
+                )
+                for email in emails:
+                    doc = by_email[email.lower()]
+                    _set_text(doc, FIELD_AI_LAST_ERROR, _uncertain_invites_note([result]))
+                    flagged.add(doc.name)
+            if result["status"] != "success":
+                continue
+            for email in emails:
+                doc = by_email[email.lower()]
+                _mark_assessment_sent(doc, assessment_id, assessment_name)
+                sent_any.add(doc.name)
+
+    for doc in by_email.values():
+        if doc.name not in sent_any | flagged:
+            continue
+        if doc.name in sent_any:
+            _set_flag(doc, FLAG_INVITES_SENT, 1)
+        try:
+            _save(doc)
+        except Exception as e:
+            _safe_log_error(f"[INVITE] Sauvegarde {doc.name} échouée", e)
+
+    frappe.logger().info(f"[INVITE] Envoi groupé : {len(invites)} candidat(s), résultats : {results}")
+    return {"candidates": len(invites), "invited": len(sent_any), "results": results}
+
+
+# -----------------------------
+# 3) Process Matching Candidat
+# -----------------------------
+
+def get_gemini_client(settings=None):
+    settings = settings or frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    API_KEY = (settings.get_password("gemini_api_key") or "").strip()
+    if not API_KEY:
+        raise ValueError(
+            "Clé API Gemini non configurée dans Job Matching Integration Settings."
+        )
+    return genai.Client(api_key=API_KEY)
+
+
+def process_job_applicant_matching(applicant_name, timeout: float | None = None, **kwargs):
+    """
+    Point d'entrée unitaire (job RQ) : un candidat, appels Gemini synchrones.
+    Sans effet si un run est déjà en cours pour ce candidat (relancé à sa fin).
+    `timeout` (s) : durée maximale du run, vérifiée entre deux étapes.
+    """
+    with applicant_lease(applicant_name) as acquired:
+        if not acquired:
+            return
+        settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+        client = get_gemini_client(settings)
+        gemini_files = GeminiFileSession(client, settings)
+        trace = MatchingTrace(applicant_name, mode="sync")
+
+        db_counter = DBQueryCounter().start()
+        try:
+            run_matching_steps(
+                matching_steps(applicant_name, settings, gemini_files, trace=trace),
+                # le span Gemini ouvert par le pipeline reçoit modèle, retries et tokens
+                lambda parts: call_gemini_with_retry(client, parts, stats=trace.active, files=gemini_files),
+                deadline=time.monotonic() + timeout if timeout else None,
+            )
+        finally:
+            gemini_files.close()
+            stats = db_counter.stop()
+        record_db_stats(stats, applicant_name)
+        trace.persist()
+
+
+class MatchingTimeoutError(Exception):
+    """Durée maximale du run dépassée : levée dans le pipeline à la place de l'étape suivante."""
+
+
+def _expired(deadline: float | None) -> MatchingTimeoutError | None:
+    if deadline is not None and time.monotonic() >= deadline:
+        return MatchingTimeoutError("Durée maximale du run de matching dépassée")
+    return None
+
+
+class BlockingStep:
+    """
+    Travail bloquant sans accès à la base (conversion LibreOffice, upload Files
+    API, lecture pypdf, appels HTTP Testlify) cédé par le pipeline comme une
+    requête Gemini. Le pilote synchrone l'exécute sur place, le pilote asyncio
+    dans un thread, hors de la boucle d'événements.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+
+    def __call__(self):
+        return self.fn(*self.args, **self.kwargs)
+
+
+def run_matching_steps(steps, call=None, deadline: float | None = None):
+    """
+    Pilote synchrone du pipeline : chaque requête Gemini cédée par `steps` est
+    confiée à `call` (client, tracing ou chronométrage propres à l'appelant),
+    chaque BlockingStep est exécutée sur place. Retourne la valeur de `steps`.
+    `deadline` (time.monotonic) dépassée : MatchingTimeoutError est levée dans
+    le pipeline à chaque étape suivante, qui finit alors son run (flags,
+    écriture finale) sans nouvel appel.
+    """
+    try:
+        request = next(steps)
+        while True:
+            try:
+                if timeout := _expired(deadline):
+                    raise timeout
+                response = request() if isinstance(request, BlockingStep) else call(request)
+            except Exception as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(response)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        steps.close()
+
+
+_DONE = object()
+
+
+def _advance(method, *args):
+    """Avance le générateur puis commite : aucune écriture non commitée ne traverse un yield."""
+    try:
+        request = method(*args)
+    except StopIteration:
+        request = _DONE  # StopIteration ne peut pas traverser un Future
+    frappe.db.commit()
+    return request
+
+
+async def run_locked(db_lock: asyncio.Lock, fn, *args):
+    """`fn` dans un thread, seul détenteur de la connexion DB partagée."""
+    async with db_lock:
+        return await asyncio.to_thread(fn, *args)
+
+
+async def run_matching_steps_async(steps, call, db_lock: asyncio.Lock, deadline: float | None = None):
+    """
+    Pilote asyncio du pipeline, même protocole et même `deadline` (`call` est
+    une coroutine, interrompue si elle dépasse la deadline) :
+    - BlockingStep : dans un thread, en parallèle des autres candidats ;
+    - le code du pipeline entre deux requêtes (lectures, écritures, Redis) :
+      dans un thread sous `db_lock`. Les runs d'un lot partagent une connexion
+      DB : elle ne sert qu'à un run à la fois, et chaque avancée se termine par
+      un commit, si bien que le rollback d'un run n'annule jamais les écritures
+      d'un autre.
+    La boucle d'événements ne fait donc qu'attendre.
+    """
+    try:
+        request = await run_locked(db_lock, _advance, steps.send, None)
+        while request is not _DONE:
+            try:
+                if timeout := _expired(deadline):
+                    raise timeout
+                if isinstance(request, BlockingStep):
+                    response = await asyncio.to_thread(request)
+                elif deadline is None:
+                    response = await call(request)
+                else:
+                    try:
+                        response = await asyncio.wait_for(call(request), max(0.0, deadline - time.monotonic()))
+                    except asyncio.TimeoutError:
+                        raise _expired(deadline) from None
+            except Exception as e:
+                request = await run_locked(db_lock, _advance, steps.throw, e)
+            else:
+                request = await run_locked(db_lock, _advance, steps.send, response)
+    finally:
+        await run_locked(db_lock, _advance, steps.close)
+
+
+def matching_steps(applicant_name, settings, gemini_files, testlify=None, trace=None):
+    """
+    Pipeline de matching d'un candidat, sans I/O Gemini : générateur qui cède
+    chaque liste de parts à envoyer et reçoit la réponse (ou l'exception, via
+    throw). Les lectures/écritures DB restent dans le générateur ; le pilote
+    décide comment appeler Gemini (synchrone ici, asyncio dans matching_batch).
+    `testlify` : client Testlify injecté (benchmarks), sinon celui des settings.
+    `trace` (utils.tracing) : spans par étape ; le pilote persiste la trace.
+    """
+    qualified_status = settings.status_qualified or "En Cours de qualification"
+    status_not_qualified = settings.status_not_qualified or "Top Profil"
+    qualification_score_threshold = settings.qualification_score_threshold or 70
+    status_rejected = settings.status_rejected or "Rejecté"
+    rejected_score = settings.rejected_max_score or 40
+    gemini_error_status = settings.gemini_error_status or "Open"
+
+    trace = trace or MatchingTrace(applicant_name)
+
+    doc = frappe.get_doc("Job Applicant", applicant_name)
+    trace.job_opening = doc.job_title
+
+    # ▶️ Flags: démarrage matching (UPDATE de colonnes, le document est écrit une seule fois en fin de run)
+    with trace.span(STAGE_FLAGS):
+        _set_progress_flags(doc, {
+            FLAG_MATCHING_IN_PROGRESS: 1,
+            FLAG_MATCHING_FAILED: 0,
+            FIELD_AI_LAST_ERROR: "",
+        })
+    snapshot = _doc_state(doc)
+
+    _matching_error = ""       # non-vide = erreur fatale → persistée dans le finally
+    _matching_succeeded = False  # True = traitement normal terminé
+
+    try:
+        fiche = frappe.get_doc("Job Opening", doc.job_title or "")
+        site_url = settings.site_url
+
+        if fiche.custom_active_cv_auto_matching == 0:
+            raise ValueError("Job auto match desable")
+
+        if not doc.resume_attachment:
+            raise ValueError("Le candidat n'a pas de pièce jointe 'resume_attachment'")
+
+        file_path = get_file_path(doc.resume_attachment)
+        if not pathlib.Path(file_path).exists():
+            raise FileNotFoundError(f"Fichier introuvable: {file_path}")
+
+        # 🗃️ Talent pool puis cache d'extraction : même CV + mêmes prompts ⇒ pas d'appel Gemini
+        talent_pool = is_talent_pool_enabled(settings)
+        with trace.span(STAGE_PREPARATION) as span:
+            file_hash = compute_file_hash(file_path)
+            cache_version = extraction_version()
+            profile_json = get_profile(doc.email_id, file_hash, cache_version) if talent_pool else None
+            cached = get_cached_extraction(file_hash, cache_version) if profile_json is None else None
+            span["profile_hit"] = profile_json is not None
+            span["cache_hit"] = cached is not None
+
+        candidate_json = None
+        if profile_json is not None:
+            # Profil déjà extrait pour ce candidat et ce CV : directement au scoring
+            cv_check = {"is_cv": True, "reason": ""}
+            candidate_json = profile_json
+            prep_info = {"strategy": "profile"}
+            trace.strategy = prep_info["strategy"]
+            mark_reused(doc.email_id, file_hash, doc.name)
+        elif cached is not None:
+            cv_check = cached["cv_check"]
+            candidate_json = cached.get("candidate_json")
+            prep_info = {"strategy": "cache", "cached_strategy": cached.get("strategy")}
+            trace.strategy = prep_info["strategy"]
+        else:
+            # 🔐 Limiter aux PDF/Word + préparer parts sûrs pour Gemini
+            try:
+                with trace.span(STAGE_CONVERSION) as span:
+                    parts_cv, prep_info = yield BlockingStep(
+                        _prepare_resume_parts_for_gemini, file_path, file_hash, gemini_files,
+                        text_first=_text_first_enabled(settings), limits=preprocess_limits(settings),
+                    )
+                    trace.strategy = span["strategy"] = prep_info.get("strategy")
+                    span.update({
+                        k: prep_info[k]
+                        for k in ("text_reason", "text_chars", "size_mb", "pages", "preprocess", "size_out_mb")
+                        if k in prep_info
+                    })
+            except ValueError as bad_fmt:
+                _set_flag(doc, FLAG_MATCHING_FAILED, 0)
+                _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
+                _set_text(doc, FIELD_AI_LAST_ERROR, str(bad_fmt))
+                _set_statut(doc, status_rejected or "Rejecté")
+                doc.custom_justification = "Rejeté: format non supporté (PDF ou Word uniquement)."
+                doc.custom_matching_score = 0
+                doc.applicant_rating = 0.0
+                return
+
+            if _get_extraction_mode(settings) == EXTRACTION_MODE_COMBINED:
+                # --- Étapes 0+1 en un seul aller-retour : verdict CV + extraction ---
+                try:
+                    combined = yield from _ask_json(
+                        trace, STAGE_COMBINED, [*parts_cv, static_context(CV_COMBINED_PROMPT, KEY_COMBINED)],
+                        OUTPUT_COMBINED, "classification + extraction CV",
+                    )
+                except StructuredOutputError:
+                    raise
+                except Exception as e:
+                    _mark_extraction_unavailable(doc, e, gemini_error_status)
+                    return
+                cv_check, candidate_json = _split_combined_response(combined)
+            else:
+                # --- Étape 0 : vérifier que le document est bien un CV ---
+                try:
+                    cv_check = yield from _ask_json(
+                        trace, STAGE_CLASSIFICATION, [*parts_cv, static_context(CV_CHECK_PROMPT, KEY_CHECK)],
+                        OUTPUT_CV_CHECK, "classification CV",
+                    )
+                except Exception as e:
+                    cv_check = {"is_cv": True, "reason": "classification sautée (moteur indisponible)", "skipped": True}
+
+        if not cv_check.get("is_cv", True):
+            if cached is None:
+                set_cached_extraction(file_hash, cache_version, cv_check, None, prep_info)
+            _set_flag(doc, FLAG_MATCHING_FAILED, 0)
+            _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
+            _set_text(doc, FIELD_AI_LAST_ERROR, "Document non CV")
+            _set_statut(doc, status_rejected or "Rejecté")
+            doc.custom_justification = f"Rejeté: ce document n'est pas un CV ({cv_check.get('reason','')})."
+            doc.custom_matching_score = 0
+            doc.applicant_rating = 0.0
+            return
+
+        # --- GEMINI EXTRACTION DU CV (mode séparé, ou réponse combinée sans candidate_info) ---
+        if candidate_json is None:
+            try:
+                candidate_json = yield from _ask_json(
+                    trace, STAGE_EXTRACTION, [*parts_cv, static_context(CV_EXTRACTION_PROMPT, KEY_EXTRACTION)],
+                    OUTPUT_EXTRACTION, "extraction CV",
+                )
+            except StructuredOutputError:
+                raise
+            except Exception as e:
+                _mark_extraction_unavailable(doc, e, gemini_error_status)
+                return
+
+        # Un verdict "classification sautée" n'est pas fiable : on ne le fige ni en cache ni en profil
+        if not cv_check.get("skipped"):
+            if cached is None and profile_json is None:
+                set_cached_extraction(file_hash, cache_version, cv_check, candidate_json, prep_info)
+            if talent_pool and profile_json is None:
+                save_profile(doc.email_id, file_hash, cache_version, candidate_json, doc.name, prep_info.get("strategy"))
+
+        frappe.logger().debug(f"[MATCHING] CV structuré ({prep_info.get('strategy')}) : {json.dumps(candidate_json, ensure_ascii=False)}")
+
+        # --- MISE À JOUR DU CANDIDAT ---
+        info = candidate_json.get("candidate_info") if isinstance(candidate_json, dict) else {}
+        # Types normalisés (aussi pour les extractions mises en cache avant les sorties structurées)
+        info = coerce_candidate_info(info if isinstance(info, dict) else {})
 
         age = info.get("age")
         if age is not None:
@@ -751,109 +1621,32 @@ def process_job_applicant_matching(applicant_name, **kwargs):
                     "level": level
                 })
 
-        _save_and_reload(doc)  # ← reload après save des données CV extraites
-
-        job_json = {
-            "skills":             [getattr(r, "skill", "") for r in (fiche.custom_skills or [])],
-            "outils":             [getattr(r, "outil", "") for r in (fiche.custom_outils or [])],
-            "minimum_experience": fiche.custom_minimum_experience,
-            "study_level":        fiche.custom_study_level,
-            "fiche":              fiche.description,
-        }
-
-        prompt2 = f"""
-            Rôle: Tu es un(e) recruteur(se) technique senior chargé(e) d'évaluer l'adéquation CV ↔ fiche de poste de façon rigoureuse, reproductible et sans hallucination.
-
-            Entrées:
-            - Profil candidat (JSON structuré du CV)
-            - Fiche de poste (JSON: skills, outils, minimum_experience, study_level, fiche [description libre])
-
-            Objectif:
-            Calculer un score sur 100 + une justification brève (1 à 5 phrases) expliquant objectivement les principaux atouts et écarts.
-
-            ⚖️ Barème (total = 100) — critères optionnels:
-            - Compétences (skills): 40 pts
-            - Outils/Technologies (outils): 25 pts
-            - Niveau d'études (study_level): 15 pts
-            - Expérience (minimum_experience): 20 pts
-
-            Si un critère est absent/non renseigné dans la fiche de poste, redistribue proportionnellement son poids sur les critères restants (ex.: si seuls skills et outils présents, ils pèsent 40/(40+25)=61.54% et 25/(40+25)=38.46%, puis normalisés à 100).
-
-            🔎 Règles d'évaluation par critère (précises):
-            1) Compétences (skills)
-            - Normalise (minuscules, pluriels simples, accents, variantes). Déduplique.
-            - Correspondances acceptées: synonymes proches (ex.: "gestion de projet" ~ "project management").
-            - Priorise explicitement les **must-have** s'ils sont identifiables dans la description de la fiche (mots-clés: "obligatoire", "indispensable", "requis", "must-have").
-            - Bonus SI la compétence est **démontrée** dans des projets/missions proches des activités du poste (preuve par description d'expérience).
-            - Score = couverture pondérée des compétences requises (plus fort poids pour must-have), avec crédit partiel pour équivalents proches.
-
-            2) Outils/Technos (outils)
-            - Équivalences acceptées: JS=JavaScript, TS=TypeScript, Node=Node.js, React=React.js, Express=Express.js, SQL~PostgreSQL/MySQL/SQL Server (selon contexte), MS Office~Microsoft Office, etc. Versions voisines acceptées si l'écosystème est identique.
-            - Compte les familles/outils équivalents, mais évite le double comptage.
-            - Score = couverture pondérée des outils requis + pertinence démontrée en projet.
+        # Préfixe statique par offre (consignes + fiche) → cache de contexte ; seul le profil varie
+        scoring_context = scoring_static_context(fiche)
+        candidate_part = scoring_candidate_part(candidate_json)
 
-            3) Niveau d'études (study_level)
-            - Mappe les équivalences (Licence=Bachelor, Master=MS/MSc, Bac+5=M2/Ingénieur, etc.).
-            - Si le candidat est en dessous du niveau requis → pénalité proportionnelle (forte si écart net).
-            - Si au-dessus ou équivalent → validation simple (pas de sur-bonus).
+        # ⚡ Pré-scoring local : cas nets routés sans appel LLM, zone ambiguë → Gemini
+        with trace.span(STAGE_PRESCORING) as span:
+            matching_score = prescore_for_matching(settings, fiche, info, rejected_score, qualification_score_threshold)
+            span["routed"] = matching_score is not None
 
-            4) Expérience (minimum_experience)
-            - Compare **années pertinentes** (même domaine/tech stack/responsabilités) au minimum requis.
-            - Si < minimum: pénalité proportionnelle à l'écart.
-            - Si > minimum: pas de bonus automatique sans pertinence claire (projets/secteur proches).
-            - Privilégie la **récence** et la **pertinence** des missions par rapport aux activités principales du poste.
-
-            🧭 Contexte & pertinence:
-            - Utilise la description de la fiche (missions/activités) pour juger la similarité des projets vécus par le candidat (secteur, responsabilités, impact, environnement technique).
-            - Aucune source externe. Toute information manquante dans CV/fiche = non satisfaite (pas d'invention).
-
-            🧹 Normalisation/qualité:
-            - Traite tout en minuscules pour matcher; garde les noms propres/technos dans leur forme canonique lors de la rédaction de la justification.
-            - Évite de pénaliser deux fois le même écart.
-            - Rends un score **entier** 0–100 (arrondi à l'unité).
-
-            🧾 Sortie STRICTE (aucun texte autour, pas de markdown):
-            - "score": entier [0..100]
-            - "justification": 1 à 5 phrases max, en français, mentionnant:
-            - 1–2 forces principales (ex.: compétences/outils alignés, projet très proche)
-            - 1–2 écarts majeurs (ex.: must-have manquant, années d'expérience insuffisantes, niveau d'études inférieur)
-
-            Données à évaluer:
-
-            Profil candidat :
-            {json.dumps(candidate_json, ensure_ascii=False)}
-
-            Fiche de poste :
-            {json.dumps(job_json, ensure_ascii=False)}
-
-            Rends UNIQUEMENT ce JSON :
-            {{
-            "score": <entier entre 0 et 100>,
-            "justification": "<jusqu'à 5 phrases expliquant objectivement les points forts et les écarts, sans détails superflus>"
-            }}
-            """
-
-        try:
-            response2 = call_gemini_with_retry(client, [prompt2])
-        except Exception as e:
-            _safe_log_error("[GEMINI] Matching échoué (overloaded/404 ?)", e)
-            _set_flag(doc, FLAG_MATCHING_FAILED, 1)
-            _set_text(doc, FIELD_AI_LAST_ERROR, str(e))
-            _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
-            _set_statut(doc, gemini_error_status)
-            doc.custom_justification = "Matching indisponible (surcharge moteur). Reprise auto ou traitement manuel."
-            doc.custom_matching_score = 0
-            doc.applicant_rating = 0.0
-            _save_and_reload(doc)  # ← reload avant return
-            return
-
-        try:
-            matching_score = json.loads(response2.text)
-        except Exception:
+        if matching_score is None:
             try:
-                matching_score = json.loads(response2.text.strip("```json\n").strip("```").strip())
-            except Exception as parse_err:
-                raise ValueError(f"Réponse Gemini (score matching) non parseable: {parse_err}")
+                matching_score = yield from _ask_json(
+                    trace, STAGE_SCORING, [scoring_context, candidate_part], OUTPUT_SCORING, "score matching",
+                )
+            except StructuredOutputError:
+                raise
+            except Exception as e:
+                _safe_log_error("[GEMINI] Matching échoué (overloaded/404 ?)", e)
+                _set_flag(doc, FLAG_MATCHING_FAILED, 1)
+                _set_text(doc, FIELD_AI_LAST_ERROR, str(e))
+                _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
+                _set_statut(doc, gemini_error_status)
+                doc.custom_justification = "Matching indisponible (surcharge moteur). Reprise auto ou traitement manuel."
+                doc.custom_matching_score = 0
+                doc.applicant_rating = 0.0
+                return
 
         score = 0  # valeur par défaut si matching_score n'est pas un dict valide
         if isinstance(matching_score, dict):
@@ -869,12 +1662,14 @@ def process_job_applicant_matching(applicant_name, **kwargs):
             else:
                 _set_statut(doc, qualified_status if score >= qualification_score_threshold else status_not_qualified)
 
-            _save_and_reload(doc)  # ← reload après save du score de matching
-
         if score >= qualification_score_threshold:
-            send_candidate_invite(doc, fiche.custom_assessments)
+            if not still_held(applicant_name):
+                raise LeaseLostError(f"Bail perdu pour {applicant_name} : invitations non envoyées")
+            with trace.span(STAGE_INVITE):
+                yield from _invite_steps(doc, fiche.custom_assessments, save=False, client=testlify)
         else:
-            send_candidate_not_matching_email(doc)
+            with trace.span(STAGE_EMAIL):
+                send_candidate_not_matching_email(doc, save=False, queue=True)
 
         frappe.logger().info(
             f"[MATCHING] Score : {score} | Statut : {doc.custom_status} | Candidat : {applicant_name}"
@@ -886,20 +1681,31 @@ def process_job_applicant_matching(applicant_name, **kwargs):
         _matching_error = str(e)
 
     finally:
-        # Recharger d'abord pour éviter TimestampMismatchError,
-        # puis appliquer les flags APRÈS le reload pour qu'ils soient bien persistés.
-        try:
-            doc.reload()
-        except Exception:
-            pass
-        _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
-        if _matching_error:
-            _set_flag(doc, FLAG_MATCHING_FAILED, 1)
-            _set_text(doc, FIELD_AI_LAST_ERROR, _matching_error)
-        elif _matching_succeeded:
-            _set_flag(doc, FLAG_MATCHING_FAILED, 0)
-            _set_text(doc, FIELD_AI_LAST_ERROR, "")
-        doc.flags.ignore_permissions = True
-        doc.validate_workflow = lambda: None
-        doc.save(ignore_permissions=True)
-        frappe.db.commit()
\ No newline at end of file
+        if not still_held(applicant_name):
+            # Un autre run a repris le candidat : c'est lui qui fera l'écriture finale
+            frappe.logger().warning(f"[MATCHING] Bail perdu pour {applicant_name} : écriture finale abandonnée")
+            _matching_error = _matching_error or "Bail perdu en cours de run : écriture finale abandonnée"
+        else:
+            # Écriture unique du run : données extraites, score, statut, tables enfants et flags finaux.
+            _set_flag(doc, FLAG_MATCHING_IN_PROGRESS, 0)
+            if _matching_error:
+                _set_flag(doc, FLAG_MATCHING_FAILED, 1)
+                _set_text(doc, FIELD_AI_LAST_ERROR, _matching_error)
+            elif _matching_succeeded:
+                _set_flag(doc, FLAG_MATCHING_FAILED, 0)
+                _set_text(doc, FIELD_AI_LAST_ERROR, doc.flags.get("invite_warning") or "")
+            try:
+                with trace.span(STAGE_SAVE):
+                    doc = _flush_pending(doc, snapshot)
+            except Exception as e:
+                # Dernier recours : au moins libérer le flag "en cours" pour l'UI
+                _safe_log_error("[MATCHING] Écriture finale échouée", e)
+                frappe.db.rollback()
+                _set_progress_flags(doc, {
+                    FLAG_MATCHING_IN_PROGRESS: 0,
+                    FLAG_MATCHING_FAILED: 1,
+                    FIELD_AI_LAST_ERROR: (_matching_error or f"Sauvegarde: {e}")[:1000],
+                })
+                _matching_error = _matching_error or f"Sauvegarde: {e}"
+        failed = _matching_error or (getattr(doc, FIELD_AI_LAST_ERROR, "") if getattr(doc, FLAG_MATCHING_FAILED, 0) else "")
+        trace.finish(status=getattr(doc, FIELD_STATUT, None), error=failed)
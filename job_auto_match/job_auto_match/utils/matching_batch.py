@@ -0,0 +1,195 @@
+"""
+Consommateur asyncio par lots pour le matching.
+
+Un job de matching passe l'essentiel de son temps à attendre Gemini : avec un
+candidat par job, le débit est borné par le nombre de workers RQ. En mode lot,
+les candidatures sont tirées de la file de matching (utils.matching_queue) et
+un seul job consommateur en traite N à la fois :
+
+- chaque candidat suit le même pipeline que process_job_applicant_matching
+  (générateur matching_steps) ;
+- les appels Gemini (classification, extraction, scoring) partent en parallèle
+  via le client async (client.aio), avec une limite d'appels simultanés ;
+- les travaux bloquants sans base (conversion LibreOffice, upload Files API,
+  lecture pypdf, invitations Testlify) partent dans des threads, eux aussi en
+  parallèle ;
+- le reste du pipeline (lectures, écritures, Redis) s'exécute dans un thread,
+  un candidat à la fois (verrou de la connexion DB partagée), avec un commit à
+  chaque étape : la boucle d'événements n'est jamais bloquée et un rollback
+  ne touche que le run qui le déclenche ;
+- chaque run est borné par matching_queue.RUN_TIMEOUT, multiplié par le
+  nombre de vagues du lot (les runs se partagent les appels simultanés), et
+  les candidats du lot ne sont acquittés qu'une fois le lot terminé ;
+- le consommateur ne tire plus de lot après matching_queue.CONSUMER_BUDGET
+  et passe le relais à un nouveau job s'il reste des candidats : le timeout
+  RQ (budget + un lot) n'interrompt jamais un lot en cours.
+
+process_job_applicant_matching reste le point d'entrée unitaire (mode lot
+désactivé, exécution en console).
+"""
+
+import asyncio
+import math
+import time
+import traceback
+
+import frappe
+
+from job_auto_match.job_auto_match.utils import applicant_lock, matching_queue
+from job_auto_match.job_auto_match.utils.gemini_files import GeminiFileSession
+from job_auto_match.job_auto_match.utils.matching import (
+    call_gemini_with_retry_async,
+    get_gemini_client,
+    matching_steps,
+    run_locked,
+    run_matching_steps_async,
+)
+from job_auto_match.job_auto_match.utils.metrics import DBQueryCounter, record_db_stats
+from job_auto_match.job_auto_match.utils.tracing import MatchingTrace
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+CONSUMER_JOB_ID = "job_auto_match:matching_batch:{slot}"
+_CONSUMER_METHOD = "job_auto_match.job_auto_match.utils.matching_batch.process_matching_batch"
+
+DEFAULT_BATCH_SIZE = 20
+DEFAULT_IN_FLIGHT = 8
+
+
+def _settings():
+    return frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+
+
+def is_batch_enabled(settings=None) -> bool:
+    try:
+        return bool(int(getattr(settings or _settings(), "matching_batch_enabled", 0) or 0))
+    except Exception:
+        return False
+
+
+# ---------- File d'attente ----------
+# Les candidats attendent dans la file partagée utils.matching_queue (priorités,
+# dédoublonnage, tourniquet par offre) ; ce module n'en est qu'un consommateur.
+
+def _batch_sizes(settings, limit: int | None = None) -> tuple[int, int]:
+    """(taille de lot, appels simultanés)."""
+    batch_size = int(limit or getattr(settings, "matching_batch_size", 0) or DEFAULT_BATCH_SIZE)
+    in_flight = int(getattr(settings, "matching_batch_in_flight", 0) or DEFAULT_IN_FLIGHT)
+    return batch_size, in_flight
+
+
+def _batch_timeout(batch_size: int, in_flight: int) -> int:
+    """Durée maximale d'un lot : RUN_TIMEOUT par vague d'appels simultanés."""
+    return matching_queue.RUN_TIMEOUT * math.ceil(batch_size / max(1, in_flight))
+
+
+def _consumer_running() -> bool:
+    from frappe.utils.background_jobs import is_job_enqueued
+
+    return any(is_job_enqueued(CONSUMER_JOB_ID.format(slot=slot)) for slot in (0, 1))
+
+
+def enqueue_consumer(slot: int = 0, relay: bool = False):
+    """
+    Un seul consommateur en file/en cours à la fois. Deux job_id en alternance :
+    le consommateur qui passe le relais ne peut pas se ré-enfiler sous son propre
+    job_id, encore « en cours » pour RQ.
+    """
+    if not relay and _consumer_running():
+        return
+    settings = _settings()
+    timeout = matching_queue.CONSUMER_BUDGET + _batch_timeout(*_batch_sizes(settings)) + matching_queue.CLAIM_GRACE
+    queue = matching_queue._rq_queue(settings)
+    kwargs = {
+        "timeout": timeout,
+        "job_id": CONSUMER_JOB_ID.format(slot=slot),
+        "deduplicate": True,
+        "user": "Administrator",
+        "slot": slot,
+    }
+    try:
+        frappe.enqueue(_CONSUMER_METHOD, queue=queue, **kwargs)
+    except Exception:
+        # File RQ dédiée non déclarée dans la configuration des workers : repli sur la file par défaut
+        fallback = matching_queue.DEFAULT_RQ_QUEUE
+        frappe.logger().warning(f"[MATCHING_BATCH] File RQ '{queue}' indisponible, repli sur '{fallback}'")
+        frappe.enqueue(_CONSUMER_METHOD, queue=fallback, **kwargs)
+
+
+# ---------- Consommateur ----------
+
+def process_matching_batch(limit: int | None = None, slot: int = 0):
+    """Job RQ : traite la file par lots de N jusqu'à épuisement ou fin du budget, puis passe le relais."""
+    settings = _settings()
+    batch_size, in_flight = _batch_sizes(settings, limit)
+    client = get_gemini_client(settings)
+    # Une seule boucle d'événements pour tout le drainage : le client async reste lié à la même boucle
+    exhausted = asyncio.run(_consume(settings, client, batch_size, in_flight))
+    if not exhausted and matching_queue.queued_count():
+        frappe.logger().info(f"[MATCHING_BATCH] Budget atteint, {matching_queue.queued_count()} en attente : relais")
+        enqueue_consumer(1 - slot, relay=True)
+
+
+async def _consume(settings, client, batch_size: int, in_flight: int) -> bool:
+    """Tire des lots tant que le budget le permet ; True si la file a été vidée."""
+    run_timeout = _batch_timeout(batch_size, in_flight)
+    started = time.monotonic()
+    while time.monotonic() - started < matching_queue.CONSUMER_BUDGET:
+        names = matching_queue.pop(batch_size, claim_timeout=run_timeout + matching_queue.CLAIM_GRACE)
+        if not names:
+            return True
+        db_counter = DBQueryCounter().start()
+        try:
+            await _run_batch(names, settings, client, in_flight, time.monotonic() + run_timeout)
+        finally:
+            stats = db_counter.stop()
+            matching_queue.ack(names)
+        record_db_stats(stats, f"lot de {len(names)}", runs=len(names))
+    return False
+
+
+async def _run_batch(names: list[str], settings, client, in_flight: int, deadline: float):
+    semaphore = asyncio.Semaphore(max(1, in_flight))
+    db_lock = asyncio.Lock()
+    results = await asyncio.gather(
+        *(_run_applicant(name, settings, client, semaphore, db_lock, deadline) for name in names),
+        return_exceptions=True,
+    )
+    for name, result in zip(names, results, strict=True):
+        if isinstance(result, BaseException):
+            frappe.log_error(
+                title=f"[MATCHING_BATCH] Échec pour {name}",
+                message="".join(traceback.format_exception(result)),
+            )
+
+
+async def _run_applicant(
+    applicant_name: str, settings, client, semaphore: asyncio.Semaphore, db_lock: asyncio.Lock, deadline: float
+):
+    """Un candidat du lot, sous bail : ignoré (puis relancé) si un run est déjà en cours ailleurs."""
+    token = await run_locked(db_lock, applicant_lock.begin, applicant_name)
+    if token is None:
+        return
+    try:
+        await _drive_applicant(applicant_name, settings, client, semaphore, db_lock, deadline)
+    finally:
+        await run_locked(db_lock, applicant_lock.end, applicant_name, token)
+
+
+async def _drive_applicant(
+    applicant_name: str, settings, client, semaphore: asyncio.Semaphore, db_lock: asyncio.Lock, deadline: float
+):
+    """Pilote asyncio de matching_steps pour un candidat."""
+    gemini_files = GeminiFileSession(client, settings)
+    trace = MatchingTrace(applicant_name, mode="batch")
+
+    async def call(request):
+        async with semaphore:
+            # le span Gemini ouvert par le pipeline reçoit modèle, retries et tokens
+            return await call_gemini_with_retry_async(client, request, stats=trace.active, files=gemini_files)
+
+    try:
+        steps = matching_steps(applicant_name, settings, gemini_files, trace=trace)
+        await run_matching_steps_async(steps, call, db_lock, deadline)
+    finally:
+        await asyncio.to_thread(gemini_files.close)
+        await run_locked(db_lock, trace.persist)
@@ -0,0 +1,365 @@
+"""
+File de matching dédiée : priorités, dédoublonnage et équité entre offres.
+
+Avant, chaque demande de matching partait directement sur la file RQ `long`.
+after_insert, les deux endpoints retry_matching et les clics manuels
+pouvaient empiler plusieurs jobs pour le même candidat. Une grosse offre
+pouvait aussi monopoliser les workers au détriment des autres.
+
+- Une entrée par candidat (hash Redis `queued`) : une nouvelle demande pour
+  un candidat déjà en attente est fusionnée. Elle ne fait que remonter sa
+  priorité si la nouvelle est plus haute.
+- Classes de priorité :
+  - new : candidature fraîche du formulaire web ;
+  - retry : relance manuelle ;
+  - bulk : re-matching en masse.
+  Une classe n'est servie que si les classes supérieures sont vides.
+- Dans une classe, une liste par Job Opening et un anneau des offres :
+  tourniquet, un candidat par offre à chaque tour.
+- Enqueue et dépilement passent par des scripts Lua, donc atomiques entre
+  workers.
+- Un candidat dépilé passe dans un ZSET « en cours » avec une échéance, et
+  n'en sort (ack) qu'à la fin de son run. drain_matching_queue remet en file
+  les candidats dont l'échéance est dépassée : un consommateur tué ne perd
+  plus de candidat. Chaque run est borné par RUN_TIMEOUT.
+- Consommation :
+  - mode unitaire : N jobs consommateurs aux job_id stables (réglage
+    matching_queue_consumers), qui rendent la main après un budget de temps
+    et se relancent s'il reste du travail ;
+  - mode lot : utils.matching_batch tire ses lots de la même file.
+- queue_stats() : profondeur, âge du plus ancien et nombre d'offres par
+  priorité.
+"""
+
+import time
+
+import frappe
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+_PREFIX = "job_auto_match:mq"
+CONSUMER_JOB_ID = "job_auto_match:matching_queue:{slot}"
+
+PRIORITY_NEW = 0
+PRIORITY_RETRY = 1
+PRIORITY_BULK = 2
+PRIORITY_NAMES = {PRIORITY_NEW: "new", PRIORITY_RETRY: "retry", PRIORITY_BULK: "bulk"}
+
+DEFAULT_CONSUMERS = 2
+DEFAULT_RQ_QUEUE = "long"
+CONSUMER_TIMEOUT = 1800
+CONSUMER_BUDGET = 1200  # s de travail avant de rendre la main (relance si la file n'est pas vide)
+RUN_TIMEOUT = 300  # s par run de matching (ancien timeout du job unitaire)
+CLAIM_GRACE = 300  # marge au-delà de RUN_TIMEOUT avant de considérer un run comme perdu
+NO_OPENING = "-"
+LEGACY_PENDING_KEY = "job_auto_match:matching_pending"
+
+# KEYS[1] = hash des candidats en attente ; ARGV = préfixe, candidat, priorité, offre, horodatage
+_ENQUEUE_LUA = """
+local prefix, applicant, priority, opening, now = ARGV[1], ARGV[2], tonumber(ARGV[3]), ARGV[4], ARGV[5]
+local current = redis.call('HGET', KEYS[1], applicant)
+if current then
+    local p, since, o = string.match(current, '^(%d+)|([^|]*)|(.*)$')
+    if tonumber(p) <= priority then
+        return 0
+    end
+    local old_list = prefix .. ':' .. p .. ':o:' .. o
+    redis.call('LREM', old_list, 0, applicant)
+    if redis.call('LLEN', old_list) == 0 then
+        redis.call('LREM', prefix .. ':' .. p .. ':ring', 0, o)
+    end
+    now = since
+end
+local list = prefix .. ':' .. priority .. ':o:' .. opening
+if redis.call('RPUSH', list, applicant) == 1 then
+    redis.call('RPUSH', prefix .. ':' .. priority .. ':ring', opening)
+end
+redis.call('HSET', KEYS[1], applicant, priority .. '|' .. now .. '|' .. opening)
+return 1
+"""
+
+# KEYS = candidats en attente, échéances en cours (ZSET), méta en cours ;
+# ARGV = préfixe, nombre de priorités, nombre max à dépiler, échéance
+_POP_LUA = """
+local prefix, levels, limit = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]) * 2  -- paires (candidat, méta)
+local out = {}
+for p = 0, levels - 1 do
+    local ring = prefix .. ':' .. p .. ':ring'
+    while #out < limit do
+        local opening = redis.call('LPOP', ring)
+        if not opening then
+            break
+        end
+        local list = prefix .. ':' .. p .. ':o:' .. opening
+        local applicant = redis.call('LPOP', list)
+        if redis.call('LLEN', list) > 0 then
+            redis.call('RPUSH', ring, opening)
+        end
+        if applicant then
+            local meta = redis.call('HGET', KEYS[1], applicant) or ''
+            table.insert(out, applicant)
+            table.insert(out, meta)
+            redis.call('HDEL', KEYS[1], applicant)
+            redis.call('ZADD', KEYS[2], ARGV[4], applicant)
+            redis.call('HSET', KEYS[3], applicant, meta)
+        end
+    end
+    if #out >= limit then
+        break
+    end
+end
+return out
+"""
+
+# KEYS = échéances en cours, méta en cours ; ARGV = candidats terminés
+_ACK_LUA = """
+for _, applicant in ipairs(ARGV) do
+    redis.call('ZREM', KEYS[1], applicant)
+    redis.call('HDEL', KEYS[2], applicant)
+end
+return #ARGV
+"""
+
+# KEYS = candidats en attente, échéances en cours, méta en cours ;
+# ARGV = préfixe, maintenant, priorité et offre par défaut → candidats remis en file
+_REQUEUE_LUA = """
+local prefix, now = ARGV[1], ARGV[2]
+local out = {}
+for _, applicant in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    local meta = redis.call('HGET', KEYS[3], applicant) or ''
+    redis.call('ZREM', KEYS[2], applicant)
+    redis.call('HDEL', KEYS[3], applicant)
+    if not redis.call('HGET', KEYS[1], applicant) then
+        local p, since, o = string.match(meta, '^(%d+)|([^|]*)|(.*)$')
+        if not p then
+            p, since, o = ARGV[3], now, ARGV[4]
+        end
+        local list = prefix .. ':' .. p .. ':o:' .. o
+        if redis.call('RPUSH', list, applicant) == 1 then
+            redis.call('RPUSH', prefix .. ':' .. p .. ':ring', o)
+        end
+        redis.call('HSET', KEYS[1], applicant, p .. '|' .. since .. '|' .. o)
+        table.insert(out, applicant)
+    end
+end
+return out
+"""
+
+_HGETALL_LUA = "return redis.call('HGETALL', KEYS[1])"
+_COUNTS_LUA = "return {redis.call('HLEN', KEYS[1]), redis.call('ZCARD', KEYS[2])}"
+
+_scripts = {}
+
+
+def _settings():
+    return frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+
+
+def _prefix() -> str:
+    key = frappe.cache().make_key(_PREFIX)
+    return key.decode() if isinstance(key, bytes) else key
+
+
+def _queued_key() -> str:
+    return f"{_prefix()}:queued"
+
+
+def _processing_keys() -> list[str]:
+    return [f"{_prefix()}:processing", f"{_prefix()}:inflight"]
+
+
+def _script(name: str, source: str):
+    if name not in _scripts:
+        _scripts[name] = frappe.cache().register_script(source)
+    return _scripts[name]
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _parse_meta(meta: str) -> dict:
+    priority, _, rest = (meta or "").partition("|")
+    since, _, opening = rest.partition("|")
+    return {
+        "priority": int(priority) if priority.isdigit() else PRIORITY_NEW,
+        "enqueued_at": float(since) if since else None,
+        "job_opening": None if opening in ("", NO_OPENING) else opening,
+    }
+
+
+# ---------- Enqueue ----------
+
+def push(applicant_name: str, priority: int = PRIORITY_NEW, job_opening: str | None = None) -> bool:
+    """Ajoute (ou remonte) le candidat dans la file ; False si déjà en attente à priorité égale ou supérieure."""
+    added = _script("enqueue", _ENQUEUE_LUA)(
+        keys=[_queued_key()],
+        args=[_prefix(), applicant_name, int(priority), job_opening or NO_OPENING, f"{time.time():.3f}"],
+    )
+    return bool(int(added or 0))
+
+
+def enqueue_matching(applicant_name: str, priority: int = PRIORITY_NEW, job_opening: str | None = None):
+    """
+    Dépose la demande puis réveille les consommateurs : après commit si la
+    transaction a des écritures en attente, tout de suite sinon (une requête
+    sans écriture se termine par un rollback, qui jetterait le callback).
+    """
+    if job_opening is None:
+        job_opening = frappe.db.get_value("Job Applicant", applicant_name, "job_title")
+
+    def _push():
+        if not push(applicant_name, priority, job_opening):
+            frappe.logger().info(f"[MATCHING_QUEUE] {applicant_name} déjà en attente : demande fusionnée")
+        wake_consumers()
+
+    if frappe.db.transaction_writes:
+        frappe.db.after_commit.add(_push)
+    else:
+        _push()
+
+
+def pop(limit: int = 1, claim_timeout: float = RUN_TIMEOUT + CLAIM_GRACE) -> list[str]:
+    """
+    Dépile jusqu'à `limit` candidats : priorité d'abord, puis tourniquet entre
+    offres. Ils restent « en cours » jusqu'à ack(), au plus `claim_timeout` s.
+    """
+    raw = _script("pop", _POP_LUA)(
+        keys=[_queued_key(), *_processing_keys()],
+        args=[_prefix(), len(PRIORITY_NAMES), int(limit), f"{time.time() + claim_timeout:.3f}"],
+    ) or []
+    return [_decode(raw[i]) for i in range(0, len(raw), 2)]
+
+
+def ack(names: list[str]):
+    """Run terminé (succès ou échec) : les candidats quittent l'ensemble « en cours »."""
+    if names:
+        _script("ack", _ACK_LUA)(keys=_processing_keys(), args=list(names))
+
+
+def requeue_expired() -> list[str]:
+    """Remet en file les candidats « en cours » dont l'échéance est dépassée (consommateur tué)."""
+    raw = _script("requeue", _REQUEUE_LUA)(
+        keys=[_queued_key(), *_processing_keys()],
+        args=[_prefix(), f"{time.time():.3f}", PRIORITY_RETRY, NO_OPENING],
+    ) or []
+    names = [_decode(name) for name in raw]
+    if names:
+        frappe.logger().warning(f"[MATCHING_QUEUE] Runs perdus remis en file : {', '.join(names)}")
+    return names
+
+
+def _counts() -> tuple[int, int]:
+    """(en attente, en cours)."""
+    try:
+        queued, in_flight = _script("counts", _COUNTS_LUA)(keys=[_queued_key(), _processing_keys()[0]]) or (0, 0)
+        return int(queued or 0), int(in_flight or 0)
+    except Exception:
+        return 0, 0
+
+
+def queued_count() -> int:
+    return _counts()[0]
+
+
+# ---------- Consommateurs ----------
+
+def _rq_queue(settings) -> str:
+    return (getattr(settings, "matching_rq_queue", "") or DEFAULT_RQ_QUEUE).strip()
+
+
+def _enqueue_consumer(slot: int, queue: str):
+    frappe.enqueue(
+        "job_auto_match.job_auto_match.utils.matching_queue.process_matching_queue",
+        queue=queue,
+        timeout=CONSUMER_TIMEOUT,
+        job_id=CONSUMER_JOB_ID.format(slot=slot),
+        deduplicate=True,
+        user="Administrator",  # job système : toujours en Administrator, peu importe qui a soumis
+        slot=slot,
+    )
+
+
+def wake_consumers():
+    """Mode lot : un consommateur asyncio ; sinon N consommateurs unitaires (job_id stables)."""
+    from job_auto_match.job_auto_match.utils import matching_batch
+
+    settings = _settings()
+    if matching_batch.is_batch_enabled(settings):
+        matching_batch.enqueue_consumer()
+        return
+    consumers = max(1, int(getattr(settings, "matching_queue_consumers", 0) or DEFAULT_CONSUMERS))
+    queue = _rq_queue(settings)
+    for slot in range(min(consumers, max(queued_count(), 1))):
+        try:
+            _enqueue_consumer(slot, queue)
+        except Exception:
+            # File RQ dédiée non déclarée dans la configuration des workers : repli sur la file par défaut
+            frappe.logger().warning(f"[MATCHING_QUEUE] File RQ '{queue}' indisponible, repli sur '{DEFAULT_RQ_QUEUE}'")
+            _enqueue_consumer(slot, DEFAULT_RQ_QUEUE)
+
+
+def process_matching_queue(slot: int = 0):
+    """Job RQ : traite la file candidat par candidat jusqu'à épuisement ou fin du budget."""
+    from job_auto_match.job_auto_match.utils.matching import process_job_applicant_matching
+
+    started = time.monotonic()
+    while time.monotonic() - started < CONSUMER_BUDGET:
+        names = pop(1)
+        if not names:
+            return
+        try:
+            process_job_applicant_matching(names[0], timeout=RUN_TIMEOUT)
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), f"[MATCHING_QUEUE] Échec pour {names[0]}")
+        finally:
+            ack(names)
+    # Budget épuisé : le job se termine d'abord, drain_matching_queue (ou le prochain enqueue) le relance
+    frappe.logger().info(f"[MATCHING_QUEUE] Consommateur {slot} : budget atteint, {queued_count()} en attente")
+
+
+def _adopt_legacy_pending():
+    """Reprend les candidats restés dans l'ancienne file du mode lot (liste Redis simple)."""
+    cache = frappe.cache()
+    while (raw := cache.lpop(LEGACY_PENDING_KEY)) is not None:
+        name = _decode(raw)
+        push(name, PRIORITY_NEW, frappe.db.get_value("Job Applicant", name, "job_title"))
+
+
+def drain_matching_queue():
+    """Tâche planifiée : reprend les runs perdus, relance les consommateurs si des candidats attendent encore."""
+    from job_auto_match.job_auto_match.utils.applicant_lock import requeue_orphan_reruns
+
+    _adopt_legacy_pending()
+    requeue_expired()
+    requeue_orphan_reruns()
+    if queued_count():
+        wake_consumers()
+
+
+# ---------- Observabilité ----------
+
+def queue_stats() -> dict:
+    """Profondeur, âge du plus ancien (s) et nombre d'offres en attente, par priorité ; runs en cours."""
+    now = time.time()
+    stats = {
+        name: {"depth": 0, "oldest_age_s": None, "openings": 0}
+        for name in PRIORITY_NAMES.values()
+    }
+    openings = {name: set() for name in PRIORITY_NAMES.values()}
+    try:
+        raw = _script("hgetall", _HGETALL_LUA)(keys=[_queued_key()]) or []
+    except Exception:
+        raw = []
+    for i in range(1, len(raw), 2):
+        info = _parse_meta(_decode(raw[i]))
+        name = PRIORITY_NAMES.get(info["priority"], PRIORITY_NAMES[PRIORITY_BULK])
+        stats[name]["depth"] += 1
+        openings[name].add(info["job_opening"])
+        if info["enqueued_at"]:
+            age = round(now - info["enqueued_at"], 1)
+            stats[name]["oldest_age_s"] = max(stats[name]["oldest_age_s"] or 0, age)
+    for name, seen in openings.items():
+        stats[name]["openings"] = len(seen)
+    stats["in_flight"] = _counts()[1]
+    return stats
@@ -0,0 +1,134 @@
+"""
+Compteurs partagés (Redis) pour les statistiques du pipeline de matching.
+
+Les compteurs vivent dans le cache Redis du site : ils sont communs à tous les
+workers RQ et survivent au redémarrage d'un worker.
+"""
+
+import frappe
+
+_METRICS_PREFIX = "job_auto_match:metrics"
+
+
+def _counter_key(name: str) -> str:
+    return frappe.cache().make_key(f"{_METRICS_PREFIX}:{name}")
+
+
+def incr_counter(name: str, amount: int = 1) -> None:
+    """Incrémente un compteur sans jamais bloquer le pipeline."""
+    try:
+        frappe.cache().incrby(_counter_key(name), amount)
+    except Exception:
+        frappe.logger().warning(f"[METRICS] Compteur '{name}' non incrémenté")
+
+
+def incr_counters(amounts: dict) -> None:
+    """Incrémente plusieurs compteurs en un seul aller-retour Redis (pipeline)."""
+    amounts = {name: amount for name, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    try:
+        pipe = frappe.cache().pipeline()
+        for name, amount in amounts.items():
+            pipe.incrby(_counter_key(name), amount)
+        pipe.execute()
+    except Exception:
+        frappe.logger().warning(f"[METRICS] {len(amounts)} compteur(s) non incrémenté(s)")
+
+
+def get_counters(names) -> dict:
+    """Retourne {nom: valeur} pour les compteurs demandés (0 si absent)."""
+    out = {}
+    for name in names:
+        try:
+            raw = frappe.cache().get(_counter_key(name))
+            out[name] = int(raw or 0)
+        except Exception:
+            out[name] = 0
+    return out
+
+
+def reset_counters(names) -> None:
+    for name in names:
+        try:
+            frappe.cache().delete(_counter_key(name))
+        except Exception:
+            pass
+
+
+# ---------- Aller-retours base de données ----------
+
+COUNTER_MATCHING_RUNS = "matching:runs"
+COUNTER_MATCHING_DB_QUERIES = "matching:db_queries"
+COUNTER_MATCHING_DB_WRITES = "matching:db_writes"
+COUNTER_MATCHING_DB_COMMITS = "matching:db_commits"
+
+_WRITE_VERBS = ("insert", "update", "delete", "replace")
+
+
+class DBQueryCounter:
+    """
+    Compte les requêtes SQL émises via frappe.db.sql entre start() et stop().
+
+    Même principe que le shadowing de validate_workflow dans _save_and_reload :
+    un attribut d'instance sur l'objet Database remplace temporairement sql().
+    """
+
+    def __init__(self):
+        self.stats = {"queries": 0, "writes": 0, "commits": 0}
+        self._db = None
+
+    def start(self):
+        db = frappe.local.db
+        original = db.sql
+        stats = self.stats
+
+        def _counting_sql(query, *args, **kwargs):
+            verb = str(query).lstrip()[:7].lower()
+            stats["queries"] += 1
+            if verb.startswith(_WRITE_VERBS):
+                stats["writes"] += 1
+            elif verb.startswith("commit"):
+                stats["commits"] += 1
+            return original(query, *args, **kwargs)
+
+        db.sql = _counting_sql
+        self._db = db
+        return self
+
+    def stop(self) -> dict:
+        if self._db is not None:
+            try:
+                del self._db.sql
+            except AttributeError:
+                pass
+            self._db = None
+        return dict(self.stats)
+
+
+def record_db_stats(stats: dict, applicant_name: str | None = None, runs: int = 1) -> None:
+    """Cumule les compteurs DB d'un run de matching (moyenne par candidat via get_db_stats)."""
+    incr_counter(COUNTER_MATCHING_RUNS, runs)
+    incr_counter(COUNTER_MATCHING_DB_QUERIES, stats.get("queries", 0))
+    incr_counter(COUNTER_MATCHING_DB_WRITES, stats.get("writes", 0))
+    incr_counter(COUNTER_MATCHING_DB_COMMITS, stats.get("commits", 0))
+    frappe.logger().info(
+        f"[MATCHING] DB {applicant_name or ''} : {stats.get('queries', 0)} requêtes, "
+        f"{stats.get('writes', 0)} écritures, {stats.get('commits', 0)} commits"
+    )
+
+
+def get_db_stats() -> dict:
+    names = [COUNTER_MATCHING_RUNS, COUNTER_MATCHING_DB_QUERIES, COUNTER_MATCHING_DB_WRITES, COUNTER_MATCHING_DB_COMMITS]
+    c = get_counters(names)
+    runs = c[COUNTER_MATCHING_RUNS]
+
+    def _avg(name):
+        return round(c[name] / runs, 2) if runs else 0.0
+
+    return {
+        "runs": runs,
+        "queries_per_applicant": _avg(COUNTER_MATCHING_DB_QUERIES),
+        "writes_per_applicant": _avg(COUNTER_MATCHING_DB_WRITES),
+        "commits_per_applicant": _avg(COUNTER_MATCHING_DB_COMMITS),
+    }
@@ -0,0 +1,221 @@
+"""
+Registre de santé des modèles Gemini + disjoncteur (circuit breaker), partagé
+entre tous les jobs de matching via Redis.
+
+Par modèle : échecs consécutifs, latence moyenne (EWMA), état du circuit.
+- closed    : modèle utilisable.
+- open      : modèle écarté jusqu'à `open_until` (modèle introuvable ou sans
+              generateContent → longue durée ; surcharge/5xx répétés → délai
+              croissant).
+- half-open : délai écoulé ; un seul worker à la fois obtient un appel d'essai
+              (verrou Redis pris au moment de l'appel). Succès → closed,
+              échec → open avec délai doublé.
+
+L'état est un hash Redis mis à jour par scripts Lua : des workers concurrents
+ne perdent ni échecs ni transitions.
+
+call_gemini_with_retry démarre ainsi directement au premier modèle sain au lieu
+de redécouvrir à chaque candidat qu'un modèle est indisponible.
+"""
+
+import time
+
+import frappe
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+_PREFIX = "job_auto_match:gemini_health"
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 60
+MAX_COOLDOWN = 900
+UNSUPPORTED_COOLDOWN = 6 * 3600
+PROBE_LOCK_TTL = 60
+STATE_TTL = 24 * 3600
+_EWMA_ALPHA = 0.3
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+
+class ModelsUnavailableError(Exception):
+    """Tous les modèles candidats ont un circuit ouvert : échec immédiat."""
+
+
+# KEYS[1] = état ; ARGV = maintenant, non supporté, essai, seuil, délai de base, délai max,
+# délai "non supporté", raison, ttl → délai d'ouverture appliqué (0 si le circuit reste fermé)
+_FAILURE_LUA = """
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local cooldown = 0
+if ARGV[2] == '1' then
+    cooldown = tonumber(ARGV[7])
+elseif ARGV[3] == '1' or state == 'open' then
+    local current = tonumber(redis.call('HGET', KEYS[1], 'cooldown')) or tonumber(ARGV[5])
+    cooldown = math.min(current * 2, tonumber(ARGV[6]))
+elseif failures >= tonumber(ARGV[4]) then
+    cooldown = tonumber(ARGV[5])
+end
+redis.call('HSET', KEYS[1], 'last_error', ARGV[8], 'last_failure', ARGV[1])
+if cooldown > 0 then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'cooldown', cooldown, 'open_until', tonumber(ARGV[1]) + cooldown)
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[9]))
+return cooldown
+"""
+
+# KEYS[1] = état ; ARGV = latence (ms), alpha EWMA, délai de base, maintenant, ttl → 1 si le circuit était ouvert
+_SUCCESS_LUA = """
+local ms = tonumber(ARGV[1])
+local ewma = tonumber(redis.call('HGET', KEYS[1], 'latency_ms'))
+if ewma then
+    ms = tonumber(ARGV[2]) * ms + (1 - tonumber(ARGV[2])) * ewma
+end
+local reopened = redis.call('HDEL', KEYS[1], 'open_until')
+redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', 0, 'cooldown', ARGV[3],
+    'latency_ms', string.format('%.1f', ms), 'last_success', ARGV[4])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+return reopened
+"""
+
+_GET_LUA = "return redis.call('HGETALL', KEYS[1])"
+
+_NUMBERS = {"failures": int, "cooldown": int, "open_until": float, "latency_ms": float,
+            "last_failure": float, "last_success": float}
+
+_scripts = {}
+
+
+def _script(name: str, source: str):
+    if name not in _scripts:
+        _scripts[name] = frappe.cache().register_script(source)
+    return _scripts[name]
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class ModelHealthRegistry:
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD, cooldown: int = DEFAULT_COOLDOWN):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = max(1, cooldown)
+
+    # ---------- stockage ----------
+
+    def _key(self, model: str, suffix: str = "health") -> str:
+        key = frappe.cache().make_key(f"{_PREFIX}:{model}:{suffix}")
+        return key.decode() if isinstance(key, bytes) else key
+
+    def get(self, model: str) -> dict:
+        try:
+            raw = _script("get", _GET_LUA)(keys=[self._key(model)]) or []
+        except Exception:
+            return {}
+        state = {}
+        for i in range(0, len(raw) - 1, 2):
+            field, value = _decode(raw[i]), _decode(raw[i + 1])
+            try:
+                state[field] = _NUMBERS[field](float(value)) if field in _NUMBERS else value
+            except ValueError:
+                continue
+        return state
+
+    def release_probe(self, model: str):
+        try:
+            frappe.cache().delete(self._key(model, "probe"))
+        except Exception:
+            pass
+
+    # ---------- décision ----------
+
+    def plan(self, models: list[str]) -> list[tuple[str, bool]]:
+        """
+        Ordre d'essai [(modèle, essai_half_open)] dans l'ordre de préférence :
+        les circuits ouverts sont écartés ; un modèle dont le délai est écoulé
+        garde sa place pour un appel d'essai. Le verrou d'essai n'est pris
+        (take_probe) qu'au moment d'appeler ce modèle.
+        """
+        now = time.time()
+        plan = []
+        for model in models:
+            state = self.get(model)
+            if state.get("state", STATE_CLOSED) == STATE_CLOSED:
+                plan.append((model, False))
+            elif now >= float(state.get("open_until") or 0):
+                plan.append((model, True))
+        return plan
+
+    def take_probe(self, model: str) -> bool:
+        """Verrou de l'appel d'essai d'un modèle half-open (un seul worker à la fois)."""
+        try:
+            return bool(frappe.cache().set(self._key(model, "probe"), "1", nx=True, ex=PROBE_LOCK_TTL))
+        except Exception:
+            return True
+
+    def is_open(self, model: str) -> bool:
+        return self.get(model).get("state") == STATE_OPEN
+
+    # ---------- observations ----------
+
+    def record_success(self, model: str, latency: float):
+        try:
+            reopened = _script("success", _SUCCESS_LUA)(
+                keys=[self._key(model)],
+                args=[round(latency * 1000, 1), _EWMA_ALPHA, self.cooldown, time.time(), STATE_TTL],
+            )
+        except Exception:
+            reopened = 0
+        if int(reopened or 0):
+            frappe.logger().info(f"[GEMINI_HEALTH] {model} rétabli (circuit fermé)")
+        self.release_probe(model)
+
+    def record_failure(self, model: str, unsupported: bool = False, probe: bool = False, reason: str = ""):
+        try:
+            cooldown = _script("failure", _FAILURE_LUA)(
+                keys=[self._key(model)],
+                args=[
+                    time.time(), int(unsupported), int(probe), self.failure_threshold, self.cooldown,
+                    MAX_COOLDOWN, UNSUPPORTED_COOLDOWN, (reason or "")[:200], STATE_TTL,
+                ],
+            )
+        except Exception:
+            cooldown = 0
+        if int(cooldown or 0):
+            frappe.logger().warning(f"[GEMINI_HEALTH] Circuit ouvert pour {model} ({int(cooldown)}s) : {reason}")
+        if probe:
+            self.release_probe(model)
+
+    def snapshot(self, models: list[str]) -> dict:
+        now = time.time()
+        out = {}
+        for model in models:
+            state = self.get(model)
+            st = state.get("state", STATE_CLOSED)
+            if st == STATE_OPEN and now >= float(state.get("open_until") or 0):
+                st = STATE_HALF_OPEN
+            out[model] = {
+                "state": st,
+                "failures": state.get("failures", 0),
+                "latency_ms": state.get("latency_ms"),
+                "retry_in_s": max(0, round(float(state.get("open_until") or 0) - now)) if st == STATE_OPEN else 0,
+                "last_error": state.get("last_error", ""),
+            }
+        return out
+
+    def reset(self, models: list[str]):
+        for model in models:
+            try:
+                frappe.cache().delete(self._key(model), self._key(model, "probe"))
+            except Exception:
+                pass
+
+
+def get_health_registry() -> ModelHealthRegistry:
+    try:
+        settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+        threshold = int(getattr(settings, "gemini_circuit_failure_threshold", 0) or DEFAULT_FAILURE_THRESHOLD)
+        cooldown = int(getattr(settings, "gemini_circuit_cooldown", 0) or DEFAULT_COOLDOWN)
+    except Exception:
+        threshold, cooldown = DEFAULT_FAILURE_THRESHOLD, DEFAULT_COOLDOWN
+    return ModelHealthRegistry(threshold, cooldown)
@@ -0,0 +1,314 @@
+"""
+E-mails candidats : templates compilés en cache + envoi groupé.
+
+- Les sources Jinja des settings (sujet, en-tête, corps) sont compilées une
+  fois par process et par valeur de `modified` des settings : modifier les
+  settings invalide naturellement le cache, sans re-parsing à chaque e-mail.
+- queue_notification() dépose la notification dans une file Redis (après
+  commit) ; flush_notifications() les rend et les met en Email Queue par lots,
+  avec une mise à jour ensembliste des flags « e-mail envoyé » et un commit par
+  lot. Un rejet de masse (clôture d'offre) ne coûte plus un job par e-mail.
+- Livraison fiable : une entrée passe (LMOVE) dans une liste « en cours » et
+  n'en sort qu'après le commit de son lot ; un worker tué laisse ses entrées
+  en cours, remises en file au passage suivant. Une notification déjà en
+  attente pour le même candidat et le même type n'est pas déposée deux fois.
+- Sous frappe.flags.job_auto_match_benchmark, les notifications vont dans une
+  file à part, vidée par le benchmark lui-même sans envoi réel.
+"""
+
+import json
+
+import frappe
+from jinja2.exceptions import TemplateNotFound
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+QUEUE_KEY = "job_auto_match:notifications"
+BENCHMARK_QUEUE_KEY = "job_auto_match:notifications:benchmark"
+CONSUMER_JOB_ID = "job_auto_match:notifications_flush"
+PROCESSING_SUFFIX = ":processing"
+PENDING_SUFFIX = ":pending"
+BATCH_SIZE = 100
+
+NOTIF_NOT_MATCHING = "not_matching"
+NOTIF_REJECTED_AFTER_TEST = "rejected_after_test"
+
+FLAG_NOT_MATCH_EMAIL_SENT = "custom_not_match_email_sent"
+FLAG_REJECTED_AFTER_TEST_EMAIL_SENT = "custom_rejected_after_test_email_sent"
+FIELD_AI_LAST_ERROR = "custom_ai_last_error"
+
+TEMPLATE_NOT_MATCHING = "job_auto_match/templates/emails/candidate_not_matching.html"
+TEMPLATE_REJECTED = "job_auto_match/templates/emails/candidate_rejected.html"
+
+DEFAULT_REJECTED_HTML = """
+<div style="font-family: Inter, Arial, sans-serif; line-height:1.5; color:#111">
+  <h2 style="margin:0 0 8px">Résultat de votre évaluation</h2>
+  <p>Bonjour {{ applicant_name or "Candidat" }},</p>
+  <p>Suite à votre évaluation pour le poste <strong>{{ job_title or "—" }}</strong>,
+     nous ne pouvons malheureusement pas donner suite favorablement à votre candidature.</p>
+  {% if score is not none %}
+    <p><strong>Score global :</strong> {{ score }} %</p>
+  {% endif %}
+  <p>Nous vous remercions pour le temps consacré et conserverons votre profil pour des opportunités futures.</p>
+  <p>Bien cordialement,<br>Équipe Recrutement</p>
+</div>
+""".strip()
+
+_FLAGS = {
+    NOTIF_NOT_MATCHING: FLAG_NOT_MATCH_EMAIL_SENT,
+    NOTIF_REJECTED_AFTER_TEST: FLAG_REJECTED_AFTER_TEST_EMAIL_SENT,
+}
+
+# {(site, modified): {source: Template}} — une seule génération conservée par site
+_compiled_cache = {}
+
+
+# ---------- Templates compilés ----------
+
+def _compile(settings, source: str):
+    """Template Jinja compilé, mis en cache pour la version courante des settings."""
+    version = (frappe.local.site, str(getattr(settings, "modified", "") or ""))
+    templates = _compiled_cache.get(version)
+    if templates is None:
+        for key in [k for k in _compiled_cache if k[0] == version[0]]:
+            del _compiled_cache[key]
+        templates = _compiled_cache[version] = {}
+
+    template = templates.get(source)
+    if template is None:
+        # Même garde que frappe.render_template
+        if ".__" in source:
+            frappe.throw(frappe._("Illegal template"))
+        template = templates[source] = frappe.get_jenv().from_string(source)
+    return template
+
+
+def render_setting(settings, fieldname: str, ctx: dict, default: str | None = None) -> str | None:
+    """Rend le template stocké dans `fieldname` ; `default` si le champ est vide."""
+    source = getattr(settings, fieldname, "") or ""
+    if not source.strip():
+        return default
+    return _compile(settings, source).render(ctx)
+
+
+def render_not_matching(settings, ctx: dict) -> tuple[str, str, str]:
+    """(sujet, en-tête, corps) de l'e-mail « non retenu »."""
+    subject = render_setting(settings, "candidate_not_matching_subject", ctx) or frappe._(
+        "Votre candidature n'est pas retenue pour le moment"
+    )
+    header = render_setting(settings, "candidate_not_matching_email_header", ctx) or frappe._(
+        "Information sur votre candidature"
+    )
+    body = render_setting(settings, "candidate_not_matching_email_template", ctx)
+    if body is None:
+        body = frappe.get_template(TEMPLATE_NOT_MATCHING).render(ctx)
+    return subject, header, body
+
+
+def render_rejected_after_test(settings, ctx: dict) -> tuple[str, None, str]:
+    """(sujet, en-tête, corps) de l'e-mail de rejet après test Testlify."""
+    subject_tpl = getattr(settings, "candidate_rejected_after_test_subject", "") or "Résultat de votre évaluation"
+    try:
+        subject = render_setting(settings, "candidate_rejected_after_test_subject", ctx) or subject_tpl
+    except Exception:
+        subject = subject_tpl
+
+    body = render_setting(settings, "candidate_rejected_after_test_template", ctx)
+    if body is None:
+        try:
+            body = frappe.get_template(TEMPLATE_REJECTED).render(ctx)
+        except (TemplateNotFound, Exception):
+            body = _compile(settings, DEFAULT_REJECTED_HTML).render(ctx)
+    return subject, None, body
+
+
+_RENDERERS = {
+    NOTIF_NOT_MATCHING: render_not_matching,
+    NOTIF_REJECTED_AFTER_TEST: render_rejected_after_test,
+}
+
+
+# ---------- File d'envoi ----------
+
+# KEYS = file, membres en attente ; ARGV = membre (type|candidat), entrée → 1 si déposée, 0 si déjà en attente
+_PUSH_LUA = """
+if redis.call('SADD', KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('RPUSH', KEYS[1], ARGV[2])
+return 1
+"""
+
+# KEYS = en cours, membres en attente ; ARGV = membre, entrée
+_ACK_LUA = """
+redis.call('LREM', KEYS[1], 1, ARGV[2])
+redis.call('SREM', KEYS[2], ARGV[1])
+return 1
+"""
+
+_scripts = {}
+
+
+def _script(name: str, source: str):
+    if name not in _scripts:
+        _scripts[name] = frappe.cache().register_script(source)
+    return _scripts[name]
+
+
+def _key(name: str) -> str:
+    key = frappe.cache().make_key(name)
+    return key.decode() if isinstance(key, bytes) else key
+
+
+def _member(item: dict) -> str:
+    return f"{item.get('kind')}|{item.get('applicant')}"
+
+
+def queue_notification(kind: str, applicant_name: str, recipient: str, ctx: dict):
+    """
+    Dépose la notification après commit, pour ne pas devancer la sauvegarde du
+    candidat ; tout de suite si la transaction n'a aucune écriture en attente
+    (un rollback de fin de requête jetterait le callback).
+    """
+    item = {"kind": kind, "applicant": applicant_name, "recipient": recipient, "ctx": ctx}
+    raw = json.dumps(item, ensure_ascii=False, default=str)
+    # Benchmark : aucun job d'envoi, la file est vidée par le benchmark (send=False)
+    benchmark = bool(frappe.flags.get("job_auto_match_benchmark"))
+    queue_key = BENCHMARK_QUEUE_KEY if benchmark else QUEUE_KEY
+
+    def _push():
+        pushed = _script("push", _PUSH_LUA)(
+            keys=[_key(queue_key), _key(queue_key + PENDING_SUFFIX)], args=[_member(item), raw]
+        )
+        if not int(pushed or 0):
+            frappe.logger().info(f"[NOTIFY] {kind} déjà en attente pour {applicant_name} : ignorée")
+        elif not benchmark:
+            _enqueue_flush()
+
+    if frappe.db.transaction_writes:
+        frappe.db.after_commit.add(_push)
+    else:
+        _push()
+
+
+def _enqueue_flush():
+    # job_id stable : un seul job d'envoi en file/en cours à la fois
+    frappe.enqueue(
+        "job_auto_match.job_auto_match.utils.notifications.flush_notifications",
+        queue="short",
+        timeout=900,
+        job_id=CONSUMER_JOB_ID,
+        deduplicate=True,
+    )
+
+
+def _recover(queue_key: str) -> set:
+    """Remet en tête de file les entrées restées « en cours » (worker tué) ; retourne ces entrées."""
+    cache = frappe.cache()
+    processing, queue = _key(queue_key + PROCESSING_SUFFIX), _key(queue_key)
+    recovered = set()
+    while (raw := cache.lmove(processing, queue, "RIGHT", "LEFT")) is not None:
+        recovered.add(raw)
+    if recovered:
+        frappe.logger().warning(f"[NOTIFY] {len(recovered)} notification(s) en cours reprise(s)")
+    return recovered
+
+
+def _pop(limit: int, queue_key: str = QUEUE_KEY) -> list[tuple[bytes, dict]]:
+    """[(entrée brute, notification)] passées dans la liste « en cours » jusqu'à l'acquittement."""
+    cache = frappe.cache()
+    processing, queue = _key(queue_key + PROCESSING_SUFFIX), _key(queue_key)
+    items = []
+    while len(items) < limit:
+        raw = cache.lmove(queue, processing, "LEFT", "RIGHT")
+        if raw is None:
+            break
+        try:
+            items.append((raw, json.loads(raw)))
+        except ValueError:
+            frappe.logger().warning(f"[NOTIFY] Entrée illisible ignorée : {raw!r}")
+            _ack([(raw, {})], queue_key)
+    return items
+
+
+def _ack(items: list[tuple[bytes, dict]], queue_key: str = QUEUE_KEY):
+    """Retire les entrées du lot commité de la liste « en cours » et des membres en attente."""
+    ack = _script("ack", _ACK_LUA)
+    keys = [_key(queue_key + PROCESSING_SUFFIX), _key(queue_key + PENDING_SUFFIX)]
+    for raw, item in items:
+        ack(keys=keys, args=[_member(item), raw])
+
+
+def _already_sent(items: list[tuple[bytes, dict]]) -> set:
+    """(type, candidat) dont le flag « e-mail envoyé » est déjà posé."""
+    sent = set()
+    for kind, fieldname in _FLAGS.items():
+        names = list({item.get("applicant") for _, item in items if item.get("kind") == kind})
+        if names:
+            rows = frappe.get_all("Job Applicant", filters={"name": ["in", names], fieldname: 1}, pluck="name")
+            sent.update((kind, name) for name in rows)
+    return sent
+
+
+def drain_notifications():
+    """Tâche planifiée : relance l'envoi si des notifications attendent encore (ou sont restées en cours)."""
+    try:
+        cache = frappe.cache()
+        if int(cache.llen(QUEUE_KEY) or 0) or int(cache.llen(QUEUE_KEY + PROCESSING_SUFFIX) or 0):
+            _enqueue_flush()
+    except Exception:
+        pass
+
+
+def _update_flags(fieldname: str, names: list[str], value: int):
+    if not names:
+        return
+    JobApplicant = frappe.qb.DocType("Job Applicant")
+    frappe.qb.update(JobApplicant).set(JobApplicant[fieldname], value).where(JobApplicant.name.isin(names)).run()
+
+
+def flush_notifications(batch_size: int = BATCH_SIZE, queue_key: str = QUEUE_KEY, send: bool = True) -> int:
+    """
+    Rend et met en Email Queue les notifications en attente, lot par lot ;
+    retourne le nombre de notifications traitées. send=False : rendu et flags
+    seulement, sans Email Queue (benchmark).
+
+    Les entrées reprises d'un worker tué dont le flag est déjà posé ont été
+    commitées avant l'acquittement : acquittées sans nouvel envoi.
+    """
+    settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    recovered = _recover(queue_key)
+    processed = 0
+    while True:
+        items = _pop(batch_size, queue_key)
+        if not items:
+            return processed
+        processed += len(items)
+        delivered = _already_sent([i for i in items if i[0] in recovered]) if recovered else set()
+
+        sent = {kind: [] for kind in _FLAGS}
+        failed = {kind: [] for kind in _FLAGS}
+        for _raw, item in items:
+            kind = item.get("kind")
+            if kind not in _RENDERERS or (kind, item.get("applicant")) in delivered:
+                continue
+            try:
+                subject, header, body = _RENDERERS[kind](settings, item.get("ctx") or {})
+                kwargs = {"header": header} if header else {}
+                if send:
+                    frappe.sendmail(recipients=[item["recipient"]], subject=subject, message=body, **kwargs)
+                sent[kind].append(item["applicant"])
+            except Exception as e:
+                frappe.log_error(title=f"[NOTIFY] Envoi {kind} échoué ({item.get('applicant')})", message=frappe.get_traceback())
+                failed[kind].append((item.get("applicant"), str(e)))
+
+        for kind, fieldname in _FLAGS.items():
+            _update_flags(fieldname, sent[kind], 1)
+            _update_flags(fieldname, [name for name, _ in failed[kind]], 0)
+            for name, err in failed[kind]:
+                frappe.db.set_value("Job Applicant", name, FIELD_AI_LAST_ERROR, f"E-mail {kind}: {err}"[:1000], update_modified=False)
+        frappe.db.commit()
+        _ack(items, queue_key)
+        frappe.logger().info(
+            f"[NOTIFY] Lot de {len(items)} : "
+            + ", ".join(f"{kind}={len(names)}" for kind, names in sent.items())
+        )
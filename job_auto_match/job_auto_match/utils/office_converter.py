@@ -0,0 +1,273 @@
+"""
+Service de conversion Word (DOC/DOCX) → PDF via LibreOffice.
+
+- Pool borné : N "slots" partagés par tous les workers de la machine (verrous
+  fichiers). Chaque slot a son propre profil LibreOffice persistant, ce qui évite
+  le coût du premier démarrage et les collisions de profil entre conversions
+  parallèles. Une conversion attend qu'un slot se libère (file d'attente locale).
+- Si `unoserver` est installé, chaque slot garde un serveur LibreOffice chaud
+  (démarré à la demande, détaché du job) et convertit via `unoconvert` : plus de
+  démarrage d'office par CV. Sinon, repli sur `soffice --convert-to` avec le
+  profil chaud du slot.
+- Timeout par conversion (le groupe de processus soffice est tué) et nettoyage
+  systématique des répertoires temporaires.
+- Cache des PDF convertis par empreinte SHA-256 du fichier source (nettoyé par
+  la tâche planifiée cleanup_converted_pdf_cache).
+"""
+
+import fcntl
+import os
+import pathlib
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+import frappe
+
+from job_auto_match.job_auto_match.utils.extraction_cache import compute_file_hash
+from job_auto_match.job_auto_match.utils.metrics import incr_counter
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+
+DEFAULT_SLOTS = 2
+DEFAULT_TIMEOUT = 60
+DEFAULT_CACHE_DAYS = 30
+UNOSERVER_BASE_PORT = 2103  # slot i → port 2103 + 2i (uno-port = port + 1)
+_SLOT_WAIT_POLL = 0.2
+_SERVER_START_TIMEOUT = 20
+
+COUNTER_CACHE_HITS = "office_conversion:cache_hits"
+COUNTER_CONVERSIONS = "office_conversion:conversions"
+COUNTER_TIMEOUTS = "office_conversion:timeouts"
+
+
+# ---------- Configuration & chemins ----------
+
+def _settings_int(fieldname: str, default: int) -> int:
+    try:
+        settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+        return int(getattr(settings, fieldname, 0) or default)
+    except Exception:
+        return default
+
+
+def _dir(*parts) -> pathlib.Path:
+    p = pathlib.Path(frappe.get_site_path("private", *parts))
+    p.mkdir(parents=True, exist_ok=True)
+    return p
+
+
+def _pool_dir() -> pathlib.Path:
+    return _dir("lo_pool")
+
+
+def _cache_dir() -> pathlib.Path:
+    return _dir("converted_cv")
+
+
+def _soffice() -> str | None:
+    return shutil.which("soffice") or shutil.which("libreoffice")
+
+
+# ---------- Slots (concurrence bornée inter-process) ----------
+
+@contextmanager
+def _acquire_slot(slots: int, wait_timeout: float):
+    """Prend le premier slot libre parmi `slots` ; attend au plus wait_timeout secondes."""
+    pool = _pool_dir()
+    deadline = time.monotonic() + wait_timeout
+    while True:
+        for i in range(max(1, slots)):
+            fh = open(pool / f"slot_{i}.lock", "w")
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                fh.close()
+                continue
+            try:
+                yield i
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+                fh.close()
+            return
+        if time.monotonic() >= deadline:
+            raise TimeoutError("Aucun slot de conversion LibreOffice disponible")
+        time.sleep(_SLOT_WAIT_POLL)
+
+
+def _profile_uri(slot: int) -> str:
+    return (_pool_dir() / f"profile_{slot}").resolve().as_uri()
+
+
+# ---------- unoserver (serveur chaud par slot) ----------
+
+def _port_open(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+def _pid_file(slot: int) -> pathlib.Path:
+    return _pool_dir() / f"unoserver_{slot}.pid"
+
+
+def _stop_unoserver(slot: int):
+    pid_file = _pid_file(slot)
+    try:
+        pid = int(pid_file.read_text().strip())
+        os.killpg(pid, signal.SIGKILL)
+    except Exception:
+        pass
+    pid_file.unlink(missing_ok=True)
+
+
+def _ensure_unoserver(slot: int) -> int | None:
+    """Démarre (si besoin) le serveur du slot et retourne son port, ou None."""
+    server = shutil.which("unoserver")
+    if not server or not shutil.which("unoconvert"):
+        return None
+    port = UNOSERVER_BASE_PORT + 2 * slot
+    if _port_open(port):
+        return port
+
+    _stop_unoserver(slot)
+    proc = subprocess.Popen(
+        [
+            server,
+            "--interface", "127.0.0.1",
+            "--port", str(port),
+            "--uno-port", str(port + 1),
+            "--user-installation", _profile_uri(slot),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,  # survit à la fin du job RQ : le serveur reste chaud
+    )
+    _pid_file(slot).write_text(str(proc.pid))
+
+    deadline = time.monotonic() + _SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            return None
+        if _port_open(port):
+            return port
+        time.sleep(0.25)
+    _stop_unoserver(slot)
+    return None
+
+
+# ---------- Exécution avec timeout ----------
+
+def _run(cmd: list, timeout: int) -> bool:
+    """Lance cmd dans son propre groupe de processus ; le tue entièrement au timeout."""
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+    try:
+        proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except Exception:
+            proc.kill()
+        proc.communicate()
+        incr_counter(COUNTER_TIMEOUTS)
+        frappe.logger().warning(f"[LO2PDF] Timeout ({timeout}s) : {cmd[0]}")
+        return False
+    return proc.returncode == 0
+
+
+def _convert_in_slot(slot: int, input_path: str, timeout: int) -> bytes | None:
+    with tempfile.TemporaryDirectory(prefix="lo2pdf_") as outdir:
+        out_pdf = pathlib.Path(outdir) / f"{pathlib.Path(input_path).stem}.pdf"
+
+        port = _ensure_unoserver(slot)
+        if port:
+            cmd = [shutil.which("unoconvert"), "--host", "127.0.0.1", "--port", str(port),
+                   "--convert-to", "pdf", input_path, str(out_pdf)]
+            if _run(cmd, timeout) and out_pdf.exists():
+                return out_pdf.read_bytes()
+            _stop_unoserver(slot)  # serveur suspect : redémarré au prochain appel
+
+        soffice = _soffice()
+        if not soffice:
+            return None
+        cmd = [soffice, f"-env:UserInstallation={_profile_uri(slot)}", "--headless", "--norestore",
+               "--convert-to", "pdf", "--outdir", outdir, input_path]
+        if not _run(cmd, timeout):
+            return None
+        if not out_pdf.exists():
+            pdfs = list(pathlib.Path(outdir).glob("*.pdf"))
+            if not pdfs:
+                return None
+            out_pdf = max(pdfs, key=lambda p: p.stat().st_mtime)
+        return out_pdf.read_bytes()
+
+
+# ---------- API ----------
+
+def convert_to_pdf_bytes(input_path: str, file_hash: str | None = None) -> bytes | None:
+    """
+    Convertit un DOC/DOCX en PDF. Retourne les octets du PDF ou None si la
+    conversion est impossible (LibreOffice absent, timeout, échec).
+    """
+    if not _soffice() and not shutil.which("unoserver"):
+        return None
+
+    try:
+        file_hash = file_hash or compute_file_hash(input_path)
+        cached = _cache_dir() / f"{file_hash}.pdf"
+        if cached.exists():
+            incr_counter(COUNTER_CACHE_HITS)
+            os.utime(cached)  # "dernier accès" pour le nettoyage
+            return cached.read_bytes()
+    except Exception:
+        cached = None
+
+    timeout = _settings_int("office_conversion_timeout", DEFAULT_TIMEOUT)
+    slots = _settings_int("office_conversion_slots", DEFAULT_SLOTS)
+    started = time.monotonic()
+    try:
+        with _acquire_slot(slots, wait_timeout=timeout) as slot:
+            pdf_bytes = _convert_in_slot(slot, input_path, timeout)
+    except Exception as e:
+        frappe.logger().warning(f"[LO2PDF] Conversion impossible pour {input_path}: {e}")
+        return None
+
+    incr_counter(COUNTER_CONVERSIONS)
+    frappe.logger().info(f"[LO2PDF] {pathlib.Path(input_path).name} converti en {time.monotonic() - started:.2f}s")
+
+    if pdf_bytes and cached is not None:
+        try:
+            # Nom temporaire unique : deux workers qui convertissent le même fichier ne s'écrasent pas
+            fd, tmp = tempfile.mkstemp(dir=cached.parent, prefix=f"{cached.stem}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(pdf_bytes)
+                os.replace(tmp, cached)  # écriture atomique
+            except Exception:
+                os.unlink(tmp)
+                raise
+        except Exception:
+            pass
+    return pdf_bytes
+
+
+def cleanup_converted_pdf_cache():
+    """Tâche planifiée : purge des PDF convertis non utilisés depuis N jours."""
+    days = _settings_int("converted_pdf_cache_days", DEFAULT_CACHE_DAYS)
+    limit = time.time() - days * 86400
+    removed = 0
+    for path in _cache_dir().glob("*"):
+        try:
+            if path.stat().st_mtime < limit:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    if removed:
+        frappe.logger().info(f"[LO2PDF] {removed} PDF converti(s) purgé(s) du cache")
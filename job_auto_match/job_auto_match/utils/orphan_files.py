@@ -0,0 +1,106 @@
+"""
+Liaison des fichiers CV orphelins (File.attached_to_doctype vide) à leur Job
+Applicant, par UPDATE ensembliste (jointure sur resume_attachment = file_url).
+
+- Pagination keyset sur Job Applicant.name : chaque lot est un seul UPDATE borné
+  (name > curseur AND name <= dernier du lot), commité aussitôt.
+- Curseur persisté dans Redis : une exécution interrompue reprend là où elle
+  s'était arrêtée ; il est effacé une fois le parcours terminé.
+- Utilisé par le patch link_orphan_resume_files, la commande
+  `bench --site <site> job-auto-match-link-orphans` et la tâche quotidienne.
+"""
+
+import time
+
+import frappe
+
+CURSOR_KEY = "job_auto_match:orphan_link_cursor"
+DEFAULT_CHUNK_SIZE = 1000
+
+_UPDATE_MARIADB = """
+    update `tabFile` f
+    join `tabJob Applicant` ja on ja.resume_attachment = f.file_url
+    set f.attached_to_doctype = 'Job Applicant',
+        f.attached_to_name = ja.name,
+        f.attached_to_field = 'resume_attachment'
+    where ja.name > %(after)s and ja.name <= %(upto)s
+        and ifnull(f.attached_to_doctype, '') = ''
+"""
+
+_UPDATE_POSTGRES = """
+    update "tabFile" f
+    set attached_to_doctype = 'Job Applicant',
+        attached_to_name = ja.name,
+        attached_to_field = 'resume_attachment'
+    from "tabJob Applicant" ja
+    where ja.resume_attachment = f.file_url
+        and ja.name > %(after)s and ja.name <= %(upto)s
+        and coalesce(f.attached_to_doctype, '') = ''
+"""
+
+
+def _get_cursor() -> str:
+    try:
+        return frappe.cache().get_value(CURSOR_KEY, expires=True) or ""
+    except Exception:
+        return ""
+
+
+def _set_cursor(value: str | None):
+    try:
+        if value:
+            frappe.cache().set_value(CURSOR_KEY, value, expires_in_sec=7 * 24 * 3600)
+        else:
+            frappe.cache().delete_value(CURSOR_KEY)
+    except Exception:
+        pass
+
+
+def _next_chunk(after: str, chunk_size: int) -> list[str]:
+    return frappe.db.sql_list(
+        """
+        select name from `tabJob Applicant`
+        where name > %s and ifnull(resume_attachment, '') != ''
+        order by name
+        limit %s
+        """,
+        (after, chunk_size),
+    )
+
+
+def link_orphan_resume_files(chunk_size: int = DEFAULT_CHUNK_SIZE, restart: bool = False, verbose: bool = False) -> int:
+    """Lie les CV orphelins lot par lot ; retourne le nombre de fichiers liés."""
+    update_sql = _UPDATE_POSTGRES if frappe.db.db_type == "postgres" else _UPDATE_MARIADB
+    after = "" if restart else _get_cursor()
+    if after and verbose:
+        print(f"Reprise après {after}")
+
+    fixed = chunks = 0
+    started = time.monotonic()
+    while True:
+        names = _next_chunk(after, chunk_size)
+        if not names:
+            break
+        frappe.db.sql(update_sql, {"after": after, "upto": names[-1]})
+        fixed += max(getattr(getattr(frappe.db, "_cursor", None), "rowcount", 0) or 0, 0)
+        frappe.db.commit()
+
+        after = names[-1]
+        _set_cursor(after)
+        chunks += 1
+        if verbose:
+            print(f"Lot {chunks} : {len(names)} candidat(s) jusqu'à {after} — {fixed} fichier(s) lié(s)")
+        if len(names) < chunk_size:
+            break
+
+    _set_cursor(None)
+    frappe.logger().info(
+        f"[link_orphan_resume_files] {fixed} fichier(s) lié(s) en {chunks} lot(s), "
+        f"{time.monotonic() - started:.1f}s"
+    )
+    return fixed
+
+
+def scheduled_link_orphan_resume_files():
+    """Tâche quotidienne : CV uploadés via le web form restés orphelins."""
+    link_orphan_resume_files()
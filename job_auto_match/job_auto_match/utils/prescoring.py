@@ -0,0 +1,362 @@
+"""
+Pré-scoring local (déterministe) CV ↔ fiche de poste.
+
+Même barème que le prompt de scoring Gemini : compétences 40, outils 25,
+niveau d'études 15, expérience 20, avec redistribution proportionnelle des
+poids quand un critère n'est pas renseigné sur la fiche.
+
+Le calcul est vectorisé (NumPy) : les compétences/outils sont normalisés puis
+projetés sur le vocabulaire de la fiche, ce qui permet de scorer N candidats
+contre une offre en une seule opération matricielle (score_candidates).
+
+Utilisé comme "gate" avant prompt2 : un candidat nettement sous le seuil de
+rejet ou nettement au-dessus du seuil de qualification est routé sans appel
+LLM ; seule la zone ambiguë part chez Gemini.
+"""
+
+import re
+import unicodedata
+
+import frappe
+import numpy as np
+
+WEIGHTS = {"skills": 40.0, "outils": 25.0, "study_level": 15.0, "experience": 20.0}
+
+# Crédit accordé quand tous les mots d'un terme requis apparaissent chez le
+# candidat sans correspondance exacte du terme (ex: "gestion projet agile").
+PARTIAL_CREDIT = 0.5
+
+DEFAULT_REJECT_BELOW = 20
+DEFAULT_ACCEPT_ABOVE = 90
+
+_STOPWORDS = {"de", "des", "du", "d", "la", "le", "les", "l", "et", "en", "a", "au", "aux", "of", "and", "the"}
+
+_SYNONYMS = {
+    "js": "javascript",
+    "ts": "typescript",
+    "node": "node.js",
+    "nodejs": "node.js",
+    "react": "react.js",
+    "reactjs": "react.js",
+    "express": "express.js",
+    "expressjs": "express.js",
+    "vue": "vue.js",
+    "vuejs": "vue.js",
+    "c sharp": "c#",
+    "csharp": "c#",
+    "ms office": "microsoft office",
+    "office 365": "microsoft office",
+    "postgres": "postgresql",
+    "project management": "gestion de projet",
+}
+
+_STUDY_WORDS = {
+    "doctorat": 8, "phd": 8,
+    "master": 5, "msc": 5, "mba": 5, "ingenieur": 5,
+    "licence": 3, "bachelor": 3,
+    "bts": 2, "dut": 2, "deug": 2,
+}
+
+
+# ---------- Normalisation ----------
+
+def _strip_accents(s: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+
+
+def _singular(word: str) -> str:
+    if len(word) > 3 and word.isalpha() and word.endswith("s") and not word.endswith(("ss", "is", "us")):
+        return word[:-1]
+    return word
+
+
+def normalize_term(term) -> str:
+    """Minuscules, sans accents, pluriels simples retirés, synonymes canonisés."""
+    s = _strip_accents(str(term or "")).lower().strip()
+    s = re.sub(r"[^\w+#.\s-]", " ", s)
+    s = re.sub(r"[\s_-]+", " ", s).strip(" .")
+    if not s:
+        return ""
+    if s in _SYNONYMS:
+        return _SYNONYMS[s]
+    s = " ".join(_singular(w) for w in s.split())
+    return _SYNONYMS.get(s, s)
+
+
+def _tokens(term: str) -> set[str]:
+    return {w for w in term.split() if w not in _STOPWORDS}
+
+
+def _normalize_terms(terms) -> list[str]:
+    out = []
+    for t in terms or []:
+        n = normalize_term(t)
+        if n and n not in out:
+            out.append(n)
+    return out
+
+
+def parse_study_level(value) -> int | None:
+    """'BAC+5' → 5 ; 'Master' → 5 ; None si non déductible."""
+    s = _strip_accents(str(value or "")).lower()
+    if not s.strip():
+        return None
+    m = re.search(r"bac\s*\+\s*(\d+)", s)
+    if m:
+        return int(m.group(1))
+    for word, level in _STUDY_WORDS.items():
+        if word in s:
+            return level
+    if "bac" in s:
+        return 0
+    return None
+
+
+def parse_years(value) -> float | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, int | float):
+        return float(value)
+    m = re.search(r"\d+(?:[.,]\d+)?", str(value))
+    return float(m.group(0).replace(",", ".")) if m else None
+
+
+# ---------- Profils ----------
+
+def build_job_profile(fiche) -> dict:
+    """Profil normalisé d'une Job Opening (tables custom_skills / custom_outils)."""
+    min_exp = parse_years(getattr(fiche, "custom_minimum_experience", None))
+    return {
+        "name": getattr(fiche, "name", None),
+        "skills": _normalize_terms(getattr(r, "skill", "") for r in (getattr(fiche, "custom_skills", None) or [])),
+        "outils": _normalize_terms(getattr(r, "outil", "") for r in (getattr(fiche, "custom_outils", None) or [])),
+        "minimum_experience": min_exp if min_exp else None,
+        "study_level": parse_study_level(getattr(fiche, "custom_study_level", None)),
+    }
+
+
+def build_candidate_profile(info: dict) -> dict:
+    """Profil normalisé depuis candidate_info (JSON d'extraction Gemini)."""
+    info = info if isinstance(info, dict) else {}
+    return {
+        "skills": _normalize_terms(info.get("competences")),
+        "outils": _normalize_terms(info.get("outils")),
+        "experience": parse_years(info.get("annee_experience")),
+        "study_level": parse_study_level(info.get("niveau_etude")),
+    }
+
+
+def effective_weights(job: dict) -> dict:
+    """Poids redistribués proportionnellement sur les critères présents (somme = 1)."""
+    present = {
+        "skills": bool(job.get("skills")),
+        "outils": bool(job.get("outils")),
+        "study_level": job.get("study_level") is not None,
+        "experience": bool(job.get("minimum_experience")),
+    }
+    total = sum(w for k, w in WEIGHTS.items() if present[k])
+    if not total:
+        return {k: 0.0 for k in WEIGHTS}
+    return {k: (w / total if present[k] else 0.0) for k, w in WEIGHTS.items()}
+
+
+# ---------- Calcul vectorisé ----------
+
+def _coverage_matrix(required: list[str], candidates_terms: list[list[str]]) -> np.ndarray:
+    """
+    Matrice (n_candidats x n_termes_requis) du crédit obtenu par terme :
+    1 si correspondance exacte, PARTIAL_CREDIT si tous les mots du terme sont
+    présents dans le vocabulaire du candidat, 0 sinon.
+    """
+    n, m = len(candidates_terms), len(required)
+    if not m or not n:
+        return np.zeros((n, m), dtype=np.float32)
+
+    term_index = {t: j for j, t in enumerate(required)}
+    req_tokens = [_tokens(t) for t in required]
+    vocab = sorted(set().union(*req_tokens)) if req_tokens else []
+    tok_index = {w: k for k, w in enumerate(vocab)}
+
+    exact = np.zeros((n, m), dtype=np.float32)
+    cand_tok = np.zeros((n, len(vocab)), dtype=np.float32)
+    for i, terms in enumerate(candidates_terms):
+        for t in terms:
+            j = term_index.get(t)
+            if j is not None:
+                exact[i, j] = 1.0
+            for w in _tokens(t):
+                k = tok_index.get(w)
+                if k is not None:
+                    cand_tok[i, k] = 1.0
+
+    req_tok = np.zeros((m, len(vocab)), dtype=np.float32)
+    for j, toks in enumerate(req_tokens):
+        for w in toks:
+            req_tok[j, tok_index[w]] = 1.0
+    req_len = np.maximum(req_tok.sum(axis=1), 1.0)
+
+    # part des mots du terme j présents chez le candidat i
+    overlap = (cand_tok @ req_tok.T) / req_len
+    partial = np.where(overlap >= 1.0, PARTIAL_CREDIT, 0.0).astype(np.float32)
+    return np.maximum(exact, partial)
+
+
+def score_candidates(job: dict, candidates: list[dict]) -> list[dict]:
+    """
+    Score N profils candidats contre une fiche en une passe matricielle.
+    Retourne, pour chaque candidat, {"score": int 0..100, "details": {...}}.
+    """
+    n = len(candidates)
+    if not n:
+        return []
+    weights = effective_weights(job)
+
+    skills_cov = _coverage_matrix(job["skills"], [c["skills"] for c in candidates])
+    outils_cov = _coverage_matrix(job["outils"], [c["outils"] for c in candidates])
+    skills_ratio = skills_cov.mean(axis=1) if job["skills"] else np.zeros(n)
+    outils_ratio = outils_cov.mean(axis=1) if job["outils"] else np.zeros(n)
+
+    exp = np.array([c["experience"] if c["experience"] is not None else 0.0 for c in candidates], dtype=np.float32)
+    if job.get("minimum_experience"):
+        exp_ratio = np.clip(exp / float(job["minimum_experience"]), 0.0, 1.0)
+    else:
+        exp_ratio = np.zeros(n)
+
+    lvl = np.array([c["study_level"] if c["study_level"] is not None else -1 for c in candidates], dtype=np.float32)
+    if job.get("study_level") is not None:
+        required = max(float(job["study_level"]), 1.0)
+        # sous le niveau requis : pénalité quadratique (forte si écart net)
+        study_ratio = np.where(lvl < 0, 0.0, np.clip(lvl / required, 0.0, 1.0) ** 2)
+    else:
+        study_ratio = np.zeros(n)
+
+    w = np.array([weights["skills"], weights["outils"], weights["experience"], weights["study_level"]], dtype=np.float32)
+    ratios = np.vstack([skills_ratio, outils_ratio, exp_ratio, study_ratio]).astype(np.float32)  # (4, n)
+    scores = np.rint(100.0 * (w @ ratios)).astype(int)
+
+    results = []
+    for i in range(n):
+        results.append({
+            "score": int(scores[i]),
+            "details": {
+                "skills_matched": int((skills_cov[i] >= 1.0).sum()) if job["skills"] else None,
+                "skills_required": len(job["skills"]),
+                "outils_matched": int((outils_cov[i] >= 1.0).sum()) if job["outils"] else None,
+                "outils_required": len(job["outils"]),
+                "experience": candidates[i]["experience"],
+                "study_level": candidates[i]["study_level"],
+                "weights": weights,
+            },
+        })
+    return results
+
+
+def score_candidate(job: dict, candidate: dict) -> dict:
+    return score_candidates(job, [candidate])[0]
+
+
+# ---------- Gate avant prompt2 ----------
+
+def _local_justification(result: dict, job: dict) -> str:
+    d = result["details"]
+    parts = []
+    if job["skills"]:
+        parts.append(f"compétences requises couvertes : {d['skills_matched']}/{d['skills_required']}")
+    if job["outils"]:
+        parts.append(f"outils requis couverts : {d['outils_matched']}/{d['outils_required']}")
+    if job.get("minimum_experience"):
+        exp = f"{d['experience']:g} an(s)" if d["experience"] is not None else "inconnue"
+        parts.append(f"expérience {exp} pour {job['minimum_experience']:g} an(s) requis")
+    if job.get("study_level") is not None:
+        lvl = f"BAC+{d['study_level']}" if d["study_level"] is not None else "inconnu"
+        parts.append(f"niveau d'études {lvl} pour BAC+{job['study_level']} requis")
+    return "Score calculé localement (pré-scoring) — " + ("; ".join(parts) or "aucun critère renseigné") + "."
+
+
+def _threshold(settings, fieldname: str, default: int) -> int:
+    """Seuil configuré ; 0 est une valeur valide (0 = jamais de rejet local), seul un champ vide prend le défaut."""
+    value = getattr(settings, fieldname, None)
+    return default if value is None or value == "" else int(value)
+
+
+def prescore_for_matching(settings, fiche, info: dict, rejected_score, qualification_score_threshold) -> dict | None:
+    """
+    Retourne {"score", "justification", "source": "local"} si le candidat peut
+    être routé sans LLM, sinon None (zone ambiguë → Gemini).
+
+    Les seuils locaux ne peuvent pas être plus permissifs que les seuils
+    métier : rejet seulement si score local < min(seuil local, rejected_max_score),
+    qualification seulement si score local ≥ max(seuil local, seuil qualification).
+    """
+    if not int(getattr(settings, "prescoring_enabled", 0) or 0):
+        return None
+
+    job = build_job_profile(fiche)
+    if not any(effective_weights(job).values()):
+        return None
+
+    reject_below = min(_threshold(settings, "prescoring_reject_below", DEFAULT_REJECT_BELOW), int(rejected_score))
+    accept_above = max(_threshold(settings, "prescoring_accept_above", DEFAULT_ACCEPT_ABOVE), int(qualification_score_threshold))
+
+    result = score_candidate(job, build_candidate_profile(info))
+    score = result["score"]
+    frappe.logger().info(
+        f"[PRESCORING] {getattr(fiche, 'name', '')} score local={score} (rejet<{reject_below}, qualif≥{accept_above})"
+    )
+    if score < reject_below or score >= accept_above:
+        return {"score": score, "justification": _local_justification(result, job), "source": "local"}
+    return None
+
+
+# ---------- Batch : tous les candidats d'une offre ----------
+
+def score_job_opening_applicants(job_opening: str) -> list[dict]:
+    """
+    Pré-score tous les Job Applicant d'une offre à partir des données déjà
+    extraites (tables custom_skills / custom_outils), en une passe matricielle.
+    3 requêtes SQL au total, quel que soit le nombre de candidats.
+    """
+    fiche = frappe.get_doc("Job Opening", job_opening)
+    job = build_job_profile(fiche)
+
+    applicants = frappe.get_all(
+        "Job Applicant",
+        filters={"job_title": job_opening},
+        fields=["name", "applicant_name", "custom_minimum_experience", "custom_study_level"],
+        limit_page_length=0,
+    )
+    if not applicants:
+        return []
+    names = [a.name for a in applicants]
+
+    skills, outils = {}, {}
+    for row in frappe.get_all(
+        "Skill Applicant",
+        filters={"parenttype": "Job Applicant", "parent": ["in", names]},
+        fields=["parent", "skill_name"],
+        limit_page_length=0,
+    ):
+        skills.setdefault(row.parent, []).append(row.skill_name)
+    for row in frappe.get_all(
+        "Outil Applicant",
+        filters={"parenttype": "Job Applicant", "parent": ["in", names]},
+        fields=["parent", "outil_name"],
+        limit_page_length=0,
+    ):
+        outils.setdefault(row.parent, []).append(row.outil_name)
+
+    profiles = [
+        build_candidate_profile({
+            "competences": skills.get(a.name, []),
+            "outils": outils.get(a.name, []),
+            "annee_experience": a.custom_minimum_experience,
+            "niveau_etude": a.custom_study_level,
+        })
+        for a in applicants
+    ]
+    results = score_candidates(job, profiles)
+    out = [
+        {"applicant": a.name, "applicant_name": a.applicant_name, "score": r["score"], "details": r["details"]}
+        for a, r in zip(applicants, results, strict=True)
+    ]
+    return sorted(out, key=lambda x: x["score"], reverse=True)
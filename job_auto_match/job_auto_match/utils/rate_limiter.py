@@ -0,0 +1,248 @@
+"""
+Limiteur de débit Gemini partagé par tous les workers RQ (Redis).
+
+Deux seaux à jetons par modèle — requêtes/minute (RPM) et tokens/minute (TPM) —
+mis à jour atomiquement par un script Lua, avec l'horloge Redis comme
+référence commune. Un appelant attend qu'il y ait de la capacité au lieu de
+consommer ses retries sur des 429.
+
+Le débit s'adapte aux 429 observés (AIMD) : chaque 429 divise le débit effectif
+du modèle par deux, chaque succès le fait remonter progressivement vers la
+limite configurée.
+
+Le coût en tokens d'un appel est estimé avant l'envoi puis régularisé avec
+usage_metadata une fois la réponse reçue.
+"""
+
+import asyncio
+import json
+import random
+import time
+
+import frappe
+
+from job_auto_match.job_auto_match.utils.metrics import incr_counter
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+_PREFIX = "job_auto_match:gemini_rl"
+
+# Limites par défaut (niveau payant 1) ; surchargeables dans les settings (JSON).
+DEFAULT_LIMITS = {
+    "gemini-2.5-pro": {"rpm": 150, "tpm": 2_000_000},
+    "gemini-2.5-flash": {"rpm": 1000, "tpm": 1_000_000},
+    "gemini-2.5-flash-lite": {"rpm": 4000, "tpm": 4_000_000},
+}
+FALLBACK_LIMITS = {"rpm": 60, "tpm": 1_000_000}
+
+DEFAULT_MAX_WAIT = 120
+MIN_FACTOR = 0.05
+PENALTY = 0.5
+RECOVERY_STEP = 0.05
+FACTOR_TTL = 600
+
+# Estimation grossière : ~4 caractères par token, ~258 tokens par page PDF (~60 Ko/page).
+_CHARS_PER_TOKEN = 4
+_PDF_BYTES_PER_TOKEN = 230
+
+COUNTER_WAITS = "gemini_rate_limit:waits"
+COUNTER_WAIT_MS = "gemini_rate_limit:wait_ms"
+COUNTER_PENALTIES = "gemini_rate_limit:penalties"
+
+_TAKE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local factor = tonumber(redis.call('GET', KEYS[3]) or '1')
+local rpm = tonumber(ARGV[1]) * factor
+local tpm = tonumber(ARGV[2]) * factor
+local cost = tonumber(ARGV[3])
+
+local function level(key, cap)
+    local b = redis.call('HMGET', key, 'level', 'ts')
+    local lvl = tonumber(b[1]) or cap
+    local ts = tonumber(b[2]) or now
+    return math.min(cap, lvl + (now - ts) * cap / 60.0)
+end
+
+local r = level(KEYS[1], rpm)
+local k = 0
+if tpm > 0 then k = level(KEYS[2], tpm) end
+
+local wait = 0
+if r < 1 then wait = (1 - r) * 60.0 / rpm end
+if tpm > 0 then
+    -- une requête plus grosse que le seau passe quand il est plein
+    local need = math.min(cost, tpm)
+    if k < need then wait = math.max(wait, (need - k) * 60.0 / tpm) end
+end
+
+if wait <= 0 then
+    r = r - 1
+    k = k - cost
+end
+redis.call('HSET', KEYS[1], 'level', r, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 300)
+if tpm > 0 then
+    redis.call('HSET', KEYS[2], 'level', k, 'ts', now)
+    redis.call('EXPIRE', KEYS[2], 300)
+end
+return tostring(wait)
+"""
+
+
+# KEYS[1] = seau de tokens ; ARGV[1] = écart (estimé - réel). Seau expiré : rien à régulariser
+_SETTLE_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HINCRBYFLOAT', KEYS[1], 'level', ARGV[1])
+end
+return false
+"""
+
+_scripts = {}
+
+
+def _script(name: str, source: str):
+    if name not in _scripts:
+        _scripts[name] = frappe.cache().register_script(source)
+    return _scripts[name]
+
+
+class RateLimitTimeout(Exception):
+    """Capacité indisponible pour ce modèle dans le délai d'attente autorisé."""
+
+
+def estimate_tokens(parts) -> int:
+    total = 0
+    for part in parts or []:
+        if isinstance(part, str):
+            total += len(part) // _CHARS_PER_TOKEN
+            continue
+        inline = getattr(part, "inline_data", None)
+        if inline is not None and getattr(inline, "data", None):
+            total += len(inline.data) // _PDF_BYTES_PER_TOKEN
+            continue
+        text = getattr(part, "text", None)
+        if text:
+            total += len(text) // _CHARS_PER_TOKEN
+            continue
+        total += 2000  # fichier référencé par URI : taille inconnue, forfait prudent
+    return max(total, 1)
+
+
+def usage_total_tokens(response) -> int | None:
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None) if usage is not None else None
+    return int(total) if total else None
+
+
+class GeminiRateLimiter:
+    def __init__(self, limits: dict, max_wait: float = DEFAULT_MAX_WAIT):
+        self.limits = limits
+        self.max_wait = max_wait
+
+    def _keys(self, model: str) -> list[str]:
+        cache = frappe.cache()
+        return [cache.make_key(f"{_PREFIX}:{model}:{suffix}") for suffix in ("req", "tok", "factor")]
+
+    def _limits_for(self, model: str) -> dict:
+        return self.limits.get(model) or FALLBACK_LIMITS
+
+    def _take(self, model: str, tokens: int) -> float | None:
+        """Tente de prendre la capacité : 0 = accordé, >0 = attente conseillée, None = Redis indisponible."""
+        limits = self._limits_for(model)
+        try:
+            take = _script("take", _TAKE_LUA)
+            return float(take(keys=self._keys(model), args=[limits["rpm"], limits.get("tpm") or 0, tokens]))
+        except Exception as e:
+            # Redis indisponible : on ne bloque pas le pipeline
+            frappe.logger().warning(f"[GEMINI_RL] Limiteur indisponible ({e}), appel non régulé")
+            return None
+
+    def _next_sleep(self, model: str, wait: float | None, waited: float) -> float:
+        """Durée du prochain sleep (0 = on peut appeler) ; RateLimitTimeout au-delà de max_wait."""
+        if wait is None or wait <= 0:
+            if wait is not None and waited:
+                incr_counter(COUNTER_WAITS)
+                incr_counter(COUNTER_WAIT_MS, int(waited * 1000))
+            return 0
+        if waited + wait > self.max_wait:
+            raise RateLimitTimeout(f"Quota {model} saturé (attente > {self.max_wait:.0f}s)")
+        return wait + random.uniform(0, 0.05)
+
+    def acquire(self, model: str, tokens: int):
+        """Bloque jusqu'à obtenir 1 requête + `tokens` tokens pour `model`."""
+        waited = 0.0
+        while True:
+            sleep = self._next_sleep(model, self._take(model, tokens), waited)
+            if not sleep:
+                return
+            time.sleep(sleep)
+            waited += sleep
+
+    async def acquire_async(self, model: str, tokens: int):
+        """Variante asyncio de acquire() : l'attente ne bloque pas la boucle d'événements."""
+        waited = 0.0
+        while True:
+            sleep = self._next_sleep(model, self._take(model, tokens), waited)
+            if not sleep:
+                return
+            await asyncio.sleep(sleep)
+            waited += sleep
+
+    def settle(self, model: str, estimated: int, actual: int | None):
+        """Régularise le seau de tokens avec la consommation réelle."""
+        if not actual or actual == estimated:
+            return
+        try:
+            # Clé déjà préfixée : passer par un script, pas par les helpers du wrapper (qui la re-préfixent)
+            _script("settle", _SETTLE_LUA)(keys=[self._keys(model)[1]], args=[estimated - actual])
+        except Exception as e:
+            frappe.logger().warning(f"[GEMINI_RL] Régularisation impossible pour {model} ({e})")
+
+    def _factor(self, model: str) -> float:
+        try:
+            return float(frappe.cache().get(self._keys(model)[2]) or 1.0)
+        except Exception:
+            return 1.0
+
+    def penalize(self, model: str):
+        """429 observé : débit effectif divisé par deux (plancher MIN_FACTOR)."""
+        factor = max(MIN_FACTOR, self._factor(model) * PENALTY)
+        try:
+            frappe.cache().set(self._keys(model)[2], factor, ex=FACTOR_TTL)
+        except Exception:
+            pass
+        incr_counter(COUNTER_PENALTIES)
+        frappe.logger().warning(f"[GEMINI_RL] 429 sur {model} → débit effectif x{factor:.2f}")
+
+    def record_success(self, model: str):
+        factor = self._factor(model)
+        if factor >= 1.0:
+            return
+        try:
+            frappe.cache().set(self._keys(model)[2], min(1.0, factor + RECOVERY_STEP), ex=FACTOR_TTL)
+        except Exception:
+            pass
+
+
+def get_rate_limiter() -> GeminiRateLimiter | None:
+    """Limiteur configuré, ou None si désactivé dans les settings."""
+    try:
+        settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    except Exception:
+        return None
+    if not int(getattr(settings, "gemini_rate_limit_enabled", 0) or 0):
+        return None
+
+    limits = {model: dict(v) for model, v in DEFAULT_LIMITS.items()}
+    raw = (getattr(settings, "gemini_rate_limits", "") or "").strip()
+    if raw:
+        try:
+            for model, v in json.loads(raw).items():
+                limits.setdefault(model, dict(FALLBACK_LIMITS)).update(
+                    {k: int(v[k]) for k in ("rpm", "tpm") if k in v}
+                )
+        except Exception:
+            frappe.logger().warning("[GEMINI_RL] JSON des limites invalide, valeurs par défaut utilisées")
+
+    max_wait = int(getattr(settings, "gemini_rate_limit_max_wait", 0) or DEFAULT_MAX_WAIT)
+    return GeminiRateLimiter(limits, max_wait=max_wait)
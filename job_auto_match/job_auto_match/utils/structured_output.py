@@ -0,0 +1,408 @@
+"""
+Sorties JSON structurées de Gemini : schémas, parseur tolérant et validation.
+
+- Chaque appel du pipeline déclare le format attendu (GeminiRequest.output).
+  call_gemini_with_retry demande alors à Gemini une réponse
+  `application/json` contrainte par le schéma correspondant
+  (response_schema).
+- parse_output() ne fait pas confiance au texte reçu :
+  - il retire les balises ``` et ignore le texte autour ;
+  - il répare un JSON tronqué (chaîne ouverte, virgule pendante, accolades
+    manquantes) par un parcours incrémental du texte ; une réponse réparée
+    n'est acceptée que si tous les champs `required` du schéma sont présents
+    (une extraction tronquée n'est ni mise en cache ni enregistrée) ;
+  - il normalise les types : entiers pour age, annee_experience et score,
+    listes de chaînes, énumérations.
+- Une réponse inexploitable lève StructuredOutputError. Le pipeline ne rejoue
+  alors que l'appel concerné, jamais tout le run.
+"""
+
+import json
+import re
+
+OUTPUT_CV_CHECK = "cv_check"
+OUTPUT_EXTRACTION = "extraction"
+OUTPUT_COMBINED = "combined"
+OUTPUT_SCORING = "scoring"
+OUTPUT_PROFILE_SCORING = "profile_scoring"
+OUTPUT_BATCH_SCORING = "batch_scoring"
+# Scores comparables d'un appel à l'autre (unitaire, par lot, multi-offres) : décodage déterministe
+SCORING_OUTPUTS = (OUTPUT_SCORING, OUTPUT_PROFILE_SCORING, OUTPUT_BATCH_SCORING)
+
+MIME_JSON = "application/json"
+DIPLOMA_LEVELS = ("Graduate", "Under Graduate", "Post Graduate")
+# Nombre maximal de coupures essayées pour réparer un JSON tronqué
+MAX_REPAIR_CUTS = 50
+
+
+class StructuredOutputError(ValueError):
+    """Réponse Gemini non exploitable (JSON irréparable ou champs obligatoires absents)."""
+
+
+class GeminiRequest(list):
+    """Parts d'un appel Gemini + format de sortie attendu (clé de SCHEMAS)."""
+
+    def __init__(self, parts, output: str | None = None):
+        super().__init__(parts)
+        self.output = output
+
+
+# ---------- Schémas (format Schema de l'API Gemini) ----------
+
+def _string():
+    return {"type": "STRING"}
+
+
+def _integer():
+    return {"type": "INTEGER", "nullable": True}
+
+
+def _strings():
+    return {"type": "ARRAY", "items": {"type": "STRING"}}
+
+
+_CANDIDATE_INFO = {
+    "type": "OBJECT",
+    "properties": {
+        "first_name": _string(),
+        "last_name": _string(),
+        "title": _string(),
+        "age": _integer(),
+        "email": _string(),
+        "phone": _strings(),
+        "location": _string(),
+        "competences": _strings(),
+        "outils": _strings(),
+        "experience_professionnelle": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"annee": _string(), "titre": _string(), "description": _string()},
+                "required": ["annee", "titre", "description"],
+            },
+        },
+        "diplomes": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "annee": _string(),
+                    "diplome": _string(),
+                    "institution": _string(),
+                    "level": {"type": "STRING", "enum": list(DIPLOMA_LEVELS)},
+                },
+                "required": ["annee", "diplome", "institution", "level"],
+            },
+        },
+        "annee_experience": _integer(),
+        "niveau_etude": _string(),
+    },
+    "required": [
+        "first_name", "last_name", "title", "age", "email", "phone", "location", "competences", "outils",
+        "experience_professionnelle", "diplomes", "annee_experience", "niveau_etude",
+    ],
+}
+
+
+def _scores(id_field: str):
+    """Liste de scores identifiés par `id_field` (plusieurs évaluations dans une réponse)."""
+    return {
+        "type": "OBJECT",
+        "properties": {
+            "results": {
+                "type": "ARRAY",
+                "items": {
+                    "type": "OBJECT",
+                    "properties": {id_field: _string(), "score": {"type": "INTEGER"}, "justification": _string()},
+                    "required": [id_field, "score", "justification"],
+                },
+            },
+        },
+        "required": ["results"],
+    }
+
+
+SCHEMAS = {
+    OUTPUT_CV_CHECK: {
+        "type": "OBJECT",
+        "properties": {"is_cv": {"type": "BOOLEAN"}, "reason": _string()},
+        "required": ["is_cv", "reason"],
+    },
+    OUTPUT_EXTRACTION: {
+        "type": "OBJECT",
+        "properties": {"candidate_info": _CANDIDATE_INFO},
+        "required": ["candidate_info"],
+    },
+    OUTPUT_COMBINED: {
+        "type": "OBJECT",
+        "properties": {
+            "is_cv": {"type": "BOOLEAN"},
+            "reason": _string(),
+            "candidate_info": {**_CANDIDATE_INFO, "nullable": True},
+        },
+        "required": ["is_cv", "reason", "candidate_info"],
+    },
+    OUTPUT_SCORING: {
+        "type": "OBJECT",
+        "properties": {"score": {"type": "INTEGER"}, "justification": _string()},
+        "required": ["score", "justification"],
+    },
+    OUTPUT_PROFILE_SCORING: _scores("job_opening"),
+    OUTPUT_BATCH_SCORING: _scores("candidate_id"),
+}
+
+
+def output_config(parts) -> dict:
+    """Champs de GenerateContentConfig pour le format attendu par `parts` (vide si libre)."""
+    output = getattr(parts, "output", None)
+    schema = SCHEMAS.get(output)
+    if schema is None:
+        return {}
+    fields = {"response_mime_type": MIME_JSON, "response_schema": schema}
+    if output in SCORING_OUTPUTS:
+        fields["temperature"] = 0.0
+    return fields
+
+
+# ---------- Parseur tolérant ----------
+
+_FENCE = re.compile(r"```(?:json|JSON)?")
+
+
+def _scan(text: str):
+    """Parcours incrémental : (fermetures attendues, chaîne ouverte, échappement en cours, virgules hors chaînes)."""
+    closers, commas = [], []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            closers.append("}" if ch == "{" else "]")
+        elif ch in "}]" and closers:
+            closers.pop()
+        elif ch == ",":
+            commas.append(i)
+    return closers, in_string, escaped, commas
+
+
+def _close(text: str) -> str:
+    """Complète un JSON tronqué : ferme la chaîne et les conteneurs ouverts."""
+    closers, in_string, escaped, _ = _scan(text)
+    if in_string:
+        text = (text[:-1] if escaped else text) + '"'
+    text = text.rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    elif text.endswith(":"):
+        text += " null"
+    return text + "".join(reversed(closers))
+
+
+def missing_required(value, schema: dict, path: str = "") -> list[str]:
+    """Chemins des champs `required` de `schema` absents de `value` (ou null sans `nullable`)."""
+    kind = schema.get("type")
+    if kind == "OBJECT" and isinstance(value, dict):
+        missing = []
+        for key in schema.get("required", []):
+            sub = schema.get("properties", {}).get(key, {})
+            where = f"{path}.{key}" if path else key
+            if key not in value or (value[key] is None and not sub.get("nullable")):
+                missing.append(where)
+            elif value[key] is not None:
+                missing.extend(missing_required(value[key], sub, where))
+        return missing
+    if kind == "ARRAY" and isinstance(value, list):
+        items = schema.get("items", {})
+        return [m for i, item in enumerate(value) for m in missing_required(item, items, f"{path}[{i}]")]
+    return []
+
+
+def repair_json(text: str, schema: dict | None = None):
+    """
+    Objet JSON contenu dans `text`, réparé si besoin ; StructuredOutputError sinon.
+    Balises markdown et texte parasite autour sont ignorés. Avec `schema`, un
+    JSON réparé (donc tronqué) doit encore porter tous ses champs obligatoires.
+    """
+    body = _FENCE.sub("", text or "").strip()
+    start = min((i for i in (body.find("{"), body.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        raise StructuredOutputError("aucun objet JSON dans la réponse")
+    body = body[start:]
+    try:
+        return json.JSONDecoder().raw_decode(body)[0]
+    except ValueError:
+        pass
+
+    # Tronqué ou mal terminé : on ferme tel quel, puis on recule de virgule en virgule
+    _, _, _, commas = _scan(body)
+    for candidate in [body, *(body[:i] for i in reversed(commas[-MAX_REPAIR_CUTS:]))]:
+        try:
+            repaired = json.loads(_close(candidate))
+        except ValueError:
+            continue
+        missing = missing_required(repaired, schema) if schema else []
+        if missing:
+            raise StructuredOutputError(f"JSON tronqué, champs obligatoires absents : {', '.join(missing[:5])}")
+        return repaired
+    raise StructuredOutputError("JSON irréparable")
+
+
+# ---------- Normalisation ----------
+
+_NUMBER = re.compile(r"-?\d+(?:[.,]\d+)?")
+
+
+def _to_int(value):
+    """Entier ou None : 12, 12.7, "12", "3 ans", "12,5" ; booléens et textes sans nombre → None."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int | float):
+        return int(round(value))
+    match = _NUMBER.search(str(value))
+    return int(round(float(match.group().replace(",", ".")))) if match else None
+
+
+def _to_bool(value, default=True) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int | float):
+        return bool(value)
+    text = str(value or "").strip().lower()
+    if text in ("true", "oui", "yes", "vrai", "1"):
+        return True
+    if text in ("false", "non", "no", "faux", "0"):
+        return False
+    return default
+
+
+def _to_str(value) -> str:
+    if value is None:
+        return ""
+    return value.strip() if isinstance(value, str) else str(value)
+
+
+def _to_strings(value) -> list[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = re.split(r"[,;\n]", value)
+    if not isinstance(value, list | tuple):
+        value = [value]
+    return [s for s in (_to_str(v) for v in value) if s]
+
+
+def _to_year(value) -> str:
+    match = re.search(r"(19|20)\d{2}", _to_str(value))
+    return match.group() if match else _to_str(value)
+
+
+def _entries(value) -> list[dict]:
+    return [v for v in (value or []) if isinstance(v, dict)] if isinstance(value, list) else []
+
+
+def coerce_candidate_info(info) -> dict:
+    if not isinstance(info, dict):
+        raise StructuredOutputError("candidate_info absent ou invalide")
+    age = _to_int(info.get("age"))
+    return {
+        "first_name": _to_str(info.get("first_name")),
+        "last_name": _to_str(info.get("last_name")),
+        "title": _to_str(info.get("title")),
+        "age": age if age is None or 14 <= age <= 99 else None,
+        "email": _to_str(info.get("email")),
+        "phone": _to_strings(info.get("phone")),
+        "location": _to_str(info.get("location")),
+        "competences": _to_strings(info.get("competences")),
+        "outils": _to_strings(info.get("outils")),
+        "experience_professionnelle": [
+            {
+                "annee": _to_year(e.get("annee")),
+                "titre": _to_str(e.get("titre")),
+                "description": _to_str(e.get("description")),
+            }
+            for e in _entries(info.get("experience_professionnelle"))
+        ],
+        "diplomes": [
+            {
+                "annee": _to_year(d.get("annee")),
+                "diplome": _to_str(d.get("diplome")),
+                "institution": _to_str(d.get("institution")),
+                "level": level if (level := _to_str(d.get("level"))) in DIPLOMA_LEVELS else "",
+            }
+            for d in _entries(info.get("diplomes"))
+        ],
+        "annee_experience": _to_int(info.get("annee_experience")),
+        "niveau_etude": _to_str(info.get("niveau_etude")),
+    }
+
+
+def _coerce_cv_check(payload: dict) -> dict:
+    return {"is_cv": _to_bool(payload.get("is_cv")), "reason": _to_str(payload.get("reason"))}
+
+
+def _coerce_extraction(payload: dict) -> dict:
+    return {"candidate_info": coerce_candidate_info(payload.get("candidate_info", payload))}
+
+
+def _coerce_combined(payload: dict) -> dict:
+    result = _coerce_cv_check(payload)
+    info = payload.get("candidate_info")
+    result["candidate_info"] = coerce_candidate_info(info) if result["is_cv"] and isinstance(info, dict) else None
+    return result
+
+
+def _coerce_scoring(payload: dict) -> dict:
+    score = _to_int(payload.get("score"))
+    if score is None:
+        raise StructuredOutputError("score absent ou non numérique")
+    return {"score": max(0, min(100, score)), "justification": _to_str(payload.get("justification"))}
+
+
+def _coerce_scores(payload: dict, id_field: str) -> dict:
+    """
+    {"results": {id: {"score", "justification"}}} ; les entrées sans id ou sans
+    score sont ignorées (l'appelant compare aux ids attendus).
+    """
+    results = {}
+    for entry in _entries(payload.get("results")):
+        key = _to_str(entry.get(id_field))
+        try:
+            scored = _coerce_scoring(entry)
+        except StructuredOutputError:
+            continue
+        if key:
+            results[key] = scored
+    return {"results": results}
+
+
+_COERCERS = {
+    OUTPUT_CV_CHECK: _coerce_cv_check,
+    OUTPUT_EXTRACTION: _coerce_extraction,
+    OUTPUT_COMBINED: _coerce_combined,
+    OUTPUT_SCORING: _coerce_scoring,
+    OUTPUT_PROFILE_SCORING: lambda payload: _coerce_scores(payload, "job_opening"),
+    OUTPUT_BATCH_SCORING: lambda payload: _coerce_scores(payload, "candidate_id"),
+}
+
+
+def parse_output(response, output: str, label: str) -> dict:
+    """Réponse Gemini → dict validé pour le format `output` ; StructuredOutputError sinon."""
+    parsed = getattr(response, "parsed", None)
+    if not isinstance(parsed, dict):
+        try:
+            parsed = repair_json(getattr(response, "text", None) or "", SCHEMAS.get(output))
+        except StructuredOutputError as e:
+            raise StructuredOutputError(f"Réponse Gemini ({label}) non parseable: {e}")
+    if not isinstance(parsed, dict):
+        raise StructuredOutputError(f"Réponse Gemini ({label}) inattendue: objet JSON attendu")
+    try:
+        return _COERCERS[output](parsed)
+    except StructuredOutputError as e:
+        raise StructuredOutputError(f"Réponse Gemini ({label}) invalide: {e}")
@@ -0,0 +1,219 @@
+"""
+Talent pool : profils candidats réutilisables entre candidatures.
+
+Une même personne postule souvent à plusieurs offres avec le même CV. Chaque
+Job Applicant repassait par la classification et l'extraction Gemini. Le
+cache d'extraction Redis (TTL, éviction LRU) ne couvrait qu'une partie des cas.
+
+- Candidate Profile : un document par (e-mail normalisé, empreinte du CV),
+  au nom déterministe. Il conserve le candidate_info extrait, d'où le pipeline
+  tire les tables enfants (custom_skills, custom_outils, custom_experiences,
+  custom_diplomes) et les champs du Job Applicant.
+- Une candidature dont le profil existe pour la même version des prompts
+  d'extraction va directement au scoring. Une autre version est ré-extraite
+  et le profil est mis à jour.
+- score_profile() évalue un profil contre plusieurs offres en une passe. Le
+  pré-scoring local tranche les cas nets, puis les offres restantes partent à
+  Gemini par paquets dans un même prompt (une évaluation par offre). Aucun
+  Job Applicant n'est créé. Au plus MAX_OPENINGS offres par demande.
+- Rétention : un profil inutilisé depuis RETENTION_DAYS jours est purgé, et
+  les profils d'une personne disparaissent avec sa dernière candidature.
+"""
+
+import hashlib
+import json
+
+import frappe
+from frappe.query_builder.functions import IfNull
+from frappe.utils import add_days, now_datetime
+
+from job_auto_match.job_auto_match.utils.structured_output import (
+    OUTPUT_PROFILE_SCORING,
+    GeminiRequest,
+    StructuredOutputError,
+    coerce_candidate_info,
+    parse_output,
+)
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+PROFILE_DOCTYPE = "Candidate Profile"
+
+MAX_OPENINGS_PER_CALL = 8  # au-delà, le prompt grossit et la qualité des justifications baisse
+FORMAT_RETRIES = 1  # nouvel appel pour les offres absentes ou illisibles de la réponse
+MAX_OPENINGS = 3 * MAX_OPENINGS_PER_CALL  # requête synchrone : au plus 3 appels Gemini
+RETENTION_DAYS = 365
+
+
+def normalize_email(email: str | None) -> str:
+    """Minuscules, sans espaces. La sous-adresse (+tag) est gardée : elle peut désigner une autre boîte."""
+    return (email or "").strip().lower()
+
+
+def profile_name(email: str | None, cv_hash: str | None) -> str:
+    digest = hashlib.sha1(f"{normalize_email(email)}|{cv_hash or ''}".encode()).hexdigest()
+    return f"CP-{digest[:16]}"
+
+
+def is_enabled(settings=None) -> bool:
+    try:
+        return bool(int(getattr(settings or frappe.get_cached_doc(_SETTINGS_DOCTYPE), "talent_pool_enabled", 1) or 0))
+    except Exception:
+        return False
+
+
+# ---------- Lecture / écriture ----------
+
+def get_profile(email: str | None, cv_hash: str | None, version: str) -> dict | None:
+    """candidate_json ({"candidate_info": ...}) du profil s'il existe pour cette version d'extraction."""
+    if not normalize_email(email) or not cv_hash:
+        return None
+    row = frappe.db.get_value(
+        PROFILE_DOCTYPE, profile_name(email, cv_hash), ["extraction_version", "candidate_info"], as_dict=True
+    )
+    if not row or row.extraction_version != version:
+        return None
+    try:
+        info = json.loads(row.candidate_info or "")
+    except ValueError:
+        return None
+    return {"candidate_info": info} if isinstance(info, dict) else None
+
+
+def mark_reused(email: str | None, cv_hash: str | None, applicant_name: str):
+    """Candidature servie par le profil : compteur et dernière candidature (sans toucher `modified`)."""
+    Profile = frappe.qb.DocType(PROFILE_DOCTYPE)
+    (
+        frappe.qb.update(Profile)
+        .set(Profile.reuse_count, IfNull(Profile.reuse_count, 0) + 1)
+        .set(Profile.last_applicant, applicant_name)
+        .set(Profile.last_used_on, now_datetime())
+        .where(Profile.name == profile_name(email, cv_hash))
+    ).run()
+
+
+def save_profile(email: str | None, cv_hash: str | None, version: str, candidate_json: dict,
+                 applicant_name: str | None = None, strategy: str | None = None):
+    """Crée ou remplace le profil (nouvelle extraction). Ignoré sans e-mail ou empreinte."""
+    email = normalize_email(email)
+    info = candidate_json.get("candidate_info") if isinstance(candidate_json, dict) else None
+    if not email or not cv_hash or not isinstance(info, dict):
+        return
+    values = {
+        "full_name": " ".join(p for p in (info.get("first_name"), info.get("last_name")) if p)[:140],
+        "title": (info.get("title") or "")[:140],
+        "extraction_version": version,
+        "strategy": strategy,
+        "candidate_info": json.dumps(info, ensure_ascii=False),
+        "last_applicant": applicant_name,
+        "last_used_on": now_datetime(),
+    }
+    name = profile_name(email, cv_hash)
+    if frappe.db.exists(PROFILE_DOCTYPE, name):
+        frappe.db.set_value(PROFILE_DOCTYPE, name, values)
+        return
+    try:
+        frappe.get_doc({"doctype": PROFILE_DOCTYPE, "email": email, "cv_hash": cv_hash, **values}).insert(
+            ignore_permissions=True
+        )
+    except frappe.DuplicateEntryError:
+        # Créé entre-temps par un autre worker (même CV envoyé à deux offres)
+        frappe.db.set_value(PROFILE_DOCTYPE, name, values)
+
+
+# ---------- Rétention ----------
+
+def on_applicant_trash(doc, method=None):
+    """
+    Suppression d'un Job Applicant : les profils de la personne partent avec sa
+    dernière candidature ; sinon, le lien last_applicant vers celle-ci est retiré.
+    """
+    email = normalize_email(getattr(doc, "email_id", ""))
+    Profile = frappe.qb.DocType(PROFILE_DOCTYPE)
+    others = email and frappe.db.exists("Job Applicant", {"email_id": email, "name": ["!=", doc.name]})
+    if email and not others:
+        frappe.qb.from_(Profile).delete().where(Profile.email == email).run()
+        return
+    frappe.qb.update(Profile).set(Profile.last_applicant, None).where(Profile.last_applicant == doc.name).run()
+
+
+def purge_candidate_profiles():
+    """Tâche planifiée : supprime les profils ni extraits ni réutilisés depuis RETENTION_DAYS jours."""
+    Profile = frappe.qb.DocType(PROFILE_DOCTYPE)
+    (
+        frappe.qb.from_(Profile)
+        .delete()
+        .where(IfNull(Profile.last_used_on, Profile.modified) < add_days(now_datetime(), -RETENTION_DAYS))
+    ).run()
+    frappe.db.commit()
+
+
+# ---------- Scoring multi-offres ----------
+
+def _opening_part(fiches) -> str:
+    from job_auto_match.job_auto_match.utils.matching import job_json
+
+    openings = [{"job_opening": fiche.name, **job_json(fiche)} for fiche in fiches]
+    return f"""
+            Fiches de poste à évaluer :
+            {json.dumps(openings, ensure_ascii=False)}
+            """
+
+
+def _score_chunk(client, fiches, candidate_part: str) -> dict:
+    """{offre: résultat} pour un paquet d'offres ; les offres sans réponse valide sont redemandées une fois."""
+    from job_auto_match.job_auto_match.utils.context_cache import KEY_PROFILE_SCORING, static_context
+    from job_auto_match.job_auto_match.utils.matching import PROFILE_SCORING_PROMPT, call_gemini_with_retry
+
+    context = static_context(PROFILE_SCORING_PROMPT, KEY_PROFILE_SCORING)
+    results, pending = {}, list(fiches)
+    for attempt in range(FORMAT_RETRIES + 1):
+        request = GeminiRequest([context, _opening_part(pending), candidate_part], OUTPUT_PROFILE_SCORING)
+        try:
+            scored = parse_output(call_gemini_with_retry(client, request), OUTPUT_PROFILE_SCORING, "score profil")["results"]
+        except StructuredOutputError as e:
+            frappe.logger().warning(f"[TALENT_POOL] {e} (essai {attempt + 1})")
+            scored = {}
+        for fiche in pending:
+            if fiche.name in scored:
+                results[fiche.name] = {**scored[fiche.name], "source": "gemini"}
+        pending = [fiche for fiche in pending if fiche.name not in results]
+        if not pending:
+            break
+    for fiche in pending:
+        results[fiche.name] = {"score": None, "justification": "", "error": "absente de la réponse Gemini"}
+    return results
+
+
+def score_profile(profile: str, job_openings: list[str]) -> list[dict]:
+    """
+    Scores du profil pour chaque offre, du meilleur au moins bon :
+    [{"job_opening", "score", "justification", "source"}].
+    """
+    from job_auto_match.job_auto_match.utils.matching import get_gemini_client, scoring_candidate_part
+    from job_auto_match.job_auto_match.utils.prescoring import prescore_for_matching
+
+    settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    doc = frappe.get_doc(PROFILE_DOCTYPE, profile)
+    info = coerce_candidate_info(json.loads(doc.candidate_info or "{}"))
+    rejected = settings.rejected_max_score or 40
+    threshold = settings.qualification_score_threshold or 70
+
+    results, to_gemini = {}, []
+    for name in dict.fromkeys(job_openings):
+        fiche = frappe.get_doc("Job Opening", name)
+        local = prescore_for_matching(settings, fiche, info, rejected, threshold)
+        if local is not None:
+            results[name] = local
+        else:
+            to_gemini.append(fiche)
+
+    if to_gemini:
+        client = get_gemini_client(settings)
+        # Même présentation du profil que le scoring unitaire
+        candidate_part = scoring_candidate_part({"candidate_info": info})
+        for i in range(0, len(to_gemini), MAX_OPENINGS_PER_CALL):
+            results.update(_score_chunk(client, to_gemini[i:i + MAX_OPENINGS_PER_CALL], candidate_part))
+
+    ranked = [{"job_opening": name, **result} for name, result in results.items()]
+    ranked.sort(key=lambda r: -1 if r.get("score") is None else r["score"], reverse=True)
+    return ranked
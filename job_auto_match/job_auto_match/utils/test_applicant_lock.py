@@ -0,0 +1,78 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from job_auto_match.job_auto_match.utils import applicant_lock
+
+APPLICANT = "HR-APP-LEASE-TEST"
+
+
+class TestApplicantLock(FrappeTestCase):
+    def setUp(self):
+        frappe.cache().delete_keys(applicant_lock._PREFIX)
+
+    def tearDown(self):
+        with applicant_lock._held_lock:
+            applicant_lock._held.clear()
+        frappe.cache().delete_keys(applicant_lock._PREFIX)
+
+    def _lease_key(self):
+        return applicant_lock._keys(APPLICANT)[0]
+
+    def test_single_flight_and_rerun(self):
+        token = applicant_lock.acquire(APPLICANT)
+        self.assertTrue(token)
+        self.assertIsNone(applicant_lock.acquire(APPLICANT))
+        self.assertIsNone(applicant_lock.acquire(APPLICANT))
+        # deux demandes pendant le run : une seule relance
+        self.assertTrue(applicant_lock.release(APPLICANT, token))
+
+        token = applicant_lock.acquire(APPLICANT)
+        self.assertTrue(token)
+        self.assertFalse(applicant_lock.release(APPLICANT, token))
+
+    def test_release_with_foreign_token(self):
+        token = applicant_lock.acquire(APPLICANT)
+        applicant_lock.release(APPLICANT, "autre-jeton")
+        self.assertEqual(frappe.cache().get(self._lease_key()).decode(), token)
+
+    def test_still_held(self):
+        self.assertTrue(applicant_lock.still_held(APPLICANT))  # hors bail
+        token = applicant_lock.acquire(APPLICANT)
+        self.assertTrue(applicant_lock.still_held(APPLICANT))
+
+        # bail expiré sans repreneur : repris sur place
+        frappe.cache().delete(self._lease_key())
+        self.assertTrue(applicant_lock.still_held(APPLICANT))
+        self.assertEqual(frappe.cache().get(self._lease_key()).decode(), token)
+
+        # repris par un autre run
+        frappe.cache().set(self._lease_key(), "autre-run")
+        self.assertFalse(applicant_lock.still_held(APPLICANT))
+        applicant_lock.release(APPLICANT, token)
+        self.assertEqual(frappe.cache().get(self._lease_key()).decode(), "autre-run")
+
+    def test_applicant_lease_reruns_once(self):
+        with patch.object(applicant_lock, "_rerun") as rerun:
+            with applicant_lock.applicant_lease(APPLICANT) as acquired:
+                self.assertTrue(acquired)
+                with applicant_lock.applicant_lease(APPLICANT) as concurrent:
+                    self.assertFalse(concurrent)
+            rerun.assert_called_once_with(APPLICANT)
+        self.assertIsNone(frappe.cache().get(self._lease_key()))
+
+    def test_requeue_orphan_reruns(self):
+        applicant_lock.acquire(APPLICANT)
+        applicant_lock.acquire(APPLICANT)  # relance notée
+        with patch.object(applicant_lock, "_rerun") as rerun:
+            self.assertEqual(applicant_lock.requeue_orphan_reruns(), 0)  # détenteur vivant
+
+            # détenteur tué : le bail expire, le marqueur reste
+            frappe.cache().delete(self._lease_key())
+            self.assertEqual(applicant_lock.requeue_orphan_reruns(), 1)
+            self.assertEqual(applicant_lock.requeue_orphan_reruns(), 0)
+            rerun.assert_called_once_with(APPLICANT)
@@ -0,0 +1,164 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+import io
+import json
+import pathlib
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from job_auto_match.job_auto_match.utils import testlify
+from job_auto_match.job_auto_match.utils.context_cache import KEY_CHECK, KEY_EXTRACTION, StaticContext
+from job_auto_match.job_auto_match.utils.fakes import (
+    FakeGeminiClient,
+    FakeTestlifyServer,
+    LocalFilesAPI,
+    fake_score,
+)
+from job_auto_match.job_auto_match.utils.structured_output import OUTPUT_EXTRACTION, parse_output
+
+MODEL = "gemini-test"
+INVITES = [{"firstName": "Awa", "lastName": "Koné", "email": "awa@example.com"}]
+
+
+class TestLocalFilesAPI(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.api = LocalFilesAPI(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_upload_path_and_stream(self):
+        source = pathlib.Path(self.tmp.name) / "cv.pdf"
+        source.write_bytes(b"%PDF-1.4 cv")
+        from_path = self.api.upload(file=str(source), config=SimpleNamespace(mime_type="application/pdf"))
+        from_stream = self.api.upload(file=io.BytesIO(b"octets"))
+
+        self.assertNotEqual(from_path.name, from_stream.name)
+        self.assertEqual(from_path.uri, f"local://{from_path.name}")
+        self.assertEqual(from_path.mime_type, "application/pdf")
+        self.assertEqual(from_stream.mime_type, "application/octet-stream")
+        self.assertEqual(from_path.size_bytes, len(b"%PDF-1.4 cv"))
+        self.assertEqual(self.api.read_bytes(from_path.uri), b"%PDF-1.4 cv")
+        self.assertEqual(self.api.upload_count, 2)
+
+    def test_unsupported_source(self):
+        with self.assertRaises(TypeError):
+            self.api.upload(file=b"octets")
+
+    def test_delete(self):
+        f = self.api.upload(file=io.BytesIO(b"x"))
+        self.api.delete(name=f.name)
+        self.assertFalse(pathlib.Path(f.path).exists())
+        self.assertEqual(self.api.delete_count, 1)
+        with self.assertRaises(FileNotFoundError):
+            self.api.get(name=f.name)
+        with self.assertRaises(FileNotFoundError):
+            self.api.delete(name=f.name)
+
+
+class TestFakeGeminiClient(unittest.TestCase):
+    def _client(self, **kwargs):
+        return FakeGeminiClient(latency=0, jitter=0, seed=1, **kwargs)
+
+    def test_check_and_extraction(self):
+        client = self._client()
+        check = client.models.generate_content(model=MODEL, contents=[StaticContext("consignes", KEY_CHECK), "cv"])
+        self.assertEqual(json.loads(check.text), {"is_cv": True, "reason": "Document simulé"})
+
+        contents = [StaticContext("consignes", KEY_EXTRACTION), "cv"]
+        first = client.models.generate_content(model=MODEL, contents=contents)
+        again = client.models.generate_content(model=MODEL, contents=contents)
+        self.assertEqual(first.text, again.text)  # même contenu, même réponse
+        info = parse_output(first, OUTPUT_EXTRACTION, "extraction")["candidate_info"]
+        self.assertTrue(info["first_name"] and info["competences"])
+        self.assertEqual(client.calls["check"], 1)
+        self.assertEqual(client.calls["extraction"], 2)
+
+    def test_not_cv_rate(self):
+        client = self._client(not_cv_rate=1.0)
+        check = client.models.generate_content(model=MODEL, contents=[StaticContext("consignes", KEY_CHECK), "cv"])
+        self.assertFalse(json.loads(check.text)["is_cv"])
+
+    def test_scoring_matches_fake_score(self):
+        client = self._client()
+        info = {"first_name": "Awa", "competences": ["Audit"]}
+        context = StaticContext("barème", "scoring:JOB-1")
+        response = client.models.generate_content(model=MODEL, contents=[context, json.dumps({"candidate_info": info})])
+        self.assertEqual(json.loads(response.text), fake_score("scoring:JOB-1", info))
+
+    def test_simulated_errors(self):
+        from google.genai import errors as genai_errors
+
+        client = self._client(rate_429=1.0)
+        with self.assertRaises(genai_errors.ClientError) as ctx:
+            client.models.generate_content(model=MODEL, contents=["cv"])
+        self.assertEqual(ctx.exception.code, 429)
+        self.assertEqual(client.errors[429], 1)
+
+    def test_cached_context(self):
+        from google.genai import errors as genai_errors
+
+        client = self._client()
+        cache = client.caches.create(model=MODEL, config=SimpleNamespace(
+            display_name=f"job_auto_match {KEY_CHECK}", system_instruction="consignes",
+        ))
+        response = client.models.generate_content(
+            model=MODEL, contents=["cv"], config=SimpleNamespace(cached_content=cache.name),
+        )
+        self.assertIn("is_cv", json.loads(response.text))
+        self.assertGreater(response.usage_metadata.cached_content_token_count, 0)
+
+        client.caches.delete(name=cache.name)
+        with self.assertRaises(genai_errors.ClientError):
+            client.models.generate_content(model=MODEL, contents=["cv"], config=SimpleNamespace(cached_content=cache.name))
+
+
+class TestFakeTestlifyServer(unittest.TestCase):
+    def test_invite_success(self):
+        with FakeTestlifyServer(latency=0) as server:
+            result = testlify.TestlifyClient(settings=server.settings()).invite("asmt-1", INVITES)
+        self.assertEqual(result, {"assessment_id": "asmt-1", "status": "success"})
+        self.assertEqual((server.requests, server.invites), (1, 1))
+
+    def test_bad_token(self):
+        with FakeTestlifyServer(latency=0) as server:
+            settings = server.settings()
+            settings._passwords["testlify_token"] = "autre"
+            result = testlify.TestlifyClient(settings=settings).invite("asmt-1", INVITES)
+        self.assertEqual((result["status"], result["message"]), (401, "Token invalide"))
+
+    def test_5xx_is_not_replayed(self):
+        with FakeTestlifyServer(latency=0, rate_503=1.0) as server:
+            result = testlify.TestlifyClient(settings=server.settings()).invite("asmt-1", INVITES)
+        self.assertEqual(result["status"], 503)
+        self.assertEqual(server.requests, 1)  # l'invitation a pu partir : pas de rejeu
+        self.assertTrue(result["uncertain"])  # signalée pour vérification / renvoi
+
+    def test_5xx_is_replayed_when_idempotent(self):
+        with FakeTestlifyServer(latency=0, rate_503=1.0, idempotent=True) as server:
+            result = testlify.TestlifyClient(settings=server.settings()).invite("asmt-1", INVITES)
+        self.assertEqual(result["status"], 503)
+        self.assertEqual(server.requests, 1 + testlify.RETRY_TOTAL)
+
+    def test_idempotent_server_deduplicates(self):
+        with FakeTestlifyServer(latency=0, idempotent=True) as server:
+            client = testlify.TestlifyClient(settings=server.settings())
+            client.invite_many([("asmt-1", INVITES), ("asmt-1", INVITES), ("asmt-2", INVITES)])
+        self.assertEqual((server.requests, server.invites), (3, 2))
+
+    def test_429_is_replayed(self):
+        with FakeTestlifyServer(latency=0, rate_429=1.0) as server:
+            result = testlify.TestlifyClient(settings=server.settings()).invite("asmt-1", INVITES)
+        self.assertEqual(result["status"], 429)
+        self.assertEqual(server.requests, 1 + testlify.RETRY_TOTAL)
+
+    def test_bulk_chunks(self):
+        invites = [{"firstName": "", "lastName": "", "email": f"c{i}@example.com"} for i in range(3)]
+        with FakeTestlifyServer(latency=0) as server:
+            client = testlify.TestlifyClient(settings=server.settings())
+            results = client.invite_many([("asmt-1", invites[:2]), ("asmt-2", invites[2:])])
+        self.assertEqual([r["assessment_id"] for r in results], ["asmt-1", "asmt-2"])
+        self.assertEqual((server.requests, server.invites), (2, 3))
@@ -0,0 +1,80 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+import tempfile
+import unittest
+
+from job_auto_match.job_auto_match.utils.fakes import FakeGeminiClient, LocalFilesAPI, StaticSettings
+from job_auto_match.job_auto_match.utils.gemini_files import (
+    FILES_MODE_ALWAYS,
+    FILES_MODE_AUTO,
+    FILES_MODE_NEVER,
+    MAX_INLINE_BYTES,
+    GeminiFileSession,
+)
+from job_auto_match.job_auto_match.utils.structured_output import GeminiRequest
+
+MB = 1024 * 1024
+
+
+class TestGeminiFileSession(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.files = LocalFilesAPI(self.tmp.name)
+        self.client = FakeGeminiClient(latency=0, jitter=0, files_api=self.files)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _session(self, mode=FILES_MODE_AUTO, threshold_mb=2, ttl_minutes=0):
+        settings = StaticSettings(
+            gemini_files_mode=mode,
+            gemini_files_threshold_mb=threshold_mb,
+            gemini_files_ttl_minutes=ttl_minutes,
+        )
+        return GeminiFileSession(self.client, settings)
+
+    def test_should_upload(self):
+        auto = self._session()
+        self.assertFalse(auto.should_upload(2 * MB - 1))
+        self.assertTrue(auto.should_upload(2 * MB))
+        self.assertTrue(self._session(FILES_MODE_ALWAYS).should_upload(1))
+        never = self._session(FILES_MODE_NEVER)
+        self.assertFalse(never.should_upload(10 * MB))
+        self.assertTrue(never.should_upload(MAX_INLINE_BYTES))  # inline impossible : upload forcé
+
+    def test_without_files_api(self):
+        session = GeminiFileSession(object(), StaticSettings(gemini_files_mode=FILES_MODE_ALWAYS))
+        self.assertFalse(session.should_upload(MAX_INLINE_BYTES))
+
+    def test_uploads_once_per_run(self):
+        session = self._session()
+        first = session.part_for(file_hash="h1", mime_type="application/pdf", data=b"%PDF cv")
+        again = session.part_for(file_hash="h1", mime_type="application/pdf", data=b"%PDF cv")
+        self.assertEqual(first.file_data.file_uri, again.file_data.file_uri)
+        self.assertEqual(self.files.upload_count, 1)
+        self.assertEqual(self.files.read_bytes(first.file_data.file_uri), b"%PDF cv")
+
+        session.part_for(file_hash="h2", mime_type="application/pdf", data=b"%PDF autre")
+        self.assertEqual(self.files.upload_count, 2)
+
+    def test_close_deletes_uploads(self):
+        session = self._session()
+        session.part_for(file_hash="h1", mime_type="application/pdf", data=b"%PDF cv")
+        session.close()
+        self.assertEqual(self.files.delete_count, 1)
+        self.assertEqual(self.files.files, {})
+        session.close()  # idempotent
+        self.assertEqual(self.files.delete_count, 1)
+
+    def test_refresh_reuploads_session_files(self):
+        session = self._session()
+        part = session.part_for(file_hash="h1", mime_type="application/pdf", data=b"%PDF cv")
+        request = GeminiRequest([part, "consignes"], "extraction")
+
+        refreshed = session.refresh(request)
+        self.assertEqual(self.files.upload_count, 2)
+        self.assertNotEqual(refreshed[0].file_data.file_uri, part.file_data.file_uri)
+        self.assertEqual(refreshed[1], "consignes")
+        self.assertEqual(refreshed.output, "extraction")
+        self.assertIsNone(session.refresh(GeminiRequest(["consignes"])))
@@ -0,0 +1,91 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from job_auto_match.job_auto_match.utils import matching_queue as mq
+
+
+class TestMatchingQueue(FrappeTestCase):
+    def setUp(self):
+        frappe.cache().delete_keys(mq._PREFIX)
+
+    def tearDown(self):
+        frappe.cache().delete_keys(mq._PREFIX)
+
+    def test_push_is_deduplicated(self):
+        self.assertTrue(mq.push("APP-1", mq.PRIORITY_BULK, "JOB-A"))
+        self.assertFalse(mq.push("APP-1", mq.PRIORITY_BULK, "JOB-A"))
+        self.assertFalse(mq.push("APP-1", mq.PRIORITY_BULK + 1, "JOB-A"))
+        self.assertEqual(mq.queued_count(), 1)
+
+    def test_push_raises_priority(self):
+        mq.push("APP-1", mq.PRIORITY_BULK, "JOB-A")
+        mq.push("APP-2", mq.PRIORITY_RETRY, "JOB-A")
+        self.assertTrue(mq.push("APP-1", mq.PRIORITY_NEW, "JOB-A"))
+        stats = mq.queue_stats()
+        self.assertEqual((stats["new"]["depth"], stats["retry"]["depth"], stats["bulk"]["depth"]), (1, 1, 0))
+        self.assertEqual(mq.pop(limit=2), ["APP-1", "APP-2"])
+
+    def test_pop_round_robin_between_openings(self):
+        for name in ("A1", "A2", "A3"):
+            mq.push(name, mq.PRIORITY_BULK, "JOB-A")
+        mq.push("B1", mq.PRIORITY_BULK, "JOB-B")
+        self.assertEqual(mq.queue_stats()["bulk"]["openings"], 2)
+        self.assertEqual(mq.pop(limit=3), ["A1", "B1", "A2"])
+        self.assertEqual(mq.pop(limit=3), ["A3"])
+        self.assertEqual(mq.pop(limit=3), [])
+
+    def test_pop_ack_in_flight(self):
+        mq.push("APP-1", mq.PRIORITY_NEW, "JOB-A")
+        mq.push("APP-2", mq.PRIORITY_NEW, "JOB-A")
+        self.assertEqual(mq.pop(limit=2), ["APP-1", "APP-2"])
+        self.assertEqual(mq.queue_stats()["in_flight"], 2)
+        self.assertEqual(mq.queued_count(), 0)
+
+        mq.ack(["APP-1"])
+        self.assertEqual(mq.queue_stats()["in_flight"], 1)
+        # un run en cours peut être redemandé : nouvelle entrée en file
+        self.assertTrue(mq.push("APP-2", mq.PRIORITY_NEW, "JOB-A"))
+
+    def test_requeue_expired(self):
+        mq.push("APP-1", mq.PRIORITY_BULK, "JOB-A")
+        mq.push("APP-2", mq.PRIORITY_BULK, "JOB-A")
+        self.assertEqual(mq.pop(limit=1, claim_timeout=-1), ["APP-1"])
+        self.assertEqual(mq.pop(limit=1), ["APP-2"])
+
+        # APP-1 : échéance dépassée → remis en file avec sa priorité ; APP-2 reste en cours
+        self.assertEqual(mq.requeue_expired(), ["APP-1"])
+        self.assertEqual(mq.requeue_expired(), [])
+        stats = mq.queue_stats()
+        self.assertEqual((stats["bulk"]["depth"], stats["in_flight"]), (1, 1))
+        self.assertEqual(mq.pop(limit=1), ["APP-1"])
+
+    def test_requeue_skips_already_queued(self):
+        mq.push("APP-1", mq.PRIORITY_BULK, "JOB-A")
+        mq.pop(limit=1, claim_timeout=-1)
+        mq.push("APP-1", mq.PRIORITY_NEW, "JOB-A")
+        self.assertEqual(mq.requeue_expired(), [])
+        self.assertEqual(mq.queued_count(), 1)
+        self.assertEqual(mq.queue_stats()["in_flight"], 0)
+
+    def test_enqueue_without_writes_survives_rollback(self):
+        # retry_matching / rematch_job_opening : rien à valider, la requête finit par un rollback
+        frappe.db.rollback()
+        with patch.object(mq, "wake_consumers") as wake:
+            mq.enqueue_matching("APP-1", mq.PRIORITY_RETRY, "JOB-A")
+            frappe.db.rollback()
+        self.assertEqual(mq.queued_count(), 1)
+        wake.assert_called_once()
+
+    def test_enqueue_waits_for_pending_writes(self):
+        frappe.db.rollback()
+        frappe.db.set_default("job_auto_match_queue_test", "1")
+        with patch.object(mq, "wake_consumers"):
+            mq.enqueue_matching("APP-1", mq.PRIORITY_NEW, "JOB-A")
+            self.assertEqual(mq.queued_count(), 0)
+            frappe.db.rollback()  # écriture annulée : la demande part avec elle
+        self.assertEqual(mq.queued_count(), 0)
@@ -0,0 +1,80 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from job_auto_match.job_auto_match.utils import matching, notifications
+
+DEFAULT_KEY = "job_auto_match_notifications_test"
+
+
+class _Applicant:
+    """Job Applicant minimal : save() écrit réellement en base (transaction ouverte)."""
+
+    doctype = "Job Applicant"
+
+    def __init__(self, name, conflict=False):
+        self.name = name
+        self.flags = frappe._dict()
+        self.conflict = conflict
+
+    def save(self, ignore_permissions=False):
+        if self.conflict:
+            self.conflict = False
+            raise frappe.TimestampMismatchError
+        frappe.db.set_default(DEFAULT_KEY, self.name)
+
+
+class TestNotificationQueue(FrappeTestCase):
+    def setUp(self):
+        frappe.db.rollback()
+        frappe.cache().delete_keys(notifications.QUEUE_KEY)
+        patcher = patch.object(notifications, "_enqueue_flush")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        frappe.db.rollback()
+        frappe.db.delete("DefaultValue", {"defkey": DEFAULT_KEY})
+        frappe.db.commit()
+        frappe.cache().delete_keys(notifications.QUEUE_KEY)
+
+    def _queued(self) -> int:
+        return frappe.cache().llen(notifications.QUEUE_KEY)
+
+    def test_queue_without_writes_survives_rollback(self):
+        notifications.queue_notification(notifications.NOTIF_NOT_MATCHING, "HR-APP-1", "a@example.com", {})
+        frappe.db.rollback()
+        self.assertEqual(self._queued(), 1)
+
+    def test_queue_waits_for_commit(self):
+        frappe.db.set_default(DEFAULT_KEY, "1")
+        notifications.queue_notification(notifications.NOTIF_NOT_MATCHING, "HR-APP-1", "a@example.com", {})
+        self.assertEqual(self._queued(), 0)
+        frappe.db.rollback()
+        self.assertEqual(self._queued(), 0)
+
+    def test_duplicate_is_not_queued(self):
+        for _ in range(2):
+            notifications.queue_notification(notifications.NOTIF_NOT_MATCHING, "HR-APP-1", "a@example.com", {})
+        self.assertEqual(self._queued(), 1)
+
+    def test_flush_pending_delivers_without_later_commit(self):
+        doc = _Applicant("HR-APP-1")
+        doc.flags.pending_notifications = [(notifications.NOTIF_NOT_MATCHING, "a@example.com", {"score": 10})]
+        matching._flush_pending(doc, {})
+        # trace.persist() en échec : rien d'autre n'est validé après l'écriture finale
+        frappe.db.rollback()
+        self.assertEqual(self._queued(), 1)
+
+    def test_flush_pending_after_timestamp_mismatch(self):
+        doc = _Applicant("HR-APP-1", conflict=True)
+        doc.flags.pending_notifications = [(notifications.NOTIF_NOT_MATCHING, "a@example.com", {})]
+        fresh = _Applicant("HR-APP-1")
+        with patch.object(matching, "_doc_state", return_value={}), patch.object(frappe, "get_doc", return_value=fresh):
+            self.assertIs(matching._flush_pending(doc, {}), fresh)
+        frappe.db.rollback()
+        self.assertEqual(self._queued(), 1)
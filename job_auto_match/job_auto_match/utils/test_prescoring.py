@@ -0,0 +1,122 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+import unittest
+from types import SimpleNamespace
+
+from job_auto_match.job_auto_match.utils.prescoring import (
+    PARTIAL_CREDIT,
+    build_candidate_profile,
+    build_job_profile,
+    effective_weights,
+    normalize_term,
+    parse_study_level,
+    parse_years,
+    score_candidate,
+    score_candidates,
+)
+
+
+def _fiche(skills=(), outils=(), experience=None, study_level=None):
+    return SimpleNamespace(
+        name="JOB-TEST",
+        custom_skills=[SimpleNamespace(skill=s) for s in skills],
+        custom_outils=[SimpleNamespace(outil=o) for o in outils],
+        custom_minimum_experience=experience,
+        custom_study_level=study_level,
+    )
+
+
+def _candidate(competences=(), outils=(), years=None, level=None):
+    return build_candidate_profile({
+        "competences": list(competences),
+        "outils": list(outils),
+        "annee_experience": years,
+        "niveau_etude": level,
+    })
+
+
+class TestNormalization(unittest.TestCase):
+    def test_normalize_term(self):
+        self.assertEqual(normalize_term("  Gestion de Projets "), "gestion de projet")
+        self.assertEqual(normalize_term("Données"), "donnee")
+        self.assertEqual(normalize_term("ReactJS"), "react.js")
+        self.assertEqual(normalize_term("Node"), "node.js")
+        self.assertEqual(normalize_term("C#"), "c#")
+        self.assertEqual(normalize_term(None), "")
+
+    def test_parse_study_level(self):
+        self.assertEqual(parse_study_level("BAC + 5"), 5)
+        self.assertEqual(parse_study_level("Master en finance"), 5)
+        self.assertEqual(parse_study_level("Licence"), 3)
+        self.assertEqual(parse_study_level("Baccalauréat"), 0)
+        self.assertIsNone(parse_study_level(""))
+        self.assertIsNone(parse_study_level("Autodidacte"))
+
+    def test_parse_years(self):
+        self.assertEqual(parse_years("5,5 ans"), 5.5)
+        self.assertEqual(parse_years(3), 3.0)
+        self.assertIsNone(parse_years(""))
+        self.assertIsNone(parse_years("aucune"))
+
+    def test_build_job_profile(self):
+        job = build_job_profile(_fiche(["Audit", "audits", ""], ["Excel"], "3 ans", "BAC+3"))
+        self.assertEqual(job["skills"], ["audit"])  # dédoublonné après normalisation
+        self.assertEqual(job["outils"], ["excel"])
+        self.assertEqual(job["minimum_experience"], 3.0)
+        self.assertEqual(job["study_level"], 3)
+        self.assertIsNone(build_job_profile(_fiche(experience=0))["minimum_experience"])
+
+
+class TestWeights(unittest.TestCase):
+    def test_all_criteria(self):
+        job = build_job_profile(_fiche(["audit"], ["excel"], 2, "BAC+3"))
+        self.assertEqual(effective_weights(job), {"skills": 0.4, "outils": 0.25, "study_level": 0.15, "experience": 0.2})
+
+    def test_redistribution(self):
+        weights = effective_weights(build_job_profile(_fiche(["audit"], ["excel"])))
+        self.assertAlmostEqual(weights["skills"], 40 / 65)
+        self.assertAlmostEqual(weights["outils"], 25 / 65)
+        self.assertEqual((weights["study_level"], weights["experience"]), (0.0, 0.0))
+        self.assertAlmostEqual(sum(weights.values()), 1.0)
+
+    def test_empty_job(self):
+        job = build_job_profile(_fiche())
+        self.assertEqual(set(effective_weights(job).values()), {0.0})
+        self.assertEqual(score_candidate(job, _candidate(["audit"]))["score"], 0)
+
+
+class TestScoring(unittest.TestCase):
+    def setUp(self):
+        self.job = build_job_profile(_fiche(["Gestion de projet", "Python"], ["Excel"], 4, "BAC+5"))
+
+    def test_weighted_score(self):
+        # compétences 1/2, outils 1/1, expérience 2/4, études (3/5)² : 40*.5 + 25 + 20*.5 + 15*.36 = 60.4
+        result = score_candidate(self.job, _candidate(["Gestion de projets", "SQL"], ["excel"], 2, "Licence"))
+        self.assertEqual(result["score"], 60)
+        self.assertEqual(result["details"]["skills_matched"], 1)
+        self.assertEqual(result["details"]["outils_matched"], 1)
+
+    def test_perfect_and_capped(self):
+        result = score_candidate(self.job, _candidate(["gestion de projet", "python"], ["Excel"], 10, "Doctorat"))
+        self.assertEqual(result["score"], 100)
+
+    def test_missing_candidate_data(self):
+        self.assertEqual(score_candidate(self.job, _candidate())["score"], 0)
+
+    def test_partial_credit(self):
+        job = build_job_profile(_fiche(["gestion projet agile"]))
+        full = score_candidate(job, _candidate(["gestion de projet", "méthode agile"]))
+        self.assertEqual(full["score"], round(100 * PARTIAL_CREDIT))
+        self.assertEqual(full["details"]["skills_matched"], 0)  # crédit partiel : pas une correspondance
+        self.assertEqual(score_candidate(job, _candidate(["gestion de projet"]))["score"], 0)
+
+    def test_batch_equals_single(self):
+        candidates = [
+            _candidate(["python"], [], 1, "BAC+2"),
+            _candidate(["gestion de projet", "python"], ["excel"], 4, "BAC+5"),
+            _candidate(),
+        ]
+        batch = score_candidates(self.job, candidates)
+        self.assertEqual([r["score"] for r in batch], [score_candidate(self.job, c)["score"] for c in candidates])
+        self.assertEqual(score_candidates(self.job, []), [])
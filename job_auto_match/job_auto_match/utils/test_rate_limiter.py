@@ -0,0 +1,51 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+import frappe
+import redis
+from frappe.tests.utils import FrappeTestCase
+
+from job_auto_match.job_auto_match.utils import rate_limiter
+from job_auto_match.job_auto_match.utils.rate_limiter import GeminiRateLimiter
+
+MODEL = "gemini-rl-test"
+
+
+class TestGeminiRateLimiter(FrappeTestCase):
+    def setUp(self):
+        frappe.cache().delete_keys(rate_limiter._PREFIX)
+        self.limiter = GeminiRateLimiter({MODEL: {"rpm": 60, "tpm": 6000}})
+
+    def tearDown(self):
+        frappe.cache().delete_keys(rate_limiter._PREFIX)
+
+    def _level(self, index: int = 1) -> float | None:
+        raw = redis.Redis.hget(frappe.cache(), self.limiter._keys(MODEL)[index], "level")
+        return float(raw) if raw is not None else None
+
+    def test_take_drains_buckets(self):
+        self.assertEqual(self.limiter._take(MODEL, 1000), 0)
+        self.assertAlmostEqual(self._level(0), 59, delta=1)
+        self.assertAlmostEqual(self._level(), 5000, delta=50)  # recharge : 100 tokens/s
+
+    def test_wait_when_bucket_empty(self):
+        self.assertEqual(self.limiter._take(MODEL, 6000), 0)
+        self.assertGreater(self.limiter._take(MODEL, 3000), 25)
+
+    def test_settle_adjusts_token_bucket(self):
+        self.limiter._take(MODEL, 1000)
+        before = self._level()
+        self.limiter.settle(MODEL, 1000, 3000)  # consommation réelle plus forte
+        self.assertAlmostEqual(self._level(), before - 2000, delta=1)
+        self.limiter.settle(MODEL, 1000, 400)
+        self.assertAlmostEqual(self._level(), before - 1400, delta=1)
+
+    def test_settle_without_bucket(self):
+        self.limiter.settle(MODEL, 1000, 3000)
+        self.assertIsNone(self._level())
+
+    def test_script_registered_once(self):
+        self.limiter._take(MODEL, 10)
+        script = rate_limiter._scripts["take"]
+        self.limiter._take(MODEL, 10)
+        self.assertIs(rate_limiter._scripts["take"], script)
@@ -0,0 +1,159 @@
+# Copyright (c) 2025, KONE Fousseni and Contributors
+# See license.txt
+
+import json
+import unittest
+from types import SimpleNamespace
+
+from job_auto_match.job_auto_match.utils.structured_output import (
+    OUTPUT_BATCH_SCORING,
+    OUTPUT_COMBINED,
+    OUTPUT_CV_CHECK,
+    OUTPUT_EXTRACTION,
+    OUTPUT_SCORING,
+    SCHEMAS,
+    StructuredOutputError,
+    coerce_candidate_info,
+    missing_required,
+    parse_output,
+    repair_json,
+)
+
+CANDIDATE_INFO = {
+    "first_name": "Awa",
+    "last_name": "Traoré",
+    "title": "Comptable",
+    "age": 31,
+    "email": "awa@example.com",
+    "phone": ["+226 70 00 00 00"],
+    "location": "Ouagadougou",
+    "competences": ["Fiscalité", "Sage"],
+    "outils": ["Excel"],
+    "experience_professionnelle": [{"annee": "2019", "titre": "Comptable", "description": "Clôtures"}],
+    "diplomes": [{"annee": "2016", "diplome": "Master CCA", "institution": "UO", "level": "Post Graduate"}],
+    "annee_experience": 6,
+    "niveau_etude": "Bac+5",
+}
+
+
+def _response(text=None, parsed=None):
+    return SimpleNamespace(text=text, parsed=parsed)
+
+
+class TestRepairJson(unittest.TestCase):
+    def test_valid_json_with_fences_and_noise(self):
+        text = 'Voici la réponse :\n```json\n{"score": 72, "justification": "ok"}\n```\nMerci'
+        self.assertEqual(repair_json(text), {"score": 72, "justification": "ok"})
+
+    def test_no_json(self):
+        with self.assertRaises(StructuredOutputError):
+            repair_json("Désolé, je ne peux pas répondre.")
+
+    def test_closes_open_string_and_containers(self):
+        self.assertEqual(
+            repair_json('{"score": 72, "justification": "profil sol'),
+            {"score": 72, "justification": "profil sol"},
+        )
+        self.assertEqual(repair_json('{"a": [1, 2,'), {"a": [1, 2]})
+        self.assertEqual(repair_json('{"a": 1, "b":'), {"a": 1, "b": None})
+
+    def test_escaped_quote_inside_string(self):
+        self.assertEqual(repair_json('{"reason": "dit \\"ok\\""}'), {"reason": 'dit "ok"'})
+
+    def test_repair_rejects_missing_required_keys(self):
+        truncated = json.dumps({"candidate_info": CANDIDATE_INFO})[:120]
+        self.assertIsInstance(repair_json(truncated), dict)
+        with self.assertRaises(StructuredOutputError):
+            repair_json(truncated, SCHEMAS[OUTPUT_EXTRACTION])
+
+    def test_repair_rejects_null_for_non_nullable(self):
+        with self.assertRaises(StructuredOutputError):
+            repair_json('{"is_cv": true, "reason":', SCHEMAS[OUTPUT_CV_CHECK])
+
+    def test_complete_json_is_not_checked(self):
+        # JSON complet : les champs absents relèvent des coercers, pas de la réparation
+        self.assertEqual(repair_json('{"is_cv": true}', SCHEMAS[OUTPUT_CV_CHECK]), {"is_cv": True})
+
+
+class TestMissingRequired(unittest.TestCase):
+    def test_complete_extraction(self):
+        self.assertEqual(missing_required({"candidate_info": CANDIDATE_INFO}, SCHEMAS[OUTPUT_EXTRACTION]), [])
+
+    def test_nested_paths(self):
+        info = {**CANDIDATE_INFO, "diplomes": [{"annee": "2016", "diplome": "Master"}]}
+        del info["niveau_etude"]
+        missing = missing_required({"candidate_info": info}, SCHEMAS[OUTPUT_EXTRACTION])
+        self.assertIn("candidate_info.niveau_etude", missing)
+        self.assertIn("candidate_info.diplomes[0].institution", missing)
+        self.assertIn("candidate_info.diplomes[0].level", missing)
+
+    def test_nullable_fields(self):
+        info = {**CANDIDATE_INFO, "age": None, "annee_experience": None}
+        self.assertEqual(missing_required({"candidate_info": info}, SCHEMAS[OUTPUT_EXTRACTION]), [])
+        combined = {"is_cv": False, "reason": "facture", "candidate_info": None}
+        self.assertEqual(missing_required(combined, SCHEMAS[OUTPUT_COMBINED]), [])
+
+
+class TestCoercers(unittest.TestCase):
+    def test_candidate_info_types(self):
+        info = coerce_candidate_info({
+            **CANDIDATE_INFO,
+            "age": "31 ans",
+            "phone": "+226 70 00 00 00; +226 71 00 00 00",
+            "competences": "Fiscalité, Sage",
+            "annee_experience": "5,6",
+            "experience_professionnelle": [{"annee": "Depuis 2019", "titre": " Comptable "}, "texte"],
+            "diplomes": [{"annee": 2016, "diplome": "Master", "institution": "UO", "level": "Doctorat"}],
+        })
+        self.assertEqual(info["age"], 31)
+        self.assertEqual(info["phone"], ["+226 70 00 00 00", "+226 71 00 00 00"])
+        self.assertEqual(info["competences"], ["Fiscalité", "Sage"])
+        self.assertEqual(info["annee_experience"], 6)
+        self.assertEqual(info["experience_professionnelle"], [{"annee": "2019", "titre": "Comptable", "description": ""}])
+        self.assertEqual(info["diplomes"][0]["annee"], "2016")
+        self.assertEqual(info["diplomes"][0]["level"], "")
+
+    def test_candidate_info_out_of_range_age(self):
+        self.assertIsNone(coerce_candidate_info({**CANDIDATE_INFO, "age": 7})["age"])
+        self.assertIsNone(coerce_candidate_info({**CANDIDATE_INFO, "age": True})["age"])
+
+    def test_candidate_info_not_a_dict(self):
+        with self.assertRaises(StructuredOutputError):
+            coerce_candidate_info(["Awa"])
+
+    def test_scoring_clamped_and_required(self):
+        self.assertEqual(
+            parse_output(_response(parsed={"score": "120", "justification": "x"}), OUTPUT_SCORING, "scoring"),
+            {"score": 100, "justification": "x"},
+        )
+        with self.assertRaises(StructuredOutputError):
+            parse_output(_response(parsed={"justification": "x"}), OUTPUT_SCORING, "scoring")
+
+    def test_cv_check_booleans(self):
+        parsed = parse_output(_response(text='{"is_cv": "non", "reason": "facture"}'), OUTPUT_CV_CHECK, "cv")
+        self.assertEqual(parsed, {"is_cv": False, "reason": "facture"})
+
+    def test_combined_drops_info_when_not_a_cv(self):
+        parsed = parse_output(
+            _response(parsed={"is_cv": False, "reason": "facture", "candidate_info": CANDIDATE_INFO}),
+            OUTPUT_COMBINED,
+            "combined",
+        )
+        self.assertIsNone(parsed["candidate_info"])
+
+    def test_batch_scoring_skips_incomplete_entries(self):
+        parsed = parse_output(
+            _response(parsed={"results": [
+                {"candidate_id": "A", "score": 55, "justification": "ok"},
+                {"candidate_id": "B", "justification": "sans score"},
+                {"score": 40, "justification": "sans id"},
+            ]}),
+            OUTPUT_BATCH_SCORING,
+            "batch",
+        )
+        self.assertEqual(parsed, {"results": {"A": {"score": 55, "justification": "ok"}}})
+
+    def test_truncated_extraction_is_rejected(self):
+        text = json.dumps({"candidate_info": CANDIDATE_INFO}, ensure_ascii=False)[:200]
+        with self.assertRaises(StructuredOutputError):
+            parse_output(_response(text=text), OUTPUT_EXTRACTION, "extraction")
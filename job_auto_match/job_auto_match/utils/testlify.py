@@ -0,0 +1,161 @@
+"""
+Client HTTP Testlify (invitations aux évaluations).
+
+- Session requests persistante par worker : pool de connexions keep-alive,
+  plus de handshake TLS par invitation.
+- Retries avec backoff exponentiel, limités aux cas où l'invitation n'a pas pu
+  être créée : échec de connexion et 429 (Retry-After respecté). Un POST
+  n'est pas idempotent : un 502/503/504 n'est rejoué que si Testlify ignore
+  les invitations en double (réglage testlify_invites_idempotent). Sinon,
+  comme pour un délai de lecture dépassé, le résultat est marqué `uncertain`
+  et l'appelant le signale sur le candidat, pour un renvoi manuel.
+- Les évaluations d'une offre partent en parallèle (threads : uniquement de
+  l'I/O HTTP, aucun accès Frappe/DB hors du thread appelant).
+- Mode groupé : une seule requête par évaluation avec tous les candidats dans
+  `candidateInvites` (ré-invitation d'une shortlist), découpée par lots.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import frappe
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+
+POOL_SIZE = 10
+MAX_CONCURRENCY = 4
+BULK_CHUNK_SIZE = 100
+TIMEOUT = (5, 30)  # (connexion, lecture)
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = (429,)  # requête refusée avant traitement : rejouable sans doublon
+TRANSIENT_STATUSES = (502, 503, 504)  # l'invitation a pu partir : rejouable seulement si Testlify dédoublonne
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+class _InviteRetry(Retry):
+    """Retry-After ne rend rejouables que les statuts listés (urllib3 l'accepte aussi sur 413/503)."""
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        return status_code in (self.status_forcelist or ()) and super().is_retry(method, status_code, has_retry_after)
+
+
+def get_session(idempotent: bool = False) -> requests.Session:
+    """Session partagée du process (créée à la demande), une par politique de rejeu des 5xx."""
+    session = _sessions.get(idempotent)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(idempotent)
+            if session is None:
+                retry = _InviteRetry(
+                    total=RETRY_TOTAL,
+                    connect=RETRY_TOTAL,
+                    read=0,
+                    other=0,
+                    backoff_factor=RETRY_BACKOFF,
+                    status_forcelist=RETRY_STATUSES + (TRANSIENT_STATUSES if idempotent else ()),
+                    allowed_methods=frozenset({"POST"}),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _sessions[idempotent] = session
+    return session
+
+
+def assessment_ref(assessment) -> tuple[str | None, str | None]:
+    """(id, nom) d'une évaluation : ligne de l'offre (id) ou du candidat (assessment_id), dict ou doc."""
+    get = assessment.get if isinstance(assessment, dict) else lambda k: getattr(assessment, k, None)
+    return get("id") or get("assessment_id"), get("assessment_name")
+
+
+def candidate_invite(doc) -> dict:
+    return {
+        "firstName": (getattr(doc, "custom_first_name", "") or "").strip(),
+        "lastName":  (getattr(doc, "custom_last_name", "") or "").strip(),
+        "email":     (getattr(doc, "email_id", "") or "").strip(),
+    }
+
+
+class TestlifyClient:
+    def __init__(self, settings=None, session: requests.Session | None = None):
+        settings = settings or frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+
+        base_url = (settings.testlify_base_url or "").strip()
+        inv_path = (settings.testlify_candidate_invite or "").strip()
+        token    = (settings.get_password("testlify_token") or "").strip()
+
+        missing = []
+        if not base_url:
+            missing.append("URL de base Testlify")
+        if not inv_path:
+            missing.append("Endpoint invitation candidat")
+        if not token:
+            missing.append("Token API Testlify")
+        if missing:
+            raise ValueError(
+                f"Configuration Testlify incomplète — champs manquants : {', '.join(missing)}"
+            )
+
+        self.api_url = urljoin(base_url.rstrip('/') + '/', inv_path.lstrip('/'))
+        self.headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json'
+        }
+        self.idempotent = bool(int(getattr(settings, "testlify_invites_idempotent", 0) or 0))
+        self.session = session or get_session(self.idempotent)
+
+    def invite(self, assessment_id: str, invites: list[dict]) -> dict:
+        """
+        Un POST pour une évaluation et 1..n candidats → {"assessment_id", "status",
+        ["message"], ["uncertain"]}. `uncertain` : l'invitation a pu partir (5xx,
+        délai de lecture dépassé), à vérifier avant un renvoi.
+        """
+        try:
+            response = self.session.post(
+                self.api_url,
+                json={"candidateInvites": invites, "assessmentId": assessment_id},
+                headers=self.headers,
+                timeout=TIMEOUT,
+            )
+        except requests.RequestException as e:
+            # échec de connexion : rien n'est parti ; sinon (délai de lecture…) la requête a pu aboutir
+            uncertain = not isinstance(e, requests.ConnectionError)
+            return {"assessment_id": assessment_id, "status": "error", "message": str(e), "uncertain": uncertain}
+
+        if response.status_code == 200:
+            return {"assessment_id": assessment_id, "status": "success"}
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        err_body = body.get("error") if isinstance(body, dict) else None
+        msg = (err_body.get("message") if isinstance(err_body, dict) else None) or response.text
+        result = {"assessment_id": assessment_id, "status": response.status_code, "message": msg}
+        if response.status_code >= 500:
+            result["uncertain"] = True
+        return result
+
+    def invite_many(self, requests_: list[tuple[str, list[dict]]]) -> list[dict]:
+        """Envoie [(assessment_id, invites)] en parallèle ; résultats dans l'ordre d'entrée."""
+        if len(requests_) <= 1:
+            return [self.invite(aid, invites) for aid, invites in requests_]
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENCY, len(requests_))) as pool:
+            return list(pool.map(lambda r: self.invite(*r), requests_))
+
+    def invite_bulk(self, assessment_id: str, invites: list[dict]) -> list[dict]:
+        """Mode groupé : tous les candidats d'une évaluation, par lots de BULK_CHUNK_SIZE."""
+        chunks = [invites[i:i + BULK_CHUNK_SIZE] for i in range(0, len(invites), BULK_CHUNK_SIZE)]
+        results = self.invite_many([(assessment_id, chunk) for chunk in chunks])
+        for chunk, result in zip(chunks, results, strict=True):
+            result["emails"] = [i["email"] for i in chunk]
+        return results
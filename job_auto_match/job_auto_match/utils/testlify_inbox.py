@@ -0,0 +1,311 @@
+"""
+Boîte de réception des webhooks Testlify.
+
+Le webhook `api.completed` se contente d'authentifier, d'enregistrer
+l'événement brut (doctype Testlify Webhook Event, nommé par une clé
+d'idempotence assessmentId | email | événement) et de répondre 200. Une
+redélivrance du même événement bute sur la clé primaire : ignorée en O(1).
+
+Un consommateur en tâche de fond applique les événements en attente par lots,
+groupés par candidat : un seul chargement, un seul save et au plus un e-mail
+(confié au dispatcher utils.notifications, pas d'envoi synchrone) par candidat.
+"""
+
+import hashlib
+import json
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import add_days, now_datetime
+
+from job_auto_match.job_auto_match.utils.matching import _set_statut
+from job_auto_match.job_auto_match.utils.notifications import (
+    FLAG_REJECTED_AFTER_TEST_EMAIL_SENT,
+    NOTIF_REJECTED_AFTER_TEST,
+    queue_notification,
+)
+
+_SETTINGS_DOCTYPE = "Job Matching Integration Settings"
+INBOX_DOCTYPE = "Testlify Webhook Event"
+CONSUMER_JOB_ID = "job_auto_match:testlify_inbox"
+
+STATUS_PENDING = "Pending"
+STATUS_PROCESSED = "Processed"
+STATUS_FAILED = "Failed"
+
+BATCH_SIZE = 200
+MAX_ATTEMPTS = 5
+RETENTION_DAYS = 30
+
+
+# ── Helpers ──────────────────────────────────────────────────────────────────
+def _to_float(x, default=0.0):
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return default
+
+
+@contextmanager
+def _as_user(user: str):
+    prev = frappe.session.user
+    frappe.set_user(user)
+    try:
+        yield
+    finally:
+        frappe.set_user(prev)
+
+
+def _service_user(settings) -> str:
+    # On utilise le champ webhook_service_user s'il existe, sinon on prend "Administrator" en dernier recours
+    if hasattr(settings, "webhook_service_user"):
+        configured_user = (getattr(settings, "webhook_service_user", "") or "").strip()
+        if configured_user and frappe.db.exists("User", configured_user):
+            return configured_user
+        frappe.logger().warning(f"[TESTLIFY] Utilisateur configuré '{configured_user}' inexistant → fallback sur Administrator")
+    else:
+        frappe.logger().warning("[TESTLIFY] Champ 'webhook_service_user' absent du doctype → utilisation d'Administrator")
+    return "Administrator"
+
+
+def event_key(assessment_id: str, email: str, event: str) -> str:
+    raw = f"{assessment_id}|{(email or '').strip().lower()}|{event or ''}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+# ── Réception (requête HTTP) ─────────────────────────────────────────────────
+def record_event(payload: dict, assessment_id: str, email: str, event: str) -> bool:
+    """Enregistre l'événement brut ; False si c'est une redélivrance (clé déjà connue)."""
+    doc = frappe.get_doc({
+        "doctype": INBOX_DOCTYPE,
+        "event_key": event_key(assessment_id, email, event),
+        "event": event,
+        "assessment_id": assessment_id,
+        "email": email,
+        "status": STATUS_PENDING,
+        "payload": json.dumps(payload, ensure_ascii=False),
+    })
+    try:
+        doc.insert(ignore_permissions=True)
+    except frappe.DuplicateEntryError:
+        return False
+    return True
+
+
+def enqueue_inbox_consumer():
+    # job_id stable : un seul consommateur en file/en cours à la fois
+    frappe.enqueue(
+        "job_auto_match.job_auto_match.utils.testlify_inbox.process_testlify_inbox",
+        queue="short",
+        timeout=600,
+        job_id=CONSUMER_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+def drain_testlify_inbox():
+    """Tâche planifiée : relance le consommateur s'il reste des événements en attente."""
+    if frappe.db.exists(INBOX_DOCTYPE, {"status": STATUS_PENDING}):
+        enqueue_inbox_consumer()
+
+
+# ── Consommateur ─────────────────────────────────────────────────────────────
+def process_testlify_inbox(limit: int = BATCH_SIZE):
+    """Applique les événements en attente, lot par lot, dans l'ordre d'arrivée."""
+    settings = frappe.get_cached_doc(_SETTINGS_DOCTYPE)
+    service_user = _service_user(settings)
+    last = None
+    while True:
+        events = _next_events(last, limit)
+        if not events:
+            return
+        last = (events[-1].creation, events[-1].name)
+        _apply_events(events, settings, service_user)
+        if len(events) < limit:
+            return
+
+
+def _next_events(after: tuple | None, limit: int) -> list:
+    """
+    Lot suivant, paginé sur (creation, name) : des événements reçus dans la même
+    microseconde ne sont ni sautés ni relus d'un lot à l'autre.
+    """
+    Event = frappe.qb.DocType(INBOX_DOCTYPE)
+    query = (
+        frappe.qb.from_(Event)
+        .select(Event.name, Event.assessment_id, Event.email, Event.payload, Event.attempts, Event.creation)
+        .where(Event.status == STATUS_PENDING)
+        .orderby(Event.creation)
+        .orderby(Event.name)
+        .limit(limit)
+    )
+    if after:
+        creation, name = after
+        query = query.where((Event.creation > creation) | ((Event.creation == creation) & (Event.name > name)))
+    return query.run(as_dict=True)
+
+
+def _resolve_applicants(events) -> dict:
+    """(assessment_id, email) → Job Applicant, en deux requêtes pour tout le lot."""
+    rows = frappe.get_all(
+        "Assessment Score",
+        filters={"parenttype": "Job Applicant", "assessment_id": ["in", list({e.assessment_id for e in events})]},
+        fields=["assessment_id", "parent"],
+    )
+    emails = dict(frappe.get_all(
+        "Job Applicant",
+        filters={"name": ["in", list({r.parent for r in rows})]},
+        fields=["name", "email_id"],
+        as_list=True,
+    )) if rows else {}
+
+    by_key, first_parent = {}, {}
+    for r in rows:
+        first_parent.setdefault(r.assessment_id, r.parent)
+        email = (emails.get(r.parent) or "").strip().lower()
+        by_key[(r.assessment_id, email)] = r.parent
+
+    # Repli historique : premier candidat portant cet assessment_id
+    return {
+        e.name: by_key.get((e.assessment_id, (e.email or "").lower())) or first_parent.get(e.assessment_id)
+        for e in events
+    }
+
+
+def _mark_events(events, status: str, applicant: str | None = None, error: str = ""):
+    """UPDATE ensembliste des événements d'un candidat (statut, tentatives, erreur)."""
+    if not events:
+        return
+    Event = frappe.qb.DocType(INBOX_DOCTYPE)
+    query = (
+        frappe.qb.update(Event)
+        .set(Event.status, status)
+        .set(Event.attempts, Event.attempts + 1)
+        .set(Event.error, (error or "")[:1000])
+        .set(Event.modified, now_datetime())
+        .where(Event.name.isin([e.name for e in events]))
+    )
+    if status == STATUS_PROCESSED:
+        query = query.set(Event.processed_on, now_datetime())
+    if applicant:
+        query = query.set(Event.applicant, applicant)
+    query.run()
+
+
+def _mark_failed(events, error: str, applicant: str | None = None):
+    """Échec : on retente au prochain passage tant que MAX_ATTEMPTS n'est pas atteint."""
+    retry = [e for e in events if (e.attempts or 0) + 1 < MAX_ATTEMPTS]
+    final = [e for e in events if (e.attempts or 0) + 1 >= MAX_ATTEMPTS]
+    _mark_events(retry, STATUS_PENDING, applicant, error)
+    _mark_events(final, STATUS_FAILED, applicant, error)
+
+
+def _apply_events(events, settings, service_user: str):
+    applicants = _resolve_applicants(events)
+
+    grouped, orphans = {}, []
+    for e in events:
+        applicant = applicants.get(e.name)
+        if applicant:
+            grouped.setdefault(applicant, []).append(e)
+        else:
+            orphans.append(e)
+    if orphans:
+        _mark_failed(orphans, "Aucun candidat pour cet assessment_id")
+        frappe.db.commit()
+
+    for applicant_name, evs in grouped.items():
+        try:
+            candidate = frappe.get_doc("Job Applicant", applicant_name)
+            candidate.flags.ignore_permissions = True
+            for e in evs:
+                data = (json.loads(e.payload or "{}").get("data") or {})
+                scores_data = data.get("scores") or {}
+                _apply_score(candidate, e.assessment_id, _to_float(scores_data.get("avgScorePercentage", 0)))
+            _finalize_scores(candidate, settings)
+
+            with _as_user(service_user):
+                candidate.save(ignore_permissions=True)
+            # Déposées avec la sauvegarde : parties au commit, annulées avec un rollback
+            for kind, recipient, ctx in candidate.flags.pop("pending_notifications", None) or []:
+                queue_notification(kind, candidate.name, recipient, ctx)
+            _mark_events(evs, STATUS_PROCESSED, applicant_name)
+            frappe.db.commit()
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), f"[TESTLIFY] Application des événements échouée ({applicant_name})")
+            _mark_failed(evs, str(e), applicant_name)
+            frappe.db.commit()
+
+
+def _apply_score(candidate, assessment_id: str, incoming_score: float):
+    for row in candidate.get("custom_assessments") or []:
+        if getattr(row, "assessment_id", None) == assessment_id:
+            row.sent = 1  # résultat reçu : invitation partie, même si l'envoi était resté incertain
+            row.completed = True
+            row.assessment_score = incoming_score
+            return
+    candidate.append("custom_assessments", {
+        "assessment_id": assessment_id,
+        "sent": 1,
+        "completed": True,
+        "assessment_score": incoming_score,
+    })
+
+
+def _finalize_scores(candidate, settings):
+    """Score global, statut et e-mail de rejet une fois toutes les évaluations complètes."""
+    all_rows = candidate.get("custom_assessments") or []
+    item_count = len(all_rows)
+    completed_count = sum(1 for r in all_rows if getattr(r, "completed", False))
+    total_score = sum(_to_float(getattr(r, "assessment_score", 0)) for r in all_rows)
+
+    frappe.logger().info(
+        f"[TESTLIFY] {candidate.name} — {completed_count}/{item_count} évaluations complètes"
+    )
+    if not item_count or completed_count != item_count:
+        return
+
+    global_score = round(total_score / item_count, 2)
+    rating = max(0.0, min(1.0, global_score / 100.0))
+
+    candidate.applicant_rating = float(f"{rating:.2f}")
+    candidate.custom_testlify_score = global_score
+
+    # Mise à jour du statut
+    threshold = getattr(settings, "score_test", 0) or 0
+    new_status = getattr(settings, "status_after_test", None) if global_score >= threshold else getattr(settings, "status_rejected", None)
+    _set_statut(candidate, new_status)
+
+    if getattr(candidate, "custom_status", None) != getattr(settings, "status_rejected", None):
+        return
+    if int(getattr(candidate, FLAG_REJECTED_AFTER_TEST_EMAIL_SENT, 0) or 0):
+        return  # déjà prévenu (événement rejoué)
+    _send_rejected_email(candidate, settings, global_score)
+
+
+def _send_rejected_email(candidate, settings, global_score: float):
+    recipient = (getattr(candidate, "email_id", "") or "").strip()
+    if not recipient:
+        frappe.logger().warning(f"[TESTLIFY] Email candidat introuvable pour {candidate.name}")
+        return
+
+    ctx = {
+        "applicant_name": getattr(candidate, "applicant_name", ""),
+        "job_title": getattr(candidate, "custom_nom_de_loffre", "") or getattr(candidate, "job_title", ""),
+        "score": global_score,
+    }
+    # Envoi groupé, déposé après la sauvegarde : le flag « e-mail envoyé » est positionné par le dispatcher
+    candidate.flags.pending_notifications = [
+        *(candidate.flags.pending_notifications or []), (NOTIF_REJECTED_AFTER_TEST, recipient, ctx),
+    ]
+
+
+def purge_testlify_inbox():
+    """Tâche planifiée : supprime les événements traités de plus de RETENTION_DAYS jours."""
+    frappe.db.delete(INBOX_DOCTYPE, {
+        "status": STATUS_PROCESSED,
+        "creation": ["<", add_days(now_datetime(), -RETENTION_DAYS)],
+    })
+    frappe.db.commit()
@@ -0,0 +1,149 @@
+"""
+Couche texte des CV : extraction locale et heuristique de qualité.
+
+La plupart des CV reçus ont une couche texte propre. Le texte brut coûte bien
+moins de tokens qu'un PDF envoyé en multimodal, et Gemini y répond plus vite.
+On n'envoie donc le binaire que pour les scans et les mises en page éclatées.
+
+L'heuristique combine trois mesures :
+- densité : caractères utiles par page ;
+- déchets : caractères de remplacement, de contrôle, glyphes « (cid:NN) » ;
+- couverture : part des pages qui portent du texte.
+Les mises en page en colonnes ou en tableaux, que l'extraction réduit à des
+fragments de quelques lettres, sont détectées par la part de lignes très
+courtes.
+
+L'extraction PDF utilise pypdf (livré avec Frappe) ; sans lui, le PDF est
+envoyé tel quel.
+"""
+
+import io
+import re
+import time
+import unicodedata
+
+MIN_CHARS = 400  # en dessous, trop peu de matière pour s'y fier
+MIN_CHARS_PER_PAGE = 300
+MAX_GARBAGE_RATIO = 0.05
+MIN_PAGE_COVERAGE = 0.75
+MIN_PAGE_CHARS = 80  # une page en dessous est considérée vide (scan)
+MAX_SHORT_LINE_RATIO = 0.4
+SHORT_LINE_CHARS = 3
+MAX_PAGES = 20  # au-delà, pas d'extraction locale (document atypique pour un CV)
+
+_CID = re.compile(r"\(cid:\d+\)")
+_SPACES = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def _pdf_pages(path: str | None = None, data: bytes | None = None, max_pages: int | None = None) -> list[str] | None:
+    """
+    Texte de chaque page (les `max_pages` premières si fourni) ; None si pypdf
+    est absent, le PDF illisible ou, sans max_pages, trop long.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+    try:
+        reader = PdfReader(path if data is None else io.BytesIO(data))
+        if reader.is_encrypted:
+            reader.decrypt("")
+        if max_pages:
+            return [page.extract_text() or "" for page in reader.pages[:max_pages]]
+        if len(reader.pages) > MAX_PAGES:
+            return None
+        return [page.extract_text() or "" for page in reader.pages]
+    except Exception:
+        return None
+
+
+def _garbage_count(text: str) -> int:
+    cid = sum(len(m) for m in _CID.findall(text))
+    bad = 0
+    for ch in _CID.sub("", text):
+        if ch in "\n\r\t":
+            continue
+        if ch == "\ufffd" or unicodedata.category(ch) in ("Cc", "Co", "Cn", "Cs"):
+            bad += 1
+    return cid + bad
+
+
+def measure(pages: list[str]) -> dict:
+    """Mesures de qualité d'une couche texte (une entrée par page ; une seule pour un DOCX)."""
+    page_count = max(len(pages), 1)
+    text = "\n".join(pages)
+    useful = sum(1 for ch in text if not ch.isspace())
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return {
+        "pages": len(pages),
+        "chars": useful,
+        "chars_per_page": round(useful / page_count, 1),
+        "garbage_ratio": round(_garbage_count(text) / useful, 4) if useful else 1.0,
+        "page_coverage": round(sum(1 for p in pages if len(p.strip()) >= MIN_PAGE_CHARS) / page_count, 2),
+        "short_line_ratio": round(
+            sum(1 for line in lines if len(line) <= SHORT_LINE_CHARS) / len(lines), 3
+        ) if lines else 1.0,
+    }
+
+
+def verdict(quality: dict, paged: bool = True) -> str | None:
+    """
+    None si la couche texte est exploitable, sinon la raison du repli sur le binaire.
+    `paged=False` (DOCX, sans pagination) : la densité par page n'a pas de sens.
+    """
+    if quality["chars"] < MIN_CHARS:
+        return "too_little_text"
+    if quality["garbage_ratio"] > MAX_GARBAGE_RATIO:
+        return "garbage"
+    if quality["pages"] > 1 and quality["page_coverage"] < MIN_PAGE_COVERAGE:
+        return "partial_scan"
+    if paged and quality["chars_per_page"] < MIN_CHARS_PER_PAGE:
+        return "low_density"
+    if quality["short_line_ratio"] > MAX_SHORT_LINE_RATIO:
+        return "fragmented_layout"
+    return None
+
+
+def clean(pages: list[str]) -> str:
+    """Texte envoyé à Gemini : espaces compactés, pages séparées, déchets retirés."""
+    out = []
+    for page in pages:
+        page = _CID.sub("", page).replace("\ufffd", "")
+        page = "\n".join(_SPACES.sub(" ", line).strip() for line in page.splitlines())
+        out.append(_BLANK_LINES.sub("\n\n", page).strip())
+    return "\n\n".join(p for p in out if p)
+
+
+def assess_pages(pages: list[str] | None) -> tuple[str | None, dict]:
+    """(texte si exploitable, infos : mesures, raison du rejet, durée d'extraction)."""
+    if pages is None:
+        return None, {"text_reason": "unreadable"}
+    quality = measure(pages)
+    reason = verdict(quality)
+    info = {"text_quality": quality}
+    if reason:
+        info["text_reason"] = reason
+        return None, info
+    text = clean(pages)
+    info["text_chars"] = len(text)
+    return text, info
+
+
+def pdf_text(path: str | None = None, data: bytes | None = None, max_pages: int | None = None) -> tuple[str | None, dict]:
+    """Couche texte d'un PDF (fichier ou octets) si elle est de bonne qualité."""
+    started = time.perf_counter()
+    text, info = assess_pages(_pdf_pages(path, data, max_pages))
+    info["text_extraction_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return text, info
+
+
+def plain_text(text: str | None) -> tuple[str | None, dict]:
+    """Même contrôle pour un texte déjà extrait (DOCX) : une seule « page »."""
+    if not text:
+        return None, {"text_reason": "unreadable"}
+    quality = measure([text])
+    reason = verdict(quality, paged=False)
+    if reason:
+        return None, {"text_quality": quality, "text_reason": reason}
+    return text, {"text_quality": quality, "text_chars": len(text)}
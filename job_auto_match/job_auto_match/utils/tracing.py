@@ -0,0 +1,284 @@
+"""
+Traces des runs de matching : spans par étape, journal « Matching Run » et
+métriques agrégées.
+
+- MatchingTrace.span(stage) mesure une étape du pipeline (préparation,
+  classification, extraction, scoring, invitation/e-mail, sauvegardes). Pour
+  les étapes Gemini, le pilote renseigne le span actif via
+  call_gemini_with_retry(stats=trace.active) : modèle, tentatives, backoff,
+  attente du limiteur et tokens (usage_metadata).
+- persist() écrit une ligne compacte par run (totaux + spans en JSON) et
+  alimente des compteurs et histogrammes Redis par étape.
+- get_matching_metrics() agrège compteurs, histogrammes (p50/p95 estimés),
+  coût en tokens par offre et latence/tokens de l'extraction par stratégie de
+  préparation du CV (texte, PDF inline, Files API…) ; exposé par
+  api.matching_run_metrics.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import add_days, add_to_date, now_datetime
+
+from job_auto_match.job_auto_match.utils.metrics import get_counters, incr_counters, reset_counters
+
+RUN_DOCTYPE = "Matching Run"
+RETENTION_DAYS = 30
+
+STAGE_FLAGS = "flags"
+STAGE_PREPARATION = "preparation"
+STAGE_CONVERSION = "conversion"
+STAGE_CLASSIFICATION = "classification"
+STAGE_EXTRACTION = "extraction"
+STAGE_COMBINED = "classification+extraction"
+STAGE_PRESCORING = "prescoring"
+STAGE_SCORING = "scoring"
+STAGE_INVITE = "invite"
+STAGE_EMAIL = "email"
+STAGE_SAVE = "save"
+STAGE_TOTAL = "total"
+
+STAGES = (
+    STAGE_FLAGS, STAGE_PREPARATION, STAGE_CONVERSION, STAGE_CLASSIFICATION, STAGE_EXTRACTION, STAGE_COMBINED,
+    STAGE_PRESCORING, STAGE_SCORING, STAGE_INVITE, STAGE_EMAIL, STAGE_SAVE, STAGE_TOTAL,
+)
+
+# Étapes qui lisent le CV : leur coût dépend de la stratégie de préparation
+EXTRACTION_STAGES = (STAGE_CLASSIFICATION, STAGE_EXTRACTION, STAGE_COMBINED)
+
+# Bornes supérieures des classes d'histogramme (ms) ; la dernière est ouverte
+HISTOGRAM_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+_TOKEN_FIELDS = ("prompt_tokens", "response_tokens", "total_tokens")
+
+COUNTER_RUNS = "runs:total"
+COUNTER_RUNS_FAILED = "runs:failed"
+COUNTER_GEMINI_CALLS = "gemini:calls"
+COUNTER_GEMINI_RETRIES = "gemini:retries"
+COUNTER_GEMINI_BACKOFF_MS = "gemini:backoff_ms"
+COUNTER_PROMPT_TOKENS = "tokens:prompt"
+COUNTER_RESPONSE_TOKENS = "tokens:response"
+
+_COUNTERS = (
+    COUNTER_RUNS, COUNTER_RUNS_FAILED, COUNTER_GEMINI_CALLS, COUNTER_GEMINI_RETRIES,
+    COUNTER_GEMINI_BACKOFF_MS, COUNTER_PROMPT_TOKENS, COUNTER_RESPONSE_TOKENS,
+)
+_PREFIX = "trace"
+
+
+def _name(counter: str) -> str:
+    return f"{_PREFIX}:{counter}"
+
+
+def _bucket(ms: float) -> str:
+    for bound in HISTOGRAM_BUCKETS_MS:
+        if ms <= bound:
+            return str(bound)
+    return "inf"
+
+
+def fill_call_stats(stats: dict | None, model: str | None, calls: int, backoff: float, waited: float, response=None):
+    """Renseigne le span d'un appel Gemini : modèle, tentatives, attentes et tokens."""
+    if stats is None:
+        return
+    stats.update({
+        "model": model,
+        "attempts": calls,
+        "retries": max(calls - 1, 0),
+        "backoff_ms": round(backoff * 1000, 1),
+        "limiter_wait_ms": round(waited * 1000, 1),
+    })
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        stats["prompt_tokens"] = int(getattr(usage, "prompt_token_count", 0) or 0)
+        stats["response_tokens"] = int(getattr(usage, "candidates_token_count", 0) or 0)
+        stats["total_tokens"] = int(getattr(usage, "total_token_count", 0) or 0)
+        # part du prompt servie par le cache de contexte (utils.context_cache)
+        stats["cached_tokens"] = int(getattr(usage, "cached_content_token_count", 0) or 0)
+
+
+class MatchingTrace:
+    """Spans d'un run de matching (un candidat)."""
+
+    def __init__(self, applicant_name: str, mode: str = "sync"):
+        self.applicant = applicant_name
+        self.mode = mode
+        self.job_opening = None
+        self.strategy = None
+        self.status = None
+        self.error = None
+        self.started_at = now_datetime()
+        self.spans = []
+        self.active = None  # span en cours, renseigné par le pilote pour les appels Gemini
+        self._t0 = time.perf_counter()
+        self._duration_ms = None
+
+    @contextmanager
+    def span(self, stage: str, **attrs):
+        span = {"stage": stage, **attrs}
+        previous, self.active = self.active, span
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span["error"] = str(e)[:200]
+            raise
+        finally:
+            span["ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self.active = previous
+            self.spans.append(span)
+
+    def finish(self, status: str | None = None, error: str | None = None):
+        self.status = status
+        self.error = (error or "")[:1000] or None
+        self._duration_ms = round((time.perf_counter() - self._t0) * 1000, 1)
+
+    @property
+    def duration_ms(self) -> float:
+        if self._duration_ms is None:
+            return round((time.perf_counter() - self._t0) * 1000, 1)
+        return self._duration_ms
+
+    def totals(self) -> dict:
+        gemini = [s for s in self.spans if "attempts" in s]
+        totals = {
+            "gemini_calls": sum(s["attempts"] for s in gemini),
+            "retries": sum(s.get("retries", 0) for s in gemini),
+            "backoff_ms": round(sum(s.get("backoff_ms", 0) for s in gemini), 1),
+        }
+        for field in _TOKEN_FIELDS:
+            totals[field] = sum(s.get(field, 0) for s in gemini)
+        extraction = [s for s in self.spans if s["stage"] in EXTRACTION_STAGES]
+        totals["extraction_ms"] = round(sum(s["ms"] for s in extraction), 1)
+        totals["extraction_tokens"] = sum(s.get("prompt_tokens", 0) for s in extraction)
+        return totals
+
+    # ---------- Persistance ----------
+
+    def persist(self):
+        """Ligne Matching Run + compteurs/histogrammes ; ne fait jamais échouer le run."""
+        totals = self.totals()
+        try:
+            frappe.get_doc({
+                "doctype": RUN_DOCTYPE,
+                "applicant": self.applicant,
+                "job_opening": self.job_opening,
+                "mode": self.mode,
+                "started_at": self.started_at,
+                "duration_ms": self.duration_ms,
+                "status": self.status,
+                "failed": 1 if self.error else 0,
+                "error": self.error,
+                "strategy": self.strategy,
+                **totals,
+                "spans": json.dumps(self.spans, ensure_ascii=False, default=str),
+            }).insert(ignore_permissions=True)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.logger().warning(f"[TRACE] Matching Run non enregistré pour {self.applicant}", exc_info=True)
+
+        amounts = {
+            _name(COUNTER_RUNS): 1,
+            _name(COUNTER_RUNS_FAILED): 1 if self.error else 0,
+            _name(COUNTER_GEMINI_CALLS): totals["gemini_calls"],
+            _name(COUNTER_GEMINI_RETRIES): totals["retries"],
+            _name(COUNTER_GEMINI_BACKOFF_MS): int(totals["backoff_ms"]),
+            _name(COUNTER_PROMPT_TOKENS): totals["prompt_tokens"],
+            _name(COUNTER_RESPONSE_TOKENS): totals["response_tokens"],
+        }
+        for span in [*self.spans, {"stage": STAGE_TOTAL, "ms": self.duration_ms}]:
+            stage, ms = span["stage"], span["ms"]
+            for key, amount in (("count", 1), ("ms", int(ms)), (f"le:{_bucket(ms)}", 1)):
+                name = _name(f"stage:{stage}:{key}")
+                amounts[name] = amounts.get(name, 0) + amount
+        incr_counters(amounts)
+
+
+# ---------- Métriques agrégées ----------
+
+def _histogram(stage: str) -> dict:
+    bounds = [str(b) for b in HISTOGRAM_BUCKETS_MS] + ["inf"]
+    c = get_counters([_name(f"stage:{stage}:{k}") for k in ["count", "ms"] + [f"le:{b}" for b in bounds]])
+    count = c[_name(f"stage:{stage}:count")]
+    buckets = {b: c[_name(f"stage:{stage}:le:{b}")] for b in bounds}
+
+    def _quantile(q: float):
+        # Borne supérieure de la classe contenant le quantile (estimation prudente)
+        target, seen = q * count, 0
+        for bound, n in buckets.items():
+            seen += n
+            if n and seen >= target:
+                return None if bound == "inf" else int(bound)
+        return None
+
+    return {
+        "count": count,
+        "mean_ms": round(c[_name(f"stage:{stage}:ms")] / count, 1) if count else 0.0,
+        "p50_le_ms": _quantile(0.5) if count else None,
+        "p95_le_ms": _quantile(0.95) if count else None,
+        "buckets": buckets,
+    }
+
+
+def _openings(hours: int) -> list[dict]:
+    """Coût par offre sur la fenêtre : runs, durée moyenne, tokens."""
+    return frappe.db.sql(
+        """
+        select job_opening, count(*) as runs, sum(failed) as failed,
+            round(avg(duration_ms), 1) as avg_duration_ms, sum(gemini_calls) as gemini_calls,
+            sum(prompt_tokens) as prompt_tokens, sum(response_tokens) as response_tokens,
+            sum(total_tokens) as total_tokens
+        from `tabMatching Run`
+        where started_at >= %(since)s
+        group by job_opening
+        order by sum(total_tokens) desc
+        """,
+        {"since": add_to_date(now_datetime(), hours=-int(hours))},
+        as_dict=True,
+    )
+
+
+def _strategies(hours: int) -> list[dict]:
+    """Latence et tokens de l'extraction par stratégie de préparation du CV (hors cache)."""
+    return frappe.db.sql(
+        """
+        select strategy, count(*) as runs, round(avg(duration_ms), 1) as avg_duration_ms,
+            round(avg(extraction_ms), 1) as avg_extraction_ms,
+            round(avg(extraction_tokens)) as avg_extraction_tokens,
+            round(avg(prompt_tokens)) as avg_prompt_tokens
+        from `tabMatching Run`
+        where started_at >= %(since)s and ifnull(strategy, '') not in ('', 'cache')
+        group by strategy
+        order by count(*) desc
+        """,
+        {"since": add_to_date(now_datetime(), hours=-int(hours))},
+        as_dict=True,
+    )
+
+
+def get_matching_metrics(hours: int = 24) -> dict:
+    counters = get_counters([_name(c) for c in _COUNTERS])
+    return {
+        "counters": {c: counters[_name(c)] for c in _COUNTERS},
+        "histograms": {stage: h for stage in STAGES if (h := _histogram(stage))["count"]},
+        "openings": _openings(hours),
+        "strategies": _strategies(hours),
+        "window_hours": int(hours),
+    }
+
+
+def reset_matching_metrics():
+    bounds = [str(b) for b in HISTOGRAM_BUCKETS_MS] + ["inf"]
+    names = [_name(c) for c in _COUNTERS]
+    for stage in STAGES:
+        names += [_name(f"stage:{stage}:{k}") for k in ["count", "ms"] + [f"le:{b}" for b in bounds]]
+    reset_counters(names)
+
+
+def purge_matching_runs():
+    """Tâche planifiée : supprime les Matching Run de plus de RETENTION_DAYS jours."""
+    frappe.db.delete(RUN_DOCTYPE, {"started_at": ["<", add_days(now_datetime(), -RETENTION_DAYS)]})
+    frappe.db.commit()